@@ -0,0 +1,293 @@
+# batch_score.py
+# Offline batch scoring for backfills and model comparisons. Supported inputs:
+#   - CMaps train_/test_ files
+#   - JSONL exports of the `anomalies` Cosmos container (one document per line)
+#   - CSV
+#   - Parquet (needs pyarrow)
+#
+# The input is cut into fixed-size chunks and scored across a process pool. Each worker loads
+# the artifacts once (the compact engine file is memory-mapped, so workers share its pages).
+# CMaps and line-based chunks are parsed by the workers. The parent only cuts the input into
+# chunks: row ranges of the memory-mapped CMaps cache, blocks of lines, or Parquet record batches.
+# It writes results in input order and keeps at most IN_FLIGHT_PER_WORKER chunks per worker in
+# flight, so memory stays flat whatever the input size.
+#
+# Results go to OUT/<input name without extension>/ as one .npy per column (as in cmaps_cache.py), plus a
+# manifest.json with the model version, row count and anomaly count. The columns are:
+#   - row: position in the input (CMaps rows in cache order, i.e. by unit)
+#   - unit_number, time_in_cycles
+#   - anomaly_score: NaN when a feature was missing or non-numeric
+#   - is_anomaly
+#
+# Models trained on rolling features need each unit's readings in order. CMaps chunks are cut at
+# unit boundaries; other inputs are scored by a single worker in input order.
+#
+# Usage:
+#   python batch_score.py INPUT [INPUT ...] [--out scores] [--model-dir models] [--workers N] [--chunk-rows 65536]
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import cmaps_cache
+from feature_engine import engine_from_env, uses_rolling_features
+from inference_engine import load_engine
+from model_store import read_feature_names, resolve_active_version
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_CHUNK_ROWS = 65536
+IN_FLIGHT_PER_WORKER = 2
+COPY_ROWS = 1 << 20 # Rows per copy step when turning the column files into .npy files
+INDEX_COLUMNS = ("unit_number", "time_in_cycles")
+OUTPUT_COLUMNS = {"row": np.int64, "unit_number": np.float64, "time_in_cycles": np.float64,
+                  "anomaly_score": np.float64, "is_anomaly": np.bool_}
+FORMATS_BY_EXTENSION = {".txt": "cmaps", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl",
+                        ".csv": "csv", ".parquet": "parquet", ".pq": "parquet"}
+
+def input_format(path):
+    fmt = FORMATS_BY_EXTENSION.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Cannot tell the format of '{path}' from its extension; pass --format.")
+    return fmt
+
+def needed_columns(feature_names, rolling_engine):
+    """Input columns a chunk needs: the index columns, the model's plain features and the rolling engine's inputs."""
+    rolling = set(rolling_engine.feature_names) if rolling_engine is not None else set()
+    inputs = rolling_engine.base_features if rolling_engine is not None else []
+    return list(dict.fromkeys([*INDEX_COLUMNS, *(name for name in feature_names if name not in rolling), *inputs]))
+
+def rolling_engine_for(feature_names):
+    """A fresh RollingFeatureEngine (ROLLING_* settings) when the model uses rolling features, else None."""
+    return engine_from_env(enabled_default=True) if uses_rolling_features(feature_names) else None
+
+# --- Worker side: one engine per process, loaded by the pool initializer ---
+_engine = None
+_rolling_engine = None
+_columns = None # needed_columns() of the loaded model
+_tables = {} # CMaps path -> memory-mapped CMapsTable
+
+def _init_worker(model_path):
+    global _engine, _rolling_engine, _columns
+    logging.getLogger().setLevel(logging.WARNING)
+    _engine = load_engine(model_path)[0]
+    _rolling_engine = rolling_engine_for(_engine.feature_names)
+    _columns = needed_columns(_engine.feature_names, _rolling_engine)
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _score_columns(columns, first_row):
+    """Score one chunk given as {column name: float64 array}; returns the OUTPUT_COLUMNS arrays."""
+    n = len(columns["unit_number"])
+    names = _engine.feature_names
+    matrix = np.full((n, len(names)), np.nan)
+    for j, name in enumerate(names):
+        if name in columns:
+            matrix[:, j] = columns[name]
+    if _rolling_engine is not None:
+        positions = [(j, _rolling_engine.feature_names.index(name)) for j, name in enumerate(names) if name in _rolling_engine.feature_names]
+        row_positions, rolling_positions = [p[0] for p in positions], [p[1] for p in positions]
+        inputs = np.column_stack([columns[name] for name in _rolling_engine.base_features])
+        for i in range(n):
+            rolling = _rolling_engine.update(float(columns["unit_number"][i]), inputs[i], float(columns["time_in_cycles"][i]))
+            matrix[i, row_positions] = rolling[rolling_positions]
+
+    valid = ~np.isnan(matrix).any(axis=1)
+    anomaly_scores = np.full(n, np.nan)
+    anomaly_flags = np.zeros(n, dtype=bool)
+    if valid.any():
+        anomaly_scores[valid], anomaly_flags[valid] = _engine.score(matrix[valid])
+    return {"row": np.arange(first_row, first_row + n, dtype=np.int64), "unit_number": columns["unit_number"],
+            "time_in_cycles": columns["time_in_cycles"], "anomaly_score": anomaly_scores, "is_anomaly": anomaly_flags}
+
+def _filled(columns, n):
+    """Every needed column, NaN-filled where the input lacks it."""
+    return {name: columns[name] if name in columns else np.full(n, np.nan) for name in _columns}
+
+def score_cmaps_chunk(path, start, stop):
+    table = _tables.get(path)
+    if table is None:
+        table = _tables[path] = cmaps_cache.load(path)
+    columns = {name: np.asarray(table[name][start:stop], dtype=np.float64) for name in _columns if name in table.columns}
+    return _score_columns(_filled(columns, stop - start), start)
+
+def score_lines_chunk(fmt, header, block, first_row):
+    if fmt == "jsonl":
+        records = [json.loads(line) for line in block.splitlines()]
+        columns = {name: np.array([_number(record.get(name)) for record in records]) for name in _columns}
+        return _score_columns(columns, first_row)
+    df = pd.read_csv(io.BytesIO(header + block))
+    columns = {name: pd.to_numeric(df[name], errors="coerce").to_numpy(np.float64) for name in _columns if name in df.columns}
+    return _score_columns(_filled(columns, len(df)), first_row)
+
+def score_column_chunk(columns, first_row):
+    return _score_columns(_filled(columns, len(next(iter(columns.values())))), first_row)
+
+# --- Parent side ---
+def chunk_tasks(path, fmt, chunk_rows, columns, unit_aligned):
+    """(function, args) per chunk of `path`, in input order."""
+    if fmt == "cmaps":
+        table = cmaps_cache.load(path)
+        if not unit_aligned:
+            for start in range(0, len(table), chunk_rows):
+                yield score_cmaps_chunk, (path, start, min(start + chunk_rows, len(table)))
+            return
+        offsets = table.offsets.tolist()
+        start = 0
+        for end in offsets[1:]:
+            if end - start >= chunk_rows or end == offsets[-1]:
+                yield score_cmaps_chunk, (path, start, end)
+                start = end
+    elif fmt in ("jsonl", "csv"):
+        with open(path, "rb") as f:
+            header = f.readline() if fmt == "csv" else b""
+            first_row, lines = 0, []
+            for line in f:
+                if line.strip():
+                    lines.append(line)
+                if len(lines) == chunk_rows:
+                    yield score_lines_chunk, (fmt, header, b"".join(lines), first_row)
+                    first_row, lines = first_row + len(lines), []
+            if lines:
+                yield score_lines_chunk, (fmt, header, b"".join(lines), first_row)
+    elif fmt == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet input needs pyarrow (pip install pyarrow).") from None
+        parquet_file = pq.ParquetFile(path)
+        present = [name for name in columns if name in parquet_file.schema_arrow.names]
+        first_row = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=present):
+            chunk = {name: pd.to_numeric(batch.column(name).to_pandas(), errors="coerce").to_numpy(np.float64) for name in present}
+            yield score_column_chunk, (chunk, first_row)
+            first_row += batch.num_rows
+    else:
+        raise ValueError(f"Unknown input format '{fmt}'.")
+
+class ColumnWriter:
+    """Appends result chunks to one raw file per column, then turns them into .npy files."""
+
+    def __init__(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.rows = 0
+        self.anomalies = 0
+        self.invalid = 0
+        self._files = {name: open(self._part_path(name), "wb") for name in OUTPUT_COLUMNS}
+
+    def _part_path(self, name):
+        return os.path.join(self.out_dir, f"{name}.part")
+
+    def append(self, result):
+        for name, dtype in OUTPUT_COLUMNS.items():
+            np.asarray(result[name], dtype=dtype).tofile(self._files[name])
+        self.rows += len(result["row"])
+        self.anomalies += int(result["is_anomaly"].sum())
+        self.invalid += int(np.isnan(result["anomaly_score"]).sum())
+
+    def close(self, manifest):
+        for name, dtype in OUTPUT_COLUMNS.items():
+            self._files[name].close()
+            out = np.lib.format.open_memmap(os.path.join(self.out_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=(self.rows,))
+            if self.rows:
+                part = np.memmap(self._part_path(name), dtype=dtype, mode="r", shape=(self.rows,))
+                for start in range(0, self.rows, COPY_ROWS):
+                    out[start:start + COPY_ROWS] = part[start:start + COPY_ROWS]
+                del part
+            out.flush()
+            del out
+            os.remove(self._part_path(name))
+        manifest = dict(manifest, rows=self.rows, anomalies=self.anomalies, invalid_rows=self.invalid, columns=list(OUTPUT_COLUMNS))
+        with open(os.path.join(self.out_dir, cmaps_cache.MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+def score_file(pool, path, fmt, out_dir, chunk_rows, max_in_flight, columns, unit_aligned, version):
+    """Score one input through `pool` into `out_dir`; returns its manifest."""
+    started = time.perf_counter()
+    writer = ColumnWriter(out_dir)
+    pending = deque()
+    for function, args in chunk_tasks(path, fmt, chunk_rows, columns, unit_aligned):
+        pending.append(pool.submit(function, *args))
+        if len(pending) >= max_in_flight:
+            writer.append(pending.popleft().result())
+    while pending:
+        writer.append(pending.popleft().result())
+    elapsed = time.perf_counter() - started
+    manifest = writer.close({"source": os.path.abspath(path), "format": fmt, "model_version": version,
+                             "scored_at": datetime.now(timezone.utc).isoformat(), "seconds": round(elapsed, 3)})
+    logging.info(f"Scored '{path}' -> {out_dir}: {manifest['rows']} rows, {manifest['anomalies']} anomalies, "
+                 f"{manifest['invalid_rows']} invalid, in {elapsed:.2f}s ({manifest['rows'] / max(elapsed, 1e-9):,.0f} rows/s).")
+    return manifest
+
+def usable_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Score CMaps files or exported readings offline, in parallel.")
+    parser.add_argument("inputs", nargs="+")
+    parser.add_argument("--out", default="scores", help="Output directory; one subdirectory per input.")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--workers", type=int, default=usable_cpus())
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--format", choices=["auto", "cmaps", "jsonl", "csv", "parquet"], default="auto")
+    args = parser.parse_args()
+
+    version, model_path = resolve_active_version(args.model_dir)
+    feature_names = read_feature_names(model_path)
+    rolling_engine = rolling_engine_for(feature_names)
+    columns = needed_columns(feature_names, rolling_engine)
+    logging.info(f"Scoring with model version '{version}' from {model_path} ({len(feature_names)} features), {args.workers} workers.")
+
+    pools = {}
+    def pool_for(workers):
+        if workers not in pools:
+            pools[workers] = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,))
+        return pools[workers]
+
+    failed = False
+    out_names = set()
+    try:
+        for path in args.inputs:
+            fmt = input_format(path) if args.format == "auto" else args.format
+            # Rolling features follow each unit's readings in order: whole units per CMaps chunk,
+            # one worker (keeping the rolling state between chunks) for other inputs.
+            workers = args.workers
+            if rolling_engine is not None and fmt != "cmaps":
+                workers = 1
+                logging.info(f"The model uses rolling features; scoring '{path}' in input order with one worker.")
+            out_name = os.path.splitext(os.path.basename(path))[0]
+            if out_name in out_names: # e.g. readings.jsonl and readings.csv
+                out_name = os.path.basename(path)
+            out_names.add(out_name)
+            out_dir = os.path.join(args.out, out_name)
+            try:
+                score_file(pool_for(workers), path, fmt, out_dir, args.chunk_rows, IN_FLIGHT_PER_WORKER * workers,
+                           columns, rolling_engine is not None, version)
+            except Exception as e:
+                logging.error(f"Scoring '{path}' failed: {e}")
+                failed = True
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# benchmarks/_artifacts.py
+# Shared helpers for the benchmark scripts: locate (or build) a model artifact set
+# and load CMaps rows, so benchmarks run offline without the training notebook.
+import os
+import tempfile
+import logging
+
+import numpy as np
+
+import cmaps_cache
+
+FEATURE_COLUMNS = ['setting_1', 'setting_2', 'setting_3'] + [f'sensor_{i}' for i in range(1, 22)]
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_cmaps_frame(name="train_FD001"):
+    """Read one CMaps file (e.g. 'train_FD001') into a float DataFrame, via the columnar cache."""
+    return cmaps_cache.load(os.path.join(REPO_ROOT, "CMaps", f"{name}.txt")).to_frame().astype(float)
+
+def ensure_model_dir(model_dir=None):
+    """
+    Return a directory holding anomaly_model.pkl, scaler.pkl and scaled_feature_names.json.
+    Uses `model_dir`, $MODEL_DIR or ./models when they contain artifacts; otherwise fits
+    a model the way the training notebook does (units 1-5, cycles <= 50 of FD001) into a
+    temporary directory.
+    """
+    for candidate in (model_dir, os.getenv("MODEL_DIR"), os.path.join(REPO_ROOT, "models")):
+        if candidate and os.path.exists(os.path.join(candidate, "anomaly_model.pkl")):
+            return candidate
+
+    from train_model import fit_model, load_training_frame, save_artifacts
+
+    df, feature_names = load_training_frame([os.path.join(REPO_ROOT, "CMaps", "train_FD001.txt")], units=[1, 2, 3, 4, 5], max_cycle=50)
+    model, scaler, _ = fit_model(df[feature_names], n_estimators=100, contamination=0.01, random_state=42)
+
+    out_dir = tempfile.mkdtemp(prefix="bench_models_")
+    save_artifacts(out_dir, model, scaler, feature_names)
+    logging.info(f"Fitted benchmark model artifacts into {out_dir}")
+    return out_dir
+
+def percentile_summary(samples_s):
+    """p50/p99/mean of a list of durations in seconds, reported in microseconds."""
+    samples_us = np.asarray(samples_s) * 1e6
+    return {
+        "p50_us": float(np.percentile(samples_us, 50)),
+        "p99_us": float(np.percentile(samples_us, 99)),
+        "mean_us": float(samples_us.mean()),
+    }
@@ -0,0 +1,103 @@
+# benchmarks/_stubs.py
+# Local stand-ins used by the consumer benchmarks: a stub model API served by aiohttp,
+# plus minimal Event Hub event / partition-context objects.
+import asyncio
+import json
+
+from aiohttp import web
+
+class StubModelAPI:
+    """
+    Serves /predict and /predict/batch with a fixed artificial latency and records the
+    (unit_number, time_in_cycles) order in which readings arrive. Setting `fault` injects
+    an outage: "hang" holds each request for `hang_s` seconds, "error" answers 503.
+    """
+
+    def __init__(self, latency_s=0.005, hang_s=60.0):
+        self.latency_s = latency_s
+        self.hang_s = hang_s
+        self.fault = None
+        self.requests = 0
+        self.failed_requests = 0
+        self.arrivals = []
+
+    async def _inject_fault(self):
+        """A 503 response for fault="error" (after holding the request for fault="hang"), else None."""
+        if self.fault is None:
+            return None
+        self.failed_requests += 1
+        if self.fault == "hang":
+            await asyncio.sleep(self.hang_s)
+        return web.json_response({"detail": f"Injected fault: {self.fault}"}, status=503)
+
+    def _prediction(self, reading):
+        self.arrivals.append((reading.get("unit_number"), reading.get("time_in_cycles")))
+        return {
+            "is_anomaly": False,
+            "anomaly_score": 0.1,
+            "unit_number": reading.get("unit_number"),
+            "time_in_cycles": reading.get("time_in_cycles"),
+            "event_timestamp": reading.get("event_timestamp"),
+            "message_id": reading.get("message_id"),
+        }
+
+    async def predict(self, request):
+        reading = await request.json()
+        self.requests += 1
+        fault_response = await self._inject_fault()
+        if fault_response is not None:
+            return fault_response
+        await asyncio.sleep(self.latency_s)
+        return web.json_response(self._prediction(reading))
+
+    async def predict_batch(self, request):
+        readings = await request.json()
+        self.requests += 1
+        fault_response = await self._inject_fault()
+        if fault_response is not None:
+            return fault_response
+        await asyncio.sleep(self.latency_s)
+        return web.json_response([self._prediction(reading) for reading in readings])
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_post("/predict", self.predict)
+        app.router.add_post("/predict/batch", self.predict_batch)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def out_of_order_units(self):
+        """Units whose readings reached the API with decreasing time_in_cycles."""
+        last_cycle = {}
+        bad = set()
+        for unit, cycle in self.arrivals:
+            if unit in last_cycle and cycle < last_cycle[unit]:
+                bad.add(unit)
+            last_cycle[unit] = cycle
+        return bad
+
+class StubEvent:
+    """Just enough of azure.eventhub.EventData for process_event_batch."""
+
+    def __init__(self, body, sequence_number=0):
+        self._body = body
+        self.sequence_number = sequence_number
+
+    def body_as_str(self, encoding="UTF-8"):
+        return self._body
+
+class StubPartitionContext:
+    def __init__(self, partition_id):
+        self.partition_id = partition_id
+        self.last_checkpoint = None
+
+    async def update_checkpoint(self, event=None):
+        self.last_checkpoint = event
+
+def make_events(records):
+    return [StubEvent(json.dumps(record), sequence_number=i) for i, record in enumerate(records)]
@@ -0,0 +1,73 @@
+# benchmarks/bench_batch_scoring.py
+# Throughput and memory of batch_score.py on a generated JSONL export (test_FD001 rows repeated
+# with fresh unit numbers, one document per line as exported from the `anomalies` container).
+# Each configuration runs batch_score.py in a fresh process and reports:
+#   - rows/s
+#   - peak RSS of the largest process (parent or worker)
+# Each worker count runs at two input sizes, so flat memory shows as the same peak for both.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_batch_scoring [--rows 400000] [--workers 1,2,4] [--chunk-rows 65536]
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir, load_cmaps_frame
+
+# Runs its arguments as a command and prints the largest peak RSS (KiB) among the processes it waited for.
+PEAK_RSS_WRAPPER = ("import resource, subprocess, sys; result = subprocess.run(sys.argv[1:]); "
+                    "print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss); sys.exit(result.returncode)")
+
+def write_export(path, rows):
+    df = load_cmaps_frame("test_FD001")
+    records = df.to_dict("records")
+    n_units = int(df["unit_number"].max())
+    with open(path, "w") as f:
+        for i in range(rows):
+            record = dict(records[i % len(records)])
+            record["unit_number"] += n_units * (i // len(records))
+            f.write(json.dumps(record) + "\n")
+
+def run(input_path, out_dir, model_dir, workers, chunk_rows):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", PEAK_RSS_WRAPPER, sys.executable, os.path.join(REPO_ROOT, "batch_score.py"),
+                             input_path, "--out", out_dir, "--model-dir", model_dir, "--workers", str(workers),
+                             "--chunk-rows", str(chunk_rows)], capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - started
+    with open(os.path.join(out_dir, os.path.splitext(os.path.basename(input_path))[0], "manifest.json")) as f:
+        manifest = json.load(f)
+    return manifest["rows"], elapsed, int(result.stdout.split()[-1]) / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch_score.py rows/s and peak memory by worker count.")
+    parser.add_argument("--rows", type=int, default=400000)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--chunk-rows", type=int, default=65536)
+    parser.add_argument("--model-dir", default=None)
+    args = parser.parse_args()
+
+    model_dir = ensure_model_dir(args.model_dir)
+    tmp = tempfile.mkdtemp(prefix="bench_batch_scoring_")
+    try:
+        inputs = []
+        for rows in (args.rows // 4, args.rows):
+            path = os.path.join(tmp, f"anomalies_{rows}.jsonl")
+            write_export(path, rows)
+            inputs.append((rows, path))
+        print(f"JSONL inputs of {', '.join(str(rows) for rows, _ in inputs)} rows, chunks of {args.chunk_rows}, {os.cpu_count()} CPUs; "
+              f"wall time includes process and worker start-up")
+        print(f"{'workers':>8}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'peak RSS MiB':>14}")
+        for workers in [int(w) for w in args.workers.split(",")]:
+            for rows, path in inputs:
+                scored, elapsed, peak_mib = run(path, os.path.join(tmp, "out"), model_dir, workers, args.chunk_rows)
+                print(f"{workers:>8}{scored:>10}{elapsed:>10.2f}{scored / elapsed:>12,.0f}{peak_mib:>14.0f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/bench_checkpoints.py
+# Checkpoint store write latency, and how much a consumer restart has to reprocess with no
+# store, with a durable store checkpointing after every batch, and with the throttled default
+# (checkpoint_store.py). The consumer scores in-process against the local pipeline; it is
+# "killed" (no final checkpoint) after `--crash-after` events, then restarted, and the
+# restart's redelivered events and catch-up time are reported.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_checkpoints [--events 20000] [--crash-after 15000]
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+import event_consumer
+from benchmarks._artifacts import ensure_model_dir
+from benchmarks.bench_consumer_concurrency import interleaved_records
+from checkpoint_store import CheckpointThrottle, FileCheckpointStore, SQLiteCheckpointStore
+from inference_engine import load_engine
+from local_pipeline import (LOCAL_NAMESPACE, InMemoryCheckpointStore, InMemoryContainer, InMemoryPartitionedQueue,
+                            LocalConsumerClient, LocalEventData, partition_for_key)
+
+async def update_latency_ms(store, n=200):
+    started = time.perf_counter()
+    for i in range(n):
+        await store.update_checkpoint({"fully_qualified_namespace": LOCAL_NAMESPACE, "eventhub_name": "bench",
+                                       "consumer_group": "$Default", "partition_id": str(i % 4),
+                                       "offset": str(i), "sequence_number": i})
+    return (time.perf_counter() - started) / n * 1e3
+
+async def consume(queue, store, stop_when):
+    """
+    Run a consumer until stop_when(events delivered, {partition: highest sequence number seen})
+    is true; returns (events delivered, seconds).
+    """
+    delivered, progress = [0], {}
+    client = LocalConsumerClient(queue, eventhub_name="bench", checkpoint_store=store)
+
+    async def on_event_batch(partition_context, events):
+        delivered[0] += len(events)
+        if events:
+            progress[partition_context.partition_id] = events[-1].sequence_number
+        await event_consumer.on_event_batch(partition_context, events)
+
+    started = time.perf_counter()
+    task = asyncio.create_task(client.receive_batch(on_event_batch=on_event_batch, max_batch_size=100,
+                                                    max_wait_time=0.2, starting_position="-1"))
+    while not stop_when(delivered[0], progress):
+        await asyncio.sleep(0.005)
+    await client.close()
+    await task
+    return delivered[0], time.perf_counter() - started
+
+async def main_async(args):
+    logging.disable(logging.WARNING)
+    event_consumer.SCORING_MODE = "local"
+    event_consumer.CONSUMER_PIPELINE_DEPTH = 0 # Processed == delivered, so a "kill" loses nothing in flight
+    event_consumer.scoring_engine, _, _, _ = load_engine(ensure_model_dir(args.model_dir))
+
+    workdir = tempfile.mkdtemp(prefix="bench_checkpoints_")
+    latencies = []
+    for name, store in (("in-memory", InMemoryCheckpointStore()),
+                        ("sqlite", SQLiteCheckpointStore(os.path.join(workdir, "latency.sqlite"))),
+                        ("file", FileCheckpointStore(os.path.join(workdir, "latency")))):
+        latencies.append(f"{name} {await update_latency_ms(store):.3f} ms")
+    print(f"checkpoint update latency: {', '.join(latencies)}")
+
+    queue = InMemoryPartitionedQueue(args.partitions)
+    records = interleaved_records(args.events, args.units)
+    if len(records) < args.events: # test_FD001 has ~13k readings
+        args.crash_after = args.crash_after * len(records) // args.events
+        args.events = len(records)
+        print(f"test_FD001 has {args.events} readings; crashing after {args.crash_after}.")
+    for record in records:
+        key = str(int(record["unit_number"]))
+        queue.append(partition_for_key(key, args.partitions), [LocalEventData(json.dumps(record), partition_key=key)])
+    last_sequence = {pid: queue.last_sequence_number(pid) for pid in queue.partition_ids}
+
+    def caught_up(delivered, progress):
+        return all(progress.get(pid, -1) >= last for pid, last in last_sequence.items())
+
+    print(f"{'store':<22}{'checkpoints':>12}{'first run s':>13}{'redelivered':>13}{'restart s':>11}")
+    for label, store_factory, every_events, interval_s in (
+            ("none", lambda: None, 1, 0.0),
+            ("sqlite, every batch", lambda: SQLiteCheckpointStore(os.path.join(workdir, "every.sqlite")), 1, 0.0),
+            ("sqlite, throttled", lambda: SQLiteCheckpointStore(os.path.join(workdir, "throttled.sqlite")),
+             args.every_events, args.interval_s)):
+        event_consumer.cosmos_container = InMemoryContainer()
+        event_consumer.cosmos_writer = None
+        event_consumer.checkpoint_throttle = CheckpointThrottle(every_events, interval_s)
+        store = store_factory()
+        _, first_s = await consume(queue, store, lambda delivered, progress: delivered >= args.crash_after)
+        checkpoints = event_consumer.checkpoint_throttle.checkpoints_written if store is not None else 0
+
+        # Restart: a fresh process would open the same store and start with an empty throttle.
+        event_consumer.checkpoint_throttle = CheckpointThrottle(every_events, interval_s)
+        restarted_store = store_factory()
+        delivered, restart_s = await consume(queue, restarted_store, caught_up)
+        redelivered = delivered - (args.events - args.crash_after)
+        print(f"{label:<22}{checkpoints:>12}{first_s:>13.2f}{max(redelivered, 0):>13}{restart_s:>11.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark durable checkpoints and restart catch-up.")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--crash-after", type=int, default=15000)
+    parser.add_argument("--units", type=int, default=100)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--every-events", type=int, default=1000)
+    parser.add_argument("--interval-s", type=float, default=10.0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
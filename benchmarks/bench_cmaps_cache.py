@@ -0,0 +1,92 @@
+# benchmarks/bench_cmaps_cache.py
+# Load time of the CMaps files: pd.read_csv on the text file versus a memory-mapped load
+# of the columnar cache (cmaps_cache.py), plus the cost of slicing one unit / cycle range.
+# Then starts several reader processes that each touch every column of every file and
+# reports their private (unshared) memory: parsed copies grow with the number of
+# processes, mapped columns are shared through the page cache.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_cmaps_cache [--processes 4]
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+import cmaps_cache
+from benchmarks._artifacts import REPO_ROOT
+
+READER = """
+import glob, os, sys, time
+import pandas as pd
+import cmaps_cache
+def private_kb():
+    with open("/proc/self/smaps_rollup") as f:
+        return sum(int(line.split()[1]) for line in f if line.startswith(("Private_Clean", "Private_Dirty")))
+paths = sorted(glob.glob(os.path.join(sys.argv[2], "*_FD00*.txt")))
+before = private_kb()
+if sys.argv[1] == "parse":
+    data = [pd.read_csv(p, sep=r"\\s+", header=None, names=cmaps_cache.columns_for(os.path.basename(p))) for p in paths]
+    total = sum(float(df.to_numpy().sum()) for df in data)
+else:
+    data = [cmaps_cache.load(p) for p in paths]
+    total = sum(float(t[c].sum()) for t in data for c in t.column_names)
+print("ready", flush=True)
+sys.stdin.readline() # Measure once every reader has loaded, so shared pages count as shared
+print(private_kb() - before, flush=True)
+"""
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def reader_private_mb(mode, processes, data_dir):
+    procs = [subprocess.Popen([sys.executable, "-c", READER, mode, data_dir], cwd=REPO_ROOT,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+             for _ in range(processes)]
+    try:
+        for p in procs:
+            p.stdout.readline()
+        for p in procs:
+            p.stdin.write("\n")
+            p.stdin.flush()
+        return [int(p.stdout.readline()) / 1024 for p in procs]
+    finally:
+        for p in procs:
+            p.stdin.close()
+            p.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the columnar CMaps cache.")
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    data_dir = os.path.join(REPO_ROOT, "CMaps")
+    paths = sorted(glob.glob(os.path.join(data_dir, "*_FD00*.txt")))
+    cmaps_cache.build_all(data_dir)
+
+    print(f"{'file':<14}{'rows':>8}{'read_csv ms':>14}{'mmap load ms':>14}{'unit slice us':>15}")
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        parse_s = best_of(lambda: pd.read_csv(path, sep=r'\s+', header=None, names=cmaps_cache.columns_for(name)))
+        load_s = best_of(lambda: cmaps_cache.load(path))
+        table = cmaps_cache.load(path)
+        unit = int(table.units[len(table.units) // 2])
+        slice_s = best_of(lambda: table.select(unit=unit, cycles=(10, 60)), repeat=100)
+        print(f"{name:<14}{len(table):>8}{parse_s * 1e3:>14.1f}{load_s * 1e3:>14.2f}{slice_s * 1e6:>15.1f}")
+
+    if os.path.exists("/proc/self/smaps_rollup"):
+        for mode in ("parse", "mmap"):
+            private = reader_private_mb(mode, args.processes, data_dir)
+            print(f"{args.processes} readers ({mode}): private memory per process "
+                  f"{min(private):.1f}-{max(private):.1f} MB, total {sum(private):.1f} MB")
+
+if __name__ == "__main__":
+    main()
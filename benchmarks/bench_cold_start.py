@@ -0,0 +1,92 @@
+# benchmarks/bench_cold_start.py
+# Cold-start cost of model_api.py and score.py with pickled artifacts (joblib + sklearn)
+# versus the compact engine file written by export_model.py. Each run is a fresh
+# interpreter that reports module import time, model load time and the latency of the
+# first prediction separately, plus which heavy libraries ended up imported.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_cold_start [--repeat 5]
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir, load_cmaps_frame
+from export_model import export_model
+from model_store import ARTIFACT_FILES
+
+PROBES = {
+    "model_api": """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import model_api
+imported = time.perf_counter()
+async def run():
+    await model_api.load_artifacts_and_init_clients()
+    loaded = time.perf_counter()
+    bundle = model_api.active_model
+    await model_api.score_reading(bundle.decoder.decode_json(sys.argv[1]), bundle)
+    predicted = time.perf_counter()
+    await model_api.close_dd_session()
+    return loaded, predicted
+loaded, predicted = asyncio.run(run())
+""",
+    "score": """
+import json, sys, time
+started = time.perf_counter()
+import score
+imported = time.perf_counter()
+score.init()
+loaded = time.perf_counter()
+assert "error" not in score.run(sys.argv[1])
+predicted = time.perf_counter()
+""",
+}
+REPORT = """
+print(json.dumps({"import_ms": (imported - started) * 1e3, "load_ms": (loaded - imported) * 1e3,
+                  "first_ms": (predicted - loaded) * 1e3,
+                  "heavy": sorted(m for m in ("sklearn", "joblib", "pandas", "aiohttp") if m in sys.modules)}))
+"""
+
+def run_probe(service, artifact_format, model_dir, payload):
+    env = dict(os.environ, MODEL_DIR=model_dir, AZUREML_MODEL_DIR=model_dir, INFERENCE_ARTIFACT_FORMAT=artifact_format,
+               MODEL_POLL_INTERVAL_S="0", DD_API_METRICS_URL="", DD_API_KEY_HEADER="")
+    started = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", PROBES[service] + REPORT, json.dumps(payload)], cwd=REPO_ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1e3
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold start with pickled vs compact model artifacts.")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    model_dir = tempfile.mkdtemp(prefix="bench_cold_start_")
+    source_dir = ensure_model_dir(args.model_dir)
+    for name in ARTIFACT_FILES:
+        shutil.copy(os.path.join(source_dir, name), model_dir)
+    export_model(model_dir)
+    payload = load_cmaps_frame("test_FD001").iloc[0].to_dict()
+
+    print(f"{'service':<11}{'artifacts':<10}{'import ms':>11}{'load ms':>10}{'first ms':>10}{'process ms':>12}  heavy modules")
+    try:
+        for service in PROBES:
+            for artifact_format in ("pickle", "compact"):
+                runs = [run_probe(service, artifact_format, model_dir, payload) for _ in range(args.repeat)]
+                median = {key: float(np.median([r[key] for r in runs])) for key in ("import_ms", "load_ms", "first_ms", "process_ms")}
+                print(f"{service:<11}{artifact_format:<10}{median['import_ms']:>11.1f}{median['load_ms']:>10.1f}"
+                      f"{median['first_ms']:>10.2f}{median['process_ms']:>12.1f}  {', '.join(runs[0]['heavy']) or '-'}")
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
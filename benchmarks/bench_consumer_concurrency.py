@@ -0,0 +1,83 @@
+# benchmarks/bench_consumer_concurrency.py
+# Per-partition consumer throughput against a local stub model API as
+# CONSUMER_MAX_IN_FLIGHT grows, with and without partition pipelining. Also checks
+# that readings of each unit reach the model API in cycle order.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_consumer_concurrency [--latency-ms 5] [--in-flight 1 4 16 64]
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+
+import event_consumer
+from benchmarks._artifacts import load_cmaps_frame
+from benchmarks._stubs import StubModelAPI, StubPartitionContext, make_events
+from local_pipeline import InMemoryContainer
+
+def interleaved_records(n_events, n_units):
+    """Readings of `n_units` engines interleaved cycle by cycle, like a live fleet."""
+    df = load_cmaps_frame("test_FD001")
+    df = df[df["unit_number"] <= n_units].sort_values(["time_in_cycles", "unit_number"]).head(n_events)
+    records = df.to_dict("records")
+    for i, record in enumerate(records):
+        record["message_id"] = f"bench_{i}"
+        record["event_timestamp"] = "2025-01-01T00:00:00"
+    return records
+
+async def run_once(stub, records, partitions, batch_size, in_flight, pipeline_depth):
+    event_consumer.CONSUMER_MAX_IN_FLIGHT = in_flight
+    event_consumer.CONSUMER_PIPELINE_DEPTH = pipeline_depth
+    event_consumer.model_call_semaphore = None
+    stub.arrivals.clear()
+
+    # Split the stream across partitions by unit (as a partition key would), then batch.
+    per_partition = [[r for r in records if int(r["unit_number"]) % partitions == p] for p in range(partitions)]
+
+    async def receive_partition(partition_id, partition_records):
+        context = StubPartitionContext(str(partition_id))
+        for start in range(0, len(partition_records), batch_size):
+            await event_consumer.on_event_batch(context, make_events(partition_records[start:start + batch_size]))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(receive_partition(p, recs) for p, recs in enumerate(per_partition)))
+    await event_consumer.close_partition_pipelines()
+    elapsed = time.perf_counter() - started
+    return len(records) / elapsed / partitions, stub.out_of_order_units()
+
+async def main_async(args):
+    logging.disable(logging.WARNING)
+    stub = StubModelAPI(latency_s=args.latency_ms / 1000.0)
+    base_url = await stub.start(args.port)
+    os.environ["ML_ENDPOINT_URL"] = f"{base_url}/predict"
+    os.environ.pop("ML_BATCH_ENDPOINT_URL", None)
+
+    event_consumer.http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+    event_consumer.cosmos_container = InMemoryContainer()
+    records = interleaved_records(args.events, args.units)
+    try:
+        print(f"{'in-flight':>10}{'pipeline':>10}{'events/s/partition':>20}{'order ok':>10}")
+        for in_flight in args.in_flight:
+            for pipeline_depth in (0, 2):
+                rate, bad_units = await run_once(stub, records, args.partitions, args.batch_size, in_flight, pipeline_depth)
+                print(f"{in_flight:>10}{pipeline_depth:>10}{rate:>20.0f}{'yes' if not bad_units else 'NO':>10}")
+    finally:
+        await event_consumer.http_session.close()
+        await stub.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent event processing in event_consumer.py.")
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--units", type=int, default=50)
+    parser.add_argument("--partitions", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--port", type=int, default=8767)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# benchmarks/bench_consumer_sharding.py
+# Consumer throughput with consumer_supervisor.py running 1, 2, 4... event_consumer processes
+# that split the partitions of the local file-backed queue (PIPELINE_BACKEND=local, in-process
+# scoring) through a shared SQLite checkpoint store. Progress is read from the store's
+# checkpoints, as the workers' documents stay in their own memory. For each worker count:
+#   - seconds until every partition is checkpointed at its last event, and events/s
+#   - seconds from the first checkpoint to the last (throughput once the workers are up)
+#   - partitions per worker, from the ownership records
+# With --kill, one worker is SIGKILLed halfway through the run (the largest worker count only)
+# and the time until all of its partitions are claimed again and move on is reported as well;
+# the supervisor restarts it under the same owner id, so it takes its partitions straight back.
+# Throughput can only scale up to the usable CPUs.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_consumer_sharding [--events 100000] [--partitions 8] [--workers 1 2 4] [--kill]
+import argparse
+import collections
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir, load_cmaps_frame
+from benchmarks.bench_prefork import process_tree
+from checkpoint_store import SQLiteCheckpointStore
+from consumer_supervisor import usable_cpus
+from local_pipeline import LOCAL_NAMESPACE, FilePartitionedQueue, LocalEventData, LocalProducerClient
+
+OWNER_PREFIX = "bench"
+
+def write_queue(queue_dir, events, partitions):
+    """test_FD001 rows repeated with fresh unit numbers, keyed by unit as stream_data.py sends them."""
+    df = load_cmaps_frame("test_FD001")
+    records = df.to_dict("records")
+    n_units = int(df["unit_number"].max())
+    producer = LocalProducerClient(FilePartitionedQueue(queue_dir, partition_count=partitions))
+    by_key = {}
+    for i in range(events):
+        record = dict(records[i % len(records)], message_id=f"bench_{i}", event_timestamp="2025-01-01T00:00:00")
+        record["unit_number"] += n_units * (i // len(records))
+        by_key.setdefault(str(int(record["unit_number"])), []).append(LocalEventData(json.dumps(record)))
+    for key, key_events in by_key.items():
+        for start in range(0, len(key_events), 500):
+            batch = producer.create_batch(partition_key=key)
+            for event in key_events[start:start + 500]:
+                batch.add(event)
+            producer.send_batch(batch)
+    queue = FilePartitionedQueue(queue_dir, partition_count=partitions)
+    return {partition_id: queue.last_sequence_number(partition_id) for partition_id in queue.partition_ids}
+
+def worker_pids(supervisor_pid):
+    """The supervisor's worker processes, in start order (so index i is owner bench-i)."""
+    pids = []
+    for pid in process_tree(supervisor_pid)[1:]:
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                if b"spawn_main" in f.read():
+                    pids.append(pid)
+        except OSError:
+            pass
+    return sorted(pids)
+
+def run(queue_dir, last_sequence, model_dir, workdir, n_workers, kill):
+    store_path = os.path.join(workdir, f"checkpoints_{n_workers}{'_kill' if kill else ''}.sqlite")
+    env = dict(os.environ, PIPELINE_BACKEND="local", SCORING_MODE="local", MODEL_DIR=model_dir, ML_ENDPOINT_URL="http://unused",
+               LOCAL_QUEUE_DIR=queue_dir, LOCAL_PARTITION_COUNT=str(len(last_sequence)),
+               CHECKPOINT_STORE="sqlite", CHECKPOINT_PATH=store_path, CHECKPOINT_INTERVAL_S="0.5",
+               CONSUMER_OWNER_ID=OWNER_PREFIX, CONSUMER_LOAD_BALANCING_INTERVAL_S="1", CONSUMER_OWNERSHIP_EXPIRATION_S="6",
+               CONSUMER_METRICS_PORT="0", CONSUMER_METRICS_DIR=os.path.join(workdir, "metrics"),
+               CONSUMER_MAX_WAIT_TIME_S="0.2", DD_API_KEY="")
+    store = SQLiteCheckpointStore(store_path)
+    started = time.perf_counter()
+    supervisor = subprocess.Popen([sys.executable, "consumer_supervisor.py", "--workers", str(n_workers)], cwd=REPO_ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    total = sum(last + 1 for last in last_sequence.values())
+    first_checkpoint = killed_at = None
+    killed_partitions, recovered = {}, {}
+    try:
+        while True:
+            time.sleep(0.05)
+            now = time.perf_counter()
+            progress = {c["partition_id"]: c["sequence_number"] for c in store._list_checkpoints(LOCAL_NAMESPACE, "local", "$Default")}
+            if progress and first_checkpoint is None:
+                first_checkpoint = now
+            done = sum(progress.get(partition_id, -1) + 1 for partition_id in last_sequence)
+            if kill and killed_at is None and done >= total // 2:
+                ownership = store._list_ownership(LOCAL_NAMESPACE, "local", "$Default")
+                killed_partitions = {o["partition_id"]: progress.get(o["partition_id"], -1)
+                                     for o in ownership if o["owner_id"] == f"{OWNER_PREFIX}-0"}
+                os.kill(worker_pids(supervisor.pid)[0], signal.SIGKILL)
+                killed_at, killed_wall = now, time.time()
+            if killed_partitions:
+                # Recovered once a live worker has claimed it since the kill and checkpointed past where it stood.
+                claimed = {o["partition_id"] for o in store._list_ownership(LOCAL_NAMESPACE, "local", "$Default")
+                           if o["owner_id"] and o["last_modified_time"] > killed_wall}
+                for partition_id, at_kill in killed_partitions.items():
+                    if partition_id not in recovered and partition_id in claimed and (
+                            progress.get(partition_id, -1) > at_kill or at_kill == last_sequence[partition_id]):
+                        recovered[partition_id] = now - killed_at
+            if all(progress.get(partition_id, -1) >= last for partition_id, last in last_sequence.items()):
+                break
+            if supervisor.poll() is not None:
+                raise RuntimeError(f"consumer_supervisor.py exited with code {supervisor.returncode}.")
+            if now - started > 600:
+                raise RuntimeError("The consumers did not catch up within 10 minutes.")
+        finished = time.perf_counter()
+        owners = collections.Counter(o["owner_id"] for o in store._list_ownership(LOCAL_NAMESPACE, "local", "$Default"))
+    finally:
+        supervisor.terminate()
+        supervisor.wait()
+        store.close()
+    return {"total": total, "seconds": finished - started, "steady_seconds": finished - first_checkpoint,
+            "partitions_per_worker": sorted(count for owner, count in owners.items() if owner),
+            "killed_partitions": len(killed_partitions), "recovery_s": max(recovered.values(), default=None)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark consumer_supervisor.py throughput by worker count on the local queue.")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--kill", action="store_true", help="Also SIGKILL a worker halfway with the largest worker count.")
+    parser.add_argument("--model-dir", default=None)
+    args = parser.parse_args()
+
+    model_dir = os.path.abspath(ensure_model_dir(args.model_dir))
+    workdir = tempfile.mkdtemp(prefix="bench_consumer_sharding_")
+    try:
+        queue_dir = os.path.join(workdir, "queue")
+        last_sequence = write_queue(queue_dir, args.events, args.partitions)
+        print(f"{args.events} events in {args.partitions} partitions; usable CPUs: {usable_cpus()}; "
+              f"wall time includes worker start-up and model loading")
+        print(f"{'workers':>8}{'kill':>6}{'seconds':>10}{'events/s':>12}{'steady ev/s':>13}{'partitions/worker':>19}{'recovery s':>12}")
+        runs = [(n_workers, False) for n_workers in args.workers]
+        if args.kill:
+            runs.append((max(args.workers), True))
+        for n_workers, kill in runs:
+            result = run(queue_dir, last_sequence, model_dir, workdir, n_workers, kill)
+            recovery = "-" if result["recovery_s"] is None else f"{result['recovery_s']:.2f}"
+            print(f"{n_workers:>8}{'yes' if kill else 'no':>6}{result['seconds']:>10.2f}{result['total'] / result['seconds']:>12,.0f}"
+                  f"{result['total'] / result['steady_seconds']:>13,.0f}{','.join(map(str, result['partitions_per_worker'])):>19}{recovery:>12}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
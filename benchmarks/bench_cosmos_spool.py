@@ -0,0 +1,139 @@
+# benchmarks/bench_cosmos_spool.py
+# Compares writing each consumer batch to Cosmos inline (CosmosBatchWriter, as event_consumer
+# does without COSMOS_SPOOL_DIR) with appending it to the write-behind spool (cosmos_spool.py)
+# while its flusher drains to the same in-memory container in the background:
+#   - latency the batch path waits for persistence, per batch, inline and per spool fsync policy
+#   - records lost when the container returns 503 for --outage-s of the run, inline and spooled
+#   - records replayed by a new spool after stopping one mid-outage
+# Batches arrive every --interval-ms (or as fast as the inline path takes them).
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_cosmos_spool [--batches 200] [--batch-size 100] [--latency-ms 5] [--interval-ms 10] [--outage-s 1]
+import argparse
+import asyncio
+import logging
+import shutil
+import statistics
+import tempfile
+import time
+
+from azure.cosmos import exceptions
+
+from cosmos_spool import CosmosSpool
+from cosmos_writer import CosmosBatchWriter
+from local_pipeline import InMemoryContainer
+
+class OutageContainer(InMemoryContainer):
+    """InMemoryContainer that answers every call with 503 while `down` is set or during [outage_start, outage_end)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.down = False
+        self.outage_start = self.outage_end = 0.0
+
+    def start_outage(self, duration_s):
+        self.outage_start = time.monotonic()
+        self.outage_end = self.outage_start + duration_s
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        if self.down or self.outage_start <= time.monotonic() < self.outage_end:
+            raise exceptions.CosmosHttpResponseError(status_code=503, message="Service unavailable (injected).")
+        return await super().execute_item_batch(batch_operations, partition_key, **kwargs)
+
+def make_batches(n_batches, batch_size, n_units):
+    return [[{"id": f"{i % n_units + 1}-{b}-{i}", "unit_number": float(i % n_units + 1), "time_in_cycles": float(i)}
+             for i in range(batch_size)] for b in range(n_batches)]
+
+def percentiles_ms(latencies):
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49] * 1000, quantiles[98] * 1000
+
+def make_writer(container):
+    return CosmosBatchWriter(container, max_retries=2, base_backoff_s=0.01, max_backoff_s=0.05)
+
+async def run_inline(batches, container, interval_s, outage_s):
+    writer, latencies, lost = make_writer(container), [], 0
+    for index, batch in enumerate(batches):
+        if outage_s and index == len(batches) // 4:
+            container.start_outage(outage_s)
+        start = time.perf_counter()
+        result = await writer.write(batch)
+        latencies.append(time.perf_counter() - start)
+        lost += len(result.failed) # The batch is checkpointed regardless
+        await asyncio.sleep(max(interval_s - latencies[-1], 0))
+    return latencies, lost
+
+async def run_spooled(batches, container, directory, fsync, interval_s, outage_s):
+    spool = CosmosSpool(directory, fsync=fsync, retry_backoff_s=(0.05, 0.2))
+    flusher = asyncio.create_task(spool.run_flusher(make_writer(container)))
+    latencies = []
+    for index, batch in enumerate(batches):
+        if outage_s and index == len(batches) // 4:
+            container.start_outage(outage_s)
+        start = time.perf_counter()
+        await spool.append(batch)
+        if fsync == "checkpoint" and index % 10 == 9:
+            await spool.sync() # CheckpointThrottle's before_checkpoint, every 10th batch
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(max(interval_s - latencies[-1], 0))
+    drain_start = time.perf_counter()
+    await spool.close(flusher, drain_timeout_s=60)
+    return latencies, spool.depth_records + spool.dead_lettered, time.perf_counter() - drain_start
+
+async def main_async(args):
+    logging.disable(logging.ERROR)
+    batches = make_batches(args.batches, args.batch_size, args.units)
+    total = args.batches * args.batch_size
+    latency_s, interval_s = args.latency_ms / 1000.0, args.interval_ms / 1000.0
+    workdir = tempfile.mkdtemp(prefix="bench_cosmos_spool_")
+    try:
+        print(f"{args.batches} batches of {args.batch_size} records, {latency_s * 1000:.0f} ms per Cosmos call; "
+              f"a batch every {interval_s * 1000:.0f} ms; outage runs get 503s for {args.outage_s:.1f}s from batch {args.batches // 4}")
+        print(f"{'mode':<26}{'outage':>8}{'p50 ms':>10}{'p99 ms':>10}{'records lost':>14}{'drain after s':>15}")
+        for with_outage in (False, True):
+            container = OutageContainer(latency_s=latency_s)
+            latencies, lost = await run_inline(batches, container, interval_s, args.outage_s if with_outage else 0)
+            p50, p99 = percentiles_ms(latencies)
+            print(f"{'inline':<26}{'yes' if with_outage else 'no':>8}{p50:>10.2f}{p99:>10.2f}{lost:>14}{'-':>15}")
+            for fsync in ("never", "checkpoint", "always"):
+                if with_outage and fsync != "checkpoint":
+                    continue
+                container = OutageContainer(latency_s=latency_s)
+                directory = tempfile.mkdtemp(dir=workdir)
+                latencies, lost, drain_s = await run_spooled(batches, container, directory, fsync, interval_s,
+                                                             args.outage_s if with_outage else 0)
+                assert lost or len(container.items) == total
+                p50, p99 = percentiles_ms(latencies)
+                print(f"{'spool, fsync=' + fsync:<26}{'yes' if with_outage else 'no':>8}{p50:>10.2f}{p99:>10.2f}{lost:>14}{drain_s:>15.2f}")
+
+        # Stop mid-outage, then start a new spool on the same directory with Cosmos back.
+        container = OutageContainer(latency_s=latency_s)
+        container.down = True
+        directory = tempfile.mkdtemp(dir=workdir)
+        spool = CosmosSpool(directory, retry_backoff_s=(0.05, 0.2))
+        flusher = asyncio.create_task(spool.run_flusher(make_writer(container)))
+        for batch in batches:
+            await spool.append(batch)
+        await spool.close(flusher, drain_timeout_s=0.5)
+        pending = spool.depth_records
+        container.down = False
+        spool = CosmosSpool(directory)
+        replayed = spool.depth_records
+        await spool.close(asyncio.create_task(spool.run_flusher(make_writer(container))), drain_timeout_s=60)
+        print(f"restart mid-outage: {pending} records pending at stop, {replayed} replayed, "
+              f"{len(container.items)} in Cosmos after the drain (of {total})")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Cosmos write-behind spool against inline writes.")
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--units", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--interval-ms", type=float, default=10.0)
+    parser.add_argument("--outage-s", type=float, default=1.0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
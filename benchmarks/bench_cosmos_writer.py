@@ -0,0 +1,54 @@
+# benchmarks/bench_cosmos_writer.py
+# Compares the previous sequential upsert_item loop with CosmosBatchWriter against the
+# in-memory container stand-in, which adds a fixed per-call latency and records call sizes.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_cosmos_writer [--records 1000] [--units 20] [--latency-ms 5]
+import argparse
+import asyncio
+import logging
+import time
+
+from cosmos_writer import CosmosBatchWriter
+from local_pipeline import InMemoryContainer
+
+def make_records(n_records, n_units):
+    return [{"id": f"{i % n_units + 1}-{i}", "unit_number": float(i % n_units + 1), "time_in_cycles": float(i)}
+            for i in range(n_records)]
+
+async def sequential_upserts(container, records):
+    for record in records:
+        await container.upsert_item(body=record)
+
+async def main_async(args):
+    logging.disable(logging.ERROR)
+    records = make_records(args.records, args.units)
+    latency_s = args.latency_ms / 1000.0
+
+    print(f"{'mode':<24}{'calls':>8}{'max call size':>15}{'seconds':>10}{'records/s':>12}")
+
+    container = InMemoryContainer(latency_s=latency_s)
+    start = time.perf_counter()
+    await sequential_upserts(container, records)
+    elapsed = time.perf_counter() - start
+    print(f"{'upsert_item loop':<24}{len(container.call_sizes):>8}{max(container.call_sizes):>15}{elapsed:>10.3f}{len(records) / elapsed:>12.0f}")
+
+    for label, throttle_every in (("batch writer", 0), ("batch writer, 429 every 5", 5)):
+        container = InMemoryContainer(latency_s=latency_s, throttle_every=throttle_every)
+        writer = CosmosBatchWriter(container, max_parallel_partitions=args.parallel, base_backoff_s=0.01)
+        start = time.perf_counter()
+        result = await writer.write(records)
+        elapsed = time.perf_counter() - start
+        assert result.written == len(records) and len(container.items) == len(records)
+        print(f"{label:<24}{len(container.call_sizes):>8}{max(container.call_sizes):>15}{elapsed:>10.3f}{len(records) / elapsed:>12.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CosmosBatchWriter against an in-memory container.")
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--units", type=int, default=20)
+    parser.add_argument("--parallel", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# benchmarks/bench_feature_engine.py
+# Per-event cost of feature_engine.RollingFeatureEngine versus recomputing the window
+# with pandas for every event, parity of its outputs with pandas rolling/ewm, and the
+# memory held with many units (bounded by max_units).
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_feature_engine [--window 30] [--units 10000]
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks._artifacts import load_cmaps_frame
+from feature_engine import SENSOR_FEATURES, RollingFeatureEngine
+
+def pandas_reference(df, window, alpha):
+    """Rolling mean/std and EWMA per unit from pandas, aligned with df rows."""
+    grouped = df.groupby('unit_number')[SENSOR_FEATURES]
+    mean = grouped.rolling(window, min_periods=1).mean().reset_index(level=0, drop=True).sort_index().to_numpy()
+    std = grouped.rolling(window, min_periods=1).std(ddof=0).reset_index(level=0, drop=True).sort_index().to_numpy()
+    ewma = grouped.transform(lambda s: s.ewm(alpha=alpha, adjust=False).mean()).to_numpy()
+    return mean, std, ewma
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark incremental rolling-window features.")
+    parser.add_argument("--window", type=int, default=30)
+    parser.add_argument("--alpha", type=float, default=0.2)
+    parser.add_argument("--units", type=int, default=10000, help="Distinct units for the memory test.")
+    parser.add_argument("--max-units", type=int, default=2000)
+    parser.add_argument("--naive-events", type=int, default=500)
+    args = parser.parse_args()
+
+    df = load_cmaps_frame("train_FD001")
+    values = df[SENSOR_FEATURES].to_numpy()
+    units = df['unit_number'].to_numpy()
+    cycles = df['time_in_cycles'].to_numpy()
+
+    engine = RollingFeatureEngine(window=args.window, ewma_alpha=args.alpha)
+    out = np.empty((len(df), len(engine.feature_names)))
+    started = time.perf_counter()
+    for i in range(len(df)):
+        out[i] = engine.update(units[i], values[i], cycles[i])
+    incremental_us = (time.perf_counter() - started) / len(df) * 1e6
+
+    # Naive: slice the unit's last `window` readings and recompute every statistic per event.
+    n = min(args.naive_events, len(df))
+    started = time.perf_counter()
+    for i in range(n):
+        unit_rows = df.iloc[max(0, i - args.window * 2):i + 1]
+        recent = unit_rows[unit_rows['unit_number'] == units[i]][SENSOR_FEATURES].tail(args.window)
+        recent.mean(), recent.std(ddof=0), np.polyfit(np.arange(len(recent)), recent.to_numpy(), 1) if len(recent) > 1 else None
+    naive_us = (time.perf_counter() - started) / n * 1e6
+
+    n_feat = len(SENSOR_FEATURES)
+    mean, std, ewma = pandas_reference(df, args.window, args.alpha)
+    print(f"incremental update: {incremental_us:8.1f} us/event  ({len(df)} events, window {args.window})")
+    print(f"pandas recompute:   {naive_us:8.1f} us/event  ({n} events)")
+    print(f"max abs diff vs pandas: mean {np.abs(out[:, :n_feat] - mean).max():.2e}, "
+          f"std {np.abs(out[:, n_feat:2 * n_feat] - std).max():.2e}, ewma {np.abs(out[:, 3 * n_feat:] - ewma).max():.2e}")
+
+    tracemalloc.start()
+    bounded = RollingFeatureEngine(window=args.window, max_units=args.max_units)
+    for unit in range(args.units):
+        bounded.update(unit, values[unit % len(values)], 1)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.units} units with max_units={args.max_units}: {bounded.stats()}, "
+          f"{current / 1e6:.1f} MB held ({current / len(bounded.units) / 1e3:.1f} kB/unit), peak {peak / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
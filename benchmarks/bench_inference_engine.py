@@ -0,0 +1,77 @@
+# benchmarks/bench_inference_engine.py
+# Compares the sklearn scoring path (scaler.transform + decision_function + predict)
+# with the flattened IsolationForestEngine, per row and per batch, after checking
+# that both produce the same scores and labels.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_inference_engine [--model-dir models] [--batch-size 100]
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+from benchmarks._artifacts import ensure_model_dir, load_cmaps_frame, percentile_summary
+from inference_engine import load_engine
+
+SCORE_TOLERANCE = 1e-6
+
+def sklearn_score(model, scaler, X):
+    scaled_input = scaler.transform(X)
+    return model.decision_function(scaled_input), model.predict(scaled_input) == -1
+
+def time_calls(fn, inputs, repeat):
+    samples = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def check_parity(engine, model, scaler, X):
+    expected_scores, expected_labels = sklearn_score(model, scaler, X)
+    scores, labels = engine.score(X)
+    max_diff = float(np.abs(scores - expected_scores).max())
+    label_mismatches = int((labels != expected_labels).sum())
+    if max_diff > SCORE_TOLERANCE or label_mismatches:
+        raise SystemExit(f"{engine.dtype} engine diverges from sklearn: max |score diff| = {max_diff:.3g}, "
+                         f"{label_mismatches} label mismatches over {len(X)} rows.")
+    return max_diff
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=200, help="Rows timed one at a time.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    model_dir = ensure_model_dir(args.model_dir)
+    engines = {dtype: load_engine(model_dir, dtype=dtype) for dtype in ("float64", "float32")}
+    _, model, scaler, feature_names = engines["float64"]
+
+    X = load_cmaps_frame("test_FD001")[feature_names].to_numpy()
+    for dtype, (engine, *_ ) in engines.items():
+        max_diff = check_parity(engine, model, scaler, X)
+        print(f"parity {dtype}: {len(X)} rows, max |score diff| {max_diff:.2e}, labels identical")
+
+    single_rows = [X[i:i + 1] for i in range(min(args.rows, len(X)))]
+    batches = [X[i:i + args.batch_size] for i in range(0, len(X) - args.batch_size + 1, args.batch_size)][:50]
+
+    candidates = {"sklearn": lambda x: sklearn_score(model, scaler, x)}
+    for dtype, (engine, *_ ) in engines.items():
+        candidates[f"engine-{dtype}"] = engine.score
+
+    print(f"\n{'path':<16}{'per-row p50':>14}{'per-row p99':>14}{'batch p50':>14}{'batch rows/s':>16}")
+    for name, fn in candidates.items():
+        row_stats = percentile_summary(time_calls(fn, single_rows, args.repeat))
+        batch_samples = time_calls(fn, batches, args.repeat)
+        batch_stats = percentile_summary(batch_samples)
+        rows_per_s = args.batch_size / np.median(batch_samples)
+        print(f"{name:<16}{row_stats['p50_us']:>12.1f}us{row_stats['p99_us']:>12.1f}us"
+              f"{batch_stats['p50_us']:>12.1f}us{rows_per_s:>16,.0f}")
+
+if __name__ == "__main__":
+    main()
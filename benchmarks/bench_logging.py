@@ -0,0 +1,80 @@
+# benchmarks/bench_logging.py
+# Cost of the consumer's per-event log line ("Processed unit ..., cycle ...") on the calling
+# thread, i.e. the event loop, with:
+#   sync     - a StreamHandler, as logging.basicConfig() sets up
+#   queue    - logging_setup's queue-backed writer thread, every line logged
+#   sampled  - queue-backed, plus a LogSampler allowing one line per unit every 10 s
+# The sink sleeps --sink-delay-us per write to stand in for a slow terminal, pipe or container
+# log driver; the sync handler pays that on every call.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_logging [--events 20000] [--units 100] [--sink-delay-us 20]
+import argparse
+import io
+import logging
+import queue
+import time
+
+import numpy as np
+
+import logging_setup
+
+class SlowSink(io.TextIOBase):
+    """Text stream that discards its input after sleeping `delay_s` per write."""
+
+    def __init__(self, delay_s):
+        self.delay_s = delay_s
+        self.lines = 0
+
+    def write(self, text):
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        self.lines += text.count("\n")
+        return len(text)
+
+def run(mode, events, n_units, sink_delay_s):
+    sink = SlowSink(sink_delay_s)
+    output = logging.StreamHandler(sink)
+    output.setFormatter(logging.Formatter(logging_setup.LOG_FORMAT))
+    logger = logging.getLogger(f"bench_logging.{mode}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    listener = queue_handler = None
+    if mode == "sync":
+        logger.addHandler(output)
+    else:
+        queue_handler = logging_setup.DroppingQueueHandler(queue.Queue(maxsize=logging_setup.LOG_QUEUE_SIZE))
+        logger.addHandler(queue_handler)
+        listener = logging_setup.QueueWriter(queue_handler.queue, output)
+        listener.start()
+    sampler = logging_setup.LogSampler(mode, interval_s=10, max_per_s=0) if mode == "sampled" else None
+
+    readings = [{"unit_number": i % n_units + 1, "time_in_cycles": i // n_units + 1} for i in range(events)]
+    latencies = np.empty(events, dtype=np.int64)
+    started_all = time.perf_counter()
+    for i, sensor_data in enumerate(readings):
+        started = time.perf_counter_ns()
+        if sampler is None or sampler.allow(sensor_data.get('unit_number')):
+            logger.info(f"Processed unit {sensor_data.get('unit_number')}, cycle {sensor_data.get('time_in_cycles')}. Anomaly from API: False, Score: {0.0123:.4f}")
+        latencies[i] = time.perf_counter_ns() - started
+    elapsed = time.perf_counter() - started_all
+    if listener is not None:
+        listener.stop()
+    dropped = queue_handler.dropped if queue_handler is not None else 0
+    print(f"{mode:<9}{latencies.mean() / 1e3:>10.2f}{np.percentile(latencies, 99) / 1e3:>10.1f}{latencies.max() / 1e3:>10.0f}"
+          f"{events / elapsed:>14,.0f}{sink.lines:>10}{dropped:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark blocking vs queue-backed vs sampled hot-path logging.")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--units", type=int, default=100)
+    parser.add_argument("--sink-delay-us", type=float, default=20)
+    args = parser.parse_args()
+
+    print(f"{args.events} events over {args.units} units, sink {args.sink_delay_us:g} us per write; per-call times on the calling thread")
+    print(f"{'mode':<9}{'mean us':>10}{'p99 us':>10}{'max us':>10}{'events/s':>14}{'written':>10}{'dropped':>10}")
+    for mode in ("sync", "queue", "sampled"):
+        run(mode, args.events, args.units, args.sink_delay_us * 1e-6)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_metrics_client.py
+# Runs MetricsAggregator against a local stub Datadog sink and compares it with the
+# previous pattern of one fire-and-forget POST per event: outbound requests, bytes on
+# the wire, and event-loop time spent per recorded event.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_metrics_client [--events 20000] [--units 100]
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+from metrics_client import MetricsAggregator
+
+class StubSink:
+    """Minimal /api/v1/series stand-in that records request counts and decoded series."""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_received = 0
+        self.series_received = 0
+
+    async def handle(self, request):
+        # aiohttp inflates Content-Encoding bodies itself; Content-Length is the wire size.
+        body = await request.read()
+        self.requests += 1
+        self.bytes_received += int(request.headers.get("Content-Length", len(body)))
+        self.series_received += len(json.loads(body)["series"])
+        return web.json_response({"status": "ok"}, status=202)
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_post("/api/v1/series", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{port}/api/v1/series"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+def per_event_series(unit_number, anomaly_score):
+    now = int(time.time())
+    tags = ["service:model_api", "env:local", f"unit_number:{unit_number}"]
+    return {"series": [
+        {"metric": "iot.anomaly.predictions.debug_total", "points": [[now, 1]], "type": "count", "tags": tags},
+        {"metric": "iot.anomaly.debug_score_distribution", "points": [[now, anomaly_score]], "type": "gauge", "tags": tags},
+    ]}
+
+async def run_per_event(url, n_events, n_units):
+    sink_tasks = []
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        for i in range(n_events):
+            payload = per_event_series(i % n_units, 0.05)
+            sink_tasks.append(asyncio.create_task(session.post(url, json=payload, headers={"DD-API-KEY": "stub"})))
+        record_s = time.perf_counter() - start
+        responses = await asyncio.gather(*sink_tasks, return_exceptions=True)
+        for response in responses:
+            if not isinstance(response, BaseException):
+                response.release()
+    return record_s
+
+async def run_aggregated(url, n_events, n_units, flush_interval_s):
+    async with aiohttp.ClientSession() as session:
+        aggregator = MetricsAggregator(session, url, "stub", flush_interval_s=flush_interval_s)
+        aggregator.start()
+        start = time.perf_counter()
+        for i in range(n_events):
+            tags = ("service:model_api", "env:local", f"unit_number:{i % n_units}")
+            aggregator.count("iot.anomaly.predictions.debug_total", 1, tags)
+            aggregator.distribution("iot.anomaly.debug_score_distribution", 0.05, tags)
+            if i % 1000 == 0:
+                await asyncio.sleep(0)  # let the flusher run, as a live server would
+        record_s = time.perf_counter() - start
+        await aggregator.close()
+    return record_s, aggregator.stats()
+
+async def main_async(args):
+    results = {}
+    for mode in ("per-event", "aggregated"):
+        sink = StubSink()
+        url = await sink.start(args.port)
+        try:
+            if mode == "per-event":
+                record_s = await run_per_event(url, args.events, args.units)
+                stats = None
+            else:
+                record_s, stats = await run_aggregated(url, args.events, args.units, args.flush_interval)
+        finally:
+            await sink.stop()
+        results[mode] = (record_s, sink, stats)
+
+    print(f"{'mode':<12}{'requests':>10}{'bytes':>12}{'series':>10}{'us/event':>10}")
+    for mode, (record_s, sink, stats) in results.items():
+        print(f"{mode:<12}{sink.requests:>10}{sink.bytes_received:>12}{sink.series_received:>10}{record_s / args.events * 1e6:>10.2f}")
+    print(f"aggregator stats: {results['aggregated'][2]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MetricsAggregator against a local stub sink.")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--units", type=int, default=100)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=8766)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
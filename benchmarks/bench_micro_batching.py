@@ -0,0 +1,101 @@
+# benchmarks/bench_micro_batching.py
+# Latency/throughput of /predict at 1, 10 and 100 concurrent clients, with the
+# micro-batcher enabled versus inline scoring on the event loop (the previous behavior).
+#
+# Each mode starts its own `uvicorn model_api:app` process on a local port.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_micro_batching [--duration 5] [--concurrency 1 10 100]
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+import numpy as np
+
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir, load_cmaps_frame
+
+MODES = {
+    "inline": {"PREDICT_MICROBATCH_ENABLED": "false"},
+    "micro-batched": {"PREDICT_MICROBATCH_ENABLED": "true"},
+}
+
+async def wait_until_healthy(url, timeout_s=30):
+    deadline = time.monotonic() + timeout_s
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"model_api did not become healthy at {url}")
+
+async def run_load(predict_url, payloads, concurrency, duration_s):
+    latencies = []
+    stop_at = time.monotonic() + duration_s
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def client(offset):
+            i = offset
+            while time.monotonic() < stop_at:
+                start = time.perf_counter()
+                async with session.post(predict_url, json=payloads[i % len(payloads)]) as response:
+                    await response.read()
+                    response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+                i += concurrency
+
+        started = time.monotonic()
+        await asyncio.gather(*(client(offset) for offset in range(concurrency)))
+        elapsed = time.monotonic() - started
+    latencies_ms = np.asarray(latencies) * 1e3
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /predict with and without micro-batching.")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of load per concurrency level.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    model_dir = os.path.abspath(ensure_model_dir(args.model_dir))
+    df = load_cmaps_frame("test_FD001").head(2000)
+    payloads = df.to_dict("records")
+    for i, payload in enumerate(payloads):
+        payload["message_id"] = f"bench_{i}"
+        payload["event_timestamp"] = "2025-01-01T00:00:00"
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    for mode, mode_env in MODES.items():
+        env = dict(os.environ, MODEL_DIR=model_dir, **mode_env)
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "model_api:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            asyncio.run(wait_until_healthy(f"{base_url}/health"))
+            for concurrency in args.concurrency:
+                stats = asyncio.run(run_load(f"{base_url}/predict", payloads, concurrency, args.duration))
+                results.append((mode, concurrency, stats))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'mode':<15}{'clients':>8}{'req/s':>10}{'p50':>10}{'p99':>10}")
+    for mode, concurrency, stats in results:
+        print(f"{mode:<15}{concurrency:>8}{stats['rps']:>10.0f}{stats['p50_ms']:>8.2f}ms{stats['p99_ms']:>8.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# benchmarks/bench_model_api_outage.py
+# Fault injection for the consumer's model_api guards (resilience.py). A producer replays CMaps
+# rows at a fixed rate into the local partitioned queue. event_consumer.receive_events()
+# consumes them and scores through a stub model API. The stub fails for --outage-s seconds
+# ("hang": requests hang past the timeout, "error": 503s), then recovers.
+#
+# Two configurations are compared:
+#   unguarded - no circuit breaker, no retries, fixed receive batches
+#   guarded   - circuit breaker, shared retry budget, adaptive receive batching
+#
+# Reported per configuration:
+#   - consumer lag (events sent but not yet persisted): its peak during the outage, and how long
+#     after recovery it took to get back under one second of events
+#   - events that fell back to the default anomaly status
+#   - when real predictions resumed after recovery
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_model_api_outage [--fault hang] [--rate 300] [--outage-s 10]
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+
+import event_consumer
+from benchmarks._stubs import StubModelAPI
+from benchmarks.bench_pipeline import ReplayProducer, TimedContainer, load_replay_records
+from checkpoint_store import CheckpointThrottle
+from local_pipeline import InMemoryCheckpointStore, InMemoryPartitionedQueue, LocalConsumerClient
+from resilience import CircuitBreaker, RetryBudget
+
+def configure(guarded, args):
+    """Set event_consumer's guards for one run."""
+    event_consumer.MODEL_API_TIMEOUT_S = args.timeout_s
+    if guarded:
+        event_consumer.model_api_breaker = CircuitBreaker("model_api", failure_threshold=3, reset_timeout_s=args.breaker_reset_s,
+                                                          max_reset_timeout_s=4 * args.breaker_reset_s)
+        event_consumer.model_api_retry_budget = RetryBudget(ratio=0.1, min_per_s=1.0)
+        event_consumer.MODEL_API_MAX_RETRIES = 2
+        event_consumer.batch_controller = event_consumer.AdaptiveBatchController(
+            batch_size=args.batch_size, max_wait_time=args.max_wait_s, target_latency_s=args.target_latency_s,
+            retune_interval_s=args.retune_interval_s)
+    else:
+        event_consumer.model_api_breaker = CircuitBreaker("model_api", failure_threshold=10**9)
+        event_consumer.model_api_retry_budget = RetryBudget(ratio=0.0, min_per_s=0.0)
+        event_consumer.MODEL_API_MAX_RETRIES = 0
+        event_consumer.batch_controller = None
+        event_consumer.CONSUMER_BATCH_SIZE = args.batch_size
+        event_consumer.CONSUMER_MAX_WAIT_TIME_S = args.max_wait_s
+
+async def run_scenario(name, guarded, args, stub, records):
+    configure(guarded, args)
+    queue = InMemoryPartitionedQueue(args.partitions)
+    container = TimedContainer()
+    event_consumer.cosmos_container = container
+    event_consumer.cosmos_writer = None
+    event_consumer.model_call_semaphore = None
+    event_consumer.checkpoint_throttle = CheckpointThrottle(1000, 1.0)
+    event_consumer.eventhub_client = LocalConsumerClient(queue, checkpoint_store=InMemoryCheckpointStore())
+
+    producer = ReplayProducer(queue, records, args.rate)
+    outage_start, outage_end = args.healthy_s, args.healthy_s + args.outage_s
+    samples = [] # (seconds since start, lag)
+    answered_at_recovery = None # Stub requests answered without a fault when the outage ended
+    first_real_after_recovery = None
+    started = time.monotonic()
+    producer.start()
+    receive_task = asyncio.create_task(event_consumer.receive_events())
+    while len(container.persisted_at) < len(records) and time.monotonic() - started < args.deadline_s:
+        await asyncio.sleep(0.1)
+        now = time.monotonic() - started
+        stub.fault = args.fault if outage_start <= now < outage_end else None
+        samples.append((now, len(producer.sent_at) - len(container.persisted_at)))
+        if now >= outage_end and first_real_after_recovery is None:
+            if answered_at_recovery is None:
+                answered_at_recovery = stub.requests - stub.failed_requests
+            elif stub.requests - stub.failed_requests > answered_at_recovery:
+                first_real_after_recovery = now - outage_end
+    stub.fault = None
+    await event_consumer.eventhub_client.close()
+    await receive_task
+    await event_consumer.close_partition_pipelines()
+    producer.join()
+
+    outage_lag = [lag for t, lag in samples if outage_start <= t < outage_end]
+    caught_up = next((t - outage_end for t, lag in samples if t >= outage_end and lag <= args.rate), None)
+    fallbacks = sum(1 for document in container.items.values() if document.get("anomaly_score") == -999.0)
+    print(f"{name:<10}{max(outage_lag, default=0):>12}{_fmt(caught_up):>14}{fallbacks:>11}{_fmt(first_real_after_recovery):>16}"
+          f"{len(container.persisted_at):>11}/{len(records)}")
+    if guarded:
+        print(f"{'':<10}circuit {event_consumer.model_api_breaker.stats()}, retries {event_consumer.model_api_retry_budget.stats()}, "
+              f"batching {event_consumer.batch_controller.stats()}")
+
+def _fmt(seconds):
+    return "never" if seconds is None else f"+{seconds:.1f}s"
+
+async def main_async(args):
+    logging.disable(logging.ERROR)
+    records = load_replay_records(["train_FD001"], int(args.rate * (args.healthy_s + args.outage_s + args.recovery_s)))
+    print(f"{len(records)} events at {args.rate:g}/s, {args.partitions} partitions, model_api '{args.fault}' for "
+          f"{args.outage_s:g}s after {args.healthy_s:g}s, call timeout {args.timeout_s:g}s, "
+          f"{'/predict/batch' if args.batch_endpoint else '/predict'}")
+    print(f"{'config':<10}{'peak lag':>12}{'caught up':>14}{'fallbacks':>11}{'real scores':>16}{'persisted':>11}")
+    for name, guarded in (("unguarded", False), ("guarded", True)):
+        stub = StubModelAPI(latency_s=args.latency_ms / 1000.0, hang_s=10 * args.timeout_s)
+        base_url = await stub.start(args.port)
+        os.environ["ML_ENDPOINT_URL"] = f"{base_url}/predict"
+        if args.batch_endpoint:
+            os.environ["ML_BATCH_ENDPOINT_URL"] = f"{base_url}/predict/batch"
+        else:
+            os.environ.pop("ML_BATCH_ENDPOINT_URL", None)
+        event_consumer.http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        try:
+            await run_scenario(name, guarded, args, stub, records)
+        finally:
+            await event_consumer.http_session.close()
+            await stub.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Consumer lag through a model_api outage, with and without the resilience guards.")
+    parser.add_argument("--fault", choices=["hang", "error"], default="hang")
+    parser.add_argument("--rate", type=float, default=300.0, help="Producer rate, events/s.")
+    parser.add_argument("--partitions", type=int, default=2)
+    parser.add_argument("--healthy-s", type=float, default=5.0)
+    parser.add_argument("--outage-s", type=float, default=10.0)
+    parser.add_argument("--recovery-s", type=float, default=15.0)
+    parser.add_argument("--deadline-s", type=float, default=120.0)
+    parser.add_argument("--timeout-s", type=float, default=2.0, help="MODEL_API_TIMEOUT_S for the run.")
+    parser.add_argument("--breaker-reset-s", type=float, default=2.0)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-wait-s", type=float, default=0.5)
+    parser.add_argument("--target-latency-s", type=float, default=0.5)
+    parser.add_argument("--retune-interval-s", type=float, default=5.0)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--batch-endpoint", action="store_true", help="Score each batch via /predict/batch.")
+    parser.add_argument("--port", type=int, default=8769)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/bench_model_reload.py
+# /predict latency and errors while model_api hot-reloads a new model version.
+#
+# Starts `uvicorn model_api:app` on a versioned MODEL_DIR, keeps a constant concurrent
+# /predict load on it, publishes new versions (copy to a temporary directory, then rename
+# into MODEL_DIR) at fixed intervals, and reports latency before and around each swap,
+# plus the number of failed requests and the versions seen in responses.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_model_reload [--duration 12] [--swaps 2] [--concurrency 20]
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import aiohttp
+import numpy as np
+
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir, load_cmaps_frame
+from benchmarks.bench_micro_batching import wait_until_healthy
+from model_store import ARTIFACT_FILES
+
+def publish_version(source_dir, model_dir, version):
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=model_dir)
+    for name in ARTIFACT_FILES:
+        shutil.copy(os.path.join(source_dir, name), staging)
+    os.rename(staging, os.path.join(model_dir, version))
+
+async def run_load(predict_url, payloads, concurrency, duration_s, on_tick):
+    samples = [] # (finished at, latency s, model_version or None on failure)
+    stop_at = time.monotonic() + duration_s
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def client(offset):
+            i = offset
+            while time.monotonic() < stop_at:
+                start = time.perf_counter()
+                try:
+                    async with session.post(predict_url, json=payloads[i % len(payloads)]) as response:
+                        body = await response.json() if response.status == 200 else None
+                except aiohttp.ClientError:
+                    body = None
+                samples.append((time.monotonic(), time.perf_counter() - start, body["model_version"] if body else None))
+                i += concurrency
+
+        await asyncio.gather(on_tick(stop_at), *(client(offset) for offset in range(concurrency)))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /predict during model hot-reloads.")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--duration", type=float, default=12.0)
+    parser.add_argument("--swaps", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=8770)
+    args = parser.parse_args()
+
+    source_dir = os.path.abspath(ensure_model_dir(args.model_dir))
+    model_dir = tempfile.mkdtemp(prefix="bench_model_versions_")
+    publish_version(source_dir, model_dir, "v000")
+    payloads = load_cmaps_frame("test_FD001").head(2000).to_dict("records")
+
+    env = dict(os.environ, MODEL_DIR=model_dir, MODEL_POLL_INTERVAL_S=str(args.poll_interval))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "model_api:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    published = [] # monotonic time of each publish
+
+    async def publisher(stop_at):
+        interval = args.duration / (args.swaps + 1)
+        for n in range(1, args.swaps + 1):
+            await asyncio.sleep(max(0.0, stop_at - args.duration + n * interval - time.monotonic()))
+            publish_version(source_dir, model_dir, f"v{n:03d}")
+            published.append(time.monotonic())
+
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        asyncio.run(wait_until_healthy(f"{base_url}/health"))
+        samples = asyncio.run(run_load(f"{base_url}/predict", payloads, args.concurrency, args.duration, publisher))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    finished = np.array([s[0] for s in samples])
+    latencies_ms = np.array([s[1] for s in samples]) * 1e3
+    # A swap lands within one poll interval of the publish, plus the load and warm-up time.
+    near_swap = np.zeros(len(samples), dtype=bool)
+    for t in published:
+        near_swap |= (finished >= t) & (finished <= t + args.poll_interval + 2.0)
+    versions = Counter(s[2] for s in samples)
+    failures = versions.pop(None, 0)
+
+    print(f"{len(samples)} requests, {failures} failed, versions served: {dict(sorted(versions.items()))}")
+    print(f"{'window':<14}{'requests':>10}{'p50':>10}{'p99':>10}{'max':>10}")
+    for label, mask in (("steady", ~near_swap), ("around swaps", near_swap)):
+        if mask.any():
+            window = latencies_ms[mask]
+            print(f"{label:<14}{mask.sum():>10}{np.percentile(window, 50):>8.2f}ms"
+                  f"{np.percentile(window, 99):>8.2f}ms{window.max():>8.2f}ms")
+
+if __name__ == "__main__":
+    main()
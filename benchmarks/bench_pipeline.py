@@ -0,0 +1,174 @@
+# benchmarks/bench_pipeline.py
+# End-to-end benchmark of producer -> Event Hub -> event_consumer -> model_api -> Cosmos DB
+# on local stand-ins: an in-memory partitioned queue replaces Event Hubs, an in-memory
+# container replaces Cosmos DB, and model_api runs as a real uvicorn process.
+#
+# CMaps rows are replayed at a target rate. The run reports delivered events/s,
+# end-to-end latency percentiles (send -> persisted) and CPU time per stage, so the
+# same command can be re-run to spot regressions.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_pipeline [--rate 2000] [--events 10000] [--partitions 4]
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import aiohttp
+import numpy as np
+
+import event_consumer
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir, load_cmaps_frame
+from benchmarks.bench_micro_batching import wait_until_healthy
+from local_pipeline import InMemoryContainer, InMemoryPartitionedQueue, LocalConsumerClient, LocalEventData, LocalProducerClient
+
+def process_cpu_seconds(pid):
+    """utime + stime of a process from /proc (Linux); None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+class TimedContainer(InMemoryContainer):
+    """In-memory document store that stamps when each message was persisted."""
+
+    def __init__(self):
+        super().__init__()
+        self.persisted_at = {}
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        result = await super().execute_item_batch(batch_operations, partition_key, **kwargs)
+        now = time.perf_counter()
+        for _, (body,), *_ in batch_operations:
+            self.persisted_at[body["message_id"]] = now
+        return result
+
+def load_replay_records(files, n_events):
+    frames = [load_cmaps_frame(name) for name in files]
+    records = []
+    for name, df in zip(files, frames):
+        for record in df.to_dict("records"):
+            record["source_file"] = name
+            records.append(record)
+    return records[:n_events]
+
+class ReplayProducer(threading.Thread):
+    """Sends records at `rate` events/s in 10 ms ticks, one batch per unit per tick."""
+
+    def __init__(self, queue, records, rate):
+        super().__init__(daemon=True)
+        self.producer = LocalProducerClient(queue)
+        self.records = records
+        self.rate = rate
+        self.sent_at = {}
+        self.cpu_seconds = 0.0
+
+    def run(self):
+        cpu_start = time.thread_time()
+        tick_s = 0.01
+        per_tick = max(1, int(self.rate * tick_s))
+        started = time.perf_counter()
+        for tick_index, start in enumerate(range(0, len(self.records), per_tick)):
+            batches = {}
+            for i, record in enumerate(self.records[start:start + per_tick], start=start):
+                record = dict(record, message_id=f"bench_{i}", event_timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))
+                key = f"{record['source_file']}-{int(record['unit_number'])}"
+                batch = batches.get(key)
+                if batch is None:
+                    batch = batches[key] = self.producer.create_batch(partition_key=key)
+                batch.add(LocalEventData(json.dumps(record)))
+                self.sent_at[record["message_id"]] = time.perf_counter()
+            for batch in batches.values():
+                self.producer.send_batch(batch)
+            sleep_s = started + (tick_index + 1) * tick_s - time.perf_counter()
+            if sleep_s > 0:
+                time.sleep(sleep_s)
+        self.cpu_seconds = time.thread_time() - cpu_start
+
+async def run_consumer(queue, container, n_events, timeout_s):
+    consumer = LocalConsumerClient(queue)
+    receive_task = asyncio.create_task(consumer.receive_batch(
+        on_event_batch=event_consumer.on_event_batch, max_batch_size=100, max_wait_time=0.5))
+    deadline = time.monotonic() + timeout_s
+    while len(container.persisted_at) < n_events and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    await consumer.close()
+    await receive_task
+    await event_consumer.close_partition_pipelines()
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end local pipeline benchmark.")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--files", nargs="+", default=["train_FD001"])
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=2000.0, help="Target producer rate, events/s.")
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--batch-endpoint", action="store_true", help="Score each batch via /predict/batch.")
+    parser.add_argument("--port", type=int, default=8768)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    model_dir = os.path.abspath(ensure_model_dir(args.model_dir))
+    records = load_replay_records(args.files, args.events)
+    n_events = len(records)
+
+    env = dict(os.environ, MODEL_DIR=model_dir)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "model_api:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        asyncio.run(wait_until_healthy(f"{base_url}/health"))
+        os.environ["ML_ENDPOINT_URL"] = f"{base_url}/predict"
+        if args.batch_endpoint:
+            os.environ["ML_BATCH_ENDPOINT_URL"] = f"{base_url}/predict/batch"
+
+        queue = InMemoryPartitionedQueue(args.partitions)
+        container = TimedContainer()
+        producer = ReplayProducer(queue, records, args.rate)
+
+        async def run():
+            event_consumer.http_session = aiohttp.ClientSession()
+            event_consumer.cosmos_container = container
+            try:
+                producer.start()
+                await run_consumer(queue, container, n_events, args.timeout)
+            finally:
+                await event_consumer.http_session.close()
+
+        api_cpu_start = process_cpu_seconds(server.pid)
+        consumer_cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        asyncio.run(run())
+        wall_s = time.perf_counter() - wall_start
+        consumer_cpu = time.thread_time() - consumer_cpu_start
+        api_cpu_end = process_cpu_seconds(server.pid)
+        producer.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    delivered = len(container.persisted_at)
+    latencies_ms = np.array([(container.persisted_at[m] - producer.sent_at[m]) * 1e3
+                             for m in container.persisted_at if m in producer.sent_at])
+    print(f"events: {delivered}/{n_events} persisted in {wall_s:.2f}s -> {delivered / wall_s:,.0f} events/s "
+          f"(target {args.rate:,.0f}/s, {args.partitions} partitions)")
+    if len(latencies_ms):
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        print(f"end-to-end latency: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, max {latencies_ms.max():.1f} ms")
+    stages = [("producer", producer.cpu_seconds), ("consumer", consumer_cpu)]
+    if api_cpu_start is not None and api_cpu_end is not None:
+        stages.append(("model_api", api_cpu_end - api_cpu_start))
+    for stage, cpu_s in stages:
+        print(f"cpu {stage:<10} {cpu_s:8.2f} s  {cpu_s / max(delivered, 1) * 1e6:8.1f} us/event")
+
+if __name__ == "__main__":
+    main()
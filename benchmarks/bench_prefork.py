@@ -0,0 +1,96 @@
+# benchmarks/bench_prefork.py
+# /predict/batch throughput and resident memory of model_api served by N worker processes:
+#
+#   uvicorn --workers N   -- each worker unpickles the artifacts and flattens its own engine
+#   prefork_server.py     -- the parent publishes one engine file that every worker maps
+#
+# Memory is the sum over the server's process tree of RSS (shared pages counted once per
+# process) and PSS (shared pages split between the processes mapping them), from
+# /proc/<pid>/smaps_rollup (Linux). Throughput can only scale up to the usable CPUs, which
+# the load generator shares with the server.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_prefork [--workers 1 2 4] [--duration 5] [--batch-size 100]
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir, load_cmaps_frame
+from benchmarks.bench_micro_batching import run_load, wait_until_healthy
+from prefork_server import usable_cpus
+
+def process_tree(pid):
+    """`pid` and all its descendants, from /proc (Linux)."""
+    parents = {}
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    parents[int(name)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    tree, frontier = [pid], [pid]
+    while frontier:
+        frontier = [child for child, parent in parents.items() if parent in frontier]
+        tree.extend(frontier)
+    return tree
+
+def memory_kb(pids):
+    """Summed Rss and Pss (kB) of `pids` from smaps_rollup."""
+    totals = {"Rss": 0, "Pss": 0}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    key, _, rest = line.partition(":")
+                    if key in totals:
+                        totals[key] += int(rest.split()[0])
+        except OSError:
+            pass
+    return totals
+
+def server_command(mode, n_workers, port):
+    if mode == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "model_api:app", "--port", str(port), "--workers", str(n_workers), "--log-level", "warning"]
+    return [sys.executable, "prefork_server.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(n_workers), "--log-level", "warning"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-process model_api serving.")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of load per configuration.")
+    parser.add_argument("--batch-size", type=int, default=100, help="Readings per /predict/batch request.")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    model_dir = os.path.abspath(ensure_model_dir(args.model_dir))
+    records = load_cmaps_frame("test_FD001").head(20 * args.batch_size).to_dict("records")
+    payloads = [records[start:start + args.batch_size] for start in range(0, len(records), args.batch_size)]
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(f"usable CPUs: {usable_cpus()}")
+    print(f"{'server':<10}{'workers':>8}{'req/s':>10}{'readings/s':>12}{'p99':>10}{'RSS MB':>10}{'PSS MB':>10}")
+    with tempfile.TemporaryDirectory(prefix="bench_prefork_") as engine_dir:
+        for mode in ("uvicorn", "prefork"):
+            for n_workers in args.workers:
+                # Pickled artifacts for uvicorn, so each worker builds its own engine as without prefork_server.py.
+                env = dict(os.environ, MODEL_DIR=model_dir, INFERENCE_ARTIFACT_FORMAT="pickle", PREFORK_ENGINE_DIR=engine_dir,
+                           MODEL_POLL_INTERVAL_S="0", RESULT_CACHE_MAX_ENTRIES="0")
+                server = subprocess.Popen(server_command(mode, n_workers, args.port), cwd=REPO_ROOT, env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    asyncio.run(wait_until_healthy(f"{base_url}/health", timeout_s=60))
+                    asyncio.run(run_load(f"{base_url}/predict/batch", payloads, 4 * n_workers, 1.0)) # Warm every worker
+                    stats = asyncio.run(run_load(f"{base_url}/predict/batch", payloads, 4 * n_workers, args.duration))
+                    memory = memory_kb(process_tree(server.pid))
+                finally:
+                    server.terminate()
+                    server.wait()
+                print(f"{mode:<10}{n_workers:>8}{stats['rps']:>10.0f}{stats['rps'] * args.batch_size:>12.0f}"
+                      f"{stats['p99_ms']:>8.1f}ms{memory['Rss'] / 1024:>10.1f}{memory['Pss'] / 1024:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/bench_request_decoding.py
+# Per-request CPU of turning a request body into the model's feature rows, for model_api.py
+# (/predict and a /predict/batch of --batch-size readings) and score.py:
+#
+#   pydantic + DataFrame -- SensorDataInput validation, .dict(), pd.DataFrame([...])[features]
+#   pydantic             -- SensorDataInput validation, then a row from its attributes
+#   decoder              -- reading_decoder.ReadingDecoder, straight into a NumPy row
+#
+# Also checks that the decoder reports the same error types and locations as pydantic for a
+# set of invalid bodies, and that all paths produce identical rows.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_request_decoding [--repeat 2000] [--batch-size 100]
+import argparse
+import json
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+from pydantic import TypeAdapter, ValidationError
+
+import model_api
+from benchmarks._artifacts import FEATURE_COLUMNS, load_cmaps_frame
+from reading_decoder import ReadingDecodeError, ReadingDecoder
+
+INVALID_BODIES = [
+    "{}",
+    '{"unit_number": "abc"}',
+    '{"unit_number": null, "sensor_1": [1], "message_id": 5}',
+    "[1, 2]",
+]
+
+def time_us(fn, arg, repeat):
+    """Best of five rounds of `repeat` calls, per call, in microseconds."""
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return best / repeat * 1e6
+
+def error_keys(errors, skip_body=False):
+    return [(error["type"], tuple(error["loc"][1:] if skip_body else error["loc"])) for error in errors]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark request decoding into feature rows.")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    records = load_cmaps_frame("test_FD001").head(args.batch_size).to_dict("records")
+    for i, record in enumerate(records):
+        record["message_id"] = f"bench_{i}"
+        record["event_timestamp"] = "2025-01-01T00:00:00"
+    single_body = json.dumps(records[0]).encode("utf-8")
+    batch_body = json.dumps(records).encode("utf-8")
+
+    features = FEATURE_COLUMNS
+    list_adapter = TypeAdapter(List[model_api.SensorDataInput])
+    decoder = ReadingDecoder(features + [n for n in model_api.READING_FIELDS if n not in features],
+                             fields=model_api.READING_FIELDS, string_fields=model_api.READING_STRING_FIELDS)
+    score_decoder = ReadingDecoder(features)
+
+    paths = {
+        "/predict": {
+            "pydantic + DataFrame": lambda body: pd.DataFrame([model_api.SensorDataInput.model_validate_json(body).model_dump()])[features].to_numpy(),
+            "pydantic": lambda body: np.array([[getattr(r, name) for name in features] for r in [model_api.SensorDataInput.model_validate_json(body)]]),
+            "decoder": lambda body: decoder.decode_json(body).values[:, :len(features)],
+        },
+        f"/predict/batch x{args.batch_size}": {
+            "pydantic + DataFrame": lambda body: pd.DataFrame([r.model_dump() for r in list_adapter.validate_json(body)])[features].to_numpy(),
+            "pydantic": lambda body: np.array([[getattr(r, name) for name in features] for r in list_adapter.validate_json(body)]),
+            "decoder": lambda body: decoder.decode_json(body, batch=True).values[:, :len(features)],
+        },
+        "score.run": {
+            "json + DataFrame": lambda body: pd.DataFrame([json.loads(body)])[features].to_numpy(),
+            "decoder": lambda body: score_decoder.decode_json(body).values,
+        },
+    }
+    bodies = {"/predict": single_body, f"/predict/batch x{args.batch_size}": batch_body, "score.run": single_body}
+
+    print(f"{'request':<22}{'path':<22}{'us/request':>12}{'us/reading':>12}{'saved':>8}")
+    for request, candidates in paths.items():
+        body = bodies[request]
+        n = args.batch_size if "batch" in request else 1
+        rows = [fn(body) for fn in candidates.values()]
+        assert all(np.array_equal(rows[0], other) for other in rows[1:]), f"{request}: paths disagree"
+        repeat = max(args.repeat // n, 20)
+        timings = {label: time_us(fn, body, repeat) for label, fn in candidates.items()}
+        baseline = next(iter(timings.values()))
+        for label, us in timings.items():
+            print(f"{request:<22}{label:<22}{us:>12.1f}{us / n:>12.2f}{1 - us / baseline:>8.0%}")
+
+    # --- Error parity with pydantic ---
+    mismatches = 0
+    for body in INVALID_BODIES:
+        try:
+            model_api.SensorDataInput.model_validate_json(body)
+            expected = []
+        except ValidationError as e:
+            expected = error_keys(e.errors())
+        try:
+            decoder.decode_json(body)
+            actual = []
+        except ReadingDecodeError as e:
+            actual = error_keys(e.errors)
+        if actual != expected:
+            mismatches += 1
+            print(f"error mismatch for {body}: pydantic {expected}, decoder {actual}")
+    print(f"\nerror parity with pydantic: {len(INVALID_BODIES) - mismatches} of {len(INVALID_BODIES)} invalid bodies match")
+
+if __name__ == "__main__":
+    main()
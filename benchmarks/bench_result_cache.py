@@ -0,0 +1,72 @@
+# benchmarks/bench_result_cache.py
+# Cost of Event Hub replays in event_consumer.py with and without the result cache
+# (result_cache.py). The same events are delivered twice, as after a restart without a
+# checkpoint, against a stub model API; each pass reports its wall time, the model API
+# requests it made and the documents it upserted.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_result_cache [--events 5000] [--latency-ms 5]
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+
+import event_consumer
+from benchmarks._stubs import StubModelAPI, StubPartitionContext, make_events
+from benchmarks.bench_consumer_concurrency import interleaved_records
+from local_pipeline import InMemoryContainer
+from result_cache import ResultCache
+
+async def deliver(records, partitions, batch_size):
+    per_partition = [[r for r in records if int(r["unit_number"]) % partitions == p] for p in range(partitions)]
+
+    async def receive_partition(partition_id, partition_records):
+        context = StubPartitionContext(str(partition_id))
+        for start in range(0, len(partition_records), batch_size):
+            await event_consumer.on_event_batch(context, make_events(partition_records[start:start + batch_size]))
+
+    await asyncio.gather(*(receive_partition(p, recs) for p, recs in enumerate(per_partition)))
+    await event_consumer.close_partition_pipelines()
+
+async def main_async(args):
+    logging.disable(logging.WARNING)
+    records = interleaved_records(args.events, args.units)
+    stub = StubModelAPI(latency_s=args.latency_ms / 1000.0)
+    base_url = await stub.start(args.port)
+    os.environ["ML_ENDPOINT_URL"] = f"{base_url}/predict"
+    os.environ.pop("ML_BATCH_ENDPOINT_URL", None)
+    event_consumer.SCORING_MODE = "http"
+    event_consumer.http_session = aiohttp.ClientSession()
+    try:
+        print(f"{'cache':<6}{'pass':<8}{'seconds':>9}{'API calls':>11}{'upserts':>9}  cache stats")
+        for cache_enabled in (False, True):
+            event_consumer.result_cache = ResultCache(max_entries=args.events * 2) if cache_enabled else None
+            container = event_consumer.cosmos_container = InMemoryContainer()
+            event_consumer.cosmos_writer = None
+            for label in ("first", "replay"):
+                requests_before, upserts_before = stub.requests, sum(container.call_sizes)
+                started = time.perf_counter()
+                await deliver(records, args.partitions, args.batch_size)
+                elapsed = time.perf_counter() - started
+                stats = event_consumer.result_cache.stats() if cache_enabled else "-"
+                print(f"{'on' if cache_enabled else 'off':<6}{label:<8}{elapsed:>9.2f}{stub.requests - requests_before:>11}"
+                      f"{sum(container.call_sizes) - upserts_before:>9}  {stats}")
+    finally:
+        await event_consumer.http_session.close()
+        await stub.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark replayed events with and without the result cache.")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--units", type=int, default=100)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Artificial latency of the stub model API.")
+    parser.add_argument("--port", type=int, default=8771)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# benchmarks/bench_scoring_modes.py
+# event_consumer.py throughput and CPU per event with SCORING_MODE=http (per-event
+# /predict calls, or one /predict/batch call per batch, against a live model_api
+# process) versus SCORING_MODE=local (in-process matrix scoring), on the same events.
+# Also checks that local scores match the ones model_api returns.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_scoring_modes [--events 5000] [--partitions 4]
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+import numpy as np
+
+import event_consumer
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir
+from benchmarks._stubs import StubPartitionContext, make_events
+from benchmarks.bench_consumer_concurrency import interleaved_records
+from benchmarks.bench_micro_batching import wait_until_healthy
+from benchmarks.bench_pipeline import process_cpu_seconds
+from inference_engine import load_engine
+from local_pipeline import InMemoryContainer
+
+async def run_mode(mode, records, partitions, batch_size, base_url, server_pid):
+    event_consumer.SCORING_MODE = "local" if mode == "local" else "http"
+    event_consumer.model_call_semaphore = None
+    os.environ["ML_ENDPOINT_URL"] = f"{base_url}/predict"
+    if mode == "http-batch":
+        os.environ["ML_BATCH_ENDPOINT_URL"] = f"{base_url}/predict/batch"
+    else:
+        os.environ.pop("ML_BATCH_ENDPOINT_URL", None)
+    container = event_consumer.cosmos_container = InMemoryContainer()
+    event_consumer.cosmos_writer = None
+
+    per_partition = [[r for r in records if int(r["unit_number"]) % partitions == p] for p in range(partitions)]
+
+    async def receive_partition(partition_id, partition_records):
+        context = StubPartitionContext(str(partition_id))
+        for start in range(0, len(partition_records), batch_size):
+            await event_consumer.on_event_batch(context, make_events(partition_records[start:start + batch_size]))
+
+    api_cpu_start = process_cpu_seconds(server_pid)
+    cpu_start = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*(receive_partition(p, recs) for p, recs in enumerate(per_partition)))
+    await event_consumer.close_partition_pipelines()
+    elapsed = time.perf_counter() - started
+    consumer_cpu = time.process_time() - cpu_start
+    api_cpu_end = process_cpu_seconds(server_pid)
+    api_cpu = api_cpu_end - api_cpu_start if mode != "local" and api_cpu_start is not None else 0.0
+    scores = {body["message_id"]: body["anomaly_score"] for body in container.items.values()}
+    return len(records) / elapsed, consumer_cpu, api_cpu, scores
+
+async def main_async(args):
+    logging.disable(logging.WARNING)
+    model_dir = os.path.abspath(ensure_model_dir(args.model_dir))
+    records = interleaved_records(args.events, args.units)
+
+    event_consumer.scoring_engine, _, _, _ = load_engine(model_dir)
+    env = dict(os.environ, MODEL_DIR=model_dir)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "model_api:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    event_consumer.http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        await wait_until_healthy(f"{base_url}/health")
+        results = {}
+        print(f"{'mode':<12}{'events/s':>10}{'consumer us/event':>20}{'model_api us/event':>20}{'total us/event':>16}")
+        for mode in ("http", "http-batch", "local"):
+            rate, consumer_cpu, api_cpu, scores = await run_mode(mode, records, args.partitions, args.batch_size, base_url, server.pid)
+            results[mode] = scores
+            per_event = lambda cpu_s: cpu_s / len(records) * 1e6
+            print(f"{mode:<12}{rate:>10,.0f}{per_event(consumer_cpu):>20.1f}{per_event(api_cpu):>20.1f}"
+                  f"{per_event(consumer_cpu + api_cpu):>16.1f}")
+    finally:
+        await event_consumer.http_session.close()
+        server.terminate()
+        server.wait()
+
+    ids = sorted(results["local"])
+    diff = np.abs(np.array([results["local"][i] for i in ids]) - np.array([results["http-batch"][i] for i in ids]))
+    print(f"max |local - model_api| score difference over {len(ids)} events: {diff.max():.2e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTTP vs in-process scoring in event_consumer.py.")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--units", type=int, default=100)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8769)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# benchmarks/bench_stage_metrics.py
+# Cost of the stage latency instrumentation (stage_metrics.py): recording one duration, timing
+# one stage (two perf_counter_ns() calls plus the record, what model_api.py and
+# event_consumer.py add per stage), rendering /metrics, and the bucket error of the quantiles
+# against exact percentiles of the recorded durations.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_stage_metrics [--observations 200000]
+import argparse
+import time
+import timeit
+
+import numpy as np
+
+import stage_metrics
+
+def per_call_ns(stmt, namespace, number):
+    """Best of five rounds, per call, in nanoseconds."""
+    return min(timeit.repeat(stmt, globals=namespace, number=number, repeat=5)) / number * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stage latency histograms.")
+    parser.add_argument("--observations", type=int, default=200000)
+    args = parser.parse_args()
+
+    histogram = stage_metrics.stage_histogram("bench_stage_seconds", "timed", "Benchmark stage.")
+    namespace = {"histogram": histogram, "perf_counter_ns": time.perf_counter_ns}
+    baseline = per_call_ns("started = perf_counter_ns(); perf_counter_ns() - started", namespace, args.observations)
+    observe = per_call_ns("histogram.observe_ns(12345)", namespace, args.observations)
+    timed = per_call_ns("started = perf_counter_ns(); histogram.observe_ns(perf_counter_ns() - started)", namespace, args.observations)
+    print(f"{'record one duration':<40}{observe:>10.0f} ns")
+    print(f"{'time one stage (clock reads + record)':<40}{timed:>10.0f} ns   (clock reads alone {baseline:.0f} ns)")
+
+    # Quantile error on a log-normal spread of durations (median 50 us).
+    durations = np.random.default_rng(0).lognormal(np.log(50e3), 1.0, args.observations).astype(np.int64)
+    accuracy = stage_metrics.stage_histogram("bench_stage_seconds", "accuracy")
+    for ns in durations.tolist():
+        accuracy.observe_ns(ns)
+    snapshot = accuracy.snapshot()
+    for q in (0.5, 0.9, 0.99, 0.999):
+        exact = np.quantile(durations, q)
+        estimate = stage_metrics.quantile_ns(snapshot, q)
+        print(f"p{q * 100:<6g} exact {exact / 1e3:>9.1f} us   histogram {estimate / 1e3:>9.1f} us   ({estimate / exact - 1:+.0%})")
+
+    for stage in ("a", "b", "c", "d", "e", "f", "g", "h"):
+        stage_metrics.stage_histogram("bench_other_seconds", stage).observe_ns(1000)
+    render_us = per_call_ns("stage_metrics.render_prometheus()", {"stage_metrics": stage_metrics}, 200) / 1e3
+    print(f"{'render /metrics (10 histograms)':<40}{render_us:>10.0f} us")
+
+if __name__ == "__main__":
+    main()
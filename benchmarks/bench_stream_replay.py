@@ -0,0 +1,72 @@
+# benchmarks/bench_stream_replay.py
+# Producer throughput of stream_data.py: the original one-event-per-send loop versus the
+# replay mode (chunked serialization, size-packed batches per partition key, token bucket),
+# sending into an in-memory partitioned queue so only the producer side is measured.
+# Also checks that each engine's readings land in one partition in cycle order.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_stream_replay [--events 20000] [--rates 10000 20000]
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+import stream_data
+from benchmarks._artifacts import REPO_ROOT
+from local_pipeline import InMemoryPartitionedQueue, LocalEventData, LocalProducerClient
+
+def ordered_per_unit(queue):
+    """True when every engine's readings sit in a single partition, in cycle order."""
+    last_cycle, home_partition = {}, {}
+    for partition_id in queue.partition_ids:
+        for event in queue.read(partition_id, 0, 10 ** 9):
+            body = json.loads(event.body)
+            key = (body["source_file"], body["unit_number"])
+            if home_partition.setdefault(key, partition_id) != partition_id:
+                return False
+            if body["time_in_cycles"] <= last_cycle.get(key, 0):
+                return False
+            last_cycle[key] = body["time_in_cycles"]
+    return True
+
+def run_replay(plan, tables, rate, workers, partitions):
+    queue = InMemoryPartitionedQueue(partitions)
+    with contextlib.redirect_stdout(io.StringIO()):
+        events, duration = stream_data.stream_replay(
+            plan, tables, rate=rate, workers=workers, producer_factory=lambda: (LocalProducerClient(queue), LocalEventData))
+    return events / duration, ordered_per_unit(queue)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark stream_data.py demo loop vs replay mode.")
+    parser.add_argument("--events", type=int, default=20000, help="Events per replay run (0 = every CMaps train/test row).")
+    parser.add_argument("--legacy-events", type=int, default=3000)
+    parser.add_argument("--rates", type=float, nargs="+", default=[10000, 20000])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--partitions", type=int, default=4)
+    args = parser.parse_args()
+
+    patterns = " ".join(os.path.join(REPO_ROOT, "CMaps", p) for p in ("train_*.txt", "test_*.txt"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        plan, tables = stream_data.load_replay_plan(patterns, send_limit=args.events or None)
+
+    legacy_df = stream_data.load_dataset(os.path.join(REPO_ROOT, "CMaps", "train_FD001.txt"))
+    producer = LocalProducerClient(InMemoryPartitionedQueue(args.partitions))
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sent = stream_data.stream_demo(producer, legacy_df, LocalEventData,
+                                       messages_per_second=10 ** 9, send_limit=args.legacy_events)
+    legacy_rate = sent / (time.perf_counter() - started)
+
+    print(f"{'mode':<34}{'events/s':>12}{'order ok':>10}")
+    print(f"{'demo loop (unthrottled)':<34}{legacy_rate:>12,.0f}{'-':>10}")
+    for workers in sorted({1, args.workers}):
+        rate, ok = run_replay(plan, tables, 0, workers, args.partitions)
+        print(f"{f'replay unthrottled, {workers} workers':<34}{rate:>12,.0f}{'yes' if ok else 'NO':>10}")
+    for target in args.rates:
+        rate, ok = run_replay(plan, tables, target, args.workers, args.partitions)
+        print(f"{f'replay target {target:,.0f}/s':<34}{rate:>12,.0f}{'yes' if ok else 'NO':>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# benchmarks/bench_training.py
+# Accuracy versus cost of the IsolationForest settings train_model.py exposes. For each
+# n_estimators x max_samples pair, a model is fitted on the "normal" rows of the training units
+# (cycles <= --max-cycle) and reported with:
+#   - fit time with one process and with all CPUs (--n-jobs -1)
+#   - artifact sizes: the three pickled artifacts, and the compact engine file
+#   - engine scoring latency: p50 for one row, and per row within 1000-row batches
+#   - ROC AUC on held-out units: how well the score separates early-life readings
+#     (cycle <= --max-cycle) from readings --warning-window cycles before failure (default
+#     60-90). Readings much closer to failure score as anomalies with any setting.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_training [--n-estimators 50,100,200] [--max-samples 64,256,1024] [--train-units 1-50]
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+import warnings
+
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+from benchmarks._artifacts import REPO_ROOT, percentile_summary
+from export_model import export_model
+from inference_engine import ENGINE_FILE, IsolationForestEngine
+from model_store import ARTIFACT_FILES
+from train_model import fit_model, load_training_frame, parse_max_samples, parse_units, read_input, save_artifacts
+
+def held_out_labels(df, train_units, max_cycle, warning_window):
+    """
+    Held-out readings labelled 1 when their cycles to failure fall in `warning_window`
+    (first, last), 0 for cycles <= max_cycle; readings that are both or neither are left out.
+    """
+    df = df[~df['unit_number'].isin(train_units)]
+    to_failure = df.groupby('unit_number')['time_in_cycles'].transform('max') - df['time_in_cycles']
+    warning = (to_failure >= warning_window[0]) & (to_failure <= warning_window[1])
+    early = df['time_in_cycles'] <= max_cycle
+    keep = warning ^ early
+    return df[keep], warning[keep].to_numpy(dtype=int)
+
+def artifact_sizes(model, scaler, feature_names):
+    """(pickled artifacts bytes, engine file bytes)."""
+    out_dir = tempfile.mkdtemp(prefix="bench_training_")
+    try:
+        save_artifacts(out_dir, model, scaler, feature_names)
+        export_model(out_dir)
+        return (sum(os.path.getsize(os.path.join(out_dir, name)) for name in ARTIFACT_FILES),
+                os.path.getsize(os.path.join(out_dir, ENGINE_FILE)))
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def scoring_latency(engine, X, repeat):
+    """(p50 us for one row, us per row in 1000-row batches)."""
+    single = []
+    for i in range(repeat):
+        row = X[i % len(X):i % len(X) + 1]
+        started = time.perf_counter()
+        engine.score(row)
+        single.append(time.perf_counter() - started)
+    batch = X[:1000]
+    started = time.perf_counter()
+    for _ in range(10):
+        engine.score(batch)
+    return percentile_summary(single)["p50_us"], (time.perf_counter() - started) / (10 * len(batch)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark training time, artifact size, scoring latency and accuracy across IsolationForest settings.")
+    parser.add_argument("--input", default=os.path.join(REPO_ROOT, "CMaps", "train_FD001.txt"))
+    parser.add_argument("--train-units", type=parse_units, default=parse_units("1-50"))
+    parser.add_argument("--max-cycle", type=int, default=50)
+    parser.add_argument("--warning-window", type=parse_units, default=parse_units("60-90"), help="Cycles before failure labelled positive, e.g. 60-90.")
+    parser.add_argument("--n-estimators", default="50,100,200")
+    parser.add_argument("--max-samples", default="64,256,1024")
+    parser.add_argument("--repeat", type=int, default=500, help="Single-row scoring calls timed per model.")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    train, feature_names = load_training_frame([args.input], args.train_units, args.max_cycle)
+    X_train = train[feature_names].astype(np.float64)
+    held_out, labels = held_out_labels(read_input(args.input), args.train_units, args.max_cycle, (args.warning_window[0], args.warning_window[-1]))
+    X_eval = held_out[feature_names].to_numpy(np.float64)
+    print(f"Training on {len(X_train)} rows ({len(args.train_units)} units, cycles <= {args.max_cycle}); "
+          f"AUC on {len(X_eval)} held-out rows ({labels.sum()} {args.warning_window[0]}-{args.warning_window[-1]} cycles before failure); {os.cpu_count()} CPUs")
+    print(f"{'trees':>6}{'samples':>9}{'fit s':>8}{'fit s -1':>10}{'pickled KB':>12}{'engine KB':>11}"
+          f"{'1 row us':>10}{'batch us/row':>14}{'AUC':>8}")
+    for n_estimators in [int(n) for n in args.n_estimators.split(",")]:
+        for max_samples in [parse_max_samples(s) for s in args.max_samples.split(",")]:
+            model, scaler, fit_s = fit_model(X_train, n_estimators, max_samples, n_jobs=1)
+            _, _, fit_parallel_s = fit_model(X_train, n_estimators, max_samples, n_jobs=-1)
+            pickled, engine_size = artifact_sizes(model, scaler, feature_names)
+            engine = IsolationForestEngine.from_estimators(model, scaler, feature_names)
+            row_us, batch_us = scoring_latency(engine, X_eval, args.repeat)
+            auc = roc_auc_score(labels, -engine.score(X_eval)[0])
+            print(f"{n_estimators:>6}{model.max_samples_:>9}{fit_s:>8.2f}{fit_parallel_s:>10.2f}{pickled / 1024:>12.0f}"
+                  f"{engine_size / 1024:>11.0f}{row_us:>10.1f}{batch_us:>14.2f}{auc:>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/bench_wire_format.py
+# JSON versus the packed wire format (wire_format.py) on every hop: event bytes and the Event
+# Hubs throughput units a replay at --rate readings/s would need, the consumer's parse CPU per
+# reading, the size and model_api decode CPU of a /predict/batch request, and whether scores
+# stay the same when readings travel as float64 and float32 frames.
+#
+# Throughput units are estimated from the Event Hubs ingress limits of 1 MB/s and 1000 events/s
+# per unit, so packing several readings into one event (REPLAY_READINGS_PER_EVENT) is what
+# lowers the count once events are small.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_wire_format [--events 20000] [--rate 10000] [--readings-per-event 8]
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+import event_consumer
+import model_api
+import stream_data
+import wire_format
+from benchmarks._artifacts import REPO_ROOT, ensure_model_dir
+from inference_engine import load_engine, records_to_matrix
+from local_pipeline import InMemoryPartitionedQueue, LocalEventData, LocalProducerClient
+from reading_decoder import ReadingDecoder
+
+TU_BYTES_PER_S = 1024 * 1024
+TU_EVENTS_PER_S = 1000
+
+def replay_into_queue(plan, tables, wire, dtype, readings_per_event, partitions):
+    """Replay the plan into an in-memory queue with the given body format; returns the queued events."""
+    queue = InMemoryPartitionedQueue(partitions)
+    stream_data.WIRE_FORMAT = wire
+    stream_data.WIRE_FORMAT_DTYPE = wire_format.dtype_from_name(dtype)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stream_data.stream_replay(plan, tables, rate=0, workers=1, readings_per_event=readings_per_event,
+                                  producer_factory=lambda: (LocalProducerClient(queue), LocalEventData))
+    return [event for pid in queue.partition_ids for event in queue.read(pid, 0, 10 ** 9)]
+
+def time_per_item_us(fn, items, n_units, repeat=3):
+    """Best-of-`repeat` time of fn over all items, per unit of work, in microseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - started)
+    return best / n_units * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the packed wire format against JSON.")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--events", type=int, default=20000, help="Readings to replay.")
+    parser.add_argument("--rate", type=float, default=10000, help="Readings/s the throughput unit estimate is for.")
+    parser.add_argument("--readings-per-event", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=100, help="Readings per /predict/batch request.")
+    parser.add_argument("--partitions", type=int, default=4)
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    with contextlib.redirect_stdout(io.StringIO()):
+        plan, tables = stream_data.load_replay_plan(send_limit=args.events)
+
+    variants = (("json", "json", "float64", 1), ("packed f8", "packed", "float64", 1), ("packed f4", "packed", "float32", 1),
+                (f"packed f8 x{args.readings_per_event}", "packed", "float64", args.readings_per_event),
+                (f"packed f4 x{args.readings_per_event}", "packed", "float32", args.readings_per_event))
+    print(f"{'format':<16}{'events':>8}{'bytes/reading':>15}{'MB':>8}{'TU @ rate':>11}{'parse us/reading':>18}")
+    decoded = {}
+    for label, wire, dtype, readings_per_event in variants:
+        events = replay_into_queue(plan, tables, wire, dtype, readings_per_event, args.partitions)
+        body_bytes = sum(len(event.body) for event in events)
+        readings = [record for event in events for record in event_consumer.parse_event(event)]
+        assert len(readings) == len(plan)
+        decoded[label] = readings
+        events_per_s = len(events) / len(plan) * args.rate
+        throughput_units = max(math.ceil(body_bytes / len(plan) * args.rate / TU_BYTES_PER_S),
+                               math.ceil(events_per_s / TU_EVENTS_PER_S))
+        parse_us = time_per_item_us(event_consumer.parse_event, events, len(plan))
+        print(f"{label:<16}{len(events):>8}{body_bytes / len(plan):>15.1f}{body_bytes / 1e6:>8.2f}"
+              f"{throughput_units:>11}{parse_us:>18.2f}")
+
+    # --- Consumer -> model_api: one /predict/batch request body, decoded as model_api does ---
+    batches = [decoded["json"][start:start + args.batch_size] for start in range(0, len(plan), args.batch_size)]
+    json_bodies = [json.dumps([event_consumer.build_api_input(r) for r in batch]).encode("utf-8") for batch in batches]
+    packed_bodies = [wire_format.encode_records([event_consumer.build_api_input(r) for r in batch]) for batch in batches]
+    decoder = ReadingDecoder(model_api.READING_FIELDS, string_fields=model_api.READING_STRING_FIELDS)
+    json_us = time_per_item_us(lambda body: model_api.decode_readings(body, wire_format.JSON_CONTENT_TYPE, decoder, batch=True),
+                               json_bodies, len(plan))
+    packed_us = time_per_item_us(lambda body: model_api.decode_readings(body, wire_format.CONTENT_TYPE, decoder, batch=True),
+                                 packed_bodies, len(plan))
+    print(f"\n/predict/batch of {args.batch_size}: JSON {np.mean([len(b) for b in json_bodies]) / 1e3:.1f} KB, "
+          f"{json_us:.2f} us/reading to decode; packed {np.mean([len(b) for b in packed_bodies]) / 1e3:.1f} KB, "
+          f"{packed_us:.2f} us/reading")
+
+    # --- Scores of the same readings decoded from JSON and from packed frames ---
+    engine, _, _, _ = load_engine(ensure_model_dir(args.model_dir))
+    json_scores, json_flags = engine.score(records_to_matrix(decoded["json"], engine.feature_names)[0])
+    for label in ("packed f8", "packed f4"):
+        packed_scores, packed_flags = engine.score(records_to_matrix(decoded[label], engine.feature_names)[0])
+        print(f"score parity (JSON vs {label}): max |diff| {np.abs(json_scores - packed_scores).max():.2e}, "
+              f"{int((json_flags != packed_flags).sum())} of {len(plan)} flags differ")
+
+if __name__ == "__main__":
+    main()
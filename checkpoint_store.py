@@ -0,0 +1,295 @@
+# checkpoint_store.py
+# Durable Event Hub checkpoint stores for event_consumer.py, and a per-partition throttle
+# that decides when a checkpoint is worth writing.
+#
+#   SQLiteCheckpointStore -- one SQLite database (WAL); every update is one transaction
+#   FileCheckpointStore   -- one JSON document per consumer group, replaced atomically
+#   CheckpointThrottle    -- checkpoint every N events or T seconds instead of every batch
+#
+# Both stores implement the azure.eventhub.aio.CheckpointStore contract (list_ownership,
+# claim_ownership, update_checkpoint, list_checkpoints), so they can be passed as
+# `checkpoint_store=` to EventHubConsumerClient.from_connection_string or to
+# local_pipeline.LocalConsumerClient. On restart the client resumes every partition from
+# the event after its last checkpoint instead of from the start of the retention window.
+import asyncio
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+def _key(record):
+    return (record["fully_qualified_namespace"], record["eventhub_name"], record["consumer_group"], record["partition_id"])
+
+class SQLiteCheckpointStore:
+    """Checkpoints and partition ownership in an SQLite database at `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL") # A committed checkpoint survives power loss
+        self._db.execute("""CREATE TABLE IF NOT EXISTS checkpoints (
+            namespace TEXT, eventhub TEXT, consumer_group TEXT, partition_id TEXT,
+            offset TEXT, sequence_number INTEGER, updated_at REAL,
+            PRIMARY KEY (namespace, eventhub, consumer_group, partition_id))""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS ownership (
+            namespace TEXT, eventhub TEXT, consumer_group TEXT, partition_id TEXT,
+            owner_id TEXT, etag TEXT, last_modified_time REAL,
+            PRIMARY KEY (namespace, eventhub, consumer_group, partition_id))""")
+
+    def _update_checkpoint(self, checkpoint):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (*_key(checkpoint), None if checkpoint.get("offset") is None else str(checkpoint["offset"]),
+                              checkpoint.get("sequence_number"), time.time()))
+
+    def _list_checkpoints(self, namespace, eventhub, consumer_group):
+        with self._lock:
+            rows = self._db.execute("SELECT partition_id, offset, sequence_number FROM checkpoints "
+                                    "WHERE namespace = ? AND eventhub = ? AND consumer_group = ?",
+                                    (namespace, eventhub, consumer_group)).fetchall()
+        return [{"fully_qualified_namespace": namespace, "eventhub_name": eventhub, "consumer_group": consumer_group,
+                 "partition_id": partition_id, "offset": offset, "sequence_number": sequence_number}
+                for partition_id, offset, sequence_number in rows]
+
+    def _list_ownership(self, namespace, eventhub, consumer_group):
+        with self._lock:
+            rows = self._db.execute("SELECT partition_id, owner_id, etag, last_modified_time FROM ownership "
+                                    "WHERE namespace = ? AND eventhub = ? AND consumer_group = ?",
+                                    (namespace, eventhub, consumer_group)).fetchall()
+        return [{"fully_qualified_namespace": namespace, "eventhub_name": eventhub, "consumer_group": consumer_group,
+                 "partition_id": partition_id, "owner_id": owner_id, "etag": etag, "last_modified_time": last_modified_time}
+                for partition_id, owner_id, etag, last_modified_time in rows]
+
+    def _claim_ownership(self, ownership_list):
+        claimed = []
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for ownership in ownership_list:
+                    row = self._db.execute("SELECT etag FROM ownership WHERE namespace = ? AND eventhub = ? "
+                                           "AND consumer_group = ? AND partition_id = ?", _key(ownership)).fetchone()
+                    # Optimistic concurrency: the claim must carry the etag it read (none for a new partition).
+                    if row is not None and row[0] != ownership.get("etag"):
+                        continue
+                    claimed_ownership = dict(ownership, etag=str(time.time_ns()), last_modified_time=time.time())
+                    self._db.execute("INSERT OR REPLACE INTO ownership VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (*_key(ownership), ownership.get("owner_id"), claimed_ownership["etag"],
+                                      claimed_ownership["last_modified_time"]))
+                    claimed.append(claimed_ownership)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return claimed
+
+    async def update_checkpoint(self, checkpoint, **kwargs):
+        await asyncio.to_thread(self._update_checkpoint, checkpoint)
+
+    async def list_checkpoints(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        return await asyncio.to_thread(self._list_checkpoints, fully_qualified_namespace, eventhub_name, consumer_group)
+
+    async def list_ownership(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        return await asyncio.to_thread(self._list_ownership, fully_qualified_namespace, eventhub_name, consumer_group)
+
+    async def claim_ownership(self, ownership_list, **kwargs):
+        return await asyncio.to_thread(self._claim_ownership, ownership_list)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class FileCheckpointStore:
+    """
+    Checkpoints and ownership as one JSON file per (namespace, event hub, consumer group) in
+    `directory`. Every change rewrites the file to a temporary name, fsyncs it and renames it
+    over the old one, so a crash leaves either the previous or the new checkpoints. Changes
+    hold an flock on a companion .lock file, so consumer processes sharing the directory (see
+    consumer_supervisor.py) never lose each other's updates or both win an ownership claim.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, namespace, eventhub, consumer_group):
+        name = "_".join(part.replace(os.sep, "-").replace("$", "") for part in (namespace, eventhub, consumer_group))
+        return os.path.join(self.directory, f"{name}.json")
+
+    @contextlib.contextmanager
+    def _locked(self, path):
+        with self._lock, open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"checkpoints": {}, "ownership": {}}
+
+    def _write(self, path, document):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(document, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _update_checkpoint(self, checkpoint):
+        path = self._path(*_key(checkpoint)[:3])
+        with self._locked(path):
+            document = self._read(path)
+            document["checkpoints"][checkpoint["partition_id"]] = {
+                "offset": None if checkpoint.get("offset") is None else str(checkpoint["offset"]),
+                "sequence_number": checkpoint.get("sequence_number"), "updated_at": time.time()}
+            self._write(path, document)
+
+    def _list(self, section, namespace, eventhub, consumer_group):
+        with self._lock:
+            document = self._read(self._path(namespace, eventhub, consumer_group))
+        return [dict(record, fully_qualified_namespace=namespace, eventhub_name=eventhub,
+                     consumer_group=consumer_group, partition_id=partition_id)
+                for partition_id, record in document[section].items()]
+
+    def _claim_ownership(self, ownership_list):
+        claimed = []
+        by_path = {}
+        for ownership in ownership_list:
+            by_path.setdefault(self._path(*_key(ownership)[:3]), []).append(ownership)
+        for path, ownerships in by_path.items():
+            with self._locked(path):
+                claimed += self._claim_in_document(path, ownerships)
+        return claimed
+
+    def _claim_in_document(self, path, ownership_list):
+        claimed = []
+        document = self._read(path)
+        for ownership in ownership_list:
+            current = document["ownership"].get(ownership["partition_id"])
+            if current is not None and current.get("etag") != ownership.get("etag"):
+                continue
+            claimed_ownership = dict(ownership, etag=str(time.time_ns()), last_modified_time=time.time())
+            document["ownership"][ownership["partition_id"]] = {
+                "owner_id": ownership.get("owner_id"), "etag": claimed_ownership["etag"],
+                "last_modified_time": claimed_ownership["last_modified_time"]}
+            claimed.append(claimed_ownership)
+        if claimed:
+            self._write(path, document)
+        return claimed
+
+    async def update_checkpoint(self, checkpoint, **kwargs):
+        await asyncio.to_thread(self._update_checkpoint, checkpoint)
+
+    async def list_checkpoints(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        return await asyncio.to_thread(self._list, "checkpoints", fully_qualified_namespace, eventhub_name, consumer_group)
+
+    async def list_ownership(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        return await asyncio.to_thread(self._list, "ownership", fully_qualified_namespace, eventhub_name, consumer_group)
+
+    async def claim_ownership(self, ownership_list, **kwargs):
+        return await asyncio.to_thread(self._claim_ownership, ownership_list)
+
+    def close(self):
+        pass
+
+def checkpoint_store_from_env():
+    """
+    Checkpoint store selected by CHECKPOINT_STORE:
+      - "sqlite" (default): database at CHECKPOINT_PATH (default checkpoints.sqlite)
+      - "file": JSON files in the CHECKPOINT_PATH directory (default checkpoints/)
+      - "blob": Azure Blob Storage container CHECKPOINT_BLOB_CONTAINER of CHECKPOINT_BLOB_CONN_STR,
+        shared by consumers on several nodes; needs azure-eventhub-checkpointstoreblob-aio
+      - "none": no store, so every start reads from the beginning of each partition
+    """
+    kind = os.getenv("CHECKPOINT_STORE", "sqlite").lower()
+    if kind == "none":
+        return None
+    if kind == "sqlite":
+        return SQLiteCheckpointStore(os.getenv("CHECKPOINT_PATH", "checkpoints.sqlite"))
+    if kind == "file":
+        return FileCheckpointStore(os.getenv("CHECKPOINT_PATH", "checkpoints"))
+    if kind == "blob":
+        try:
+            from azure.eventhub.extensions.checkpointstoreblobaio import BlobCheckpointStore
+        except ImportError:
+            raise ValueError("CHECKPOINT_STORE=blob needs azure-eventhub-checkpointstoreblob-aio (pip install it).") from None
+        return BlobCheckpointStore.from_connection_string(os.environ["CHECKPOINT_BLOB_CONN_STR"],
+                                                          os.getenv("CHECKPOINT_BLOB_CONTAINER", "eventhub-checkpoints"))
+    raise ValueError(f"Unknown CHECKPOINT_STORE '{kind}' (expected sqlite, file, blob or none).")
+
+class CheckpointThrottle:
+    """
+    Checkpoints a partition once `every_events` events were processed since its last checkpoint,
+    or `interval_s` seconds passed with events pending, whichever comes first, instead of after
+    every batch. Events processed after the last checkpoint are redelivered after a crash; the
+    consumer's result cache absorbs them. flush() checkpoints everything pending (at shutdown, or
+    for a partition handed over to another consumer).
+    """
+
+    def __init__(self, every_events=1000, interval_s=10.0, clock=time.monotonic, before_checkpoint=None):
+        self.every_events = every_events
+        self.interval_s = interval_s
+        self.clock = clock
+        self.before_checkpoint = before_checkpoint # Awaited before every checkpoint write (e.g. cosmos_spool's sync)
+        self._pending = {} # partition_id -> [partition_context, last event, events since checkpoint, time of checkpoint]
+        self._revoked = {} # partition_id -> partition_context of a lost claim, whose late batches are ignored
+        self.checkpoints_written = 0
+
+    async def processed(self, partition_context, events):
+        """Record a processed batch (possibly empty) and checkpoint the partition if it is due."""
+        revoked = self._revoked.get(partition_context.partition_id)
+        if revoked is partition_context:
+            return # Queued before the partition was lost; the new owner checkpoints it
+        if revoked is not None:
+            del self._revoked[partition_context.partition_id] # Claimed again, with a new context
+        now = self.clock()
+        state = self._pending.setdefault(partition_context.partition_id, [partition_context, None, 0, now])
+        if events:
+            state[0], state[1] = partition_context, events[-1]
+            state[2] += len(events)
+        if state[1] is not None and (state[2] >= self.every_events or now - state[3] >= self.interval_s):
+            await self._checkpoint(state, now)
+
+    async def _checkpoint(self, state, now):
+        if self.before_checkpoint is not None:
+            await self.before_checkpoint()
+        await state[0].update_checkpoint(state[1])
+        state[1], state[2], state[3] = None, 0, now
+        self.checkpoints_written += 1
+
+    async def flush(self, partition_id=None):
+        """
+        Checkpoint what is pending, for every partition or only `partition_id`. Partitions are
+        discarded or added while a checkpoint is awaited, so this walks a copy and skips those
+        no longer pending.
+        """
+        for pending_id, state in list(self._pending.items()):
+            if self._pending.get(pending_id) is not state:
+                continue
+            if state[1] is not None and partition_id in (None, pending_id):
+                try:
+                    await self._checkpoint(state, self.clock())
+                except Exception as e:
+                    logging.error(f"Final checkpoint for partition {pending_id} failed: {e}")
+
+    def discard(self, partition_id, partition_context=None):
+        """
+        Forget what is pending for `partition_id` (its new owner checkpoints it from here). With
+        `partition_context`, batches still processed under that claim record nothing either.
+        """
+        self._pending.pop(partition_id, None)
+        if partition_context is not None:
+            self._revoked[partition_id] = partition_context
@@ -0,0 +1,184 @@
+# cmaps_cache.py
+# Columnar, memory-mapped cache for the NASA CMaps text files.
+#
+# Each train_/test_/RUL_ file is parsed once into one typed .npy file per column plus a
+# per-unit row offset index, next to a manifest recording the source file's size and
+# mtime. Later loads memory-map the arrays instead of re-parsing the text, so start-up
+# is near-instant, slicing by unit or cycle range touches only the rows it needs, and
+# several producer processes share the same pages through the OS page cache. A cache
+# entry is rebuilt automatically when its source file changes.
+#
+# Build every cache entry up front with:  python cmaps_cache.py [CMaps]
+import glob
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+CACHE_FORMAT_VERSION = 1
+# Defaults to a .cache directory next to the CMaps files.
+CMAPS_CACHE_DIR = os.getenv("CMAPS_CACHE_DIR")
+
+CMAPS_COLUMNS = ['unit_number', 'time_in_cycles', 'setting_1', 'setting_2', 'setting_3'] + \
+                [f'sensor_{i}' for i in range(1, 22)]
+RUL_COLUMNS = ['RUL']
+INTEGER_COLUMNS = {'unit_number', 'time_in_cycles', 'RUL'}
+
+MANIFEST_NAME = "manifest.json"
+UNITS_NAME = "_units.npy"
+OFFSETS_NAME = "_offsets.npy"
+
+def columns_for(name):
+    return RUL_COLUMNS if name.startswith("RUL_") else CMAPS_COLUMNS
+
+def parse_text_file(path, columns):
+    # CMaps files are space-separated with no header; sep='\s+' also absorbs trailing spaces.
+    df = pd.read_csv(path, sep=r'\s+', header=None, names=columns)
+    return {col: df[col].to_numpy(np.int32 if col in INTEGER_COLUMNS else np.float64) for col in columns}
+
+def build_unit_index(columns, n_rows):
+    """Unit ids and row offsets (rows of units[i] are offsets[i]:offsets[i+1]); sorts rows by unit if needed."""
+    if 'unit_number' not in columns:
+        # RUL files hold one row per unit, in unit order.
+        return np.arange(1, n_rows + 1, dtype=np.int32), np.arange(n_rows + 1, dtype=np.int64), columns
+    unit = columns['unit_number']
+    if n_rows and np.any(np.diff(unit) < 0):
+        order = np.argsort(unit, kind='stable')
+        columns = {col: values[order] for col, values in columns.items()}
+        unit = columns['unit_number']
+    units, starts = np.unique(unit, return_index=True)
+    offsets = np.append(starts, n_rows).astype(np.int64)
+    return units.astype(np.int32), offsets, columns
+
+def cache_dir_for(path, cache_dir=None):
+    base = cache_dir or CMAPS_CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+    return os.path.join(base, os.path.splitext(os.path.basename(path))[0])
+
+def source_signature(path):
+    stat = os.stat(path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+def read_manifest(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_fresh(manifest, path):
+    return (manifest is not None
+            and manifest.get("format_version") == CACHE_FORMAT_VERSION
+            and all(manifest.get(k) == v for k, v in source_signature(path).items()))
+
+def _save_atomic(path, array):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def build_cache(path, cache_dir=None):
+    """Parse `path` and write its columnar cache entry. The manifest is written last, so a
+    reader never sees a manifest for a half-written entry; replaced .npy files keep their old
+    inode alive for processes that still have them mapped."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    entry_dir = cache_dir_for(path, cache_dir)
+    os.makedirs(entry_dir, exist_ok=True)
+    signature = source_signature(path)
+    try:
+        os.remove(os.path.join(entry_dir, MANIFEST_NAME))
+    except FileNotFoundError:
+        pass
+
+    columns = parse_text_file(path, columns_for(name))
+    n_rows = len(next(iter(columns.values())))
+    units, offsets, columns = build_unit_index(columns, n_rows)
+    for col, values in columns.items():
+        _save_atomic(os.path.join(entry_dir, f"{col}.npy"), values)
+    _save_atomic(os.path.join(entry_dir, UNITS_NAME), units)
+    _save_atomic(os.path.join(entry_dir, OFFSETS_NAME), offsets)
+
+    manifest = {"format_version": CACHE_FORMAT_VERSION, "source": os.path.basename(path), **signature,
+                "rows": n_rows, "units": len(units),
+                "columns": {col: str(values.dtype) for col, values in columns.items()}}
+    tmp_manifest = os.path.join(entry_dir, f"{MANIFEST_NAME}.{os.getpid()}.tmp")
+    with open(tmp_manifest, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, os.path.join(entry_dir, MANIFEST_NAME))
+    logging.info(f"Built CMaps cache for '{path}': {n_rows} rows, {len(units)} units -> {entry_dir}")
+    return manifest
+
+class CMapsTable:
+    """One CMaps file as read-only column arrays (memory-mapped when loaded from the cache)."""
+
+    def __init__(self, name, columns, units, offsets):
+        self.name = name
+        self.columns = columns
+        self.units = units
+        self.offsets = offsets
+        self._unit_positions = {int(u): i for i, u in enumerate(units)}
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def unit_rows(self, unit, cycles=None):
+        """Row slice for one unit, optionally limited to an inclusive (first, last) cycle range."""
+        i = self._unit_positions.get(int(unit))
+        if i is None:
+            return slice(0, 0)
+        start, stop = int(self.offsets[i]), int(self.offsets[i + 1])
+        if cycles is not None and 'time_in_cycles' in self.columns:
+            unit_cycles = self.columns['time_in_cycles'][start:stop]
+            first, last = cycles
+            start, stop = (start + int(np.searchsorted(unit_cycles, first, side='left')),
+                           start + int(np.searchsorted(unit_cycles, last, side='right')))
+        return slice(start, stop)
+
+    def select(self, unit=None, cycles=None, columns=None):
+        """Dict of column views (no copy) for all rows, or one unit's rows / cycle range."""
+        rows = slice(None) if unit is None else self.unit_rows(unit, cycles)
+        return {col: self.columns[col][rows] for col in (columns or self.columns)}
+
+    def to_frame(self, unit=None, cycles=None, columns=None):
+        """DataFrame copy of the selected rows, with the same columns and dtypes as the text file."""
+        return pd.DataFrame({col: np.array(values) for col, values in self.select(unit, cycles, columns).items()})
+
+def load(path, cache_dir=None, mmap_mode="r"):
+    """Load one CMaps file through the cache, (re)building the entry if missing or stale."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    entry_dir = cache_dir_for(path, cache_dir)
+    manifest = read_manifest(entry_dir)
+    if not is_fresh(manifest, path):
+        try:
+            manifest = build_cache(path, cache_dir)
+        except OSError as e:
+            logging.warning(f"Could not write CMaps cache for '{path}' ({e}); parsing it in memory instead.")
+            columns = parse_text_file(path, columns_for(name))
+            units, offsets, columns = build_unit_index(columns, len(next(iter(columns.values()))))
+            return CMapsTable(name, columns, units, offsets)
+    columns = {col: np.load(os.path.join(entry_dir, f"{col}.npy"), mmap_mode=mmap_mode) for col in manifest["columns"]}
+    units = np.load(os.path.join(entry_dir, UNITS_NAME), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(entry_dir, OFFSETS_NAME), mmap_mode=mmap_mode)
+    return CMapsTable(name, columns, units, offsets)
+
+def build_all(data_dir="CMaps", cache_dir=None):
+    """(Re)build stale cache entries for every train_/test_/RUL_ file in data_dir."""
+    paths = sorted(p for prefix in ("train_", "test_", "RUL_") for p in glob.glob(os.path.join(data_dir, f"{prefix}*.txt")))
+    for path in paths:
+        if not is_fresh(read_manifest(cache_dir_for(path, cache_dir)), path):
+            build_cache(path, cache_dir)
+    return paths
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    built = build_all(sys.argv[1] if len(sys.argv) > 1 else "CMaps")
+    print(f"CMaps cache up to date for {len(built)} files.")
@@ -0,0 +1,178 @@
+# consumer_supervisor.py
+# Partition-sharded multi-process running of event_consumer.py. The supervisor starts
+# CONSUMER_WORKERS consumer processes that share one checkpoint store (CHECKPOINT_STORE) and split
+# the Event Hub partitions between them through its ownership records (see "Partition Load
+# Balancing" in event_consumer.py), so decoding, scoring and persistence of different partitions
+# run on different cores.
+#
+# Worker i has the stable owner id <CONSUMER_OWNER_ID or hostname>-<i>. A worker that exits is
+# restarted under the same id and takes back its partitions at once; while it is down (or if it
+# keeps failing) the other workers take its partitions over once its claims expire
+# (CONSUMER_OWNERSHIP_EXPIRATION_S). Supervisors on several nodes split the partitions the same
+# way when their store is one they all reach (CHECKPOINT_STORE=blob).
+#
+# Workers share their stage latency histograms through files in CONSUMER_METRICS_DIR (see
+# stage_metrics.py); the supervisor serves the sum on CONSUMER_METRICS_PORT. Rolling-window
+# state (feature_engine.py) is per unit, and a unit's readings stay in one partition, so each
+# worker keeps the state of the units it has seen, snapshotted to ROLLING_STATE_PATH.<i> and
+# restored when it restarts. State is not handed over with a partition: when a partition moves
+# to another worker (its owner's claims expired, or the partitions were rebalanced), the new
+# owner starts the rolling windows of that partition's units empty, and they fill up again
+# over the next ROLLING_WINDOW readings. Each worker also has its own Cosmos spool,
+# COSMOS_SPOOL_DIR.<i> (see cosmos_spool.py), which the restarted worker replays.
+#
+# Usage:
+#   python consumer_supervisor.py [--workers N]
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+WORKER_SHUTDOWN_TIMEOUT_S = 30
+WORKER_RESTART_BACKOFF_S = (1, 60) # Doubles while a worker keeps exiting within WORKER_MIN_UPTIME_S
+WORKER_MIN_UPTIME_S = 30
+METRICS_DIR = os.getenv("CONSUMER_METRICS_DIR", os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "event-consumer-metrics"))
+
+def usable_cpus():
+    """CPUs this process may run on (respects taskset / cpusets, unlike os.cpu_count())."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def run_worker(env):
+    """Worker process: event_consumer.main() with `env` applied, stopped cleanly by SIGTERM."""
+    os.environ.update(env)
+    import event_consumer
+
+    async def run():
+        main_task = asyncio.create_task(event_consumer.main())
+
+        def stop():
+            if event_consumer.eventhub_client is None:
+                main_task.cancel() # Still starting up, nothing to drain
+            else:
+                event_consumer.request_stop()
+
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, stop)
+        loop.add_signal_handler(signal.SIGINT, stop) # Ctrl-C reaches the whole process group
+        try:
+            await main_task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await event_consumer.close_clients()
+
+    asyncio.run(run())
+
+class ConsumerSupervisor:
+    """Keeps `n_workers` event_consumer processes running, restarting any that exit."""
+
+    def __init__(self, n_workers, owner_prefix):
+        self.n_workers = n_workers
+        self.owner_prefix = owner_prefix
+        self.context = multiprocessing.get_context("spawn") # Workers start without the parent's imports
+        self.workers = []
+        self.started_at = []
+        self.backoff_s = []
+        self.restart_at = []
+        self.stopping = False
+
+    def worker_env(self, index):
+        env = {"CONSUMER_OWNER_ID": f"{self.owner_prefix}-{index}",
+               "CONSUMER_METRICS_PORT": "0", # The supervisor serves the workers' metrics
+               "STAGE_METRICS_DIR": METRICS_DIR}
+        for name in ("ROLLING_STATE_PATH", "COSMOS_SPOOL_DIR"):
+            if os.getenv(name):
+                env[name] = f"{os.environ[name]}.{index}"
+        return env
+
+    def start_worker(self, index):
+        process = self.context.Process(target=run_worker, args=(self.worker_env(index),), name=f"event-consumer-{index}")
+        process.start()
+        self.started_at[index] = time.monotonic()
+        logging.info(f"Started worker {index} (pid {process.pid}, owner '{self.owner_prefix}-{index}').")
+        return process
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def check_workers(self):
+        """Restart exited workers, backing off while one keeps exiting soon after it starts."""
+        now = time.monotonic()
+        for i, process in enumerate(self.workers):
+            if process is not None and not process.is_alive():
+                if now - self.started_at[i] >= WORKER_MIN_UPTIME_S:
+                    self.backoff_s[i] = WORKER_RESTART_BACKOFF_S[0]
+                logging.warning(f"Worker {i} (pid {process.pid}) exited with code {process.exitcode}; "
+                                f"restarting it in {self.backoff_s[i]:.0f}s.")
+                self.workers[i] = None
+                self.restart_at[i] = now + self.backoff_s[i]
+                self.backoff_s[i] = min(self.backoff_s[i] * 2, WORKER_RESTART_BACKOFF_S[1])
+            elif process is None and now >= self.restart_at[i]:
+                self.workers[i] = self.start_worker(i)
+
+    def run(self):
+        import stage_metrics
+
+        shutil.rmtree(METRICS_DIR, ignore_errors=True) # Histograms start from zero with the supervisor
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        stage_metrics.STAGE_METRICS_DIR = METRICS_DIR
+        metrics_port = int(os.getenv("CONSUMER_METRICS_PORT", "9108"))
+        metrics_server = None
+        if metrics_port:
+            try:
+                metrics_server = stage_metrics.start_http_server(metrics_port)
+                logging.info(f"Stage latency metrics of all workers served at http://0.0.0.0:{metrics_port}/metrics.")
+            except OSError as e:
+                logging.warning(f"Could not serve stage metrics on port {metrics_port}: {e}")
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.started_at = [0.0] * self.n_workers
+        self.backoff_s = [WORKER_RESTART_BACKOFF_S[0]] * self.n_workers
+        self.restart_at = [0.0] * self.n_workers
+        self.workers = [self.start_worker(i) for i in range(self.n_workers)]
+        logging.info(f"Running {self.n_workers} event_consumer workers.")
+
+        while not self.stopping:
+            time.sleep(0.5)
+            if not self.stopping:
+                self.check_workers()
+
+        running = [process for process in self.workers if process is not None]
+        logging.info(f"Stopping {len(running)} workers...")
+        for process in running:
+            process.terminate()
+        for process in running:
+            process.join(WORKER_SHUTDOWN_TIMEOUT_S)
+            if process.is_alive():
+                logging.warning(f"Worker {process.pid} did not stop within {WORKER_SHUTDOWN_TIMEOUT_S}s; killing it.")
+                process.kill()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run event_consumer.py in several processes that split the Event Hub partitions.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CONSUMER_WORKERS", "0")) or usable_cpus(),
+                        help="Consumer processes (default: $CONSUMER_WORKERS, or one per usable CPU).")
+    args = parser.parse_args()
+    n_workers = max(args.workers, 1)
+    if n_workers > 1 and os.getenv("CHECKPOINT_STORE", "sqlite").lower() == "none":
+        # Without a store there are no ownership records, and every worker would read every partition.
+        logging.critical("CHECKPOINT_STORE=none cannot split partitions between workers; set a checkpoint store or --workers 1.")
+        raise SystemExit(1)
+    owner_prefix = os.getenv("CONSUMER_OWNER_ID") or socket.gethostname()
+    ConsumerSupervisor(n_workers, owner_prefix).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+# cosmos_spool.py
+# Durable write-behind spool between event_consumer.py and Cosmos DB.
+#
+# process_event_batch appends a batch's records to the spool (a local disk write) instead of
+# waiting for Cosmos, so its checkpoint can advance at disk speed. A background flusher drains
+# the spool to Cosmos in bulk through cosmos_writer.CosmosBatchWriter, oldest records first:
+#   - records that failed transiently (throttling, timeouts, Cosmos unreachable) stay in the
+#     spool and are retried with backoff, so an outage delays documents instead of losing them
+#   - records Cosmos rejects outright, and any other error, are moved to dead-letter.jsonl in
+#     the spool directory, so one bad record cannot hold up the ones behind it
+# File I/O, fsyncs and JSON encoding run in worker threads, off the consumer's event loop.
+#
+# The spool is a directory of append-only segment files (segment-<n>.log) of frames
+# <u32 payload length><u32 crc32><JSON list of records>. New segments start every
+# `segment_bytes`; the flusher records how far it has drained in a small position file and
+# deletes drained segments. On open, everything after that position is replayed (a torn
+# frame at the end of a segment, from a crash mid-write, is dropped). Replayed records may
+# already be in Cosmos; upserts by id make the rewrite harmless.
+#
+# Appends wait while the spool holds `max_bytes` or more, which backs the receivers up rather
+# than filling the disk. fsync policy:
+#   - "always": every append is fsynced before it returns
+#   - "checkpoint" (default): the spool is fsynced before an Event Hub checkpoint is written
+#     (see CheckpointThrottle's before_checkpoint), so no checkpoint covers records a power
+#     loss could take away; a process crash loses nothing either way
+#   - "never": left to the OS
+import asyncio
+import json
+import logging
+import os
+import re
+import struct
+import zlib
+
+from cosmos_writer import is_transient
+
+FRAME_HEADER = struct.Struct("<II")
+SEGMENT_PATTERN = re.compile(r"^segment-(\d+)\.log$")
+POSITION_FILE = "position"
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+FSYNC_POLICIES = ("always", "checkpoint", "never")
+
+def encode_frame(records):
+    payload = json.dumps(records, separators=(",", ":")).encode("utf-8")
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def read_frames(path, offset, limit=None):
+    """
+    Yields (records, end offset) for the valid frames of segment `path` from `offset`, up to
+    byte `limit` (default: end of file); stops at the first incomplete or corrupt frame.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        end = os.fstat(f.fileno()).st_size if limit is None else limit
+        while offset + FRAME_HEADER.size <= end:
+            length, crc = FRAME_HEADER.unpack(f.read(FRAME_HEADER.size))
+            if offset + FRAME_HEADER.size + length > end:
+                return
+            payload = f.read(length)
+            if zlib.crc32(payload) != crc:
+                return
+            offset += FRAME_HEADER.size + length
+            yield json.loads(payload), offset
+
+class CosmosSpool:
+    """Segment-file spool of records on their way to Cosmos DB; drain with run_flusher(writer)."""
+
+    def __init__(self, directory, max_bytes=1 << 30, segment_bytes=64 << 20, fsync="checkpoint",
+                 drain_batch_records=1000, retry_backoff_s=(1.0, 30.0)):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown spool fsync policy '{fsync}' (expected {', '.join(FSYNC_POLICIES)}).")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.drain_batch_records = drain_batch_records
+        self.retry_backoff_s = retry_backoff_s
+        os.makedirs(directory, exist_ok=True)
+
+        self.depth_bytes = 0
+        self.depth_records = 0
+        self.appended_records = 0
+        self.drained_records = 0
+        self.dead_lettered = 0
+        self.write_failures = 0
+        self.append_waits = 0
+        self._changed = asyncio.Event() # Set by appends and drains
+        self._closing = False
+        self._unsynced = False
+        self._write_lock = asyncio.Lock() # Serializes appends, segment rolls and fsyncs of the write segment
+
+        self._read_segment, self._read_offset = self._load_position()
+        segments = self._segment_ids()
+        for segment_id in segments:
+            if segment_id < self._read_segment:
+                os.remove(self._segment_path(segment_id)) # Drained before the last shutdown
+        self._sizes = {} # segment id -> bytes of valid frames, for segments not yet drained
+        for segment_id in (s for s in segments if s >= self._read_segment):
+            start = self._read_offset if segment_id == self._read_segment else 0
+            valid_end = start
+            for records, valid_end in read_frames(self._segment_path(segment_id), start):
+                self.depth_records += len(records)
+            self._sizes[segment_id] = valid_end
+            self.depth_bytes += valid_end - start
+            if valid_end < os.path.getsize(self._segment_path(segment_id)):
+                logging.warning(f"Spool segment {segment_id} ends in a torn frame; dropping its last "
+                                f"{os.path.getsize(self._segment_path(segment_id)) - valid_end} bytes.")
+                os.truncate(self._segment_path(segment_id), valid_end)
+        # Appends always go to a fresh segment, after anything left from the previous run.
+        self._write_segment = max(segments + [self._read_segment - 1]) + 1
+        if self._read_segment not in self._sizes:
+            self._read_segment, self._read_offset = min(self._sizes, default=self._write_segment), 0
+        self._write_file = open(self._segment_path(self._write_segment), "ab")
+        self._sizes[self._write_segment] = 0
+        if self.depth_records:
+            logging.info(f"Spool '{directory}' holds {self.depth_records} records ({self.depth_bytes} bytes) "
+                         f"not yet written to Cosmos DB; replaying them.")
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.directory, f"segment-{segment_id:012d}.log")
+
+    def _segment_ids(self):
+        return sorted(int(m.group(1)) for m in map(SEGMENT_PATTERN.match, os.listdir(self.directory)) if m)
+
+    def _load_position(self):
+        try:
+            with open(os.path.join(self.directory, POSITION_FILE)) as f:
+                position = json.load(f)
+            return int(position["segment"]), int(position["offset"])
+        except FileNotFoundError:
+            segments = self._segment_ids()
+            return (segments[0] if segments else 0), 0
+
+    def _save_position(self, segment_id, offset):
+        path = os.path.join(self.directory, POSITION_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": segment_id, "offset": offset}, f)
+            if self.fsync != "never":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # --- Appending (event_consumer's batch path) ---
+    async def append(self, records):
+        """Spool `records` (JSON-serializable dicts); waits while the spool is full."""
+        if not records:
+            return
+        if self.depth_bytes >= self.max_bytes:
+            self.append_waits += 1
+            logging.warning(f"Cosmos spool is full ({self.depth_bytes} bytes); waiting for the flusher to drain it.")
+            while self.depth_bytes >= self.max_bytes and not self._closing:
+                self._changed.clear()
+                await self._changed.wait()
+        frame = await asyncio.to_thread(encode_frame, records)
+        # Shielded: once started, the write is counted even if the caller is cancelled.
+        await asyncio.shield(self._append_frame(frame, len(records)))
+
+    async def _append_frame(self, frame, n_records):
+        async with self._write_lock: # Frames of concurrent partitions must not interleave
+            if self._sizes[self._write_segment] and self._sizes[self._write_segment] + len(frame) > self.segment_bytes:
+                await self._roll_segment()
+            await asyncio.to_thread(self._write, frame, self.fsync == "always")
+            # Only counted once written, so the flusher never reads a partial frame.
+            self._sizes[self._write_segment] += len(frame)
+            self._unsynced = self.fsync != "always"
+        self.depth_bytes += len(frame)
+        self.depth_records += n_records
+        self.appended_records += n_records
+        self._changed.set()
+
+    def _write(self, frame, fsync):
+        self._write_file.write(frame)
+        self._write_file.flush()
+        if fsync:
+            os.fsync(self._write_file.fileno())
+
+    async def _roll_segment(self):
+        """Seal the segment being appended to and start the next one (under _write_lock)."""
+        def roll(sealed, path):
+            if self.fsync != "never":
+                os.fsync(sealed.fileno()) # Sealed segments are always on disk
+            sealed.close()
+            return open(path, "ab")
+
+        self._write_file = await asyncio.to_thread(roll, self._write_file, self._segment_path(self._write_segment + 1))
+        self._write_segment += 1
+        self._sizes[self._write_segment] = 0
+        self._unsynced = False
+
+    async def sync(self):
+        """fsync the segment being appended to (CheckpointThrottle's before_checkpoint under "checkpoint")."""
+        async with self._write_lock:
+            if self._unsynced and self.fsync != "never":
+                self._unsynced = False
+                await asyncio.to_thread(os.fsync, self._write_file.fileno())
+
+    # --- Draining (background task) ---
+    def _read_chunk(self, sizes, write_segment, segment_id, offset):
+        """
+        Up to drain_batch_records records from `segment_id`/`offset`, reading only the bytes in
+        `sizes` (a snapshot; runs in a worker thread). Returns (records, segment id, end offset).
+        """
+        records = []
+        while segment_id in sizes:
+            if offset >= sizes[segment_id]:
+                if segment_id == write_segment:
+                    break
+                segment_id, offset = segment_id + 1, 0
+                continue
+            for frame_records, end in read_frames(self._segment_path(segment_id), offset, sizes[segment_id]):
+                records.extend(frame_records)
+                offset = end
+                if len(records) >= self.drain_batch_records:
+                    return records, segment_id, offset
+            if offset < sizes[segment_id]: # Unreadable frame in a sealed segment: skip the rest of it
+                logging.error(f"Spool segment {segment_id} is corrupt at byte {offset}; skipping its remaining "
+                              f"{sizes[segment_id] - offset} bytes.")
+                offset = sizes[segment_id]
+        return records, segment_id, offset
+
+    async def _next_chunk(self):
+        return await asyncio.to_thread(self._read_chunk, dict(self._sizes), self._write_segment,
+                                       self._read_segment, self._read_offset)
+
+    async def _advance(self, segment_id, offset, n_records):
+        drained_bytes = sum(self._sizes[s] for s in range(self._read_segment, segment_id)) - self._read_offset + offset
+        drained_segments = range(self._read_segment, segment_id)
+        self._read_segment, self._read_offset = segment_id, offset
+
+        def persist():
+            self._save_position(segment_id, offset) # Before the segments go, so a crash never points into a deleted one
+            for drained_segment in drained_segments:
+                os.remove(self._segment_path(drained_segment))
+
+        await asyncio.to_thread(persist)
+        for drained_segment in drained_segments:
+            del self._sizes[drained_segment]
+        self.depth_bytes -= drained_bytes
+        self.depth_records -= n_records
+        self.drained_records += n_records
+        self._changed.set()
+
+    async def _dead_letter(self, failed):
+        lines = "".join(json.dumps({"record": record, "status": getattr(error, "status_code", None),
+                                    "error": f"{type(error).__name__}: {error}"[:500]}) + "\n" for record, error in failed)
+
+        def write():
+            with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as f:
+                f.write(lines)
+
+        await asyncio.to_thread(write)
+        self.dead_lettered += len(failed)
+        logging.error(f"Cosmos DB rejected {len(failed)} spooled records ({failed[0][1]}); moved them to {DEAD_LETTER_FILE}.")
+
+    async def _write_until_done(self, writer, records):
+        """Write `records`, retrying transient failures until they succeed or the spool is closed; returns True when done."""
+        backoff_s = self.retry_backoff_s[0]
+        while records:
+            try:
+                result = await writer.write(records)
+                failed = result.failed
+            except Exception as e: # Nothing is known to be written; only transient errors (see cosmos_writer.is_transient) are retried
+                failed = [(record, e) for record in records]
+            transient, rejected = [], []
+            for record, error in failed:
+                (transient if is_transient(error) else rejected).append((record, error))
+            if rejected:
+                await self._dead_letter(rejected)
+            records = [record for record, _ in transient]
+            if records:
+                self.write_failures += 1
+                if self._closing:
+                    return False # Kept in the spool for the next start
+                logging.warning(f"Writing {len(records)} spooled records to Cosmos DB failed ({transient[0][1]}); retrying in {backoff_s:.1f}s.")
+                await asyncio.sleep(backoff_s)
+                backoff_s = min(backoff_s * 2, self.retry_backoff_s[1])
+        return True
+
+    async def run_flusher(self, writer):
+        """Drain the spool to Cosmos through `writer` (a CosmosBatchWriter) until close()."""
+        while True:
+            records, segment_id, offset = await self._next_chunk()
+            if not records:
+                if (segment_id, offset) != (self._read_segment, self._read_offset):
+                    await self._advance(segment_id, offset, 0) # Only skipped corrupt bytes
+                if self._closing:
+                    return
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+            if not await self._write_until_done(writer, records):
+                return
+            await self._advance(segment_id, offset, len(records))
+
+    async def close(self, flusher_task=None, drain_timeout_s=10.0):
+        """Give the flusher up to `drain_timeout_s` to empty the spool, then stop it and sync; the rest replays on the next start."""
+        self._closing = True
+        self._changed.set()
+        if flusher_task is not None:
+            try:
+                await asyncio.wait_for(flusher_task, drain_timeout_s)
+            except asyncio.TimeoutError:
+                pass # wait_for cancelled it; the chunk being written is replayed next time
+        await self.sync()
+        async with self._write_lock:
+            self._write_file.close()
+        if self.depth_records:
+            logging.warning(f"{self.depth_records} spooled records not yet written to Cosmos DB; they are replayed on the next start.")
+
+    def stats(self):
+        return {"depth_records": self.depth_records, "depth_bytes": self.depth_bytes, "segments": len(self._sizes),
+                "appended": self.appended_records, "drained": self.drained_records, "dead_lettered": self.dead_lettered,
+                "write_failures": self.write_failures, "append_waits": self.append_waits}
+
+def spool_from_env():
+    """
+    CosmosSpool in COSMOS_SPOOL_DIR (unset: no spool, records are written to Cosmos inline),
+    limited by COSMOS_SPOOL_MAX_BYTES and COSMOS_SPOOL_SEGMENT_BYTES, with COSMOS_SPOOL_FSYNC
+    (always, checkpoint or never) and COSMOS_SPOOL_DRAIN_BATCH records per bulk write.
+    """
+    directory = os.getenv("COSMOS_SPOOL_DIR")
+    if not directory:
+        return None
+    return CosmosSpool(directory, max_bytes=int(os.getenv("COSMOS_SPOOL_MAX_BYTES", str(1 << 30))),
+                       segment_bytes=int(os.getenv("COSMOS_SPOOL_SEGMENT_BYTES", str(64 << 20))),
+                       fsync=os.getenv("COSMOS_SPOOL_FSYNC", "checkpoint").lower(),
+                       drain_batch_records=int(os.getenv("COSMOS_SPOOL_DRAIN_BATCH", "1000")))
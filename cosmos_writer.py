@@ -0,0 +1,151 @@
+# cosmos_writer.py
+# Batched Cosmos DB persistence for event_consumer.py (azure.cosmos.aio). The Azure Function
+# keeps a synchronous counterpart in iot-anomaly-function/cosmos_writer.py; keep the two in step.
+#
+# Records are grouped by the container's partition key (`/unit_number`) and written as
+# transactional batches of up to 100 upserts, with a bounded number of partitions in
+# flight. A batch is atomic, so when one operation is rejected the writer drops only that
+# record (reporting it as failed) and resubmits the rest; throttled (429) and transient
+# failures, including dropped connections and timeouts, are retried after the
+# server-suggested delay or an exponential backoff. Records of a partition key whose write
+# fails unexpectedly are reported as failed, without losing the other partition keys' results.
+import asyncio
+import logging
+import random
+
+from azure.core.exceptions import AzureError, ServiceRequestError, ServiceResponseError
+from azure.cosmos import exceptions
+
+# Cosmos DB limit on operations per transactional batch.
+TRANSACTIONAL_BATCH_LIMIT = 100
+# Status codes worth retrying unchanged: timeout, throttled, retry-with, unavailable.
+RETRYABLE_STATUS_CODES = {408, 429, 449, 503}
+REQUEST_TOO_LARGE = 413
+# Failures before Cosmos answered: the connection failed or timed out.
+TRANSIENT_ERRORS = (ServiceRequestError, ServiceResponseError, asyncio.TimeoutError)
+
+def is_transient(error):
+    """Whether a failed write is worth retrying unchanged (a dropped connection, a timeout or a retryable status)."""
+    return isinstance(error, TRANSIENT_ERRORS) or getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+def group_by_partition_key(records, partition_key_field="unit_number"):
+    """Group records by partition key value, preserving their order within each group."""
+    groups = {}
+    for record in records:
+        groups.setdefault(record.get(partition_key_field), []).append(record)
+    return groups
+
+def retry_delay_s(error, attempt, base_backoff_s, max_backoff_s):
+    """Delay before retry `attempt` (1-based): Cosmos' x-ms-retry-after-ms when given, else jittered exponential."""
+    headers = getattr(error, "headers", None) or {}
+    retry_after_ms = headers.get("x-ms-retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return min(float(retry_after_ms) / 1000.0, max_backoff_s)
+        except ValueError:
+            pass
+    return min(base_backoff_s * (2 ** (attempt - 1)), max_backoff_s) * random.uniform(0.5, 1.0)
+
+class WriteResult:
+    def __init__(self):
+        self.written = 0
+        self.failed = [] # (record, error) pairs that were given up on
+        self.batch_calls = 0
+        self.retries = 0
+
+    def merge(self, other):
+        self.written += other.written
+        self.failed.extend(other.failed)
+        self.batch_calls += other.batch_calls
+        self.retries += other.retries
+
+class CosmosBatchWriter:
+    """Writes records to an azure.cosmos.aio container with per-partition transactional batches."""
+
+    def __init__(self, container, partition_key_field="unit_number", max_parallel_partitions=8,
+                 max_retries=5, base_backoff_s=0.1, max_backoff_s=5.0):
+        self.container = container
+        self.partition_key_field = partition_key_field
+        self.max_parallel_partitions = max_parallel_partitions
+        self.max_retries = max_retries
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+
+    @staticmethod
+    def _chunks(records):
+        """Work list of chunks still to be written: (records, attempt)."""
+        return [(records[i:i + TRANSACTIONAL_BATCH_LIMIT], 0) for i in range(0, len(records), TRANSACTIONAL_BATCH_LIMIT)]
+
+    def _handle_failure(self, result, pending, partition_key, chunk, attempt, error):
+        """
+        Record what is given up on of a failed chunk in `result`, and put what is to be
+        resubmitted at the front of `pending`. Returns the seconds to wait before resubmitting.
+        """
+        status = getattr(error, "status_code", None)
+        failed_index = error.error_index if isinstance(error, exceptions.CosmosBatchOperationError) else None
+        if is_transient(error):
+            if attempt >= self.max_retries:
+                result.failed.extend((record, error) for record in chunk)
+                logging.error(f"Giving up on {len(chunk)} records for partition {partition_key} after {attempt} retries: {error}")
+                return 0
+            result.retries += 1
+            pending.insert(0, (chunk, attempt + 1))
+            return retry_delay_s(error, attempt + 1, self.base_backoff_s, self.max_backoff_s)
+        if status == REQUEST_TOO_LARGE and len(chunk) > 1:
+            half = len(chunk) // 2
+            pending[:0] = [(chunk[:half], attempt), (chunk[half:], attempt)]
+        elif failed_index is not None and 0 <= failed_index < len(chunk):
+            # Atomic batch: nothing was committed. Drop only the rejected record and resubmit the rest.
+            result.failed.append((chunk[failed_index], error))
+            logging.error(f"Cosmos DB rejected record {chunk[failed_index].get('id')} (status {status}): {error}")
+            pending.insert(0, (chunk[:failed_index] + chunk[failed_index + 1:], attempt))
+        else:
+            result.failed.extend((record, error) for record in chunk)
+            logging.error(f"Batch write of {len(chunk)} records for partition {partition_key} failed (status {status}): {error}")
+        return 0
+
+    @staticmethod
+    def _partition_failed(partition_key, records, error):
+        """WriteResult for a partition key whose write raised: all its records failed (some may be written)."""
+        result = WriteResult()
+        result.failed.extend((record, error) for record in records)
+        logging.error(f"Writing {len(records)} records for partition {partition_key} failed unexpectedly: {type(error).__name__}: {error}")
+        return result
+
+    async def write(self, records):
+        """Upsert all records; returns a WriteResult. Never raises for per-record failures."""
+        semaphore = asyncio.Semaphore(self.max_parallel_partitions)
+        groups = group_by_partition_key(records, self.partition_key_field)
+
+        async def write_group(partition_key, group):
+            async with semaphore:
+                return await self._write_partition(partition_key, group)
+
+        result = WriteResult()
+        group_results = await asyncio.gather(*(write_group(pk, group) for pk, group in groups.items()), return_exceptions=True)
+        for (partition_key, group), group_result in zip(groups.items(), group_results):
+            if isinstance(group_result, asyncio.CancelledError):
+                raise group_result
+            if isinstance(group_result, BaseException):
+                group_result = self._partition_failed(partition_key, group, group_result)
+            result.merge(group_result)
+        return result
+
+    async def _write_partition(self, partition_key, records):
+        result = WriteResult()
+        pending = self._chunks(records)
+        while pending:
+            chunk, attempt = pending.pop(0)
+            if not chunk:
+                continue
+            operations = [("upsert", (record,)) for record in chunk]
+            result.batch_calls += 1
+            try:
+                await self.container.execute_item_batch(batch_operations=operations, partition_key=partition_key)
+                result.written += len(chunk)
+                continue
+            except (AzureError, asyncio.TimeoutError) as e:
+                delay_s = self._handle_failure(result, pending, partition_key, chunk, attempt, e)
+            if delay_s:
+                await asyncio.sleep(delay_s)
+        return result
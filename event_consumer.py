@@ -1,24 +1,187 @@
 import os
 import asyncio
+import hashlib
 import json
 import logging
-import time # Needed for Datadog metric timestamps
+import random
+import socket
+import time
 from azure.eventhub.aio import EventHubConsumerClient
 from azure.cosmos.aio import CosmosClient 
 from azure.cosmos import exceptions
 from dotenv import load_dotenv 
 import aiohttp 
+import numpy as np
+
+from metrics_client import MetricsAggregator # Batches Datadog metrics into periodic payloads
+from cosmos_writer import CosmosBatchWriter # Per-partition transactional batch writes with retries
+from cosmos_spool import spool_from_env # Durable write-behind spool drained to Cosmos DB in the background
+import local_pipeline # Local Event Hub / Cosmos stand-ins for PIPELINE_BACKEND=local
+from feature_engine import ROLLING_STATS, engine_from_env, restore_if_present, snapshot_periodically # Per-unit rolling-window features
+from inference_engine import load_engine, records_to_matrix # Same scoring core as model_api.py and score.py
+from result_cache import cache_from_env # Bounded LRU+TTL cache for redelivered events
+from checkpoint_store import CheckpointThrottle, checkpoint_store_from_env # Durable checkpoints, resume from offset
+import wire_format # Packed binary readings (WIRE_FORMAT=packed) alongside JSON
+import stage_metrics # Per-stage latency histograms, served in Prometheus format
+import logging_setup # Queue-backed log writer and hot-path log sampling
+from resilience import AdaptiveBatchController, CircuitBreaker, CircuitOpenError, RetryBudget # Guards for model_api calls
 
 # --- Logging Setup ---
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# Records are written to the terminal by a background thread (logging_setup.py), so the event
+# loop never blocks on log output.
+logging_setup.configure_logging()
 logging.getLogger("azure").setLevel(logging.WARNING) 
 
 # --- Global Clients and Config Variables (initialized to None) ---
 eventhub_client = None
 cosmos_client = None
 cosmos_container = None 
+cosmos_writer = None # CosmosBatchWriter wrapping cosmos_container
+cosmos_spool = None # CosmosSpool when COSMOS_SPOOL_DIR is set, created in main()
 http_session = None # Shared aiohttp client session for both model API and Datadog API calls
+metrics = None # MetricsAggregator for Datadog custom metrics, started in main()
+feature_engine = None # RollingFeatureEngine when ROLLING_FEATURES_ENABLED=true, created in main()
+scoring_engine = None # IsolationForestEngine when SCORING_MODE=local, loaded in main()
+checkpoint_store = None # SQLiteCheckpointStore / FileCheckpointStore, created in initialize_clients()
+result_cache = None # ResultCache of document id -> (is_anomaly, anomaly_score, written document digest), created in main()
+
+# --- Backend Selection ---
+# "azure" (default) uses Event Hubs and Cosmos DB; "local" reads a file-backed partitioned
+# queue in LOCAL_QUEUE_DIR (as written by local_pipeline.LocalProducerClient) and keeps documents
+# in memory, so the pipeline can run and be benchmarked without Azure resources.
+PIPELINE_BACKEND = os.getenv("PIPELINE_BACKEND", "azure").lower()
+LOCAL_QUEUE_DIR = os.getenv("LOCAL_QUEUE_DIR", "local_eventhub")
+LOCAL_PARTITION_COUNT = int(os.getenv("LOCAL_PARTITION_COUNT", "4"))
+
+# --- Scoring Mode ---
+# "http" (default) calls model_api (ML_ENDPOINT_URL / ML_BATCH_ENDPOINT_URL); "local" loads the
+# artifacts in MODEL_DIR into the same IsolationForestEngine that model_api uses and scores
+# each batch in-process as one matrix, skipping the JSON/HTTP round trip.
+SCORING_MODE = os.getenv("SCORING_MODE", "http").lower()
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+
+# --- Concurrency Settings ---
+# Max model-API calls in flight at once across all partitions.
+CONSUMER_MAX_IN_FLIGHT = int(os.getenv("CONSUMER_MAX_IN_FLIGHT", "16"))
+# Batches a partition may have queued behind the one being processed; 0 processes
+# each batch inline in the receive callback (no overlap with the next receive).
+CONSUMER_PIPELINE_DEPTH = int(os.getenv("CONSUMER_PIPELINE_DEPTH", "2"))
+
+# Partition-key groups written to Cosmos DB in parallel, and retries for throttled/transient failures.
+COSMOS_MAX_PARALLEL_PARTITIONS = int(os.getenv("COSMOS_MAX_PARALLEL_PARTITIONS", "8"))
+COSMOS_MAX_RETRIES = int(os.getenv("COSMOS_MAX_RETRIES", "5"))
+
+# Rolling-window features (ROLLING_FEATURES_ENABLED, ROLLING_WINDOW, ...; see feature_engine.py) are
+# added to every record before scoring and persistence. State is snapshotted to ROLLING_STATE_PATH,
+# when set, every ROLLING_SNAPSHOT_INTERVAL_S seconds and at shutdown, and restored at startup.
+ROLLING_STATE_PATH = os.getenv("ROLLING_STATE_PATH")
+ROLLING_SNAPSHOT_INTERVAL_S = float(os.getenv("ROLLING_SNAPSHOT_INTERVAL_S", "60"))
+
+# --- Replay Deduplication ---
+# Without a checkpoint store every restart replays the hub from the start. Events are looked up by
+# their Cosmos document id in a bounded LRU+TTL cache (RESULT_CACHE_MAX_ENTRIES, default 100000,
+# 0 disables; RESULT_CACHE_TTL_S, default 3600): a hit reuses the stored prediction instead of
+# scoring the event again, and its upsert is skipped when the document would be unchanged.
+
+# --- Checkpointing ---
+# Checkpoints are persisted in the store chosen by CHECKPOINT_STORE (sqlite by default, see
+# checkpoint_store.py), so a restart resumes each partition after its last checkpoint. A partition
+# is checkpointed every CHECKPOINT_EVERY_EVENTS events or CHECKPOINT_INTERVAL_S seconds, whichever
+# comes first, and at shutdown; CHECKPOINT_EVERY_EVENTS=1 checkpoints after every batch.
+CHECKPOINT_EVERY_EVENTS = int(os.getenv("CHECKPOINT_EVERY_EVENTS", "1000"))
+CHECKPOINT_INTERVAL_S = float(os.getenv("CHECKPOINT_INTERVAL_S", "10"))
+checkpoint_throttle = CheckpointThrottle(CHECKPOINT_EVERY_EVENTS, CHECKPOINT_INTERVAL_S)
+
+# --- Cosmos Write-Behind Spool (cosmos_spool.py) ---
+# With COSMOS_SPOOL_DIR set, processed records are appended to an on-disk spool instead of being
+# written to Cosmos DB inline, and a background flusher drains it in bulk; a slow or unavailable
+# Cosmos no longer holds up receiving and checkpointing, and failed writes are retried from the
+# spool instead of being lost. Size limits, fsync policy and drain batch: see spool_from_env().
+# At shutdown the flusher gets COSMOS_SPOOL_SHUTDOWN_DRAIN_S seconds to empty the spool; what is
+# left is replayed on the next start. Depth and drain rate are logged (and sent to Datadog) every
+# COSMOS_SPOOL_REPORT_INTERVAL_S seconds.
+COSMOS_SPOOL_SHUTDOWN_DRAIN_S = float(os.getenv("COSMOS_SPOOL_SHUTDOWN_DRAIN_S", "10"))
+COSMOS_SPOOL_REPORT_INTERVAL_S = float(os.getenv("COSMOS_SPOOL_REPORT_INTERVAL_S", "30"))
+
+# --- Partition Load Balancing ---
+# Consumers sharing a checkpoint store (in one consumer group) split the partitions between them
+# through its ownership records: every CONSUMER_LOAD_BALANCING_INTERVAL_S seconds each renews its
+# claims and claims its share, and partitions of a consumer that stopped renewing for
+# CONSUMER_OWNERSHIP_EXPIRATION_S seconds are taken over. consumer_supervisor.py runs several
+# consumers on one node; more nodes need a store they all reach (CHECKPOINT_STORE=blob).
+# CONSUMER_OWNER_ID names this consumer in the local backend's ownership records (the Azure SDK
+# picks its own), so a restarted consumer takes back its partitions at once.
+CONSUMER_OWNER_ID = os.getenv("CONSUMER_OWNER_ID") or socket.gethostname()
+CONSUMER_LOAD_BALANCING_INTERVAL_S = float(os.getenv("CONSUMER_LOAD_BALANCING_INTERVAL_S", "10"))
+CONSUMER_OWNERSHIP_EXPIRATION_S = float(os.getenv("CONSUMER_OWNERSHIP_EXPIRATION_S", "60"))
+
+# --- Wire Format ---
+# Events are decoded by content type: wire_format.CONTENT_TYPE bodies are packed frames of one or
+# more readings, anything else is JSON. MODEL_API_WIRE_FORMAT=packed also sends the readings to
+# model_api as a packed frame (Content-Type negotiated per request) in WIRE_FORMAT_DTYPE (float64
+# by default, float32 halves the values) instead of a JSON body.
+MODEL_API_WIRE_FORMAT = os.getenv("MODEL_API_WIRE_FORMAT", "json").lower()
+WIRE_FORMAT_DTYPE = wire_format.dtype_from_name(os.getenv("WIRE_FORMAT_DTYPE", "float64"))
+
+# --- Model API Resilience (resilience.py) ---
+# Each model_api call times out after MODEL_API_TIMEOUT_S. After MODEL_API_BREAKER_FAILURES
+# consecutive failed calls (connection errors, timeouts, 429/5xx) the circuit opens. Events then
+# fall back to the default anomaly status at once, without a call, for MODEL_API_BREAKER_RESET_S
+# seconds (doubling up to MODEL_API_BREAKER_MAX_RESET_S while probes keep failing). After that,
+# single probe calls test whether the API is back. Calls that failed fast (not timeouts, which
+# already took MODEL_API_TIMEOUT_S) are retried up to MODEL_API_MAX_RETRIES times from a budget
+# shared by all calls: MODEL_API_RETRY_BUDGET_RATIO retries per call made, plus
+# MODEL_API_RETRY_MIN_PER_S per second.
+MODEL_API_TIMEOUT_S = float(os.getenv("MODEL_API_TIMEOUT_S", "10"))
+MODEL_API_MAX_RETRIES = int(os.getenv("MODEL_API_MAX_RETRIES", "2"))
+MODEL_API_RETRY_BACKOFF_S = float(os.getenv("MODEL_API_RETRY_BACKOFF_S", "0.1"))
+model_api_breaker = CircuitBreaker("model_api",
+                                   failure_threshold=int(os.getenv("MODEL_API_BREAKER_FAILURES", "3")),
+                                   reset_timeout_s=float(os.getenv("MODEL_API_BREAKER_RESET_S", "5")),
+                                   max_reset_timeout_s=float(os.getenv("MODEL_API_BREAKER_MAX_RESET_S", "60")))
+model_api_retry_budget = RetryBudget(ratio=float(os.getenv("MODEL_API_RETRY_BUDGET_RATIO", "0.1")),
+                                     min_per_s=float(os.getenv("MODEL_API_RETRY_MIN_PER_S", "1")))
+
+# --- Receive Batching ---
+# receive_batch starts with CONSUMER_BATCH_SIZE events / CONSUMER_MAX_WAIT_TIME_S seconds per
+# batch. With CONSUMER_ADAPTIVE_BATCHING (default on), AdaptiveBatchController re-derives both
+# from the model_call latency per batch. Batches are sized so their model call takes about
+# CONSUMER_TARGET_BATCH_LATENCY_S, within CONSUMER_MIN_BATCH_SIZE..CONSUMER_MAX_BATCH_SIZE.
+# receive_batch only takes these values when it starts. So when they have drifted by 1.5x or
+# more, at most every CONSUMER_RETUNE_INTERVAL_S seconds, the receiver is restarted with the
+# new values after draining the partition pipelines and flushing checkpoints. Without a
+# checkpoint store (CHECKPOINT_STORE=none), the restarted receiver starts each partition after
+# the last event received, instead of replaying it from the beginning.
+CONSUMER_BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", "100"))
+CONSUMER_MAX_WAIT_TIME_S = float(os.getenv("CONSUMER_MAX_WAIT_TIME_S", "5"))
+CONSUMER_ADAPTIVE_BATCHING = os.getenv("CONSUMER_ADAPTIVE_BATCHING", "true").lower() in ("1", "true", "yes")
+CONSUMER_MIN_BATCH_SIZE = int(os.getenv("CONSUMER_MIN_BATCH_SIZE", "10"))
+CONSUMER_MAX_BATCH_SIZE = int(os.getenv("CONSUMER_MAX_BATCH_SIZE", "500"))
+CONSUMER_TARGET_BATCH_LATENCY_S = float(os.getenv("CONSUMER_TARGET_BATCH_LATENCY_S", "1"))
+CONSUMER_RETUNE_INTERVAL_S = float(os.getenv("CONSUMER_RETUNE_INTERVAL_S", "30"))
+batch_controller = None # AdaptiveBatchController when CONSUMER_ADAPTIVE_BATCHING, created in main()
+received_sequence_numbers = {} # partition_id -> sequence number of the last event handed to processing
+
+model_call_semaphore = None # Created lazily on the running loop, bounds in-flight model calls
+partition_pipelines = {} # partition_id -> PartitionPipeline
+
+# --- Stage Timings (stage_metrics.py) ---
+# Per Event Hub batch: receive (from the receive callback until processing starts, i.e. time
+# queued in the partition pipeline), parse, model_call (scoring, in-process or via model_api),
+# cosmos_write (the spool append, with COSMOS_SPOOL_DIR) and checkpoint. Served as Prometheus text on CONSUMER_METRICS_PORT (0 disables)
+# and summarized in the log every STAGE_METRICS_LOG_INTERVAL_S seconds.
+CONSUMER_METRICS_PORT = int(os.getenv("CONSUMER_METRICS_PORT", "9108"))
+STAGES = ("receive", "parse", "model_call", "cosmos_write", "checkpoint")
+stage_timings = {stage: stage_metrics.stage_histogram("event_consumer_stage_seconds", stage, "Time spent in each event_consumer stage, per Event Hub batch.") for stage in STAGES}
+
+# --- Hot-Path Log Sampling (logging_setup.py) ---
+# Per-event lines are logged at most once per unit, and per-batch lines once per partition,
+# every LOG_SAMPLE_INTERVAL_S seconds; each class is also capped at LOG_SAMPLE_MAX_PER_S lines
+# per second, which also bounds per-event error lines. Suppressed lines are counted and
+# reported in the log once a minute.
+batch_log = logging_setup.sampler("event_consumer.batch") # Keyed by partition id
+event_log = logging_setup.sampler("event_consumer.event") # Keyed by unit_number
+event_error_log = logging_setup.sampler("event_consumer.event_errors", interval_s=0)
 
 # --- Global Datadog API Config Variables ---
 # These will be set inside initialize_clients() and then accessed globally.
@@ -27,7 +190,7 @@ GLOBAL_DD_API_KEY_HEADER = None
 
 async def initialize_clients():
     """Initializes Event Hub, Cosmos DB, and HTTP clients."""
-    global eventhub_client, cosmos_client, cosmos_container, http_session, GLOBAL_DD_API_METRICS_URL, GLOBAL_DD_API_KEY_HEADER
+    global eventhub_client, cosmos_client, cosmos_container, checkpoint_store, http_session, GLOBAL_DD_API_METRICS_URL, GLOBAL_DD_API_KEY_HEADER
 
     # --- Configuration - Get env vars INSIDE this function ---
     # These are local variables within this function's scope
@@ -40,12 +203,26 @@ async def initialize_clients():
     cosmos_db_database_id = "iot-sensor-db"
     cosmos_db_container_id = "anomalies"
 
-    ml_endpoint_url_check = os.getenv("ML_ENDPOINT_URL")
+    # The model API is only needed when scoring over HTTP.
+    ml_endpoint_url_check = os.getenv("ML_ENDPOINT_URL") if SCORING_MODE == "http" else "in-process"
 
     # --- Assign Datadog env vars to GLOBAL variables ---
     GLOBAL_DD_API_METRICS_URL = os.getenv("DD_API_METRICS_URL")
     GLOBAL_DD_API_KEY_HEADER = os.getenv("DD_API_KEY_HEADER")
 
+    try:
+        checkpoint_store = checkpoint_store_from_env()
+        if checkpoint_store is not None:
+            logging.info(f"Checkpoints persisted in {type(checkpoint_store).__name__} at '{os.getenv('CHECKPOINT_PATH') or 'default path'}'.")
+        else:
+            logging.warning("CHECKPOINT_STORE=none: every restart reprocesses each partition from the beginning.")
+    except Exception as e:
+        logging.critical(f"CRITICAL ERROR: Failed to open the checkpoint store: {e}")
+        return False
+
+    if PIPELINE_BACKEND == "local":
+        return await initialize_local_clients(eh_consumer_group, ml_endpoint_url_check)
+
     # --- Debugging: Check if ALL env vars are loaded ---
     if not all([eh_connection_str, eh_name, cosmos_uri, cosmos_key, ml_endpoint_url_check, GLOBAL_DD_API_METRICS_URL, GLOBAL_DD_API_KEY_HEADER]):
         missing_vars = [v for v, val in {
@@ -65,7 +242,10 @@ async def initialize_clients():
         eventhub_client = EventHubConsumerClient.from_connection_string(
             conn_str=eh_connection_str, # Use local variable
             consumer_group=eh_consumer_group, # Use local variable
-            eventhub_name=eh_name # Use local variable
+            eventhub_name=eh_name, # Use local variable
+            checkpoint_store=checkpoint_store, # Resume from the last persisted offset per partition
+            load_balancing_interval=CONSUMER_LOAD_BALANCING_INTERVAL_S, # Split partitions with other consumers of the store
+            partition_ownership_expiration_interval=CONSUMER_OWNERSHIP_EXPIRATION_S
         )
         logging.info("Event Hub Consumer Client initialized.")
     except Exception as e:
@@ -102,16 +282,245 @@ async def initialize_clients():
 
     return True # All clients initialized successfully
 
-async def process_event_batch(partition_context, events):
-    """Processes a batch of events from Event Hubs."""
-    logging.info(f"Received batch of {len(events)} events from partition {partition_context.partition_id}.")
+def build_api_input(sensor_data):
+    """Prepare data for API call (matches SensorDataInput Pydantic model in model_api.py)."""
+    api_input_data = sensor_data.copy()
+    if 'raw_message_id' in api_input_data: del api_input_data['raw_message_id']
+    if 'raw_data_sample' in api_input_data: del api_input_data['raw_data_sample']
+    if 'sensor_2_value' in api_input_data: del api_input_data['sensor_2_value'] 
+    return api_input_data
+
+def api_request_body(headers, api_input):
+    """
+    aiohttp post() arguments for a reading (dict) or a list of readings: a JSON body, or a packed
+    frame with its Content-Type when MODEL_API_WIRE_FORMAT=packed.
+    """
+    if MODEL_API_WIRE_FORMAT != "packed":
+        return {"headers": headers, "json": api_input}
+    records = api_input if isinstance(api_input, list) else [api_input]
+    return {"headers": dict(headers, **{"Content-Type": wire_format.CONTENT_TYPE}),
+            "data": wire_format.encode_records(records, dtype=WIRE_FORMAT_DTYPE)}
+
+def parse_event(event):
+    """Readings carried by one event: a packed frame (by content type) holds one or more, a JSON body one."""
+    if getattr(event, "content_type", None) == wire_format.CONTENT_TYPE:
+        body = event.body
+        if not isinstance(body, (bytes, bytearray, memoryview)):
+            body = b"".join(body) # azure.eventhub yields the data sections of the AMQP body
+        return wire_format.decode_records(body)
+    return [json.loads(event.body_as_str())]
+
+def is_transient_failure(error):
+    """Whether a failed model_api call says the API is unavailable (and the call is worth retrying)."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+async def post_to_model_api(url, request_body):
+    """
+    POSTs to model_api through model_api_breaker and returns the decoded JSON response. Transient
+    failures other than timeouts are retried with jittered exponential backoff while
+    model_api_retry_budget allows.
+    Raises CircuitOpenError without calling while the circuit is open.
+    """
+    attempt = 0
+    while True:
+        if not model_api_breaker.allow():
+            raise CircuitOpenError(f"circuit '{model_api_breaker.name}' is open")
+        if attempt == 0:
+            model_api_retry_budget.record_call()
+        try:
+            async with http_session.post(url, **request_body, timeout=aiohttp.ClientTimeout(total=MODEL_API_TIMEOUT_S)) as response:
+                response.raise_for_status()
+                api_response = await response.json()
+        except Exception as e:
+            if not is_transient_failure(e):
+                model_api_breaker.record_success() # model_api answered; the request itself was rejected
+                raise
+            model_api_breaker.record_failure()
+            attempt += 1
+            if isinstance(e, asyncio.TimeoutError) or attempt > MODEL_API_MAX_RETRIES or not model_api_retry_budget.try_retry():
+                raise
+            await asyncio.sleep(MODEL_API_RETRY_BACKOFF_S * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+            continue
+        model_api_breaker.record_success()
+        return api_response
+
+async def predict_via_api(ml_endpoint_url, headers, sensor_data):
+    """Scores one reading through /predict. Returns (is_anomaly, anomaly_score)."""
+    api_input_data = build_api_input(sensor_data)
+    try:
+        api_response = await post_to_model_api(ml_endpoint_url, api_request_body(headers, api_input_data))
+
+        is_anomaly = api_response.get("is_anomaly", False)
+        anomaly_score = api_response.get("anomaly_score", 0.0)
+
+        if event_log.allow(sensor_data.get('unit_number')):
+            logging.info(f"API Prediction for unit {sensor_data.get('unit_number')}, cycle {sensor_data.get('time_in_cycles')}: Anomaly: {is_anomaly}, Score: {anomaly_score:.4f}")
+        return is_anomaly, anomaly_score
+
+    except CircuitOpenError:
+        pass # Counted by model_api_breaker; its state changes are logged there
+    except (aiohttp.ClientError, asyncio.TimeoutError) as api_e:
+        if event_error_log.allow():
+            logging.error(f"API call to ML endpoint failed for unit {sensor_data.get('unit_number')}, cycle {sensor_data.get('time_in_cycles')}: {api_e}")
+            logging.warning("Falling back to default anomaly status due to API failure.")
+    except Exception as e_api:
+        if event_error_log.allow():
+            logging.error(f"Unexpected error during API call for unit {sensor_data.get('unit_number')}, cycle {sensor_data.get('time_in_cycles')}: {e_api}")
+    return False, -999.0
+
+async def predict_batch_via_api(ml_batch_endpoint_url, headers, sensor_data_list):
+    """
+    Scores all readings of an Event Hub batch in a single /predict/batch call.
+    Returns a list of (is_anomaly, anomaly_score) aligned with `sensor_data_list`.
+    """
+    api_input_list = [build_api_input(sensor_data) for sensor_data in sensor_data_list]
+    try:
+        api_response = await post_to_model_api(ml_batch_endpoint_url, api_request_body(headers, api_input_list))
+
+        if len(api_response) != len(sensor_data_list):
+            raise ValueError(f"expected {len(sensor_data_list)} predictions, got {len(api_response)}")
+
+        if batch_log.allow("predict_batch"):
+            logging.info(f"API batch prediction returned {len(api_response)} results.")
+        return [(prediction.get("is_anomaly", False), prediction.get("anomaly_score", 0.0)) for prediction in api_response]
+
+    except CircuitOpenError:
+        if batch_log.allow("circuit_open"):
+            logging.warning(f"model_api circuit is open: {len(sensor_data_list)} events fall back to the default anomaly status without a call.")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as api_e:
+        logging.error(f"Batch API call to ML endpoint failed for {len(sensor_data_list)} events: {api_e}")
+        logging.warning("Falling back to default anomaly status due to API failure.")
+    except Exception as e_api:
+        logging.error(f"Unexpected error during batch API call for {len(sensor_data_list)} events: {e_api}")
+    return [(False, -999.0)] * len(sensor_data_list)
+
+def record_id(sensor_data):
+    """Cosmos document id of an event; identical for every delivery of the same event."""
+    return f"{sensor_data.get('unit_number')}-{sensor_data.get('time_in_cycles')}-{sensor_data.get('event_timestamp')}-{sensor_data.get('message_id')}"
+
+def document_digest(record):
+    """Content hash of a record, to recognize a redelivered event whose document would not change."""
+    return hashlib.blake2b(json.dumps(record, sort_keys=True, default=str).encode(), digest_size=16).digest()
+
+def build_record(sensor_data, is_anomaly, anomaly_score):
+    """Construct the record to save to Cosmos DB."""
+    record_to_save = sensor_data.copy()
+    
+    record_to_save["id"] = record_id(sensor_data)
+    record_to_save["is_anomaly"] = is_anomaly 
+    record_to_save["anomaly_score"] = anomaly_score 
+    
+    record_to_save["unit_number"] = sensor_data.get('unit_number')
+
+    if "raw_message_id" in record_to_save: del record_to_save["raw_message_id"]
+    if "raw_data_sample" in record_to_save: del record_to_save["raw_data_sample"]
+    if "sensor_2_value" in record_to_save: del record_to_save["sensor_2_value"] 
+    return record_to_save
+
+def record_consumer_metrics(sensor_data, written=True):
+    """Record Custom Metrics for one event (from consumer); the aggregator ships them to Datadog in batches."""
+    if metrics is None:
+        return
+    unit_tag = "unit_number:{}".format(sensor_data.get('unit_number'))
+    metrics.count("iot.consumer.events_processed", 1, ("service:event_consumer", "env:local", unit_tag))
+    metrics.count("iot.consumer.writes_to_cosmos_db", 1 if written else 0, ("service:event_consumer", "env:local", unit_tag))
+
+def get_cosmos_writer():
+    """CosmosBatchWriter for the current cosmos_container (rebuilt if the container was swapped)."""
+    global cosmos_writer
+    if cosmos_writer is None or cosmos_writer.container is not cosmos_container:
+        cosmos_writer = CosmosBatchWriter(cosmos_container, max_parallel_partitions=COSMOS_MAX_PARALLEL_PARTITIONS, max_retries=COSMOS_MAX_RETRIES)
+    return cosmos_writer
+
+def get_model_call_semaphore():
+    global model_call_semaphore
+    if model_call_semaphore is None:
+        model_call_semaphore = asyncio.Semaphore(CONSUMER_MAX_IN_FLIGHT)
+    return model_call_semaphore
+
+async def predict_events_concurrently(ml_endpoint_url, headers, parsed_events):
+    """
+    Scores events one /predict call each, with up to CONSUMER_MAX_IN_FLIGHT calls in flight.
+    Events of the same unit_number are scored strictly in batch order; different units
+    proceed in parallel. Returns predictions aligned with `parsed_events`.
+    """
+    semaphore = get_model_call_semaphore()
+    predictions = [None] * len(parsed_events)
+
+    events_by_unit = {}
+    for index, sensor_data in enumerate(parsed_events):
+        events_by_unit.setdefault(sensor_data.get('unit_number'), []).append(index)
+
+    async def score_unit(indices):
+        for index in indices:
+            async with semaphore:
+                predictions[index] = await predict_via_api(ml_endpoint_url, headers, parsed_events[index])
+
+    await asyncio.gather(*(score_unit(indices) for indices in events_by_unit.values()))
+    return predictions
+
+def load_scoring_engine():
+    """Loads the model artifacts for SCORING_MODE=local. Returns True on success."""
+    global scoring_engine
+    try:
+        scoring_engine, _, _, _ = load_engine(MODEL_DIR)
+        logging.info(f"In-process scoring enabled with artifacts from '{MODEL_DIR}' ({len(scoring_engine.feature_names)} features).")
+        return True
+    except Exception as e:
+        logging.critical(f"ERROR: Could not load model artifacts from '{MODEL_DIR}' for in-process scoring: {e}")
+        return False
+
+async def predict_batch_locally(parsed_events):
+    """Scores a batch in-process as one matrix. Returns (is_anomaly, anomaly_score) per event, in order."""
+    predictions = [(False, -999.0)] * len(parsed_events)
+    matrix, valid = records_to_matrix(parsed_events, scoring_engine.feature_names)
+    for i in np.flatnonzero(~valid).tolist():
+        if event_error_log.allow():
+            logging.error(f"Missing or non-numeric features for unit {parsed_events[i].get('unit_number')}, cycle {parsed_events[i].get('time_in_cycles')}. Falling back to default anomaly status.")
+    if valid.any():
+        # Scored in a worker thread so a large batch does not stall receiving on other partitions.
+        anomaly_scores, anomaly_flags = await asyncio.to_thread(scoring_engine.score, matrix[valid])
+        for i, anomaly_score, is_anomaly in zip(np.flatnonzero(valid).tolist(), anomaly_scores.tolist(), anomaly_flags.tolist()):
+            predictions[i] = (is_anomaly, anomaly_score)
+    return predictions
+
+async def initialize_local_clients(eh_consumer_group, ml_endpoint_url_check):
+    """Initializes the local queue consumer, in-memory document store, and HTTP client."""
+    global eventhub_client, cosmos_container, http_session
+
+    if not ml_endpoint_url_check:
+        logging.critical("ERROR: Missing environment variables: ML_ENDPOINT_URL. Check .env file.")
+        return False
+
+    queue = local_pipeline.FilePartitionedQueue(LOCAL_QUEUE_DIR, partition_count=LOCAL_PARTITION_COUNT)
+    eventhub_client = local_pipeline.LocalConsumerClient(queue, consumer_group=eh_consumer_group, checkpoint_store=checkpoint_store,
+                                                         owner_id=CONSUMER_OWNER_ID,
+                                                         load_balancing_interval=CONSUMER_LOAD_BALANCING_INTERVAL_S,
+                                                         partition_ownership_expiration_interval=CONSUMER_OWNERSHIP_EXPIRATION_S)
+    cosmos_container = local_pipeline.InMemoryContainer()
+    http_session = aiohttp.ClientSession()
+    logging.info(f"Local backend initialized: queue '{LOCAL_QUEUE_DIR}' ({len(queue.partition_ids)} partitions), in-memory document store.")
+    return True
+
+async def process_event_batch(partition_context, events, received_ns=None):
+    """Processes a batch of events from Event Hubs (`received_ns`: perf_counter_ns() when it was received)."""
+    if received_ns is not None:
+        stage_timings["receive"].observe_ns(time.perf_counter_ns() - received_ns)
+    log_batch = batch_log.allow(partition_context.partition_id)
+    if log_batch:
+        logging.info(f"Received batch of {len(events)} events from partition {partition_context.partition_id}.")
     
     processed_records = []
     if not cosmos_container:
-        logging.warning("Cosmos DB container not available. Skipping record persistence for this batch.")
+        if log_batch:
+            logging.warning("Cosmos DB container not available. Skipping record persistence for this batch.")
         return 
 
     ML_ENDPOINT_URL = os.getenv("ML_ENDPOINT_URL") # This needs to be fetched here or passed as param
+    # Optional: when set, the whole batch is scored with one call to model_api's /predict/batch.
+    ML_BATCH_ENDPOINT_URL = os.getenv("ML_BATCH_ENDPOINT_URL")
     
     headers = {"Content-Type": "application/json"}
     # If your local API had authentication, add headers here:
@@ -119,113 +528,250 @@ async def process_event_batch(partition_context, events):
     # if ML_ENDPOINT_KEY and ML_ENDPOINT_KEY != "N/A":
     #    headers["Authorization"] = f"Bearer {ML_ENDPOINT_KEY}" 
 
-    if not ML_ENDPOINT_URL or not http_session:
+    if SCORING_MODE == "http" and (not ML_ENDPOINT_URL or not http_session):
         logging.critical("ML Endpoint URL or HTTP session not available. Cannot perform anomaly prediction via API.")
         return 
 
+    # --- Parse all events of the batch first ---
+    started = time.perf_counter_ns()
+    parsed_events = []
     for event in events:
         try:
-            event_body = event.body_as_str()
-            sensor_data = json.loads(event_body)
+            parsed_events.extend(parse_event(event))
+        except Exception as e:
+            # latin-1 decodes any bytes, so packed bodies can be previewed too.
+            if event_error_log.allow():
+                logging.error(f"Error processing event: {e}. Event body: {event.body_as_str(encoding='latin-1')[:200]}...")
+    stage_timings["parse"].observe_ns(time.perf_counter_ns() - started)
 
-            # --- Debugging: Inspect incoming data (can be removed after verification) ---
-            # logging.debug(f"DEBUG: Incoming sensor_data keys: {list(sensor_data.keys())}") 
-            # logging.debug(f"DEBUG: Sample sensor_data content (first 500 chars): {json.dumps(sensor_data, indent=2)[:500]}...") 
-            # --- End Debugging ---
+    # --- Rolling features: advance each unit's window in event order (events of a unit share a partition) ---
+    if feature_engine is not None:
+        for sensor_data in parsed_events:
+            try:
+                sensor_data.update(feature_engine.update_record(sensor_data))
+            except Exception as e:
+                if event_error_log.allow():
+                    logging.error(f"Error computing rolling features for unit {sensor_data.get('unit_number')}: {e}")
 
-            is_anomaly = False 
-            anomaly_score = 0.0 
+    # --- Replays: reuse the results of events already scored, by document id ---
+    cached = [None] * len(parsed_events)
+    if result_cache is not None:
+        cached = [result_cache.get(record_id(sensor_data)) for sensor_data in parsed_events]
+    to_score = [i for i, entry in enumerate(cached) if entry is None]
+    events_to_score = [parsed_events[i] for i in to_score]
 
-            # Prepare data for API call (matches SensorDataInput Pydantic model in model_api.py)
-            api_input_data = sensor_data.copy()
-            if 'raw_message_id' in api_input_data: del api_input_data['raw_message_id']
-            if 'raw_data_sample' in api_input_data: del api_input_data['raw_data_sample']
-            if 'sensor_2_value' in api_input_data: del api_input_data['sensor_2_value'] 
+    # --- Score: in-process, one /predict/batch call for the batch, or one /predict call per event ---
+    started = time.perf_counter_ns()
+    if SCORING_MODE == "local":
+        new_predictions = await predict_batch_locally(events_to_score)
+    elif ML_BATCH_ENDPOINT_URL and events_to_score:
+        async with get_model_call_semaphore():
+            new_predictions = await predict_batch_via_api(ML_BATCH_ENDPOINT_URL, headers, events_to_score)
+    else:
+        new_predictions = await predict_events_concurrently(ML_ENDPOINT_URL, headers, events_to_score)
+    model_call_ns = time.perf_counter_ns() - started
+    stage_timings["model_call"].observe_ns(model_call_ns)
+    if batch_controller is not None:
+        batch_controller.observe(len(events_to_score), model_call_ns / 1e9)
 
-            try:
-                async with http_session.post(ML_ENDPOINT_URL, headers=headers, json=api_input_data, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    response.raise_for_status() 
-                    api_response = await response.json()
-                    
-                    is_anomaly = api_response.get("is_anomaly", False)
-                    anomaly_score = api_response.get("anomaly_score", 0.0)
-                    
-                    logging.info(f"API Prediction for unit {sensor_data.get('unit_number')}, cycle {sensor_data.get('time_in_cycles')}: Anomaly: {is_anomaly}, Score: {anomaly_score:.4f}")
-
-            except aiohttp.ClientError as api_e:
-                logging.error(f"API call to ML endpoint failed for unit {sensor_data.get('unit_number')}, cycle {sensor_data.get('time_in_cycles')}: {api_e}")
-                is_anomaly = False 
-                anomaly_score = -999.0 
-                logging.warning("Falling back to default anomaly status due to API failure.")
-            except Exception as e_api:
-                logging.error(f"Unexpected error during API call for unit {sensor_data.get('unit_number')}, cycle {sensor_data.get('time_in_cycles')}: {e_api}")
-                is_anomaly = False
-                anomaly_score = -999.0 
-            
-            # --- Construct the record to save to Cosmos DB ---
-            record_to_save = sensor_data.copy()
-            
-            record_to_save["id"] = f"{sensor_data.get('unit_number')}-{sensor_data.get('time_in_cycles')}-{sensor_data.get('event_timestamp')}-{sensor_data.get('message_id')}"
-            record_to_save["is_anomaly"] = is_anomaly 
-            record_to_save["anomaly_score"] = anomaly_score 
-            
-            record_to_save["unit_number"] = sensor_data.get('unit_number')
-
-            if "raw_message_id" in record_to_save: del record_to_save["raw_message_id"]
-            if "raw_data_sample" in record_to_save: del record_to_save["raw_data_sample"]
-            if "sensor_2_value" in record_to_save: del record_to_save["sensor_2_value"] 
-            
-            processed_records.append(record_to_save)
-
-            logging.info(f"Processed unit {sensor_data.get('unit_number')}, cycle {sensor_data.get('time_in_cycles')}. Anomaly from API: {is_anomaly}, Score: {anomaly_score:.4f}")
-
-            # --- Send Custom Metrics to Datadog API (from consumer) ---
-            if GLOBAL_DD_API_METRICS_URL and GLOBAL_DD_API_KEY_HEADER and http_session: # Use GLOBAL vars
-                metrics_payload = {
-                    "series": [
-                        {
-                            "metric": "iot.consumer.events_processed",
-                            "points": [[int(time.time()), 1]], 
-                            "type": "count",
-                            "tags": ["service:event_consumer", "env:local", "unit_number:{}".format(sensor_data.get('unit_number'))]
-                        },
-                        {
-                            "metric": "iot.consumer.writes_to_cosmos_db",
-                            "points": [[int(time.time()), 1]], 
-                            "type": "count",
-                            "tags": ["service:event_consumer", "env:local", "unit_number:{}".format(sensor_data.get('unit_number'))]
-                        }
-                    ]
-                }
-                headers_dd = { 
-                    "Content-Type": "application/json",
-                    "DD-API-KEY": GLOBAL_DD_API_KEY_HEADER # Use GLOBAL var
-                }
-                try:
-                    asyncio.create_task(http_session.post(GLOBAL_DD_API_METRICS_URL, headers=headers_dd, json=metrics_payload, timeout=aiohttp.ClientTimeout(total=5)))
-                    logging.info("Custom consumer metrics sent to Datadog API.")
-                except Exception as dd_e:
-                    logging.error(f"Failed to send consumer metrics to Datadog API: {dd_e}")
-            else:
-                logging.warning("Datadog API credentials or session not available for consumer. Skipping metrics send.")
+    predictions = [entry[:2] if entry is not None else None for entry in cached]
+    for i, prediction in zip(to_score, new_predictions):
+        predictions[i] = prediction
+
+    digests = {} # document id -> digest of the record being written
+    unchanged = 0
+    for sensor_data, (is_anomaly, anomaly_score), entry in zip(parsed_events, predictions, cached):
+        try:
+            record = build_record(sensor_data, is_anomaly, anomaly_score)
+            if result_cache is not None and anomaly_score != -999.0: # Never cache the API-failure fallback
+                digest = document_digest(record)
+                if entry is not None and entry[2] == digest:
+                    unchanged += 1
+                    record_consumer_metrics(sensor_data, written=False)
+                    continue
+                result_cache.put(record["id"], (is_anomaly, anomaly_score, None))
+                digests[record["id"]] = digest
+            processed_records.append(record)
+
+            if event_log.allow(record["unit_number"]):
+                logging.info(f"Processed unit {record['unit_number']}, cycle {sensor_data.get('time_in_cycles')}. Anomaly from API: {is_anomaly}, Score: {anomaly_score:.4f}")
+
+            record_consumer_metrics(sensor_data)
 
         except Exception as e:
-            logging.error(f"Error processing event: {e}. Event body: {event_body[:200]}...")
+            if event_error_log.allow():
+                logging.error(f"Error processing event: {e}. Event body: {json.dumps(sensor_data)[:200]}...")
+
+    if result_cache is not None and len(to_score) < len(parsed_events):
+        if log_batch:
+            logging.info(f"Replayed events: {len(parsed_events) - len(to_score)} of {len(parsed_events)} served from the result cache, "
+                         f"{unchanged} unchanged documents not rewritten.")
+        if metrics is not None:
+            metrics.count("iot.consumer.result_cache_hits", len(parsed_events) - len(to_score), ("service:event_consumer", "env:local"))
+            metrics.count("iot.consumer.unchanged_writes_skipped", unchanged, ("service:event_consumer", "env:local"))
     
+    # --- Spool processed records for the background flusher (COSMOS_SPOOL_DIR) ---
+    spooled = False
+    if cosmos_spool is not None and processed_records:
+        try:
+            started = time.perf_counter_ns()
+            await cosmos_spool.append(processed_records)
+            stage_timings["cosmos_write"].observe_ns(time.perf_counter_ns() - started)
+            spooled = True
+            if log_batch:
+                logging.info(f"Spooled {len(processed_records)} records for Cosmos DB ({cosmos_spool.depth_records} waiting for the flusher).")
+            # Spooled documents reach Cosmos even across a restart, so redeliveries can skip them.
+            for record in processed_records:
+                if record["id"] in digests:
+                    result_cache.put(record["id"], (record["is_anomaly"], record["anomaly_score"], digests[record["id"]]))
+        except OSError as e:
+            logging.error(f"Spooling {len(processed_records)} records failed, writing them to Cosmos DB directly: {e}")
+
     # --- Write processed records to Cosmos DB ---
-    if cosmos_container and processed_records: 
+    if cosmos_container and processed_records and not spooled: 
         try:
+            started = time.perf_counter_ns()
+            write_result = await get_cosmos_writer().write(processed_records)
+            stage_timings["cosmos_write"].observe_ns(time.perf_counter_ns() - started)
+            if write_result.failed:
+                logging.error(f"Wrote {write_result.written} of {len(processed_records)} records to Cosmos DB; {len(write_result.failed)} failed.")
+            elif log_batch:
+                logging.info(f"Successfully wrote {write_result.written} records to Cosmos DB in {write_result.batch_calls} batch calls ({write_result.retries} retries).")
+            # Only documents that are now stored can be skipped when their event is redelivered.
+            failed_ids = {record.get("id") for record, _ in write_result.failed}
             for record in processed_records:
-                await cosmos_container.upsert_item(body=record) 
-            logging.info(f"Successfully wrote {len(processed_records)} records to Cosmos DB.")
+                if record["id"] in digests and record["id"] not in failed_ids:
+                    result_cache.put(record["id"], (record["is_anomaly"], record["anomaly_score"], digests[record["id"]]))
         except Exception as e:
             logging.error(f"Error writing to Cosmos DB: {e}")
-    else:
+    elif processed_records and not spooled:
         logging.warning(f"Skipped writing {len(processed_records)} records to Cosmos DB because client or container was not initialized.")
     
-    # --- Checkpointing: Update Event Hubs offset ---
-    if events: 
-        await partition_context.update_checkpoint(events[-1]) 
+    # --- Checkpointing: Update Event Hubs offset (every CHECKPOINT_EVERY_EVENTS events / CHECKPOINT_INTERVAL_S seconds) ---
+    started = time.perf_counter_ns()
+    await checkpoint_throttle.processed(partition_context, events)
+    stage_timings["checkpoint"].observe_ns(time.perf_counter_ns() - started)
+
+class PartitionPipeline:
+    """
+    Decouples receiving from processing for one partition. The receive callback only
+    enqueues the batch, so the client can fetch the next batch while this one is scored
+    and persisted. Batches are processed (and checkpointed) strictly in arrival order;
+    a full queue blocks the callback, which applies backpressure to the receiver.
+    """
+
+    def __init__(self, partition_id, depth):
+        self.partition_id = partition_id
+        self.queue = asyncio.Queue(maxsize=depth)
+        self.worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            partition_context, events, received_ns = await self.queue.get()
+            try:
+                await process_event_batch(partition_context, events, received_ns)
+            except Exception as e:
+                logging.error(f"Error processing batch from partition {self.partition_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def close(self):
+        """Finish the batches already queued, then stop the worker."""
+        await self.queue.join()
+        self.worker.cancel()
+        await asyncio.gather(self.worker, return_exceptions=True)
+
+async def on_event_batch(partition_context, events):
+    """receive_batch callback: hands the batch to its partition's pipeline (or processes it inline)."""
+    received_ns = time.perf_counter_ns()
+    partition_id = partition_context.partition_id
+    if CONSUMER_PIPELINE_DEPTH <= 0:
+        await process_event_batch(partition_context, events, received_ns)
+    else:
+        pipeline = partition_pipelines.get(partition_id)
+        if pipeline is None:
+            pipeline = partition_pipelines[partition_id] = PartitionPipeline(partition_id, CONSUMER_PIPELINE_DEPTH)
+        await pipeline.queue.put((partition_context, events, received_ns))
+    if events: # Only once queued: a batch cancelled by a receiver restart is received again
+        received_sequence_numbers[partition_id] = events[-1].sequence_number
+
+async def on_partition_close(partition_context, reason):
+    """
+    receive_batch callback: finish a partition's queued batches when it closes. At shutdown its
+    checkpoint is flushed. When another consumer took it over, the pending checkpoint is dropped
+    and the queued batches checkpoint nothing, as the new owner may already be past them.
+    """
+    shutdown = reason.name == "SHUTDOWN" # azure.eventhub.CloseReason, or local_pipeline's stand-in
+    if not shutdown:
+        checkpoint_throttle.discard(partition_context.partition_id, partition_context)
+    pipeline = partition_pipelines.pop(partition_context.partition_id, None)
+    if pipeline is not None:
+        await pipeline.close()
+    if shutdown:
+        await checkpoint_throttle.flush(partition_context.partition_id)
+        logging.info(f"Partition {partition_context.partition_id} closed ({reason.name}).")
+
+async def close_partition_pipelines():
+    for pipeline in list(partition_pipelines.values()):
+        await pipeline.close()
+    partition_pipelines.clear()
+
+async def receive_events():
+    """
+    Runs eventhub_client.receive_batch. With batch_controller set, the receiver is restarted
+    whenever the controller's max_batch_size / max_wait_time have drifted from the running ones;
+    queued batches are finished and checkpoints flushed first, so it resumes where it stopped.
+    """
+    starting_position = "-1"
+    if batch_controller is None:
+        await eventhub_client.receive_batch(on_event_batch=on_event_batch, on_partition_close=on_partition_close,
+                                            max_batch_size=CONSUMER_BATCH_SIZE, max_wait_time=CONSUMER_MAX_WAIT_TIME_S,
+                                            starting_position="-1")
+        return
+    while True:
+        max_batch_size, max_wait_time = batch_controller.apply()
+        receive_task = asyncio.create_task(eventhub_client.receive_batch(
+            on_event_batch=on_event_batch, on_partition_close=on_partition_close, max_batch_size=max_batch_size,
+            max_wait_time=max_wait_time, starting_position=starting_position))
+        retune_task = asyncio.create_task(batch_controller.wait_for_change())
+        try:
+            await asyncio.wait((receive_task, retune_task), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            receive_task.cancel()
+            retune_task.cancel()
+            raise
+        if receive_task.done():
+            retune_task.cancel()
+            return receive_task.result() # The receiver stopped (or failed) on its own
+        receive_task.cancel()
+        await asyncio.gather(receive_task, return_exceptions=True)
+        await close_partition_pipelines()
+        await checkpoint_throttle.flush()
+        if checkpoint_store is None:
+            # No store to resume from: continue after the last event received (sequence numbers are exclusive).
+            # Partitions missing from the dict would start at the latest event, so every partition is listed.
+            starting_position = {partition_id: received_sequence_numbers.get(partition_id, "-1")
+                                 for partition_id in await eventhub_client.get_partition_ids()}
+        logging.info(f"Restarting the receiver with max_batch_size={batch_controller.batch_size}, max_wait_time={batch_controller.max_wait_time}s "
+                     f"(model call latency {batch_controller.stats()['batch_latency_ms']} ms per batch).")
+
+async def report_spool_periodically(interval_s):
+    """Background task: log the spool's depth and drain rate, and send them to Datadog, every `interval_s` seconds."""
+    drained, dead_lettered, last = cosmos_spool.drained_records, cosmos_spool.dead_lettered, time.monotonic()
+    while True:
+        await asyncio.sleep(interval_s)
+        stats, now = cosmos_spool.stats(), time.monotonic()
+        drain_rate = (stats["drained"] - drained) / (now - last)
+        if stats["depth_records"] or drain_rate:
+            logging.info(f"Cosmos spool: {stats['depth_records']} records ({stats['depth_bytes'] / 1e6:.1f} MB) waiting, "
+                         f"draining {drain_rate:.0f} records/s; {stats}")
+        if metrics is not None:
+            tags = ("service:event_consumer", "env:local")
+            metrics.gauge("iot.consumer.spool_depth_records", stats["depth_records"], tags)
+            metrics.gauge("iot.consumer.spool_depth_bytes", stats["depth_bytes"], tags)
+            metrics.gauge("iot.consumer.spool_drain_rate", drain_rate, tags)
+            metrics.count("iot.consumer.spool_dead_lettered", stats["dead_lettered"] - dead_lettered, tags)
+        drained, dead_lettered, last = stats["drained"], stats["dead_lettered"], now
 
 async def main():
     """Main function to run the Event Hubs consumer."""
@@ -235,6 +781,7 @@ async def main():
     local_consumer_group = os.getenv("EVENT_HUB_CONSUMER_GROUP", "$Default")
 
     local_ml_endpoint_url = os.getenv("ML_ENDPOINT_URL")
+    local_ml_batch_endpoint_url = os.getenv("ML_BATCH_ENDPOINT_URL")
 
     if not await initialize_clients():
         logging.critical("Client initialization failed. Exiting main.")
@@ -244,22 +791,127 @@ async def main():
         logging.critical("Event Hub client not available after initialization. Exiting.")
         return
 
+    if SCORING_MODE == "local" and not load_scoring_engine():
+        return
+
+    global metrics, feature_engine, result_cache, batch_controller, cosmos_spool
+    if GLOBAL_DD_API_METRICS_URL and GLOBAL_DD_API_KEY_HEADER:
+        metrics = MetricsAggregator(http_session, GLOBAL_DD_API_METRICS_URL, GLOBAL_DD_API_KEY_HEADER,
+                                    flush_interval_s=float(os.getenv("DD_FLUSH_INTERVAL_S", "10")))
+        metrics.start()
+
+    # Models trained on rolling features need them computed here when scoring in-process.
+    model_uses_rolling = scoring_engine is not None and any(
+        name.endswith(tuple(f"_{stat}" for stat in ROLLING_STATS)) for name in scoring_engine.feature_names)
+    feature_engine = engine_from_env(enabled_default=model_uses_rolling)
+    rolling_snapshot_task = None
+    result_cache = cache_from_env()
+    if result_cache is not None:
+        logging.info(f"Result cache enabled for redelivered events (up to {result_cache.max_entries} entries, TTL {result_cache.ttl_s}s).")
+    if feature_engine is not None:
+        restore_if_present(feature_engine, ROLLING_STATE_PATH)
+        logging.info(f"Rolling features enabled (window {feature_engine.window}, up to {feature_engine.max_units} units).")
+        if ROLLING_STATE_PATH:
+            rolling_snapshot_task = asyncio.create_task(snapshot_periodically(feature_engine, ROLLING_STATE_PATH, ROLLING_SNAPSHOT_INTERVAL_S))
+
+    spool_flusher_task = spool_report_task = None
+    if cosmos_container is not None:
+        try:
+            cosmos_spool = spool_from_env()
+        except (OSError, ValueError) as e:
+            logging.critical(f"Cosmos spool could not be opened: {e}")
+            return
+    if cosmos_spool is not None:
+        spool_flusher_task = asyncio.create_task(cosmos_spool.run_flusher(get_cosmos_writer()))
+        if COSMOS_SPOOL_REPORT_INTERVAL_S > 0:
+            spool_report_task = asyncio.create_task(report_spool_periodically(COSMOS_SPOOL_REPORT_INTERVAL_S))
+        if cosmos_spool.fsync == "checkpoint":
+            checkpoint_throttle.before_checkpoint = cosmos_spool.sync
+        logging.info(f"Records are spooled in '{cosmos_spool.directory}' (fsync: {cosmos_spool.fsync}, up to "
+                     f"{cosmos_spool.max_bytes} bytes) and written to Cosmos DB in the background.")
+
+    if CONSUMER_ADAPTIVE_BATCHING:
+        batch_controller = AdaptiveBatchController(
+            batch_size=CONSUMER_BATCH_SIZE, max_wait_time=CONSUMER_MAX_WAIT_TIME_S,
+            min_batch_size=CONSUMER_MIN_BATCH_SIZE, max_batch_size=CONSUMER_MAX_BATCH_SIZE,
+            target_latency_s=CONSUMER_TARGET_BATCH_LATENCY_S, retune_interval_s=CONSUMER_RETUNE_INTERVAL_S)
+        logging.info(f"Adaptive receive batching enabled ({CONSUMER_MIN_BATCH_SIZE}-{CONSUMER_MAX_BATCH_SIZE} events, "
+                     f"target model call latency {CONSUMER_TARGET_BATCH_LATENCY_S}s per batch).")
+
+    stage_report_task = asyncio.create_task(stage_metrics.report_periodically())
+    metrics_server = None
+    if CONSUMER_METRICS_PORT:
+        try:
+            metrics_server = stage_metrics.start_http_server(CONSUMER_METRICS_PORT)
+            logging.info(f"Stage latency metrics served at http://0.0.0.0:{CONSUMER_METRICS_PORT}/metrics.")
+        except OSError as e:
+            logging.warning(f"Could not serve stage metrics on port {CONSUMER_METRICS_PORT}: {e}")
+
     async with eventhub_client:
         logging.info(f"Starting to receive events from Event Hub '{local_event_hub_name}' consumer group '$Default'...") # Use $Default as defined
-        if local_ml_endpoint_url: 
+        if SCORING_MODE == "local":
+            logging.info(f"Anomaly predictions will be computed in-process from '{MODEL_DIR}'.")
+        elif local_ml_endpoint_url: 
             logging.info(f"Anomaly predictions will be obtained from ML Endpoint: {local_ml_endpoint_url}")
+            if local_ml_batch_endpoint_url:
+                logging.info(f"Event batches will be scored in one call via ML Batch Endpoint: {local_ml_batch_endpoint_url}")
         else:
             logging.warning("ML_ENDPOINT_URL not set in .env. Anomaly prediction via API will be skipped.")
 
         try:
-            await eventhub_client.receive_batch(
-                on_event_batch=process_event_batch,
-                max_batch_size=100, 
-                max_wait_time=5,    
-                starting_position="-1", 
-            )
+            await receive_events()
         except Exception as e:
             logging.critical(f"CRITICAL ERROR during event reception: {e}")
+        finally:
+            await close_partition_pipelines()
+            await checkpoint_throttle.flush()
+            logging.info(f"{checkpoint_throttle.checkpoints_written} checkpoints written.")
+            if cosmos_spool is not None:
+                if spool_report_task:
+                    spool_report_task.cancel()
+                await cosmos_spool.close(spool_flusher_task, COSMOS_SPOOL_SHUTDOWN_DRAIN_S)
+                logging.info(f"Cosmos spool: {cosmos_spool.stats()}")
+            if rolling_snapshot_task:
+                rolling_snapshot_task.cancel()
+            stage_report_task.cancel()
+            logging.info(f"Stage latencies: {stage_metrics.summary()}")
+            if SCORING_MODE == "http":
+                logging.info(f"model_api circuit: {model_api_breaker.stats()}, retries: {model_api_retry_budget.stats()}")
+            if batch_controller is not None:
+                logging.info(f"Adaptive batching: {batch_controller.stats()}")
+            if metrics_server is not None:
+                metrics_server.shutdown()
+            if feature_engine is not None and ROLLING_STATE_PATH:
+                n_units = feature_engine.snapshot(ROLLING_STATE_PATH)
+                logging.info(f"Rolling feature state for {n_units} units saved to '{ROLLING_STATE_PATH}'.")
+            if result_cache is not None:
+                logging.info(f"Result cache: {result_cache.stats()}")
+            if metrics:
+                await metrics.close()
+                logging.info(f"Datadog metrics aggregator flushed and stopped: {metrics.stats()}")
+
+stop_task = None # eventhub_client.close() scheduled by request_stop()
+
+def request_stop():
+    """Stop receiving (SIGTERM under consumer_supervisor.py): main() then shuts down as at the end of the stream."""
+    global stop_task
+    if eventhub_client is not None and stop_task is None:
+        stop_task = asyncio.get_running_loop().create_task(eventhub_client.close())
+
+async def close_clients():
+    if eventhub_client:
+        logging.info("Closing Event Hub Consumer Client...")
+        await eventhub_client.close()
+    if cosmos_client:
+        logging.info("Closing Cosmos DB Client...")
+        await cosmos_client.close()
+    if checkpoint_store:
+        closed = checkpoint_store.close()
+        if asyncio.iscoroutine(closed): # BlobCheckpointStore
+            await closed
+    if http_session:
+        logging.info("Closing aiohttp ClientSession...")
+        await http_session.close()
 
 # --- Entry Point for Script Execution ---
 if __name__ == "__main__":
@@ -272,14 +924,4 @@ if __name__ == "__main__":
         logging.critical(f"Unhandled exception in main execution: {e}")
     finally:
         logging.info("Shutting down clients.")
-        async def close_clients_async():
-            if eventhub_client:
-                logging.info("Closing Event Hub Consumer Client...")
-                await eventhub_client.close()
-            if cosmos_client:
-                logging.info("Closing Cosmos DB Client...")
-                await cosmos_client.close()
-            if http_session: 
-                logging.info("Closing aiohttp ClientSession...")
-                await http_session.close()
-        asyncio.run(close_clients_async())
\ No newline at end of file
+        asyncio.run(close_clients())
\ No newline at end of file
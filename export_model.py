@@ -0,0 +1,76 @@
+# export_model.py
+# Export trained artifacts (anomaly_model.pkl, scaler.pkl, scaled_feature_names.json) to the
+# compact engine file read by inference_engine.py, so serving processes start without
+# unpickling the model or importing sklearn.
+#
+# The file holds the flattened forest and scaler, the feature names, the model version, and
+# a few rows scored by sklearn at export time; loaders check the engine against those rows.
+#
+# Usage:
+#   python export_model.py [MODEL_DIR ...]     (default: $MODEL_DIR or ./models)
+import argparse
+import logging
+import os
+import sys
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+
+from inference_engine import ENGINE_FILE, IsolationForestEngine, flatten_estimators, load_engine, save_engine_file
+from model_store import ARTIFACT_FILES, artifact_fingerprint, synthetic_rows, validate_artifacts, version_of
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+REFERENCE_ROWS = 64
+
+def export_model(model_dir, out_path=None):
+    """Write ENGINE_FILE for the pickled artifacts in `model_dir`; returns its path."""
+    import sklearn
+
+    out_path = out_path or os.path.join(model_dir, ENGINE_FILE)
+    _, model, scaler, feature_names = load_engine(model_dir, artifact_format="pickle")
+    validate_artifacts(model, scaler, feature_names)
+
+    arrays = flatten_estimators(model, scaler, feature_names)
+    arrays["reference_rows"] = synthetic_rows(scaler, REFERENCE_ROWS)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore") # Estimators fitted on DataFrames warn about unnamed arrays
+        arrays["reference_scores"] = model.decision_function(scaler.transform(arrays["reference_rows"]))
+
+    fingerprint = artifact_fingerprint(model_dir, ARTIFACT_FILES)
+    metadata = {
+        "model_version": version_of(model_dir, os.path.basename(os.path.abspath(model_dir))),
+        "source_fingerprint": fingerprint,
+        "sklearn_version": sklearn.__version__,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+    }
+    size = save_engine_file(out_path, arrays, feature_names, metadata)
+
+    # Read the file back the way the services will and check it against sklearn.
+    exported = IsolationForestEngine.from_file(out_path)
+    max_diff = float(np.max(np.abs(exported.score(exported.reference_rows)[0] - exported.reference_scores)))
+    if max_diff > 1e-9:
+        os.remove(out_path)
+        raise ValueError(f"Exported engine differs from sklearn by up to {max_diff:.2e}; removed {out_path}.")
+
+    pickled_size = sum(os.path.getsize(os.path.join(model_dir, name)) for name in ARTIFACT_FILES)
+    logging.info(f"Exported {model_dir} ({exported.n_trees} trees, {len(exported.feature)} nodes) to {out_path}: "
+                 f"{size / 1e6:.2f} MB (pickled artifacts {pickled_size / 1e6:.2f} MB).")
+    return out_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model artifacts to the compact engine file.")
+    parser.add_argument("model_dirs", nargs="*", default=[os.getenv("MODEL_DIR", "models")])
+    args = parser.parse_args()
+    failed = False
+    for model_dir in args.model_dirs:
+        try:
+            export_model(model_dir)
+        except Exception as e:
+            logging.error(f"Export of {model_dir} failed: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# feature_engine.py
+# Incremental per-unit rolling-window features for streaming inference.
+#
+# Degradation shows up as a trend across cycles, which a single reading cannot capture.
+# RollingFeatureEngine keeps, for each unit_number, a fixed-size ring buffer of the last
+# `window` readings plus running sums, so every new reading updates the rolling mean,
+# standard deviation, least-squares slope and EWMA of each tracked sensor in O(1) per
+# sensor. The slope is regressed on the reading's position in the window, so it is the
+# change per reading; that is the change per cycle only while cycles arrive one apart
+# (repeated and late cycles are dropped, skipped ones are not filled in). Units are kept in LRU
+# order and the least recently seen unit is evicted beyond `max_units`, so memory stays
+# bounded with thousands of engines. State can be snapshotted to a single .npz file and
+# restored after a restart.
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SENSOR_FEATURES = [f'sensor_{i}' for i in range(1, 22)]
+ROLLING_STATS = ("roll_mean", "roll_std", "roll_slope", "ewma")
+SNAPSHOT_FORMAT_VERSION = 1
+
+def rolling_feature_names(base_features, stats=ROLLING_STATS):
+    """Output names, stat-major: all '<sensor>_roll_mean', then '_roll_std', '_roll_slope', '_ewma'."""
+    return [f"{name}_{stat}" for stat in stats for name in base_features]
+
+def uses_rolling_features(feature_names):
+    """True when a model's feature list contains rolling outputs such as '<sensor>_roll_mean'."""
+    return any(name.endswith(tuple(f"_{stat}" for stat in ROLLING_STATS)) for name in feature_names)
+
+class _UnitState:
+    __slots__ = ("buffer", "count", "head", "shift", "sum_y", "sum_y2", "sum_xy", "ewma", "last_cycle", "since_resync")
+
+    def __init__(self, window, n_features):
+        self.buffer = np.zeros((window, n_features))
+        self.count = 0 # Readings in the window (<= window)
+        self.head = 0 # Slot the next reading goes to; the oldest reading once the window is full
+        # Sums are over (reading - shift), with shift near the window mean, so the variance
+        # does not lose precision to cancellation on large readings with a small spread.
+        self.shift = np.zeros(n_features)
+        self.sum_y = np.zeros(n_features)
+        self.sum_y2 = np.zeros(n_features)
+        self.sum_xy = np.zeros(n_features) # x = position in the window, 0 = oldest
+        self.ewma = np.zeros(n_features)
+        self.last_cycle = np.nan
+        self.since_resync = 0
+
+class RollingFeatureEngine:
+    """
+    Thread-safe store of per-unit rolling statistics, keyed by unit_number. The slope is per
+    reading (x = 0..n-1 over the window), not per time_in_cycles.
+    """
+
+    def __init__(self, base_features=SENSOR_FEATURES, window=30, ewma_alpha=0.2, max_units=10000):
+        if window < 2:
+            raise ValueError("window must be at least 2 readings.")
+        self.base_features = list(base_features)
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+        self.max_units = max_units
+        self.feature_names = rolling_feature_names(self.base_features)
+        self.units = OrderedDict() # unit_number -> _UnitState, least recently updated first
+        self.evictions = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self._lock = threading.Lock()
+
+    def update(self, unit, values, cycle=None):
+        """
+        Add one reading (values ordered like base_features) and return the unit's rolling
+        features as an array ordered like feature_names. A repeated cycle (redelivery) or a lower
+        one (a late or replayed reading) leaves the state unchanged, unless the cycle restarts at 1
+        or drops by at least a window: that starts a new run for the unit.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        with self._lock:
+            state = self.units.get(unit)
+            if state is not None and cycle is not None and not np.isnan(state.last_cycle):
+                if cycle < state.last_cycle and (cycle <= 1 or state.last_cycle - cycle >= self.window):
+                    state = None
+                elif cycle <= state.last_cycle:
+                    if cycle == state.last_cycle:
+                        self.duplicates += 1
+                    else:
+                        self.out_of_order += 1
+                    self.units.move_to_end(unit)
+                    return self._features(state)
+            if state is None:
+                state = _UnitState(self.window, len(self.base_features))
+                self.units[unit] = state
+                if len(self.units) > self.max_units:
+                    self.units.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self.units.move_to_end(unit)
+            self._push(state, values)
+            if cycle is not None:
+                state.last_cycle = cycle
+            return self._features(state)
+
+    def update_record(self, record):
+        """update() from a reading dict (unit_number, time_in_cycles, sensors); returns {feature name: value}."""
+        values = [record.get(name, np.nan) for name in self.base_features]
+        features = self.update(record.get('unit_number'), values, record.get('time_in_cycles'))
+        return dict(zip(self.feature_names, features.tolist()))
+
+    def features(self, unit):
+        """Current rolling features of a unit as {feature name: value}, or None for an unknown unit."""
+        with self._lock:
+            state = self.units.get(unit)
+            if state is None:
+                return None
+            return dict(zip(self.feature_names, self._features(state).tolist()))
+
+    def _push(self, state, value):
+        n = state.count
+        if n == 0:
+            state.shift = value.copy()
+        y = value - state.shift
+        if n < self.window:
+            state.sum_xy += n * y
+            state.sum_y += y
+            state.sum_y2 += y * y
+            state.count += 1
+        else:
+            # Drop the oldest reading (x = 0) and shift every other x down by one, then append at x = n - 1.
+            y_old = state.buffer[state.head] - state.shift
+            state.sum_xy += (n - 1) * y - (state.sum_y - y_old)
+            state.sum_y += y - y_old
+            state.sum_y2 += y * y - y_old * y_old
+        state.buffer[state.head] = value
+        state.head = (state.head + 1) % self.window
+        state.ewma = value.copy() if n == 0 else self.ewma_alpha * value + (1.0 - self.ewma_alpha) * state.ewma
+        # Running sums drift slowly in floating point; recompute them exactly once per window (amortized O(1)).
+        state.since_resync += 1
+        if state.since_resync >= self.window:
+            self._resync(state)
+
+    def _ordered_window(self, state):
+        if state.count < self.window:
+            return state.buffer[:state.count]
+        return np.concatenate((state.buffer[state.head:], state.buffer[:state.head]))
+
+    def _resync(self, state):
+        window = self._ordered_window(state)
+        state.shift = window.mean(axis=0)
+        ys = window - state.shift
+        x = np.arange(len(ys), dtype=np.float64)
+        state.sum_y = ys.sum(axis=0)
+        state.sum_y2 = (ys * ys).sum(axis=0)
+        state.sum_xy = x @ ys
+        state.since_resync = 0
+
+    def _features(self, state):
+        n = state.count
+        centered_mean = state.sum_y / n
+        mean = state.shift + centered_mean
+        std = np.sqrt(np.maximum(state.sum_y2 / n - centered_mean * centered_mean, 0.0))
+        if n > 1:
+            sum_x = n * (n - 1) / 2.0
+            sum_x2 = (n - 1) * n * (2 * n - 1) / 6.0
+            slope = (n * state.sum_xy - sum_x * state.sum_y) / (n * sum_x2 - sum_x * sum_x)
+        else:
+            slope = np.zeros_like(mean)
+        return np.concatenate((mean, std, slope, state.ewma))
+
+    def stats(self):
+        return {"units": len(self.units), "evictions": self.evictions, "duplicates": self.duplicates,
+                "out_of_order": self.out_of_order}
+
+    # --- Snapshot / Restore ---
+    def snapshot(self, path):
+        """Write all unit states to `path` (.npz) atomically; returns the number of units saved."""
+        with self._lock:
+            states = list(self.units.items())
+            n_units, n_features = len(states), len(self.base_features)
+            arrays = {
+                "format_version": np.array(SNAPSHOT_FORMAT_VERSION),
+                "base_features": np.array(self.base_features),
+                "window": np.array(self.window),
+                "ewma_alpha": np.array(self.ewma_alpha),
+                "units": np.array([unit for unit, _ in states], dtype=np.float64),
+                "buffer": np.zeros((n_units, self.window, n_features)),
+                "count": np.zeros(n_units, dtype=np.int64),
+                "head": np.zeros(n_units, dtype=np.int64),
+                "ewma": np.zeros((n_units, n_features)),
+                "last_cycle": np.zeros(n_units),
+            }
+            for i, (_, state) in enumerate(states):
+                arrays["buffer"][i] = state.buffer
+                arrays["count"][i] = state.count
+                arrays["head"][i] = state.head
+                arrays["ewma"][i] = state.ewma
+                arrays["last_cycle"][i] = state.last_cycle
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        return n_units
+
+    def restore(self, path):
+        """Replace the current state with a snapshot written by snapshot(); returns the number of units loaded."""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["format_version"]) != SNAPSHOT_FORMAT_VERSION:
+                raise ValueError(f"Unsupported feature snapshot format {int(data['format_version'])}.")
+            if list(data["base_features"]) != self.base_features or int(data["window"]) != self.window:
+                raise ValueError("Feature snapshot was taken with different sensors or window size.")
+            units = OrderedDict()
+            for i, unit in enumerate(data["units"].tolist()):
+                state = _UnitState(self.window, len(self.base_features))
+                state.buffer[:] = data["buffer"][i]
+                state.count = int(data["count"][i])
+                state.head = int(data["head"][i])
+                state.ewma = data["ewma"][i].copy()
+                state.last_cycle = float(data["last_cycle"][i])
+                self._resync(state)
+                units[unit] = state
+        while len(units) > self.max_units:
+            units.popitem(last=False)
+        with self._lock:
+            self.units = units
+        return len(units)
+
+def enabled_from_env(enabled_default=False):
+    return os.getenv("ROLLING_FEATURES_ENABLED", "true" if enabled_default else "false").lower() in ("1", "true", "yes")
+
+def engine_from_env(enabled_default=False):
+    """RollingFeatureEngine configured from ROLLING_* environment variables, or None when disabled."""
+    if not enabled_from_env(enabled_default):
+        return None
+    return RollingFeatureEngine(window=int(os.getenv("ROLLING_WINDOW", "30")),
+                                ewma_alpha=float(os.getenv("ROLLING_EWMA_ALPHA", "0.2")),
+                                max_units=int(os.getenv("ROLLING_MAX_UNITS", "10000")))
+
+def restore_if_present(engine, path):
+    """Best-effort restore at startup: a missing or incompatible snapshot starts from empty state."""
+    if not path or not os.path.exists(path):
+        return 0
+    try:
+        n_units = engine.restore(path)
+        logging.info(f"Restored rolling feature state for {n_units} units from '{path}'.")
+        return n_units
+    except Exception as e:
+        logging.warning(f"Could not restore rolling feature state from '{path}': {e}. Starting empty.")
+        return 0
+
+async def snapshot_periodically(engine, path, interval_s):
+    """Background task: snapshot `engine` to `path` every `interval_s` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            await asyncio.to_thread(engine.snapshot, path)
+        except Exception as e:
+            logging.error(f"Rolling feature snapshot to '{path}' failed: {e}")
@@ -0,0 +1,356 @@
+# inference_engine.py
+# Array-backed IsolationForest + MinMaxScaler inference shared by model_api.py and score.py.
+#
+# At load time the fitted sklearn objects are flattened into a handful of contiguous
+# NumPy arrays (one node table for all trees). Scoring a matrix then costs one affine
+# transform plus `max_depth` vectorized gathers, and yields both the decision_function()
+# score and the predict() label in a single pass over the forest.
+#
+# The flattened arrays can also be exported (export_model.py) to a single compact file,
+# ENGINE_FILE, which loads by memory-mapping without importing joblib or sklearn.
+import hashlib
+import os
+import json
+import logging
+
+import numpy as np
+
+# Number of rows traversed at once; bounds the (rows x trees) node-index scratch array.
+SCORE_CHUNK_ROWS = 4096
+
+# Compact engine file: ENGINE_MAGIC, a little-endian uint64 header length, a JSON header
+# (format version, feature names, scalars, metadata and the dtype/shape/offset of every
+# array), then the raw arrays, each aligned to ENGINE_ALIGNMENT bytes.
+ENGINE_FILE = "anomaly_engine.bin"
+ENGINE_MAGIC = b"IFENGINE"
+ENGINE_FORMAT_VERSION = 1
+ENGINE_ALIGNMENT = 64
+ENGINE_ARRAY_DTYPES = {"roots": "<i4", "feature": "<i4", "children": "<i4", "threshold": "<f8",
+                       "leaf_value": "<f8", "scale": "<f8", "bias": "<f8",
+                       "reference_rows": "<f8", "reference_scores": "<f8"}
+ENGINE_SCALARS = ("max_depth", "denominator", "offset")
+# Pickled artifacts the engine is flattened from (as written by the training notebook / train_model.py).
+ARTIFACT_FILES = ("anomaly_model.pkl", "scaler.pkl", "scaled_feature_names.json")
+
+def average_path_length(n_samples):
+    """Average path length of an unsuccessful BST search (same as sklearn's _average_path_length)."""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n_samples)
+    mask_2 = n_samples == 2
+    mask_big = n_samples > 2
+    result[mask_2] = 1.0
+    n = n_samples[mask_big]
+    result[mask_big] = 2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n
+    return result
+
+def _floor_to_float32(values):
+    """Largest float32 <= each float64 value, so `x32 <= t32` matches sklearn's `x32 <= t64`."""
+    values32 = values.astype(np.float32)
+    too_big = values32.astype(np.float64) > values
+    values32[too_big] = np.nextafter(values32[too_big], np.float32(-np.inf))
+    return values32
+
+class IsolationForestEngine:
+    """
+    Flattened IsolationForest with the MinMaxScaler folded in.
+
+    All trees share one node table: `feature`, `threshold`, `children` (left/right) and
+    `leaf_value` (depth + average path length of the leaf, i.e. sklearn's per-leaf
+    contribution). Leaves point to themselves, so every row can take exactly
+    `max_depth` steps without branching on leaf-ness.
+    """
+
+    def __init__(self, arrays, feature_names, dtype=np.float64, metadata=None):
+        self.feature_names = list(feature_names)
+        self.metadata = dict(metadata or {})
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f"Unsupported engine dtype: {self.dtype}")
+
+        self.roots = np.ascontiguousarray(arrays["roots"], dtype=np.int32)
+        self.feature = np.ascontiguousarray(arrays["feature"], dtype=np.int32)
+        self.children = np.ascontiguousarray(arrays["children"], dtype=np.int32)
+        self.max_depth = int(arrays["max_depth"])
+        self.denominator = float(arrays["denominator"])
+        self.offset = float(arrays["offset"])
+
+        # sklearn compares float32 inputs against float64 thresholds. In float64 mode we
+        # keep that exactly; in float32 mode thresholds are rounded *down* so that the
+        # comparison outcome for any float32 input is unchanged.
+        if self.dtype == np.float32:
+            self.threshold = _floor_to_float32(np.asarray(arrays["threshold"], dtype=np.float64))
+        else:
+            self.threshold = np.ascontiguousarray(arrays["threshold"], dtype=np.float64)
+        self.leaf_value = np.ascontiguousarray(arrays["leaf_value"], dtype=self.dtype)
+        # The affine step stays in float64 in both modes: it is cheap, and rounding the
+        # scaled values differently from sklearn would flip comparisons near thresholds.
+        self.scale = np.ascontiguousarray(arrays["scale"], dtype=np.float64)
+        self.bias = np.ascontiguousarray(arrays["bias"], dtype=np.float64)
+
+        self.n_features = len(self.feature_names)
+        self.n_trees = len(self.roots)
+
+        # Rows scored by sklearn at export time, kept in engine files to verify a load.
+        self.reference_rows = arrays.get("reference_rows")
+        self.reference_scores = arrays.get("reference_scores")
+
+    @classmethod
+    def from_estimators(cls, model, scaler, feature_names, dtype=np.float64):
+        """Flatten a fitted IsolationForest and MinMaxScaler (duck-typed, no sklearn import)."""
+        return cls(flatten_estimators(model, scaler, feature_names), feature_names, dtype=dtype)
+
+    @classmethod
+    def from_file(cls, path, dtype=np.float64):
+        """Load an engine file written by save_engine_file(); node tables stay memory-mapped."""
+        header, arrays = read_engine_file(path)
+        return cls(arrays, header["feature_names"], dtype=dtype, metadata=header.get("metadata"))
+
+    def _path_lengths(self, scaled):
+        """Sum over trees of the per-leaf path length for each row of a scaled matrix."""
+        n_rows = scaled.shape[0]
+        flat = scaled.reshape(-1)
+        row_base = (np.arange(n_rows, dtype=np.int64) * self.n_features)[:, None]
+        nodes = np.broadcast_to(self.roots, (n_rows, self.n_trees))
+        for _ in range(self.max_depth):
+            go_right = flat[row_base + self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children[nodes, go_right.view(np.int8)]
+        return self.leaf_value[nodes].sum(axis=1, dtype=np.float64)
+
+    def _as_rows(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}.")
+        return X
+
+    def _scaled(self, X):
+        # sklearn's trees see the scaled matrix cast to float32.
+        return (X * self.scale + self.bias).astype(np.float32)
+
+    def _scores(self, depths):
+        if self.denominator != 0:
+            anomaly_scores = -np.exp2(-depths / self.denominator) - self.offset
+        else:
+            anomaly_scores = np.full(depths.shape[0], -1.0 - self.offset)
+        return anomaly_scores, anomaly_scores < 0
+
+    def score(self, X):
+        """
+        Score raw (unscaled) feature rows ordered like `feature_names`.
+        Returns (anomaly_scores, is_anomaly): decision_function() values and the
+        boolean equivalent of predict() == -1.
+        """
+        X = self._as_rows(X)
+        depths = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], SCORE_CHUNK_ROWS):
+            depths[start:start + SCORE_CHUNK_ROWS] = self._path_lengths(self._scaled(X[start:start + SCORE_CHUNK_ROWS]))
+        return self._scores(depths)
+
+    def transform(self, X):
+        """The first half of score(): raw feature rows scaled to the float32 matrix the trees compare."""
+        return self._scaled(self._as_rows(X))
+
+    def score_transformed(self, scaled):
+        """The second half of score(): (anomaly_scores, is_anomaly) of rows returned by transform()."""
+        depths = np.empty(scaled.shape[0], dtype=np.float64)
+        for start in range(0, scaled.shape[0], SCORE_CHUNK_ROWS):
+            depths[start:start + SCORE_CHUNK_ROWS] = self._path_lengths(scaled[start:start + SCORE_CHUNK_ROWS])
+        return self._scores(depths)
+
+def flatten_estimators(model, scaler, feature_names):
+    """The engine arrays of a fitted IsolationForest and MinMaxScaler (duck-typed, no sklearn import)."""
+    n_features = len(feature_names)
+    if getattr(model, "n_features_in_", n_features) != n_features:
+        raise ValueError(f"Model expects {model.n_features_in_} features, feature list has {n_features}.")
+
+    # When every feature is used, sklearn fits the trees on X directly and ignores
+    # estimators_features_; otherwise tree feature ids index into that subset.
+    subsample_features = getattr(model, "_max_features", n_features) != n_features
+
+    features, thresholds, children, leaf_values, roots = [], [], [], [], []
+    node_offset = 0
+    max_depth = 0
+    for estimator, estimator_features in zip(model.estimators_, model.estimators_features_):
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        left = tree.children_left.astype(np.int64)
+        right = tree.children_right.astype(np.int64)
+        is_leaf = left == -1
+
+        # Node depths (root = 0); children always have larger ids than their parent.
+        depth = np.zeros(n_nodes, dtype=np.int64)
+        for node in range(n_nodes):
+            if not is_leaf[node]:
+                depth[left[node]] = depth[node] + 1
+                depth[right[node]] = depth[node] + 1
+        max_depth = max(max_depth, int(depth.max()))
+
+        tree_feature = tree.feature.astype(np.int64)
+        if subsample_features:
+            tree_feature = np.where(is_leaf, 0, np.asarray(estimator_features)[np.maximum(tree_feature, 0)])
+        tree_feature = np.where(is_leaf, 0, tree_feature)
+
+        node_ids = np.arange(n_nodes)
+        left = np.where(is_leaf, node_ids, left) + node_offset
+        right = np.where(is_leaf, node_ids, right) + node_offset
+
+        leaf_value = np.where(is_leaf, depth + average_path_length(tree.n_node_samples), 0.0)
+
+        features.append(tree_feature)
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        children.append(np.stack([left, right], axis=1))
+        leaf_values.append(leaf_value)
+        roots.append(node_offset)
+        node_offset += n_nodes
+
+    arrays = {
+        "roots": np.asarray(roots),
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "children": np.concatenate(children),
+        "leaf_value": np.concatenate(leaf_values),
+        "max_depth": max_depth,
+        "denominator": len(model.estimators_) * float(average_path_length([model.max_samples_])[0]),
+        "offset": float(model.offset_),
+        # MinMaxScaler.transform(X) == X * scale_ + min_
+        "scale": np.asarray(scaler.scale_, dtype=np.float64),
+        "bias": np.asarray(scaler.min_, dtype=np.float64),
+    }
+    return arrays
+
+# --- Compact Engine File ---
+def _aligned(n):
+    return -(-n // ENGINE_ALIGNMENT) * ENGINE_ALIGNMENT
+
+def save_engine_file(path, arrays, feature_names, metadata=None):
+    """
+    Write engine arrays (from flatten_estimators, optionally with reference_rows/reference_scores)
+    to `path` as one ENGINE_FILE, atomically. Returns the file size in bytes.
+    """
+    blobs, layout, offset = [], {}, 0
+    for name, dtype in ENGINE_ARRAY_DTYPES.items():
+        if name not in arrays:
+            continue
+        array = np.ascontiguousarray(arrays[name], dtype=dtype)
+        layout[name] = {"dtype": dtype, "shape": list(array.shape), "offset": offset}
+        blobs.append(array)
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({
+        "format_version": ENGINE_FORMAT_VERSION,
+        "feature_names": list(feature_names),
+        "scalars": {name: arrays[name] for name in ENGINE_SCALARS},
+        "metadata": metadata or {},
+        "arrays": layout,
+    }).encode()
+    # Array offsets in the header are relative to the data section, which starts aligned.
+    data_start = _aligned(len(ENGINE_MAGIC) + 8 + len(header))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(ENGINE_MAGIC + len(header).to_bytes(8, "little") + header)
+        for blob, spec in zip(blobs, layout.values()):
+            f.seek(data_start + spec["offset"])
+            f.write(blob.tobytes())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(ENGINE_MAGIC)) != ENGINE_MAGIC:
+            raise ValueError(f"{path} is not an engine file.")
+        header_size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_size))
+    if header.get("format_version") != ENGINE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported engine file format {header.get('format_version')} in {path}.")
+    return header, _aligned(len(ENGINE_MAGIC) + 8 + header_size)
+
+def read_engine_header(path):
+    """The JSON header of an ENGINE_FILE (no array data is read)."""
+    return _read_header(path)[0]
+
+def artifact_fingerprint(path, names=ARTIFACT_FILES + (ENGINE_FILE,)):
+    """Short hash of the artifacts' sizes and mtimes; changes whenever a file is replaced."""
+    digest = hashlib.sha1()
+    for name in names:
+        if not os.path.isfile(os.path.join(path, name)):
+            continue
+        stat = os.stat(os.path.join(path, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:12]
+
+def engine_is_stale(path):
+    """
+    True when `path` holds both ENGINE_FILE and the pickled artifacts, and the engine was not
+    exported from these pickles (they were replaced after export_model.py ran).
+    """
+    engine_path = os.path.join(path, ENGINE_FILE)
+    if not os.path.isfile(engine_path) or not all(os.path.isfile(os.path.join(path, name)) for name in ARTIFACT_FILES):
+        return False
+    source = read_engine_header(engine_path).get("metadata", {}).get("source_fingerprint")
+    return source != artifact_fingerprint(path, ARTIFACT_FILES)
+
+def read_engine_file(path):
+    """Returns (header, arrays) of an ENGINE_FILE, with the arrays as read-only views of one memory map."""
+    header, data_start = _read_header(path)
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = dict(header["scalars"])
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        start = data_start + spec["offset"]
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = mapped[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+    return header, arrays
+
+def records_to_matrix(records, feature_names):
+    """
+    Feature matrix (float64, rows ordered like `records`) from reading dicts, plus a boolean
+    mask of rows whose features were all present and numeric. Invalid rows are zero-filled
+    so the caller can score `matrix[valid]` and report the rest.
+    """
+    matrix = np.zeros((len(records), len(feature_names)), dtype=np.float64)
+    valid = np.ones(len(records), dtype=bool)
+    for i, record in enumerate(records):
+        try:
+            matrix[i] = [record[name] for name in feature_names]
+        except (KeyError, TypeError, ValueError):
+            matrix[i] = 0.0
+            valid[i] = False
+    return matrix, valid
+
+def load_engine(model_dir, dtype=None, artifact_format=None):
+    """
+    Load anomaly_model.pkl, scaler.pkl and scaled_feature_names.json from `model_dir` and
+    flatten them into an IsolationForestEngine. Returns (engine, model, scaler, feature_names).
+    `dtype` defaults to the INFERENCE_DTYPE environment variable (float64 or float32).
+
+    `artifact_format` (default: INFERENCE_ARTIFACT_FORMAT, "auto") selects "compact" to load
+    ENGINE_FILE instead, without joblib or sklearn (model and scaler are then None), "pickle",
+    or "auto": compact when `model_dir` contains ENGINE_FILE, unless the pickles beside it are
+    not the ones it was exported from.
+    """
+    dtype = dtype or os.getenv("INFERENCE_DTYPE", "float64")
+    artifact_format = artifact_format or os.getenv("INFERENCE_ARTIFACT_FORMAT", "auto")
+    engine_path = os.path.join(model_dir, ENGINE_FILE)
+    stale = artifact_format != "pickle" and engine_is_stale(model_dir)
+    if stale and artifact_format == "compact":
+        raise ValueError(f"{engine_path} was exported from other artifacts than the pickles in {model_dir}; re-run export_model.py.")
+    if stale:
+        logging.warning(f"{engine_path} was exported from other artifacts than the pickles in {model_dir}; "
+                        f"loading the pickles instead (re-run export_model.py).")
+    if artifact_format == "compact" or (artifact_format == "auto" and os.path.exists(engine_path) and not stale):
+        engine = IsolationForestEngine.from_file(engine_path, dtype=dtype)
+        logging.info(f"Inference engine mapped from {engine_path}: {engine.n_trees} trees, {len(engine.feature)} nodes, max depth {engine.max_depth}, {engine.dtype}.")
+        return engine, None, None, engine.feature_names
+
+    import joblib
+
+    model = joblib.load(os.path.join(model_dir, "anomaly_model.pkl"))
+    scaler = joblib.load(os.path.join(model_dir, "scaler.pkl"))
+    with open(os.path.join(model_dir, "scaled_feature_names.json"), 'r') as f:
+        feature_names = json.load(f)
+
+    engine = IsolationForestEngine.from_estimators(model, scaler, feature_names, dtype=dtype)
+    logging.info(f"Inference engine built: {engine.n_trees} trees, {len(engine.feature)} nodes, max depth {engine.max_depth}, {engine.dtype}.")
+    return engine, model, scaler, feature_names
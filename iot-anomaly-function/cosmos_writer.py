@@ -0,0 +1,134 @@
+# cosmos_writer.py (Azure Function)
+# Batched Cosmos DB persistence for ConsumeEventHubData.
+#
+# Synchronous counterpart of the consumer's cosmos_writer.py in the repository root (this
+# folder is deployed on its own, so it keeps its own copy; keep the two in step): records
+# are grouped by the `/unit_number` partition key and written as transactional batches of
+# up to 100 upserts, with a bounded thread pool across partitions. A batch is atomic, so
+# when one operation is rejected only that record is dropped and the rest are resubmitted;
+# throttled (429) and transient failures, including dropped connections and timeouts, are
+# retried with the server-suggested delay or a backoff. Records of a partition key whose
+# write fails unexpectedly are reported as failed, without losing the other partition keys' results.
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core.exceptions import AzureError, ServiceRequestError, ServiceResponseError
+from azure.cosmos import exceptions
+
+TRANSACTIONAL_BATCH_LIMIT = 100
+RETRYABLE_STATUS_CODES = {408, 429, 449, 503}
+REQUEST_TOO_LARGE = 413
+# Failures before Cosmos answered: the connection failed or timed out.
+TRANSIENT_ERRORS = (ServiceRequestError, ServiceResponseError)
+
+def is_transient(error):
+    return isinstance(error, TRANSIENT_ERRORS) or getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+def group_by_partition_key(records, partition_key_field="unit_number"):
+    groups = {}
+    for record in records:
+        groups.setdefault(record.get(partition_key_field), []).append(record)
+    return groups
+
+def retry_delay_s(error, attempt, base_backoff_s, max_backoff_s):
+    headers = getattr(error, "headers", None) or {}
+    retry_after_ms = headers.get("x-ms-retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return min(float(retry_after_ms) / 1000.0, max_backoff_s)
+        except ValueError:
+            pass
+    return min(base_backoff_s * (2 ** (attempt - 1)), max_backoff_s) * random.uniform(0.5, 1.0)
+
+class WriteResult:
+    def __init__(self):
+        self.written = 0
+        self.failed = [] # (record, error) pairs that were given up on
+        self.batch_calls = 0
+        self.retries = 0
+
+    def merge(self, other):
+        self.written += other.written
+        self.failed.extend(other.failed)
+        self.batch_calls += other.batch_calls
+        self.retries += other.retries
+
+class SyncCosmosBatchWriter:
+    """Writes records to a synchronous azure.cosmos container with per-partition transactional batches."""
+
+    def __init__(self, container, partition_key_field="unit_number", max_parallel_partitions=4,
+                 max_retries=5, base_backoff_s=0.1, max_backoff_s=5.0):
+        self.container = container
+        self.partition_key_field = partition_key_field
+        self.max_parallel_partitions = max_parallel_partitions
+        self.max_retries = max_retries
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+
+    def write(self, records):
+        groups = group_by_partition_key(records, self.partition_key_field)
+        result = WriteResult()
+        if len(groups) <= 1 or self.max_parallel_partitions <= 1:
+            for partition_key, group in groups.items():
+                try:
+                    result.merge(self._write_partition(partition_key, group))
+                except Exception as e:
+                    result.merge(self._partition_failed(partition_key, group, e))
+            return result
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel_partitions, len(groups))) as pool:
+            futures = [(partition_key, group, pool.submit(self._write_partition, partition_key, group))
+                       for partition_key, group in groups.items()]
+            for partition_key, group, future in futures:
+                try:
+                    result.merge(future.result())
+                except Exception as e:
+                    result.merge(self._partition_failed(partition_key, group, e))
+        return result
+
+    def _write_partition(self, partition_key, records):
+        result = WriteResult()
+        pending = [(records[i:i + TRANSACTIONAL_BATCH_LIMIT], 0)
+                   for i in range(0, len(records), TRANSACTIONAL_BATCH_LIMIT)]
+        while pending:
+            chunk, attempt = pending.pop(0)
+            if not chunk:
+                continue
+            operations = [("upsert", (record,)) for record in chunk]
+            result.batch_calls += 1
+            try:
+                self.container.execute_item_batch(batch_operations=operations, partition_key=partition_key)
+                result.written += len(chunk)
+                continue
+            except AzureError as e:
+                error = e
+
+            status = getattr(error, "status_code", None)
+            failed_index = error.error_index if isinstance(error, exceptions.CosmosBatchOperationError) else None
+            if is_transient(error):
+                if attempt >= self.max_retries:
+                    result.failed.extend((record, error) for record in chunk)
+                    logging.error(f"Giving up on {len(chunk)} records for partition {partition_key} after {attempt} retries: {error}")
+                    continue
+                result.retries += 1
+                time.sleep(retry_delay_s(error, attempt + 1, self.base_backoff_s, self.max_backoff_s))
+                pending.insert(0, (chunk, attempt + 1))
+            elif status == REQUEST_TOO_LARGE and len(chunk) > 1:
+                half = len(chunk) // 2
+                pending[:0] = [(chunk[:half], attempt), (chunk[half:], attempt)]
+            elif failed_index is not None and 0 <= failed_index < len(chunk):
+                result.failed.append((chunk[failed_index], error))
+                logging.error(f"Cosmos DB rejected record {chunk[failed_index].get('id')} (status {status}): {error}")
+                pending.insert(0, (chunk[:failed_index] + chunk[failed_index + 1:], attempt))
+            else:
+                result.failed.extend((record, error) for record in chunk)
+                logging.error(f"Batch write of {len(chunk)} records for partition {partition_key} failed (status {status}): {error}")
+        return result
+
+    @staticmethod
+    def _partition_failed(partition_key, records, error):
+        result = WriteResult()
+        result.failed.extend((record, error) for record in records)
+        logging.error(f"Writing {len(records)} records for partition {partition_key} failed unexpectedly: {type(error).__name__}: {error}")
+        return result
@@ -4,6 +4,8 @@ import os
 import azure.functions as func
 from azure.cosmos import CosmosClient, exceptions
 
+from cosmos_writer import SyncCosmosBatchWriter # Per-partition transactional batch writes with retries
+
 # --- Cosmos DB Configuration (Loaded from Application Settings in Azure) ---
 COSMOS_DB_URI = os.getenv("CosmosDbUri")
 COSMOS_DB_KEY = os.getenv("CosmosDbKey")
@@ -91,12 +93,13 @@ def ConsumeEventHubData(events: list[func.EventHubEvent]):
     # 5. Write to Cosmos DB (if client and container are initialized)
     if current_container and processed_records:
         try:
-            # Batch insert is more efficient for multiple items
-            # Cosmos DB allows batching using bulk operations, but for simplicity here,
-            # we'll use upsert_item in a loop.
-            for record in processed_records:
-                current_container.upsert_item(body=record) 
-            logging.info(f"Successfully wrote {len(processed_records)} records to Cosmos DB.")
+            # Records are grouped by unit_number (the partition key) and written as
+            # transactional batches; only rejected records are dropped, throttling is retried.
+            write_result = SyncCosmosBatchWriter(current_container).write(processed_records)
+            if write_result.failed:
+                logging.error(f"Wrote {write_result.written} of {len(processed_records)} records to Cosmos DB; {len(write_result.failed)} failed.")
+            else:
+                logging.info(f"Successfully wrote {write_result.written} records to Cosmos DB in {write_result.batch_calls} batch calls.")
         except Exception as e:
             logging.error(f"Error writing to Cosmos DB: {e}")
     elif not current_container:
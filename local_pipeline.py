@@ -0,0 +1,498 @@
+# local_pipeline.py
+# Local stand-ins for the Azure services used by stream_data.py and event_consumer.py,
+# so the whole pipeline can run (and be benchmarked) without live resources.
+#
+#   InMemoryPartitionedQueue / FilePartitionedQueue  -- the Event Hub itself
+#   LocalProducerClient   -- EventHubProducerClient (create_batch / send_batch)
+#   LocalConsumerClient   -- azure.eventhub.aio.EventHubConsumerClient (receive_batch, with partition
+#                            load balancing between consumers that share a checkpoint store)
+#   InMemoryCheckpointStore -- azure.eventhub.aio.CheckpointStore
+#   InMemoryContainer     -- the Cosmos DB container (azure.cosmos.aio ContainerProxy)
+#
+# The clients expose the subset of the Azure SDK surface the scripts use, so they can be
+# swapped in with PIPELINE_BACKEND=local (see event_consumer.initialize_clients).
+import asyncio
+import collections
+import enum
+import fcntl
+import itertools
+import logging
+import os
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from azure.cosmos import exceptions
+
+from cosmos_writer import TRANSACTIONAL_BATCH_LIMIT
+
+# Default EventDataBatch size limit of a Standard-tier Event Hub.
+DEFAULT_MAX_BATCH_BYTES = 1024 * 1024
+LOCAL_NAMESPACE = "local.servicebus.windows.net"
+
+class LocalEventData:
+    """The parts of azure.eventhub.EventData the pipeline touches."""
+
+    def __init__(self, body, partition_key=None, content_type=None, properties=None,
+                 sequence_number=None, enqueued_time=None):
+        self.body = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+        self.partition_key = partition_key
+        self.content_type = content_type
+        self.properties = properties or {}
+        self.sequence_number = sequence_number
+        self.offset = None if sequence_number is None else str(sequence_number)
+        self.enqueued_time = enqueued_time
+
+    def body_as_str(self, encoding="UTF-8"):
+        return self.body.decode(encoding)
+
+    def __len__(self):
+        return len(self.body)
+
+def partition_for_key(partition_key, n_partitions):
+    """Stable partition assignment for a partition key (crc32, not Event Hubs' own hash)."""
+    return str(zlib.crc32(str(partition_key).encode("utf-8")) % n_partitions)
+
+class InMemoryPartitionedQueue:
+    """Append-only per-partition event log held in memory; safe across threads."""
+
+    def __init__(self, partition_count=4):
+        self.partition_ids = [str(i) for i in range(partition_count)]
+        self._logs = {partition_id: [] for partition_id in self.partition_ids}
+        self._lock = threading.Lock()
+
+    def append(self, partition_id, events):
+        with self._lock:
+            log = self._logs[partition_id]
+            now = datetime.now(timezone.utc)
+            for event in events:
+                log.append(LocalEventData(event.body, partition_key=event.partition_key,
+                                          content_type=event.content_type, properties=event.properties,
+                                          sequence_number=len(log), enqueued_time=now))
+
+    def read(self, partition_id, from_sequence, max_count):
+        with self._lock:
+            return self._logs[partition_id][from_sequence:from_sequence + max_count]
+
+    def last_sequence_number(self, partition_id):
+        with self._lock:
+            return len(self._logs[partition_id]) - 1
+
+class FilePartitionedQueue:
+    """
+    Append-only per-partition event log on disk, shareable between processes.
+
+    Each partition is one file of records framed as
+    <u32 body length><f64 enqueued epoch><u16 key length><u16 content-type length><key><content type><body>.
+    Appends take an exclusive flock; readers keep their own per-partition offset index.
+    """
+
+    HEADER = struct.Struct("<IdHH")
+
+    def __init__(self, directory, partition_count=4):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        existing = sorted(int(name.split("-")[1].split(".")[0]) for name in os.listdir(directory)
+                          if name.startswith("partition-") and name.endswith(".log"))
+        count = max(partition_count, len(existing))
+        self.partition_ids = [str(i) for i in range(count)]
+        for partition_id in self.partition_ids:
+            open(self._path(partition_id), "ab").close()
+        self._positions = {partition_id: [] for partition_id in self.partition_ids} # byte offset per sequence number
+        self._scanned_to = {partition_id: 0 for partition_id in self.partition_ids}
+        self._lock = threading.Lock()
+
+    def _path(self, partition_id):
+        return os.path.join(self.directory, f"partition-{partition_id}.log")
+
+    def append(self, partition_id, events):
+        now = time.time()
+        frames = []
+        for event in events:
+            key = b"" if event.partition_key is None else str(event.partition_key).encode("utf-8")
+            content_type = (event.content_type or "").encode("utf-8")
+            frames.append(self.HEADER.pack(len(event.body), now, len(key), len(content_type)) + key + content_type + event.body)
+        with open(self._path(partition_id), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(b"".join(frames))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _scan(self, partition_id, f):
+        """Index any records appended since the last scan."""
+        positions = self._positions[partition_id]
+        position = self._scanned_to[partition_id]
+        size = os.fstat(f.fileno()).st_size
+        while position + self.HEADER.size <= size:
+            f.seek(position)
+            body_len, _, key_len, ct_len = self.HEADER.unpack(f.read(self.HEADER.size))
+            end = position + self.HEADER.size + key_len + ct_len + body_len
+            if end > size:
+                break # partially written record; pick it up next time
+            positions.append(position)
+            position = end
+        self._scanned_to[partition_id] = position
+
+    def read(self, partition_id, from_sequence, max_count):
+        with self._lock, open(self._path(partition_id), "rb") as f:
+            self._scan(partition_id, f)
+            positions = self._positions[partition_id]
+            events = []
+            for sequence_number in range(from_sequence, min(from_sequence + max_count, len(positions))):
+                f.seek(positions[sequence_number])
+                body_len, enqueued, key_len, ct_len = self.HEADER.unpack(f.read(self.HEADER.size))
+                key = f.read(key_len).decode("utf-8") or None
+                content_type = f.read(ct_len).decode("utf-8") or None
+                events.append(LocalEventData(f.read(body_len), partition_key=key, content_type=content_type,
+                                             sequence_number=sequence_number,
+                                             enqueued_time=datetime.fromtimestamp(enqueued, timezone.utc)))
+            return events
+
+    def last_sequence_number(self, partition_id):
+        with self._lock, open(self._path(partition_id), "rb") as f:
+            self._scan(partition_id, f)
+            return len(self._positions[partition_id]) - 1
+
+class LocalEventDataBatch:
+    """Size-bounded batch with EventDataBatch's add() contract (ValueError when full)."""
+
+    def __init__(self, max_size_in_bytes=DEFAULT_MAX_BATCH_BYTES, partition_id=None, partition_key=None):
+        self.max_size_in_bytes = max_size_in_bytes
+        self.partition_id = partition_id
+        self.partition_key = partition_key
+        self.events = []
+        self.size_in_bytes = 0
+
+    def add(self, event):
+        # Rough per-event AMQP framing overhead, so packing behaves like the real service.
+        event_size = len(event.body) + 64
+        if self.events and self.size_in_bytes + event_size > self.max_size_in_bytes:
+            raise ValueError("EventDataBatch has reached its size limit.")
+        if self.partition_key is not None and event.partition_key is None:
+            event.partition_key = self.partition_key
+        self.events.append(event)
+        self.size_in_bytes += event_size
+
+    def __len__(self):
+        return len(self.events)
+
+class LocalProducerClient:
+    """Stand-in for azure.eventhub.EventHubProducerClient over a partitioned queue."""
+
+    def __init__(self, queue, eventhub_name="local"):
+        self.queue = queue
+        self.eventhub_name = eventhub_name
+        self._round_robin = itertools.cycle(queue.partition_ids)
+
+    def create_batch(self, partition_id=None, partition_key=None, max_size_in_bytes=None):
+        return LocalEventDataBatch(max_size_in_bytes or DEFAULT_MAX_BATCH_BYTES, partition_id, partition_key)
+
+    def send_batch(self, event_data_batch, **kwargs):
+        if not isinstance(event_data_batch, LocalEventDataBatch):
+            batch = self.create_batch(partition_id=kwargs.get("partition_id"), partition_key=kwargs.get("partition_key"))
+            for event in event_data_batch:
+                batch.add(event)
+            event_data_batch = batch
+        if event_data_batch.partition_id is not None:
+            partition_id = event_data_batch.partition_id
+        elif event_data_batch.partition_key is not None:
+            partition_id = partition_for_key(event_data_batch.partition_key, len(self.queue.partition_ids))
+        else:
+            partition_id = next(self._round_robin)
+        self.queue.append(partition_id, event_data_batch.events)
+
+    def get_partition_ids(self):
+        return list(self.queue.partition_ids)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class InMemoryCheckpointStore:
+    """azure.eventhub.aio.CheckpointStore contract, kept in a dict (lost on exit)."""
+
+    def __init__(self):
+        self._checkpoints = {}
+        self._ownership = {}
+
+    async def list_ownership(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        return [dict(o) for (ns, eh, cg, _), o in self._ownership.items()
+                if (ns, eh, cg) == (fully_qualified_namespace, eventhub_name, consumer_group)]
+
+    async def claim_ownership(self, ownership_list, **kwargs):
+        claimed = []
+        for ownership in ownership_list:
+            key = (ownership["fully_qualified_namespace"], ownership["eventhub_name"],
+                   ownership["consumer_group"], ownership["partition_id"])
+            current = self._ownership.get(key)
+            if current is not None and current.get("etag") != ownership.get("etag"):
+                continue
+            claimed_ownership = dict(ownership, etag=str(time.time_ns()), last_modified_time=time.time())
+            self._ownership[key] = claimed_ownership
+            claimed.append(dict(claimed_ownership))
+        return claimed
+
+    async def update_checkpoint(self, checkpoint, **kwargs):
+        key = (checkpoint["fully_qualified_namespace"], checkpoint["eventhub_name"],
+               checkpoint["consumer_group"], checkpoint["partition_id"])
+        self._checkpoints[key] = dict(checkpoint)
+
+    async def list_checkpoints(self, fully_qualified_namespace, eventhub_name, consumer_group, **kwargs):
+        return [dict(c) for (ns, eh, cg, _), c in self._checkpoints.items()
+                if (ns, eh, cg) == (fully_qualified_namespace, eventhub_name, consumer_group)]
+
+class CloseReason(enum.Enum):
+    """Stand-in for azure.eventhub.CloseReason, passed to on_partition_close."""
+    SHUTDOWN = 0
+    OWNERSHIP_LOST = 1
+
+class LocalPartitionContext:
+    """Stand-in for azure.eventhub.aio.PartitionContext."""
+
+    def __init__(self, client, partition_id):
+        self.fully_qualified_namespace = LOCAL_NAMESPACE
+        self.eventhub_name = client.eventhub_name
+        self.consumer_group = client.consumer_group
+        self.partition_id = partition_id
+        self._client = client
+        self.last_enqueued_event_properties = {}
+
+    async def update_checkpoint(self, event=None, **kwargs):
+        if event is None or self._client.checkpoint_store is None:
+            return
+        if self._client.balancing and not await self._client._owns(self.partition_id):
+            return # Taken over by another consumer, whose checkpoints are ahead of ours
+        await self._client.checkpoint_store.update_checkpoint({
+            "fully_qualified_namespace": self.fully_qualified_namespace,
+            "eventhub_name": self.eventhub_name,
+            "consumer_group": self.consumer_group,
+            "partition_id": self.partition_id,
+            "offset": event.offset,
+            "sequence_number": event.sequence_number,
+        })
+
+class LocalConsumerClient:
+    """
+    Stand-in for azure.eventhub.aio.EventHubConsumerClient.receive_batch over a partitioned queue.
+
+    With a checkpoint store, consumers sharing it split the partitions between them the way
+    the SDK's load balancer does. Every `load_balancing_interval` seconds each one renews its
+    claims through list_ownership / claim_ownership. It claims unowned partitions, or ones whose
+    owner has not renewed for `partition_ownership_expiration_interval`, up to its fair share;
+    if there are none, it takes one from the consumer owning the most. A consumer keeps its
+    `owner_id`'s unexpired claims across restarts, and writes no checkpoints for a partition the
+    store no longer names it the owner of. Without a store, it reads every partition.
+    """
+
+    def __init__(self, queue, consumer_group="$Default", eventhub_name="local", checkpoint_store=None,
+                 poll_interval_s=0.005, owner_id=None, load_balancing_interval=10.0,
+                 partition_ownership_expiration_interval=None):
+        self.queue = queue
+        self.consumer_group = consumer_group
+        self.eventhub_name = eventhub_name
+        self.checkpoint_store = checkpoint_store
+        self.poll_interval_s = poll_interval_s
+        self.owner_id = owner_id or str(uuid.uuid4())
+        self.load_balancing_interval = load_balancing_interval
+        self.ownership_expiration_s = partition_ownership_expiration_interval or 6 * load_balancing_interval
+        self.owned = {} # partition_id -> our ownership record (with its etag), when load balancing
+        self.balancing = False
+        self._closed = asyncio.Event()
+
+    async def _start_sequence(self, partition_id, starting_position):
+        if self.checkpoint_store is not None:
+            for checkpoint in await self.checkpoint_store.list_checkpoints(LOCAL_NAMESPACE, self.eventhub_name, self.consumer_group):
+                if checkpoint["partition_id"] == partition_id and checkpoint.get("sequence_number") is not None:
+                    return int(checkpoint["sequence_number"]) + 1
+        if isinstance(starting_position, dict):
+            starting_position = starting_position.get(partition_id, "-1")
+        if starting_position in (None, "-1", -1):
+            return 0
+        if starting_position == "@latest":
+            return self.queue.last_sequence_number(partition_id) + 1
+        return int(starting_position) + 1
+
+    async def _receive_partition(self, partition_id, on_event_batch, max_batch_size, max_wait_time, starting_position,
+                                 stop=None, on_partition_close=None):
+        context = LocalPartitionContext(self, partition_id)
+        next_sequence = await self._start_sequence(partition_id, starting_position)
+        stopped = lambda: self._closed.is_set() or (stop is not None and stop.is_set())
+        while not stopped():
+            deadline = time.monotonic() + (max_wait_time if max_wait_time else float("inf"))
+            events = self.queue.read(partition_id, next_sequence, max_batch_size)
+            # Like the real client, deliver whatever is available; an empty batch is only
+            # delivered once max_wait_time has passed.
+            while not events and time.monotonic() < deadline and not stopped():
+                await asyncio.sleep(self.poll_interval_s)
+                events = self.queue.read(partition_id, next_sequence, max_batch_size)
+            if stopped():
+                break
+            if events or max_wait_time:
+                next_sequence += len(events)
+                await on_event_batch(context, events)
+        if on_partition_close is not None:
+            await on_partition_close(context, CloseReason.SHUTDOWN if self._closed.is_set() else CloseReason.OWNERSHIP_LOST)
+
+    def _ownership(self, partition_id, etag=None, owner_id=None):
+        return {"fully_qualified_namespace": LOCAL_NAMESPACE, "eventhub_name": self.eventhub_name,
+                "consumer_group": self.consumer_group, "partition_id": partition_id,
+                "owner_id": self.owner_id if owner_id is None else owner_id, "etag": etag}
+
+    async def _balance(self):
+        """One load-balancing round: renew our claims and claim our share. Returns the partitions we own."""
+        records = {o["partition_id"]: o for o in await self.checkpoint_store.list_ownership(
+            LOCAL_NAMESPACE, self.eventhub_name, self.consumer_group)}
+        now = time.time()
+        active = {partition_id: o for partition_id, o in records.items()
+                  if o.get("owner_id") and now - (o.get("last_modified_time") or 0) < self.ownership_expiration_s}
+        counts = collections.Counter(o["owner_id"] for o in active.values())
+        counts.setdefault(self.owner_id, 0)
+        minimum, extra = divmod(len(self.queue.partition_ids), len(counts))
+        mine = counts[self.owner_id]
+        wanted = max(minimum - mine, 0)
+        if mine == minimum and sum(1 for count in counts.values() if count > minimum) < extra:
+            wanted = 1
+
+        claims = [self._ownership(partition_id, o.get("etag")) for partition_id, o in active.items() if o["owner_id"] == self.owner_id]
+        free = [partition_id for partition_id in self.queue.partition_ids if partition_id not in active]
+        random.shuffle(free)
+        claims += [self._ownership(partition_id, records.get(partition_id, {}).get("etag")) for partition_id in free[:wanted]]
+        if wanted > len(free):
+            # Nothing free: take one partition from the consumer owning the most, if it has more than its share.
+            richest, count = max(((owner, count) for owner, count in counts.items() if owner != self.owner_id),
+                                 key=lambda item: item[1], default=(None, 0))
+            if count > minimum + 1 or (count == minimum + 1 and sum(1 for c in counts.values() if c > minimum) > extra):
+                partition_id = random.choice([pid for pid, o in active.items() if o["owner_id"] == richest])
+                claims.append(self._ownership(partition_id, active[partition_id].get("etag")))
+        claimed = await self.checkpoint_store.claim_ownership(claims) if claims else []
+        self.owned = {o["partition_id"]: o for o in claimed if o.get("owner_id") == self.owner_id}
+        return set(self.owned)
+
+    async def _owns(self, partition_id):
+        """Whether the store still names us as the owner of `partition_id` (we learn of a takeover only at the next round)."""
+        return any(o["partition_id"] == partition_id and o.get("owner_id") == self.owner_id
+                   for o in await self.checkpoint_store.list_ownership(LOCAL_NAMESPACE, self.eventhub_name, self.consumer_group))
+
+    async def _release_ownership(self):
+        if self.owned:
+            await self.checkpoint_store.claim_ownership([self._ownership(partition_id, o.get("etag"), owner_id="")
+                                                         for partition_id, o in self.owned.items()])
+            self.owned = {}
+
+    async def _receive_balanced(self, on_event_batch, max_batch_size, max_wait_time, starting_position, on_partition_close):
+        receivers = {} # partition_id -> (task, stop event)
+        self.balancing = True
+        try:
+            while not self._closed.is_set():
+                try:
+                    owned = await self._balance()
+                except Exception as e:
+                    logging.error(f"Partition load balancing for '{self.owner_id}' failed; keeping the current partitions: {e}")
+                    owned = set(receivers)
+                for partition_id, (task, stop) in list(receivers.items()):
+                    if task.done(): # Stopped, or failed (and is restarted below while still owned)
+                        receivers.pop(partition_id)
+                        if not task.cancelled() and task.exception() is not None:
+                            logging.error(f"Receiver of partition {partition_id} failed: {task.exception()}")
+                    elif partition_id not in owned and not stop.is_set():
+                        stop.set() # It finishes its current batch first
+                        logging.info(f"Consumer '{self.owner_id}' lost partition {partition_id}.")
+                for partition_id in sorted(owned - set(receivers)):
+                    stop = asyncio.Event()
+                    task = asyncio.create_task(self._receive_partition(partition_id, on_event_batch, max_batch_size, max_wait_time,
+                                                                       starting_position, stop, on_partition_close))
+                    receivers[partition_id] = (task, stop)
+                    logging.info(f"Consumer '{self.owner_id}' claimed partition {partition_id}.")
+                try:
+                    await asyncio.wait_for(self._closed.wait(), self.load_balancing_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await asyncio.gather(*(task for task, _ in receivers.values()), return_exceptions=True)
+            await self._release_ownership()
+        finally:
+            for task, _ in receivers.values():
+                task.cancel()
+
+    async def receive_batch(self, on_event_batch, max_batch_size=300, max_wait_time=None,
+                            starting_position=None, partition_id=None, on_partition_close=None, **kwargs):
+        if partition_id is None and self.checkpoint_store is not None:
+            await self._receive_balanced(on_event_batch, max_batch_size, max_wait_time, starting_position, on_partition_close)
+            return
+        partition_ids = [partition_id] if partition_id is not None else self.queue.partition_ids
+        await asyncio.gather(*(self._receive_partition(pid, on_event_batch, max_batch_size, max_wait_time, starting_position,
+                                                       on_partition_close=on_partition_close)
+                               for pid in partition_ids))
+
+    async def get_partition_ids(self):
+        return list(self.queue.partition_ids)
+
+    async def close(self):
+        self._closed.set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class InMemoryContainer:
+    """
+    Local stand-in for an azure.cosmos.aio container. Stores documents by (partition key, id),
+    records the size of every call, and can inject throttling and per-document rejections.
+    """
+
+    def __init__(self, partition_key_field="unit_number", throttle_every=0, reject_ids=(), latency_s=0.0):
+        self.partition_key_field = partition_key_field
+        self.throttle_every = throttle_every
+        self.reject_ids = set(reject_ids)
+        self.latency_s = latency_s
+        self.items = {}
+        self.call_sizes = []
+        self.throttled_calls = 0
+        self._calls = 0
+
+    def _maybe_throttle(self):
+        self._calls += 1
+        if self.throttle_every and self._calls % self.throttle_every == 0:
+            self.throttled_calls += 1
+            raise exceptions.CosmosHttpResponseError(status_code=429, message="Request rate is large (injected).")
+
+    async def upsert_item(self, body, **kwargs):
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        self.call_sizes.append(1)
+        self._maybe_throttle()
+        self.items[(body.get(self.partition_key_field), body["id"])] = dict(body)
+        return body
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        self.call_sizes.append(len(batch_operations))
+        self._maybe_throttle()
+        if len(batch_operations) > TRANSACTIONAL_BATCH_LIMIT:
+            raise exceptions.CosmosHttpResponseError(status_code=400, message="Batch exceeds 100 operations.")
+        for index, (operation, args, *_) in enumerate(batch_operations):
+            body = args[0]
+            if body.get(self.partition_key_field) != partition_key:
+                raise exceptions.CosmosHttpResponseError(status_code=400, message="Partition key mismatch in batch.")
+            if body["id"] in self.reject_ids:
+                raise exceptions.CosmosBatchOperationError(
+                    error_index=index, headers={}, status_code=400,
+                    message=f"Operation {index} rejected (injected).",
+                    operation_responses=[{"statusCode": 400}])
+        for operation, args, *_ in batch_operations:
+            body = args[0]
+            self.items[(partition_key, body["id"])] = dict(body)
+        return [{"statusCode": 200} for _ in batch_operations]
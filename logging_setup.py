@@ -0,0 +1,175 @@
+# logging_setup.py
+# Shared logging for the services (model_api.py, event_consumer.py): non-blocking output and
+# sampling of the per-request / per-event log lines.
+#
+# configure_logging() puts a QueueHandler on the root logger, and a QueueListener thread
+# writes the records to stderr, so the event loop never waits on the terminal, a pipe or a
+# container log driver. The queue is bounded (LOG_QUEUE_SIZE); when the writer falls that far
+# behind, new records are dropped and counted instead of blocking the caller.
+# route_through_queue() does the same for loggers that bring their own handlers (uvicorn's
+# access log writes one line per request).
+#
+# LogSampler rate-limits one class of hot-path messages: at most one line per key (e.g. per
+# unit) every LOG_SAMPLE_INTERVAL_S seconds, and at most LOG_SAMPLE_MAX_PER_S lines per second
+# for the whole class. Callers check allow() before formatting, so suppressed lines cost a
+# dict lookup; suppressed lines are counted and reported once a minute.
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Defaults for hot-path samplers; 0 disables the respective limit (LOG_SAMPLE_INTERVAL_S=0 and
+# LOG_SAMPLE_MAX_PER_S=0 log every line, as before).
+LOG_SAMPLE_INTERVAL_S = float(os.getenv("LOG_SAMPLE_INTERVAL_S", "10"))
+LOG_SAMPLE_MAX_PER_S = float(os.getenv("LOG_SAMPLE_MAX_PER_S", "20"))
+SUPPRESSED_REPORT_INTERVAL_S = 60
+MAX_SAMPLER_KEYS = 100000 # Keys remembered per sampler before the oldest half is forgotten
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops (and counts) records when the queue is full instead of raising.
+    Records are queued as they are and formatted by the writer thread: the queue never leaves
+    the process, and formatters that read record.args (uvicorn's access log) keep working.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class QueueWriter(logging.handlers.QueueListener):
+    """QueueListener whose stop() waits for room in a full queue rather than raising queue.Full."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+_queue_handler = None # On the root logger
+_listener = None
+_routed = [] # (DroppingQueueHandler, QueueWriter) per route_through_queue() logger
+_samplers = {} # name -> LogSampler
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """
+    Route the root logger through a bounded queue to a background writer thread (idempotent).
+    Replaces logging.basicConfig(level=..., format=...) in the services.
+    """
+    global _queue_handler, _listener
+    if _listener is not None:
+        return _queue_handler
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(fmt))
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+    _listener = QueueWriter(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _queue_handler
+
+def route_through_queue(*logger_names):
+    """Move the handlers of already-configured loggers behind a queue and writer thread of their own."""
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        handlers = [handler for handler in logger.handlers if not isinstance(handler, logging.handlers.QueueHandler)]
+        if not handlers:
+            continue
+        queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+        listener = QueueWriter(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _routed.append((queue_handler, listener))
+
+def shutdown_logging():
+    """Write out the queued records and stop the writer threads."""
+    global _listener
+    while _routed:
+        _routed.pop()[1].stop()
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class LogSampler:
+    """
+    Decides which lines of one message class are logged: at most one per key every `interval_s`
+    seconds and at most `max_per_s` per second overall (0 disables either limit).
+
+        if processed_log.allow(unit_number):
+            logging.info(f"Processed unit {unit_number} ...")
+    """
+
+    def __init__(self, name, interval_s=LOG_SAMPLE_INTERVAL_S, max_per_s=LOG_SAMPLE_MAX_PER_S):
+        self.name = name
+        self.interval_s = interval_s
+        self.max_per_s = max_per_s
+        self.logged = 0
+        self.suppressed = 0
+        self._last_logged = {} # key -> monotonic time of its last line
+        self._second_start = 0.0
+        self._second_count = 0
+        self._reported_at = time.monotonic()
+        self._reported_suppressed = 0
+
+    def allow(self, key=None):
+        now = time.monotonic()
+        if self.interval_s > 0:
+            last = self._last_logged.get(key)
+            if last is not None and now - last < self.interval_s:
+                self.suppressed += 1
+                return False
+        if self.max_per_s > 0:
+            if now - self._second_start >= 1.0:
+                self._second_start, self._second_count = now, 0
+            if self._second_count >= self.max_per_s:
+                self.suppressed += 1
+                return False
+            self._second_count += 1
+        if self.interval_s > 0:
+            if len(self._last_logged) >= MAX_SAMPLER_KEYS:
+                for old_key in list(self._last_logged)[:MAX_SAMPLER_KEYS // 2]:
+                    del self._last_logged[old_key]
+            self._last_logged[key] = now
+        self.logged += 1
+        if now - self._reported_at >= SUPPRESSED_REPORT_INTERVAL_S:
+            self._report(now)
+        return True
+
+    def _report(self, now):
+        suppressed = self.suppressed - self._reported_suppressed
+        if suppressed:
+            logging.info(f"Log sampling: {suppressed} '{self.name}' lines suppressed in the last {now - self._reported_at:.0f}s "
+                         f"({self.logged} logged in total).")
+        self._reported_at, self._reported_suppressed = now, self.suppressed
+
+    def stats(self):
+        return {"logged": self.logged, "suppressed": self.suppressed}
+
+def sampler(name, interval_s=LOG_SAMPLE_INTERVAL_S, max_per_s=LOG_SAMPLE_MAX_PER_S):
+    """The LogSampler of message class `name` (created on first use)."""
+    if name not in _samplers:
+        _samplers[name] = LogSampler(name, interval_s, max_per_s)
+    return _samplers[name]
+
+def stats():
+    """Lines logged and suppressed per message class, and records dropped by a full queue."""
+    dropped = sum(handler.dropped for handler, _ in _routed)
+    return {"dropped": dropped + (_queue_handler.dropped if _queue_handler is not None else 0),
+            "samplers": {name: sampler.stats() for name, sampler in _samplers.items()}}
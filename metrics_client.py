@@ -0,0 +1,164 @@
+# metrics_client.py
+# In-process aggregation of Datadog custom metrics for model_api.py and event_consumer.py.
+#
+# Instead of one HTTPS POST per event, callers record counters, gauges and score
+# distributions into an in-memory table keyed by (metric, type, tags). The table is
+# flushed every `flush_interval_s` seconds, or early once it holds `max_series` keys,
+# as a single deflate-compressed /api/v1/series payload. Payloads wait in a bounded
+# queue for one sender task; anything that cannot be queued is dropped and counted.
+import asyncio
+import json
+import logging
+import time
+import zlib
+
+import aiohttp
+
+class MetricsAggregator:
+    def __init__(self, session, url, api_key, flush_interval_s=10.0, max_series=1000,
+                 max_pending_payloads=8, request_timeout_s=5.0):
+        self.session = session
+        self.url = url
+        self.api_key = api_key
+        self.flush_interval_s = flush_interval_s
+        self.max_series = max_series
+        self.request_timeout_s = request_timeout_s
+
+        # (metric, type, tags) -> accumulated value. Counters hold a sum, gauges the
+        # last value, distributions [count, sum, min, max].
+        self._table = {}
+        self._payloads = asyncio.Queue(maxsize=max_pending_payloads)
+        self._flush_requested = asyncio.Event()
+        self._flusher = None
+        self._sender = None
+
+        # Drop accounting and throughput counters.
+        self.points_recorded = 0
+        self.series_flushed = 0
+        self.payloads_sent = 0
+        self.payloads_failed = 0
+        self.payloads_dropped = 0
+        self.series_dropped = 0
+        self.bytes_sent = 0
+
+    # --- Recording (synchronous, O(1), never touches the network) ---
+    def count(self, metric, value=1, tags=()):
+        key = (metric, "count", tuple(tags))
+        self._table[key] = self._table.get(key, 0) + value
+        self._recorded()
+
+    def gauge(self, metric, value, tags=()):
+        self._table[(metric, "gauge", tuple(tags))] = value
+        self._recorded()
+
+    def distribution(self, metric, value, tags=()):
+        key = (metric, "distribution", tuple(tags))
+        summary = self._table.get(key)
+        if summary is None:
+            self._table[key] = [1, value, value, value]
+        else:
+            summary[0] += 1
+            summary[1] += value
+            if value < summary[2]:
+                summary[2] = value
+            if value > summary[3]:
+                summary[3] = value
+        self._recorded()
+
+    def _recorded(self):
+        self.points_recorded += 1
+        if len(self._table) >= self.max_series:
+            self._flush_requested.set()
+
+    # --- Flushing ---
+    def start(self):
+        """Start the interval flusher and the sender on the running event loop."""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever())
+            self._sender = asyncio.create_task(self._send_forever())
+
+    async def close(self):
+        """Flush what is left, wait for queued payloads to go out, and stop the tasks."""
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        self.flush()
+        try:
+            await asyncio.wait_for(self._payloads.join(), timeout=self.request_timeout_s)
+        except asyncio.TimeoutError:
+            logging.warning(f"Metrics aggregator closed with {self._payloads.qsize()} payloads unsent.")
+        self._sender.cancel()
+        await asyncio.gather(self._flusher, self._sender, return_exceptions=True)
+        self._flusher = self._sender = None
+
+    def build_series(self, table, timestamp):
+        series = []
+        for (metric, metric_type, tags), value in table.items():
+            if metric_type == "distribution":
+                n, total, low, high = value
+                # Datadog's v1 series API has no distribution type: ship summary gauges,
+                # with the mean under the original metric name.
+                for name, point in ((metric, total / n), (f"{metric}.min", low), (f"{metric}.max", high)):
+                    series.append({"metric": name, "points": [[timestamp, point]], "type": "gauge", "tags": list(tags)})
+                series.append({"metric": f"{metric}.count", "points": [[timestamp, n]], "type": "count", "tags": list(tags)})
+            else:
+                series.append({"metric": metric, "points": [[timestamp, value]], "type": metric_type, "tags": list(tags)})
+        return series
+
+    def flush(self):
+        """Swap out the current table and queue it as one compressed payload."""
+        self._flush_requested.clear()
+        if not self._table:
+            return
+        table, self._table = self._table, {}
+        series = self.build_series(table, int(time.time()))
+        body = zlib.compress(json.dumps({"series": series}).encode("utf-8"))
+        try:
+            self._payloads.put_nowait((body, len(series)))
+        except asyncio.QueueFull:
+            self.payloads_dropped += 1
+            self.series_dropped += len(series)
+            logging.warning(f"Metrics queue full; dropped a payload of {len(series)} series.")
+
+    async def _flush_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self.flush()
+
+    async def _send_forever(self):
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Encoding": "deflate",
+            "DD-API-KEY": self.api_key,
+        }
+        while True:
+            body, n_series = await self._payloads.get()
+            try:
+                async with self.session.post(self.url, headers=headers, data=body,
+                                             timeout=aiohttp.ClientTimeout(total=self.request_timeout_s)) as response:
+                    response.raise_for_status()
+                self.payloads_sent += 1
+                self.series_flushed += n_series
+                self.bytes_sent += len(body)
+            except Exception as e:
+                self.payloads_failed += 1
+                self.series_dropped += n_series
+                logging.error(f"Failed to send {n_series} metric series to Datadog API: {e}")
+            finally:
+                self._payloads.task_done()
+
+    def stats(self):
+        return {
+            "points_recorded": self.points_recorded,
+            "series_pending": len(self._table),
+            "payloads_queued": self._payloads.qsize(),
+            "payloads_sent": self.payloads_sent,
+            "payloads_failed": self.payloads_failed,
+            "payloads_dropped": self.payloads_dropped,
+            "series_flushed": self.series_flushed,
+            "series_dropped": self.series_dropped,
+            "bytes_sent": self.bytes_sent,
+        }
@@ -0,0 +1,127 @@
+# micro_batcher.py
+# In-process dynamic batching for CPU-bound scoring behind an asyncio server.
+#
+# Concurrent callers submit one feature row each; a collector task cuts a batch when it
+# reaches `max_batch_size` rows or `max_wait_ms` after its first row, scores the stacked
+# matrix in a worker thread, and resolves every caller's future with its own result.
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+class MicroBatcher:
+    """
+    Collects concurrent `submit(row)` calls into one matrix for `score_fn`.
+
+    `score_fn(matrix)` must return a sequence of per-row arrays (e.g. the
+    `(anomaly_scores, is_anomaly)` pair from IsolationForestEngine.score); each
+    caller receives a tuple with its own row of each.
+
+    The wait is adaptive: when the previous batch held a single row and nothing else
+    is queued, the row is dispatched immediately, so a lone client never pays
+    `max_wait_ms`. Once requests overlap, the collector waits up to `max_wait_ms`
+    for more rows to arrive.
+    """
+
+    def __init__(self, score_fn, max_batch_size=64, max_wait_ms=2.0):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        # One scoring thread keeps batches in order and avoids GIL contention between them.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="micro-batcher")
+        self._queue = None
+        self._collector = None
+        self._last_batch_size = 0
+        self._batch_open = False # A batch has been started and its futures are not yet resolved
+
+        self.batches_scored = 0
+        self.rows_scored = 0
+
+    def start(self):
+        """Start the collector task on the running event loop."""
+        if self._collector is None:
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.create_task(self._collect_forever())
+
+    async def close(self):
+        """Stop collecting, fail anything still queued, and shut the scoring thread down."""
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("MicroBatcher closed before the row was scored."))
+        self.executor.shutdown(wait=False)
+
+    async def drain_and_close(self, poll_s=0.001):
+        """Score every row already submitted, then close. Used to retire a batcher once no new rows arrive."""
+        while self._collector is not None and (self._batch_open or not self._queue.empty()):
+            await asyncio.sleep(poll_s)
+        await self.close()
+
+    async def submit(self, row):
+        """Queue one feature row and wait for its result tuple."""
+        if self._collector is None:
+            raise RuntimeError("MicroBatcher.start() has not been called.")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+
+    async def _next_batch(self):
+        row, future = await self._queue.get()
+        self._batch_open = True
+        batch = [(row, future)]
+
+        if self._last_batch_size <= 1 and self._queue.empty():
+            return batch
+
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _collect_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            self._last_batch_size = len(batch)
+            futures = [future for _, future in batch]
+            try:
+                matrix = np.stack([row for row, _ in batch])
+                outputs = await loop.run_in_executor(self.executor, self.score_fn, matrix)
+            except asyncio.CancelledError:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(RuntimeError("MicroBatcher closed while the batch was scoring."))
+                raise
+            except Exception as e:
+                logging.error(f"Micro-batch of {len(batch)} rows failed: {e}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                self._batch_open = False
+                continue
+
+            self.batches_scored += 1
+            self.rows_scored += len(batch)
+            for i, future in enumerate(futures):
+                # Callers that went away (client disconnect) leave a cancelled future behind.
+                if not future.done():
+                    future.set_result(tuple(output[i] for output in outputs))
+            self._batch_open = False
@@ -1,35 +1,90 @@
 # model_api.py
 import os
-import json
-import joblib
-import pandas as pd
 import numpy as np
 import logging
-import time # For getting current timestamp for Datadog metrics
 import asyncio # For running async tasks (sending metrics)
+import signal
+import time
+from datetime import datetime, timezone
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel
-import aiohttp # For making async HTTP requests to Datadog API
 from dotenv import load_dotenv # Ensure this import is at the top
 
-# Configure logging for the API. This will print messages to the terminal.
-logging.basicConfig(level=logging.INFO, 
-                            format='%(asctime)s - %(levelname)s - %(message)s')
+from inference_engine import load_engine # Array-backed IsolationForest + scaler scoring
+from model_store import read_feature_names, resolve_active_version, validate_artifacts, warm_up # Versioned artifact sets in MODEL_DIR
+from micro_batcher import MicroBatcher # Groups concurrent /predict calls into one matrix
+from result_cache import cache_from_env # LRU+TTL cache of results by message_id, for redelivered readings
+import wire_format # Packed binary request bodies, negotiated by Content-Type
+from reading_decoder import ReadingDecodeError, ReadingDecoder, Readings # Request body -> feature matrix, no per-request pydantic model
+import stage_metrics # Per-stage latency histograms for GET /metrics
+import logging_setup # Queue-backed log writer and hot-path log sampling
+# aiohttp and metrics_client (Datadog) are imported at startup only when credentials are set.
+from feature_engine import engine_from_env, uses_rolling_features, restore_if_present, snapshot_periodically # Per-unit rolling-window features
+
+# Configure logging for the API. This will print messages to the terminal from a background
+# thread (logging_setup.py), so request handlers never wait on the write.
+logging_setup.configure_logging()
 
 # Define the directory where model artifacts are located.
-MODEL_DIR = "models" 
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+
+# Hot reload: MODEL_DIR is checked every MODEL_POLL_INTERVAL_S seconds (0 disables polling;
+# POST /model/reload and SIGHUP always work) for a new artifact set, see model_store.py. A new set is
+# loaded, validated and warmed up in a worker thread, then swapped in for new requests while
+# requests already scoring finish on the previous model.
+MODEL_POLL_INTERVAL_S = float(os.getenv("MODEL_POLL_INTERVAL_S", "30"))
+
+# Upper bound on the number of readings accepted by /predict/batch in one request.
+MAX_BATCH_SIZE = int(os.getenv("PREDICT_MAX_BATCH_SIZE", "1000"))
+
+# Micro-batching of concurrent /predict calls: a batch is cut at MICROBATCH_MAX_SIZE rows
+# or MICROBATCH_MAX_WAIT_MS after its first row, then scored off the event loop.
+MICROBATCH_ENABLED = os.getenv("PREDICT_MICROBATCH_ENABLED", "true").lower() in ("1", "true", "yes")
+MICROBATCH_MAX_SIZE = int(os.getenv("PREDICT_MICROBATCH_MAX_SIZE", "64"))
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("PREDICT_MICROBATCH_MAX_WAIT_MS", "2"))
+
+# Rolling-window features per unit_number (feature_engine.py). Enabled automatically when the
+# model was trained on them (scaled_feature_names contains '<sensor>_roll_mean' etc.), or with
+# ROLLING_FEATURES_ENABLED=true. State is snapshotted to ROLLING_STATE_PATH, when set, every
+# ROLLING_SNAPSHOT_INTERVAL_S seconds and at shutdown, and restored at startup.
+ROLLING_STATE_PATH = os.getenv("ROLLING_STATE_PATH")
+ROLLING_SNAPSHOT_INTERVAL_S = float(os.getenv("ROLLING_SNAPSHOT_INTERVAL_S", "60"))
 
-# Global variables for model, scaler, and feature names.
-model = None
-scaler = None
-scaled_feature_names = None
+# Global variables for the served model version and the background tasks around it.
+active_model = None # ModelBundle serving requests; replaced as a whole on reload
+last_reload_error = None
+model_reload_lock = None # asyncio.Lock, so polls and POST /model/reload never load concurrently
+model_poll_task = None
+batcher_drain_tasks = set() # Retired versions' MicroBatcher.drain_and_close(), awaited at shutdown
+feature_engine = None # RollingFeatureEngine, or None when rolling features are off
+result_cache = None # ResultCache of message_id -> (anomaly_score, is_anomaly, model_version); RESULT_CACHE_MAX_ENTRIES=0 disables
+rolling_snapshot_task = None
+stage_report_task = None # stage_metrics.report_periodically()
 dd_http_session = None # Global aiohttp client session for Datadog API calls
+metrics = None # Global MetricsAggregator, created at startup when Datadog credentials are set
 
 # --- Datadog API Configuration (Declared globally, assigned in startup) ---
 # These will be assigned their values from os.getenv inside the startup event
 GLOBAL_DD_API_METRICS_URL = None
 GLOBAL_DD_API_KEY_HEADER = None
+DD_FLUSH_INTERVAL_S = float(os.getenv("DD_FLUSH_INTERVAL_S", "10"))
+
+# --- Hot-Path Log Sampling (logging_setup.py) ---
+# /predict logs a unit's request and result at most once every LOG_SAMPLE_INTERVAL_S seconds;
+# each class of per-request lines is capped at LOG_SAMPLE_MAX_PER_S lines per second overall.
+# Suppressed lines are counted (GET /health) and reported in the log once a minute.
+predict_log = logging_setup.sampler("model_api.predict")
+predict_batch_log = logging_setup.sampler("model_api.predict_batch", interval_s=0)
+predict_error_log = logging_setup.sampler("model_api.predict_errors", interval_s=0)
+
+# --- Stage Timings (stage_metrics.py; GET /metrics, summary log every STAGE_METRICS_LOG_INTERVAL_S) ---
+# decode, features and respond are timed per request; scale and score per scoring call, which
+# covers a whole micro-batch or /predict/batch request.
+STAGES = ("decode", "features", "scale", "score", "respond")
+stage_timings = {stage: stage_metrics.stage_histogram("model_api_stage_seconds", stage, "Time spent in each model_api stage.") for stage in STAGES}
 
 # --- FastAPI Application Setup ---
 app = FastAPI(title="IoT Anomaly Detection API",
@@ -70,13 +125,274 @@ class SensorDataInput(BaseModel):
     class Config:
         extra = "allow" 
 
+# --- Request Decoding (content negotiation) ---
+# /predict and /predict/batch accept a JSON body (application/json, the default) or a packed
+# frame of readings (Content-Type wire_format.CONTENT_TYPE, see wire_format.py); responses are JSON.
+# SensorDataInput documents the body, but requests are not validated through it: each model
+# version's ReadingDecoder (reading_decoder.py) writes the body straight into a float matrix
+# laid out like the version's feature names, with the same type and missing-field errors.
+READING_FIELDS = [name for name, field in SensorDataInput.model_fields.items() if field.is_required()]
+READING_STRING_FIELDS = ["message_id", "event_timestamp"]
+
+def readings_request_body(batch):
+    """OpenAPI requestBody for the endpoints that read their body themselves."""
+    schema = SensorDataInput.model_json_schema()
+    return {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"type": "array", "items": schema} if batch else schema},
+        wire_format.CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}}}}}
+
+def decode_readings(body, content_type, decoder: ReadingDecoder, batch: bool):
+    """Readings in a request body, decoded per its content type; raises HTTPException / RequestValidationError."""
+    try:
+        if content_type == wire_format.CONTENT_TYPE:
+            try:
+                frame = wire_format.decode_frame(body)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid packed body: {e}")
+            if not batch and len(frame) != 1:
+                raise HTTPException(status_code=400, detail=f"/predict takes one reading, the packed body holds {len(frame)}.")
+            return decoder.decode_frame(frame, loc=() if batch else None)
+        if content_type and content_type != wire_format.JSON_CONTENT_TYPE:
+            raise HTTPException(status_code=415, detail=f"Unsupported Content-Type '{content_type}' (expected {wire_format.JSON_CONTENT_TYPE} or {wire_format.CONTENT_TYPE}).")
+        return decoder.decode_json(body, batch=batch)
+    except ReadingDecodeError as e:
+        raise RequestValidationError([dict(error, loc=("body", *error["loc"])) for error in e.errors])
+
+async def read_readings(request: Request, batch: bool):
+    """
+    (model version serving this request, its decoded readings). The bundle is acquired before
+    the body is read, so a reload meanwhile cannot close its micro-batcher; the caller releases it.
+    """
+    bundle = active_model
+    if bundle is None:
+        raise HTTPException(status_code=503, detail="Model not loaded yet.")
+    bundle.acquire()
+    try:
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        body = await request.body()
+        started = time.perf_counter_ns()
+        readings = decode_readings(body, content_type, bundle.decoder, batch)
+    except BaseException:
+        bundle.release()
+        raise
+    stage_timings["decode"].observe_ns(time.perf_counter_ns() - started)
+    return bundle, readings
+
+# --- Model Versions ---
+class ModelBundle:
+    """
+    One loaded artifact set: the flattened engine, the sklearn objects it was built from, the
+    feature order, and a micro-batcher of its own (when enabled). Requests capture the bundle
+    once and use only it, so a swap never mixes two versions within a request. A swapped-out
+    bundle is retired: its micro-batcher stays open until the last request holding it releases it.
+    """
+
+    def __init__(self, version, path, engine, model, scaler, feature_names, rolling_positions):
+        self.version = version
+        self.path = path
+        self.engine = engine
+        self.model = model
+        self.scaler = scaler
+        self.feature_names = feature_names
+        self.rolling_positions = rolling_positions # (positions in a feature row, positions in the feature engine's output)
+        # Decoded rows hold the features first, in feature_names order, then the other request fields.
+        self.decoder = ReadingDecoder(list(feature_names) + [name for name in READING_FIELDS if name not in feature_names],
+                                      fields=READING_FIELDS, string_fields=READING_STRING_FIELDS)
+        self.rolling_inputs = None
+        if feature_engine is not None:
+            self.rolling_inputs = np.array([self.decoder.index[name] for name in feature_engine.base_features], dtype=np.intp)
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        self.batcher = None
+        self.in_flight = 0 # Requests that captured this bundle and have not finished
+        self.retired = False
+
+    def score_rows(self, rows):
+        """engine.score(rows), with scaling and the forest traversal timed as separate stages."""
+        started = time.perf_counter_ns()
+        scaled = self.engine.transform(rows)
+        scaled_at = time.perf_counter_ns()
+        result = self.engine.score_transformed(scaled)
+        stage_timings["scale"].observe_ns(scaled_at - started)
+        stage_timings["score"].observe_ns(time.perf_counter_ns() - scaled_at)
+        return result
+
+    def start_batcher(self):
+        if MICROBATCH_ENABLED:
+            self.batcher = MicroBatcher(self.score_rows, max_batch_size=MICROBATCH_MAX_SIZE, max_wait_ms=MICROBATCH_MAX_WAIT_MS)
+            self.batcher.start()
+
+    def acquire(self):
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        if self.retired and self.in_flight == 0:
+            self.close_batcher()
+
+    def retire(self):
+        """Called once the bundle is swapped out; closes the micro-batcher when no request holds the bundle."""
+        self.retired = True
+        if self.in_flight == 0:
+            self.close_batcher()
+
+    def close_batcher(self):
+        if self.batcher is not None:
+            # Rows already queued are scored by this model before the batcher stops.
+            task = asyncio.create_task(self.batcher.drain_and_close())
+            batcher_drain_tasks.add(task) # The event loop holds tasks weakly
+            task.add_done_callback(batcher_drain_tasks.discard)
+            self.batcher = None
+
+def load_model_bundle(version, path):
+    """
+    Load, validate and warm up the artifact set at `path` (blocking; run it in a worker thread).
+    Raises if the set cannot be served, so the caller keeps the current version.
+    """
+    engine, model, scaler, feature_names = load_engine(path)
+    validate_artifacts(model, scaler, feature_names)
+
+    rolling_names = set(feature_engine.feature_names) if feature_engine is not None else set()
+    unknown = [name for name in feature_names if name not in READING_FIELDS and name not in rolling_names]
+    if unknown:
+        hint = " (rolling features are disabled)" if feature_engine is None and uses_rolling_features(unknown) else ""
+        raise ValueError(f"Model version '{version}' uses features that requests do not provide{hint}: {unknown}")
+    rolling_positions = None
+    if feature_engine is not None:
+        output_index = {name: i for i, name in enumerate(feature_engine.feature_names)}
+        pairs = [(i, output_index[name]) for i, name in enumerate(feature_names) if name in output_index]
+        rolling_positions = (np.array([p[0] for p in pairs], dtype=np.intp), np.array([p[1] for p in pairs], dtype=np.intp))
+
+    max_diff = warm_up(engine, model, scaler)
+    logging.info(f"Model version '{version}' loaded from '{path}' and warmed up (max deviation from sklearn {max_diff:.1e}).")
+    return ModelBundle(version, path, engine, model, scaler, feature_names, rolling_positions)
+
+async def reload_model():
+    """
+    Load the active version in MODEL_DIR if it differs from the one being served, and swap it in.
+    Returns True when a new version was swapped in. On failure the current version keeps serving.
+    """
+    global active_model, last_reload_error
+    async with model_reload_lock:
+        try:
+            version, path = await asyncio.to_thread(resolve_active_version, MODEL_DIR)
+            if active_model is not None and version == active_model.version:
+                return False
+            bundle = await asyncio.to_thread(load_model_bundle, version, path)
+        except Exception as e:
+            last_reload_error = f"{type(e).__name__}: {e}"
+            logging.error(f"Model reload from '{MODEL_DIR}' failed, still serving version '{active_model.version if active_model else None}': {e}")
+            return False
+
+        bundle.start_batcher()
+        previous, active_model = active_model, bundle # Single reference swap; new requests see only the new version
+        last_reload_error = None
+        logging.info(f"Now serving model version '{bundle.version}' (previous: '{previous.version if previous else None}').")
+        if previous is not None:
+            previous.retire()
+        return True
+
+async def poll_model_dir(interval_s):
+    """Background task: reload_model() every `interval_s` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval_s)
+        await reload_model()
+
+# --- Scoring Helpers (shared by /predict and /predict/batch) ---
+def feature_rows(readings: Readings, bundle: ModelBundle, indices=None):
+    """
+    Feature matrix of `readings` (or of the rows at `indices`), ordered like the bundle's feature
+    names: the leading columns of the decoded rows, with the rolling features filled in.
+    """
+    started = time.perf_counter_ns()
+    values = readings.values if indices is None else readings.values[indices]
+    rows = values[:, :len(bundle.feature_names)]
+    if feature_engine is None:
+        stage_timings["features"].observe_ns(time.perf_counter_ns() - started)
+        return rows
+    # Every reading advances its unit's rolling window, whether or not the model uses the features.
+    unit_numbers, cycles = readings.decoder.index["unit_number"], readings.decoder.index["time_in_cycles"]
+    row_positions, rolling_positions = bundle.rolling_positions
+    for row, reading in zip(rows, values):
+        rolling = feature_engine.update(float(reading[unit_numbers]), reading[bundle.rolling_inputs], float(reading[cycles]))
+        row[row_positions] = rolling[rolling_positions]
+    stage_timings["features"].observe_ns(time.perf_counter_ns() - started)
+    return rows
+
+def configure_rolling_features(feature_names):
+    """Create the rolling feature engine if enabled (by default when the first model uses its outputs)."""
+    global feature_engine
+    feature_engine = engine_from_env(enabled_default=uses_rolling_features(feature_names))
+    if feature_engine is None:
+        return
+    restore_if_present(feature_engine, ROLLING_STATE_PATH)
+    logging.info(f"Rolling features enabled (window {feature_engine.window}).")
+
+def score_readings(readings: Readings, bundle: ModelBundle, indices=None):
+    """
+    Scale and score readings (or the rows at `indices`) as a single matrix.
+    Returns (anomaly_scores, is_anomaly) as NumPy arrays aligned with the scored rows.
+    """
+    # One pass over the flattened forest yields both the decision_function() score
+    # and the predict() == -1 label; scaling is folded into the engine.
+    return bundle.score_rows(feature_rows(readings, bundle, indices))
+
+async def score_reading(readings: Readings, bundle: ModelBundle):
+    """
+    Score the single reading in `readings`, through the micro-batcher when enabled. A reading
+    whose message_id was already scored gets the cached result (from the model version that
+    produced it). Returns (anomaly_score, is_anomaly, model_version).
+    """
+    message_id = readings.strings["message_id"][0]
+    use_cache = result_cache is not None and message_id
+    if use_cache:
+        cached = result_cache.get(message_id)
+        if cached is not None:
+            return cached
+    if bundle.batcher is not None:
+        anomaly_score, is_anomaly = await bundle.batcher.submit(feature_rows(readings, bundle)[0])
+    else:
+        anomaly_scores, anomaly_flags = score_readings(readings, bundle)
+        anomaly_score, is_anomaly = anomaly_scores[0], anomaly_flags[0]
+    result = (float(anomaly_score), bool(is_anomaly), bundle.version)
+    if use_cache:
+        result_cache.put(message_id, result)
+    return result
+
+def build_prediction_response(unit_number, time_in_cycles, event_timestamp, message_id, is_anomaly: bool, anomaly_score: float, model_version: str):
+    return {
+        "is_anomaly": is_anomaly,
+        "anomaly_score": anomaly_score,
+        "unit_number": unit_number,
+        "time_in_cycles": time_in_cycles,
+        "event_timestamp": event_timestamp,
+        "message_id": message_id,
+        "model_version": model_version
+    }
+
+def response_fields(readings: Readings):
+    """(unit_number, time_in_cycles, event_timestamp, message_id) per reading, for build_prediction_response."""
+    return zip(readings.column("unit_number").tolist(), readings.column("time_in_cycles").tolist(),
+               readings.strings["event_timestamp"], readings.strings["message_id"])
+
+def record_prediction_metrics(unit_number, is_anomaly: bool, anomaly_score: float):
+    """Record custom metrics for one prediction in the Datadog aggregator (no network I/O)."""
+    if metrics is None:
+        return
+    unit_tag = "unit_number:{}".format(unit_number)
+    metrics.count("iot.anomaly.predictions.debug_total", 1, ("service:model_api", "env:local", unit_tag))
+    metrics.count("iot.anomaly.predictions.debug_anomaly", 1 if is_anomaly else 0, ("service:model_api", "env:local", "is_anomaly:{}".format(is_anomaly), unit_tag))
+    metrics.distribution("iot.anomaly.debug_score_distribution", anomaly_score, ("service:model_api", "env:local", unit_tag))
+
 # --- API Startup Event ---
 @app.on_event("startup")
 async def load_artifacts_and_init_clients():
     """
     Load the pre-trained model, scaler, feature names, and initialize Datadog HTTP client.
     """
-    global model, scaler, scaled_feature_names, dd_http_session, GLOBAL_DD_API_METRICS_URL, GLOBAL_DD_API_KEY_HEADER
+    global active_model, model_reload_lock, model_poll_task, result_cache, dd_http_session, metrics, rolling_snapshot_task, stage_report_task, GLOBAL_DD_API_METRICS_URL, GLOBAL_DD_API_KEY_HEADER
+    # uvicorn configured its own log handlers before importing the app; its per-request access
+    # lines get a background writer too.
+    logging_setup.route_through_queue("uvicorn.access", "uvicorn.error")
     try:
         # --- Load environment variables explicitly here ---
         load_dotenv() 
@@ -92,20 +408,46 @@ async def load_artifacts_and_init_clients():
             logging.info("Datadog API credentials loaded successfully.")
 
         logging.info("Attempting to load model artifacts...")
-        model_path = os.path.join(MODEL_DIR, "anomaly_model.pkl")
-        scaler_path = os.path.join(MODEL_DIR, "scaler.pkl")
-        scaled_feature_names_path = os.path.join(MODEL_DIR, "scaled_feature_names.json")
-
-        model = joblib.load(model_path)
-        scaler = joblib.load(scaler_path)
-        with open(scaled_feature_names_path, 'r') as f:
-            scaled_feature_names = json.load(f)
+        version, path = resolve_active_version(MODEL_DIR)
+        configure_rolling_features(read_feature_names(path))
+        active_model = load_model_bundle(version, path)
         
-        logging.info("Model, scaler, and feature names loaded successfully.")
+        logging.info(f"Model, scaler, and feature names loaded successfully (version '{version}').")
+
+        if feature_engine is not None and ROLLING_STATE_PATH:
+            rolling_snapshot_task = asyncio.create_task(snapshot_periodically(feature_engine, ROLLING_STATE_PATH, ROLLING_SNAPSHOT_INTERVAL_S))
+
+        active_model.start_batcher()
+        if active_model.batcher is not None:
+            logging.info(f"Micro-batching enabled for /predict (max size {MICROBATCH_MAX_SIZE}, max wait {MICROBATCH_MAX_WAIT_MS} ms).")
+
+        result_cache = cache_from_env()
+        if result_cache is not None:
+            logging.info(f"Result cache enabled for repeated message_ids (up to {result_cache.max_entries} entries, TTL {result_cache.ttl_s}s).")
+
+        stage_report_task = asyncio.create_task(stage_metrics.report_periodically())
+
+        model_reload_lock = asyncio.Lock()
+        try:
+            # SIGHUP reloads as well; prefork_server.py signals its workers this way after publishing a version.
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(reload_model()))
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError): # No SIGHUP (Windows), or not the main thread
+            pass
+        if MODEL_POLL_INTERVAL_S > 0:
+            model_poll_task = asyncio.create_task(poll_model_dir(MODEL_POLL_INTERVAL_S))
+            logging.info(f"Polling '{MODEL_DIR}' for new model versions every {MODEL_POLL_INTERVAL_S}s.")
+
+        if GLOBAL_DD_API_METRICS_URL and GLOBAL_DD_API_KEY_HEADER:
+            import aiohttp # For making async HTTP requests to Datadog API
+            from metrics_client import MetricsAggregator # Batches Datadog metrics into periodic payloads
 
-        # Initialize aiohttp ClientSession for Datadog API calls
-        dd_http_session = aiohttp.ClientSession() 
-        logging.info("aiohttp ClientSession for Datadog API initialized.")
+            # Initialize aiohttp ClientSession for Datadog API calls
+            dd_http_session = aiohttp.ClientSession() 
+            logging.info("aiohttp ClientSession for Datadog API initialized.")
+
+            metrics = MetricsAggregator(dd_http_session, GLOBAL_DD_API_METRICS_URL, GLOBAL_DD_API_KEY_HEADER, flush_interval_s=DD_FLUSH_INTERVAL_S)
+            metrics.start()
+            logging.info(f"Datadog metrics aggregator started (flush every {DD_FLUSH_INTERVAL_S}s).")
 
     except Exception as e:
         logging.error(f"API startup failed: Could not load model artifacts or init clients. Error: {e}")
@@ -117,7 +459,31 @@ async def close_dd_session():
     """
     Close the Datadog aiohttp client session when the API shuts down.
     """
-    global dd_http_session
+    global dd_http_session, metrics, rolling_snapshot_task, model_poll_task, stage_report_task
+    if model_poll_task:
+        model_poll_task.cancel()
+        model_poll_task = None
+    if active_model is not None and active_model.batcher is not None:
+        await active_model.batcher.close()
+        active_model.batcher = None
+        logging.info("Micro-batcher stopped.")
+    if batcher_drain_tasks:
+        # Retired versions still scoring their queued rows finish before the session closes.
+        await asyncio.gather(*batcher_drain_tasks, return_exceptions=True)
+    if rolling_snapshot_task:
+        rolling_snapshot_task.cancel()
+        rolling_snapshot_task = None
+    if stage_report_task:
+        stage_report_task.cancel()
+        stage_report_task = None
+        stage_metrics.flush()
+    if feature_engine is not None and ROLLING_STATE_PATH:
+        n_units = feature_engine.snapshot(ROLLING_STATE_PATH)
+        logging.info(f"Rolling feature state for {n_units} units saved to '{ROLLING_STATE_PATH}'.")
+    if metrics:
+        await metrics.close()
+        logging.info(f"Datadog metrics aggregator flushed and stopped: {metrics.stats()}")
+        metrics = None
     if dd_http_session:
         await dd_http_session.close()
         logging.info("aiohttp ClientSession for Datadog API closed.")
@@ -125,81 +491,128 @@ async def close_dd_session():
 # --- Health Check Endpoint ---
 @app.get("/health")
 async def health_check():
-    if model is not None and scaler is not None and scaled_feature_names is not None and dd_http_session is not None:
-        return {"status": "healthy", "model_loaded": True, "message": "API is running and model artifacts are loaded."}
+    if active_model is not None:
+        return {"status": "healthy", "model_loaded": True, "message": "API is running and model artifacts are loaded.",
+                "model_version": active_model.version, "model_loaded_at": active_model.loaded_at,
+                "last_reload_error": last_reload_error,
+                "result_cache": result_cache.stats() if result_cache is not None else None,
+                "logging": logging_setup.stats()}
     else:
         raise HTTPException(status_code=500, detail="API is unhealthy: Model artifacts or clients not loaded.")
 
-# --- Prediction Endpoint ---
-@app.post("/predict")
-async def predict_anomaly(data: SensorDataInput):
-    try:
-        logging.info(f"Received prediction request for unit {data.unit_number}, cycle {data.time_in_cycles}.")
+# --- Metrics Endpoint ---
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Stage latency histograms in Prometheus text format (of every worker under prefork_server.py)."""
+    return Response(stage_metrics.render_prometheus(), media_type=stage_metrics.PROMETHEUS_CONTENT_TYPE)
 
-        input_dict = data.dict()
-        input_df = pd.DataFrame([input_dict])[scaled_feature_names] 
+# --- Model Reload Endpoint ---
+@app.post("/model/reload")
+async def reload_model_endpoint():
+    """Check MODEL_DIR for a new model version now, instead of waiting for the next poll."""
+    if model_reload_lock is None:
+        raise HTTPException(status_code=503, detail="API is still starting up.")
+    reloaded = await reload_model()
+    if not reloaded and last_reload_error is not None:
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving version '{active_model.version}': {last_reload_error}")
+    return {"reloaded": reloaded, "model_version": active_model.version, "model_loaded_at": active_model.loaded_at}
 
-        scaled_input = scaler.transform(input_df)
+# --- Rolling Features Endpoint ---
+@app.get("/features/{unit_number}")
+async def get_rolling_features(unit_number: float):
+    """Current rolling-window features of one unit, as of its last scored reading."""
+    if feature_engine is None:
+        raise HTTPException(status_code=404, detail="Rolling features are not enabled.")
+    features = feature_engine.features(unit_number)
+    if features is None:
+        raise HTTPException(status_code=404, detail=f"No readings seen for unit {unit_number}.")
+    return {"unit_number": unit_number, "window": feature_engine.window, "features": features}
+
+# --- Prediction Endpoint ---
+@app.post("/predict", openapi_extra=readings_request_body(batch=False))
+async def predict_anomaly(request: Request):
+    bundle, readings = await read_readings(request, batch=False)
+    unit_number, time_in_cycles, event_timestamp, message_id = next(response_fields(readings))
+    log_request = predict_log.allow(unit_number)
+    try:
+        if log_request:
+            logging.info(f"Received prediction request for unit {unit_number}, cycle {time_in_cycles}.")
 
-        anomaly_score = float(model.decision_function(scaled_input)[0])
-        prediction_value = model.predict(scaled_input)[0]
-        is_anomaly = True if prediction_value == -1 else False
+        anomaly_score, is_anomaly, model_version = await score_reading(readings, bundle)
 
-        response_data = {
-            "is_anomaly": is_anomaly,
-            "anomaly_score": anomaly_score,
-            "unit_number": data.unit_number,
-            "time_in_cycles": data.time_in_cycles,
-            "event_timestamp": data.event_timestamp,
-            "message_id": data.message_id 
-        }
+        started = time.perf_counter_ns()
+        response = JSONResponse(build_prediction_response(unit_number, time_in_cycles, event_timestamp, message_id, is_anomaly, anomaly_score, model_version))
+        stage_timings["respond"].observe_ns(time.perf_counter_ns() - started)
         
-        logging.info(f"Prediction result: Unit {data.unit_number}, Cycle {data.time_in_cycles}, Anomaly: {is_anomaly}, Score: {anomaly_score:.4f}")
-
-        # --- Send custom metrics directly to Datadog API ---
-        # Use the GLOBAL variables for Datadog API credentials directly here
-        # This bypasses any potential timing issues with the 'if' condition on globals
-        metrics_payload = {
-            "series": [
-                {
-                    "metric": "iot.anomaly.predictions.debug_total", 
-                    "points": [[int(time.time()), 1]], 
-                    "type": "count",
-                    "tags": ["service:model_api", "env:local", "unit_number:{}".format(data.unit_number)]
-                },
-                {
-                    "metric": "iot.anomaly.predictions.debug_anomaly", 
-                    "points": [[int(time.time()), 1 if is_anomaly else 0]],
-                    "type": "count", 
-                    "tags": ["service:model_api", "env:local", "is_anomaly:{}".format(is_anomaly), "unit_number:{}".format(data.unit_number)]
-                },
-                {
-                    "metric": "iot.anomaly.debug_score_distribution", 
-                    "points": [[int(time.time()), anomaly_score]],
-                    "type": "gauge", 
-                    "tags": ["service:model_api", "env:local", "unit_number:{}".format(data.unit_number)]
-                }
-            ]
-        }
-        headers = { # Re-define headers here so GLOBAL_DD_API_KEY_HEADER is used directly
-            "Content-Type": "application/json",
-            "DD-API-KEY": GLOBAL_DD_API_KEY_HEADER # Use GLOBAL variable here
-        }
-        try:
-            # Fire and forget: send the request in a background task
-            # Check if dd_http_session is not None before using it
-            if dd_http_session and GLOBAL_DD_API_METRICS_URL: # Only attempt if session and URL are truly available
-                 asyncio.create_task(dd_http_session.post(GLOBAL_DD_API_METRICS_URL, headers=headers, json=metrics_payload, timeout=aiohttp.ClientTimeout(total=5)))
-                 logging.info("Custom metrics sent to Datadog API.")
-            else:
-                 logging.warning("Datadog API credentials or session not properly initialized. Skipping metrics send.")
-
-        except Exception as dd_e:
-            logging.error(f"Failed to send metrics to Datadog API: {dd_e}")
+        if log_request:
+            logging.info(f"Prediction result: Unit {unit_number}, Cycle {time_in_cycles}, Anomaly: {is_anomaly}, Score: {anomaly_score:.4f}")
+
+        # --- Record custom metrics; the aggregator ships them to Datadog in periodic batches ---
+        record_prediction_metrics(unit_number, is_anomaly, anomaly_score)
             
-        return response_data
+        return response
+
+    except Exception as e:
+        error_message = f"Prediction failed for unit {unit_number}, cycle {time_in_cycles}: {e}"
+        if predict_error_log.allow():
+            logging.error(error_message)
+        raise HTTPException(status_code=500, detail=error_message)
+    finally:
+        bundle.release()
+
+# --- Batch Prediction Endpoint ---
+@app.post("/predict/batch", openapi_extra=readings_request_body(batch=True))
+async def predict_anomaly_batch(request: Request):
+    """
+    Score a list of readings in one request. The whole batch is scaled and evaluated
+    as a single matrix; the response is a list with one /predict-shaped result per reading,
+    in request order.
+    """
+    bundle, readings = await read_readings(request, batch=True)
+    bundle.release() # Batches score on the bundle's engine directly, never through its micro-batcher
+    if len(readings) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch of {len(readings)} readings exceeds the limit of {MAX_BATCH_SIZE}.")
+    if not len(readings):
+        return []
+
+    log_request = predict_batch_log.allow()
+    try:
+        if log_request:
+            logging.info(f"Received batch prediction request with {len(readings)} readings.")
+
+        # Rolling features are built on the event loop, where every other request updates the same
+        # per-unit windows; only scaling and scoring the matrix run in a worker thread, so large
+        # batches do not stall the loop.
+        message_ids = readings.strings["message_id"]
+        results = [None] * len(readings) # (anomaly_score, is_anomaly, model_version) per reading
+        if result_cache is not None:
+            results = [result_cache.get(message_id) if message_id else None for message_id in message_ids]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            indices = None if len(misses) == len(readings) else misses
+            rows = feature_rows(readings, bundle, indices)
+            anomaly_scores, anomaly_flags = await asyncio.to_thread(bundle.score_rows, rows)
+            for i, anomaly_score, is_anomaly in zip(misses, anomaly_scores.tolist(), anomaly_flags.tolist()):
+                results[i] = (anomaly_score, is_anomaly, bundle.version)
+                if result_cache is not None and message_ids[i]:
+                    result_cache.put(message_ids[i], results[i])
+
+        started = time.perf_counter_ns()
+        response_data = []
+        for fields, (anomaly_score, is_anomaly, model_version) in zip(response_fields(readings), results):
+            response_data.append(build_prediction_response(*fields, is_anomaly, anomaly_score, model_version))
+            record_prediction_metrics(fields[0], is_anomaly, anomaly_score)
+        response = JSONResponse(response_data)
+        stage_timings["respond"].observe_ns(time.perf_counter_ns() - started)
+
+        if log_request:
+            logging.info(f"Batch prediction result: {len(readings)} readings ({len(readings) - len(misses)} from the result cache), "
+                         f"{sum(result[1] for result in results)} anomalies.")
+
+        return response
 
     except Exception as e:
-        error_message = f"Prediction failed for unit {data.unit_number}, cycle {data.time_in_cycles}: {e}"
-        logging.error(error_message)
-        raise HTTPException(status_code=500, detail=error_message)
\ No newline at end of file
+        error_message = f"Batch prediction failed for {len(readings)} readings: {e}"
+        if predict_error_log.allow():
+            logging.error(error_message)
+        raise HTTPException(status_code=500, detail=error_message)
@@ -0,0 +1,107 @@
+# model_store.py
+# Locating, validating and warming up model artifact sets in MODEL_DIR.
+#
+# MODEL_DIR may hold the three artifacts directly (the layout the training notebook
+# writes), or one subdirectory per version, each with its own anomaly_model.pkl,
+# scaler.pkl and scaled_feature_names.json, or just the compact engine file written by
+# export_model.py (which is preferred when present and exported from the pickles beside it, see inference_engine.load_engine). With subdirectories, the active version is
+# the one named in MODEL_DIR/CURRENT if that file exists, otherwise the highest version
+# name (so use sortable names such as 20250723-1430). Publish a new version by writing it
+# to a temporary directory and renaming it into MODEL_DIR, so it appears complete.
+import json
+import os
+import warnings
+
+import numpy as np
+
+from inference_engine import ARTIFACT_FILES, ENGINE_FILE, artifact_fingerprint, engine_is_stale, read_engine_header # Re-exported for the services
+
+MANIFEST_FILE = "manifest.json" # Optional: {"version": ...} written alongside the artifacts
+CURRENT_FILE = "CURRENT"
+
+def has_artifacts(path):
+    return (os.path.isfile(os.path.join(path, ENGINE_FILE))
+            or all(os.path.isfile(os.path.join(path, name)) for name in ARTIFACT_FILES))
+
+def version_of(path, default):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            return str(json.load(f)["version"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return default
+
+def resolve_active_version(model_dir):
+    """
+    Returns (version, path) of the artifact set to serve. Flat layouts get a version derived
+    from the manifest or the artifacts' fingerprint, so replacing the files in place is
+    also detected as a new version.
+    """
+    current_path = os.path.join(model_dir, CURRENT_FILE)
+    if os.path.isfile(current_path):
+        with open(current_path) as f:
+            version = f.read().strip()
+        path = os.path.join(model_dir, version)
+        if not has_artifacts(path):
+            raise FileNotFoundError(f"{CURRENT_FILE} names version '{version}', but {path} has no complete artifact set.")
+        return version_of(path, version), path
+
+    versions = sorted(name for name in os.listdir(model_dir)
+                      if not name.startswith(".") and has_artifacts(os.path.join(model_dir, name)))
+    if versions:
+        path = os.path.join(model_dir, versions[-1])
+        return version_of(path, versions[-1]), path
+    if has_artifacts(model_dir):
+        return version_of(model_dir, f"flat-{artifact_fingerprint(model_dir)}"), model_dir
+    raise FileNotFoundError(f"No model artifacts found in {model_dir}.")
+
+def read_feature_names(path):
+    """Feature names of the artifact set at `path`, without loading the model."""
+    names_path = os.path.join(path, "scaled_feature_names.json")
+    if os.path.isfile(names_path):
+        with open(names_path) as f:
+            return json.load(f)
+    return read_engine_header(os.path.join(path, ENGINE_FILE))["feature_names"]
+
+def validate_artifacts(model, scaler, feature_names):
+    """Raise ValueError when the model, scaler and feature list do not describe the same inputs."""
+    n_features = len(feature_names)
+    if len(set(feature_names)) != n_features:
+        raise ValueError("scaled_feature_names.json contains duplicate names.")
+    for name, estimator in (("model", model), ("scaler", scaler)):
+        expected = getattr(estimator, "n_features_in_", n_features)
+        if expected != n_features:
+            raise ValueError(f"The {name} expects {expected} features, but scaled_feature_names.json lists {n_features}.")
+    fitted_names = getattr(scaler, "feature_names_in_", None)
+    if fitted_names is not None and list(fitted_names) != list(feature_names):
+        raise ValueError("The scaler was fitted on different feature names than scaled_feature_names.json.")
+
+def synthetic_rows(scaler, n_rows=64, seed=0):
+    """Rows spread over (and a little beyond) the scaler's fitted range of each feature."""
+    low, high = np.asarray(scaler.data_min_, dtype=np.float64), np.asarray(scaler.data_max_, dtype=np.float64)
+    margin = (high - low) * 0.1
+    return np.random.default_rng(seed).uniform(low - margin, high + margin, size=(n_rows, len(low)))
+
+def warm_up(engine, model, scaler, n_rows=64, tolerance=1e-6):
+    """
+    Score synthetic rows with the engine (touching every node table once) and check them
+    against sklearn's own decision_function. Raises ValueError on non-finite or diverging scores.
+    Engines loaded from an engine file (model and scaler None) are checked against the rows
+    sklearn scored at export time instead.
+    """
+    if model is None:
+        if engine.reference_rows is None:
+            raise ValueError("Engine file has no reference rows to warm up with.")
+        rows, reference = engine.reference_rows, engine.reference_scores
+    else:
+        rows = synthetic_rows(scaler, n_rows)
+    anomaly_scores, _ = engine.score(rows)
+    if not np.all(np.isfinite(anomaly_scores)):
+        raise ValueError("Warm-up produced non-finite anomaly scores.")
+    if model is not None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore") # Estimators fitted on DataFrames warn about unnamed arrays
+            reference = model.decision_function(scaler.transform(rows))
+    max_diff = float(np.max(np.abs(anomaly_scores - reference)))
+    if max_diff > tolerance:
+        raise ValueError(f"Warm-up scores differ from sklearn by up to {max_diff:.2e}.")
+    return max_diff
@@ -0,0 +1,202 @@
+# prefork_server.py
+# Pre-fork multi-process serving of model_api.py. The parent resolves the active model version
+# once, writes its flattened engine (inference_engine.ENGINE_FILE) to a shared-memory directory,
+# binds the port, and starts MODEL_API_WORKERS uvicorn worker processes that all accept on that
+# one socket. Every worker memory-maps the same read-only engine file, so the forest's node
+# tables sit in RAM once however many workers score with them.
+#
+# The parent also takes over hot reload: it checks MODEL_DIR every MODEL_POLL_INTERVAL_S
+# seconds, publishes a new version's engine file next to the current one and sends SIGHUP to
+# the workers, which reload it (model_api.py). Workers that exit are restarted. Workers share
+# their stage latency histograms through files in PREFORK_METRICS_DIR (see stage_metrics.py).
+#
+# Rolling-window features (feature_engine.py) keep per-unit state inside one process, and a
+# unit's readings would be spread over all workers, so models that use them are served by a
+# single worker.
+#
+# Usage:
+#   python prefork_server.py [--host 0.0.0.0] [--port 8000] [--workers N]
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+from feature_engine import enabled_from_env, uses_rolling_features
+from inference_engine import ENGINE_FILE
+from model_store import CURRENT_FILE, MANIFEST_FILE, engine_is_stale, read_feature_names, resolve_active_version
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+MODEL_POLL_INTERVAL_S = float(os.getenv("MODEL_POLL_INTERVAL_S", "30"))
+WORKER_SHUTDOWN_TIMEOUT_S = 30
+
+# Engine files the workers map; tmpfs (/dev/shm) keeps them in shared memory, not on disk.
+DEFAULT_ENGINE_DIR = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "model-api-engines")
+ENGINE_DIR = os.getenv("PREFORK_ENGINE_DIR", DEFAULT_ENGINE_DIR)
+# Per-worker stage latency files (stage_metrics.py), so /metrics on any worker reports all of them.
+METRICS_DIR = os.getenv("PREFORK_METRICS_DIR", os.path.join(os.path.dirname(DEFAULT_ENGINE_DIR), "model-api-metrics"))
+
+def usable_cpus():
+    """CPUs this process may run on (respects taskset / cpusets, unlike os.cpu_count())."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _export(path, out_path):
+    from export_model import export_model
+    export_model(path, out_path=out_path)
+
+def publish_engine(version, path, engine_dir):
+    """
+    Make `version` the active version of `engine_dir`: its ENGINE_FILE (copied from `path`, or
+    exported from the pickled artifacts there when `path` has no engine file or a stale one) in a
+    subdirectory, named by `engine_dir`/CURRENT.
+    Returns the subdirectory.
+    """
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", version)
+    target = os.path.join(engine_dir, name)
+    if not os.path.isfile(os.path.join(target, ENGINE_FILE)):
+        staging = tempfile.mkdtemp(prefix=f".{name}.", dir=engine_dir)
+        source = os.path.join(path, ENGINE_FILE)
+        if os.path.isfile(source) and not engine_is_stale(path):
+            shutil.copyfile(source, os.path.join(staging, ENGINE_FILE))
+        else:
+            # export_model imports sklearn and unpickles the model; a short-lived process keeps both out of the parent.
+            process = multiprocessing.get_context("spawn").Process(target=_export, args=(path, os.path.join(staging, ENGINE_FILE)))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise RuntimeError(f"Exporting the engine file of '{path}' failed (exit code {process.exitcode}).")
+        os.chmod(staging, 0o755)
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+            json.dump({"version": version}, f)
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(staging, target)
+
+    current_tmp = os.path.join(engine_dir, f".{CURRENT_FILE}.{os.getpid()}")
+    with open(current_tmp, "w") as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(engine_dir, CURRENT_FILE))
+    return target
+
+def prune_engines(engine_dir, keep):
+    """Remove published versions not in `keep`; workers still mapping one keep their mapping."""
+    for name in os.listdir(engine_dir):
+        if name not in keep and name != CURRENT_FILE:
+            shutil.rmtree(os.path.join(engine_dir, name), ignore_errors=True)
+
+def run_worker(sock, log_level):
+    """Worker process: serve model_api.app on the inherited listening socket."""
+    import uvicorn
+
+    config = uvicorn.Config("model_api:app", log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+class PreforkServer:
+    """Binds the socket, publishes engines and keeps `n_workers` worker processes running."""
+
+    def __init__(self, host, port, n_workers, engine_dir=ENGINE_DIR, log_level="info"):
+        self.host = host
+        self.port = port
+        self.n_workers = n_workers
+        self.engine_dir = engine_dir
+        self.log_level = log_level
+        self.context = multiprocessing.get_context("spawn") # Workers start without the parent's imports
+        self.workers = []
+        self.version = None
+        self.published = []
+        self.stopping = False
+
+    def publish_active_version(self):
+        """Publish the active version of MODEL_DIR if it changed; returns True when it did."""
+        version, path = resolve_active_version(MODEL_DIR)
+        if version == self.version:
+            return False
+        target = publish_engine(version, path, self.engine_dir)
+        self.published = (self.published + [os.path.basename(target)])[-2:] # The previous one may still be draining
+        prune_engines(self.engine_dir, self.published)
+        logging.info(f"Published model version '{version}' from '{path}' to '{target}'.")
+        self.version = version
+        return True
+
+    def start_worker(self, sock):
+        process = self.context.Process(target=run_worker, args=(sock, self.log_level), name="model-api-worker")
+        process.start()
+        return process
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def serve(self):
+        os.makedirs(self.engine_dir, exist_ok=True)
+        self.publish_active_version()
+        feature_names = read_feature_names(os.path.join(self.engine_dir, self.published[-1]))
+        if self.n_workers > 1 and enabled_from_env(enabled_default=uses_rolling_features(feature_names)):
+            logging.warning(f"Rolling features keep per-unit state in one process; serving with 1 worker instead of {self.n_workers}.")
+            self.n_workers = 1
+
+        # Workers load only the published engine files, and leave polling to the parent.
+        os.environ.update(MODEL_DIR=self.engine_dir, INFERENCE_ARTIFACT_FORMAT="compact", MODEL_POLL_INTERVAL_S="0",
+                          STAGE_METRICS_DIR=METRICS_DIR)
+        shutil.rmtree(METRICS_DIR, ignore_errors=True) # Histograms start from zero with the server
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        # proto IPPROTO_TCP (not the default 0) so asyncio sets TCP_NODELAY on accepted connections;
+        # without it, Nagle's algorithm adds ~40 ms to every response.
+        sock = socket.socket(socket.AF_INET6 if ":" in self.host else socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.workers = [self.start_worker(sock) for _ in range(self.n_workers)]
+        logging.info(f"Serving model_api on {self.host}:{self.port} with {self.n_workers} workers (engine files in '{self.engine_dir}').")
+
+        next_poll = time.monotonic() + MODEL_POLL_INTERVAL_S
+        while not self.stopping:
+            time.sleep(0.5)
+            for i, process in enumerate(self.workers):
+                if not process.is_alive() and not self.stopping:
+                    logging.warning(f"Worker {process.pid} exited with code {process.exitcode}; restarting it.")
+                    self.workers[i] = self.start_worker(sock)
+            if MODEL_POLL_INTERVAL_S > 0 and time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + MODEL_POLL_INTERVAL_S
+                try:
+                    if self.publish_active_version():
+                        for process in self.workers:
+                            os.kill(process.pid, signal.SIGHUP)
+                except Exception as e:
+                    logging.error(f"Publishing the active model version of '{MODEL_DIR}' failed, workers keep serving '{self.version}': {e}")
+
+        logging.info(f"Stopping {len(self.workers)} workers...")
+        for process in self.workers:
+            process.terminate()
+        for process in self.workers:
+            process.join(WORKER_SHUTDOWN_TIMEOUT_S)
+            if process.is_alive():
+                process.kill()
+        sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve model_api.py with several worker processes sharing one model copy.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MODEL_API_WORKERS", "0")) or usable_cpus(),
+                        help="Worker processes (default: $MODEL_API_WORKERS, or one per usable CPU).")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info").lower())
+    args = parser.parse_args()
+    PreforkServer(args.host, args.port, max(args.workers, 1), log_level=args.log_level).serve()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# reading_decoder.py
+# Request decoding for model_api.py and score.py without a pydantic model or DataFrame per
+# request: a JSON body (or a packed frame, see wire_format.py) is written straight into a
+# preallocated float64 matrix whose columns are laid out once per model version, feature
+# columns first in scaled_feature_names order, so the model's input is a slice of it.
+#
+# Type rules follow the pydantic `float` / `str` fields of model_api.SensorDataInput: numbers
+# and numeric strings are accepted, a missing field, null or non-numeric value is reported
+# with the same error types, messages and locations FastAPI returns for a validation error
+# (in a packed frame, a NaN required value counts as missing).
+import json
+import operator
+
+import numpy as np
+
+try:
+    from pydantic_core import from_json as _json_loads # Rust parser, about 3x faster than json.loads on these bodies
+except ImportError: # e.g. score.py's Azure ML environment without pydantic
+    _json_loads = json.loads
+
+class ReadingDecodeError(ValueError):
+    """Invalid request body; `errors` holds pydantic-style error dicts (type, loc, msg, input)."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{'.'.join(str(part) for part in error['loc']) or 'body'}: {error['msg']}" for error in errors[:5]))
+
+class Readings:
+    """
+    Decoded readings: `values` is a (readings, len(columns)) float64 matrix, `strings` maps each
+    string field to one value (or None) per reading.
+    """
+
+    def __init__(self, decoder, values, strings):
+        self.decoder = decoder
+        self.values = values
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.values)
+
+    def column(self, name):
+        return self.values[:, self.decoder.index[name]]
+
+def _error(error_type, loc, msg, value):
+    return {"type": error_type, "loc": loc, "msg": msg, "input": value}
+
+class ReadingDecoder:
+    """
+    Decodes readings into rows laid out like `columns`. Every name in `fields` (default: all
+    columns) is required and numeric; columns that are not fields (e.g. rolling features
+    computed later) are left uninitialized. `string_fields` are optional strings.
+    """
+
+    def __init__(self, columns, fields=None, string_fields=()):
+        self.columns = list(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.required = list(fields) if fields is not None else list(self.columns) # Error reporting order
+        self.fields = [name for name in self.columns if name in set(self.required)] # Column order, for the fast path
+        self.string_fields = list(string_fields)
+        positions = [self.index[name] for name in self.fields]
+        self._get_fields = operator.itemgetter(*self.fields) if len(self.fields) > 1 else (lambda record: (record[self.fields[0]],))
+        # Fields that form a leading block of columns are written with one slice assignment per row.
+        self._target = slice(0, len(positions)) if positions == list(range(len(positions))) else np.array(positions, dtype=np.intp)
+
+    def _field_errors(self, record, loc):
+        """Errors for one reading object, in field order; only called once the fast path has failed."""
+        if not isinstance(record, dict):
+            return [_error("model_type", loc, "Input should be an object", record)]
+        errors = []
+        for name in self.required:
+            if name not in record:
+                errors.append(_error("missing", (*loc, name), "Field required", record))
+                continue
+            value = record[name]
+            if isinstance(value, str):
+                try:
+                    float(value)
+                except ValueError:
+                    errors.append(_error("float_parsing", (*loc, name), "Input should be a valid number, unable to parse string as a number", value))
+            elif not isinstance(value, (int, float)):
+                errors.append(_error("float_type", (*loc, name), "Input should be a valid number", value))
+        for name in self.string_fields:
+            value = record.get(name)
+            if value is not None and not isinstance(value, str):
+                errors.append(_error("string_type", (*loc, name), "Input should be a valid string", value))
+        return errors
+
+    def decode_records(self, records, loc=()):
+        """Readings from a list of reading dicts (e.g. parsed JSON); raises ReadingDecodeError listing every invalid field."""
+        values = np.empty((len(records), len(self.columns)), dtype=np.float64)
+        strings = {name: [None] * len(records) for name in self.string_fields}
+        get_fields, target, errors = self._get_fields, self._target, []
+        string_columns = [(name, strings[name]) for name in self.string_fields]
+        for i, record in enumerate(records):
+            try:
+                # NumPy's float conversion accepts exactly what pydantic's lax float does (numbers,
+                # numeric strings, booleans) and raises for null, lists, objects and other strings.
+                values[i, target] = get_fields(record)
+                for name, column in string_columns:
+                    value = record.get(name)
+                    if value is not None and value.__class__ is not str:
+                        raise TypeError(name)
+                    column[i] = value
+            except (KeyError, TypeError, ValueError, AttributeError, OverflowError):
+                record_loc = (*loc, i) if loc is not None else ()
+                errors.extend(self._field_errors(record, record_loc) or [_error("value_error", record_loc, "Invalid reading", record)])
+        if errors:
+            raise ReadingDecodeError(errors)
+        return Readings(self, values, strings)
+
+    def decode_json(self, body, batch=False):
+        """Readings from a JSON body: one object, or a list of objects when `batch`."""
+        try:
+            parsed = _json_loads(body)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise ReadingDecodeError([_error("json_invalid", (), f"JSON decode error: {e}", None)])
+        if batch:
+            if not isinstance(parsed, list):
+                raise ReadingDecodeError([_error("list_type", (), "Input should be a valid list", parsed)])
+            return self.decode_records(parsed, loc=())
+        return self.decode_records([parsed], loc=None)
+
+    def decode_frame(self, frame, loc=()):
+        """
+        Readings from a decoded wire_format.Frame; raises ReadingDecodeError when its schema lacks a
+        field or a reading's required value is not finite. wire_format.encode_records writes a field
+        missing from a record as NaN, so NaN is reported like a missing JSON field. `loc` as in
+        decode_records (None for a single reading).
+        """
+        missing = [name for name in self.required if name not in frame.schema.index]
+        if missing:
+            raise ReadingDecodeError([_error("missing", (name,), "Field required", None) for name in missing])
+        values = np.empty((len(frame), len(self.columns)), dtype=np.float64)
+        values[:, self._target] = frame.values[:, [frame.schema.index[name] for name in self.fields]]
+        if not np.isfinite(values[:, self._target]).all():
+            raise ReadingDecodeError(self._non_finite_errors(frame, loc))
+        strings = {name: frame.strings.get(name, [None] * len(frame)) for name in self.string_fields}
+        return Readings(self, values, strings)
+
+    def _non_finite_errors(self, frame, loc):
+        """Errors for the NaN (missing) and infinite required values of a frame, in reading then field order."""
+        errors = []
+        columns = [(name, frame.schema.index[name]) for name in self.required]
+        for i in np.flatnonzero(~np.isfinite(frame.values[:, [column for _, column in columns]]).all(axis=1)):
+            row = frame.values[i]
+            # The reading as the error's input, without the non-finite values (not valid JSON in a 422 body).
+            record = {name: value for name, value in zip(frame.schema.fields, row.tolist()) if np.isfinite(value)}
+            record_loc = (*loc, int(i)) if loc is not None else ()
+            for name, column in columns:
+                if np.isnan(row[column]):
+                    errors.append(_error("missing", (*record_loc, name), "Field required", record))
+                elif np.isinf(row[column]):
+                    errors.append(_error("finite_number", (*record_loc, name), "Input should be a finite number", record))
+        return errors
@@ -0,0 +1,180 @@
+# resilience.py
+# Guards for event_consumer.py's calls to model_api, so an outage or slowdown of the model API
+# costs the consumer a bounded amount of time instead of a full timeout per event:
+#
+#   CircuitBreaker          -- after `failure_threshold` consecutive failures calls fail fast for
+#                              `reset_timeout_s`; then one probe call at a time is let through
+#                              (half-open) and its outcome closes the circuit or reopens it with
+#                              the timeout doubled (up to `max_reset_timeout_s`).
+#   RetryBudget             -- retries shared by all model calls, limited to `ratio` of the calls
+#                              made plus `min_per_s`, so retries cannot multiply load on a
+#                              struggling API.
+#   AdaptiveBatchController -- picks receive_batch's max_batch_size / max_wait_time from the observed
+#                              downstream latency per batch, aiming for `target_latency_s` per batch.
+import asyncio
+import logging
+import time
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a downstream service whose circuit is open."""
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout_s=5.0, max_reset_timeout_s=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout_s = reset_timeout_s
+        self.max_reset_timeout_s = max_reset_timeout_s
+        self.state = self.CLOSED
+        self.reset_timeout_s = reset_timeout_s
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = None # monotonic start of the half-open probe in flight
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """True if a call may go ahead now (its outcome must then be recorded)."""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.reset_timeout_s:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_started_at = None
+        # Half-open: one probe at a time. A probe that never reported (e.g. its task was
+        # cancelled) is given up on after reset_timeout_s.
+        if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout_s:
+            self.rejected += 1
+            return False
+        self.probe_started_at = now
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logging.info(f"Circuit '{self.name}' closed: the probe call succeeded after {time.monotonic() - self.opened_at:.1f}s open.")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.reset_timeout_s = self.base_reset_timeout_s
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self.reset_timeout_s = min(self.reset_timeout_s * 2, self.max_reset_timeout_s)
+            self._open(f"the probe call failed, retrying in {self.reset_timeout_s:.0f}s")
+        elif self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open(f"{self.consecutive_failures} consecutive failures, retrying in {self.reset_timeout_s:.0f}s")
+
+    def _open(self, reason):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probe_started_at = None
+        self.times_opened += 1
+        logging.warning(f"Circuit '{self.name}' opened: {reason}. Calls fail fast until then.")
+
+    def stats(self):
+        return {"state": self.state, "times_opened": self.times_opened, "rejected": self.rejected,
+                "consecutive_failures": self.consecutive_failures}
+
+class RetryBudget:
+    """Token bucket of retries: each call adds `ratio` tokens, time adds `min_per_s`; a retry takes one."""
+
+    def __init__(self, ratio=0.1, min_per_s=1.0, max_tokens=100.0):
+        self.ratio = ratio
+        self.min_per_s = min_per_s
+        self.max_tokens = max_tokens
+        self.tokens = min(min_per_s, max_tokens)
+        self.retries = 0
+        self.exhausted = 0
+        self._refilled_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._refilled_at) * self.min_per_s)
+        self._refilled_at = now
+
+    def record_call(self):
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_retry(self):
+        """Take a retry from the budget; False when it is spent."""
+        self._refill()
+        if self.tokens < 1.0:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1.0
+        self.retries += 1
+        return True
+
+    def stats(self):
+        return {"retries": self.retries, "exhausted": self.exhausted, "tokens": round(self.tokens, 1)}
+
+class AdaptiveBatchController:
+    """
+    Sizes Event Hub receive batches from the downstream latency reported by observe():
+    max_batch_size ~ target_latency_s / (smoothed seconds per event), so one batch's model call
+    takes about target_latency_s, and max_wait_time = target_latency_s minus the smoothed latency
+    per batch (a slow downstream leaves less time to wait for a batch to fill). receive_batch
+    takes both when it starts, so wait_for_change() returns once the proposal differs from the
+    values in use by `change_ratio` or more, at most every `retune_interval_s` seconds.
+    """
+
+    def __init__(self, batch_size=100, max_wait_time=5.0, min_batch_size=10, max_batch_size=500,
+                 min_wait_time=0.1, target_latency_s=1.0, retune_interval_s=30.0, change_ratio=1.5, smoothing=0.2):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_wait_time = min_wait_time
+        self.max_wait_time_limit = max_wait_time
+        self.target_latency_s = target_latency_s
+        self.retune_interval_s = retune_interval_s
+        self.change_ratio = change_ratio
+        self.smoothing = smoothing
+        self.batch_size = min(max(batch_size, min_batch_size), max_batch_size) # Proposed values
+        self.max_wait_time = max_wait_time
+        self.applied = None # (max_batch_size, max_wait_time) receive_batch runs with
+        self.applied_at = time.monotonic()
+        self.batch_latency_s = None # Smoothed downstream seconds per batch
+        self.event_latency_s = None # ... and per event
+        self.retunes = 0
+        self._changed = asyncio.Event()
+
+    def apply(self):
+        """The values to start receive_batch with; they count as in use from now on."""
+        if self.applied is not None:
+            self.retunes += 1
+        self.applied = (self.batch_size, self.max_wait_time)
+        self.applied_at = time.monotonic()
+        self._changed.clear()
+        return self.applied
+
+    def observe(self, n_events, latency_s):
+        """Record the downstream latency of one batch of `n_events` events."""
+        if n_events <= 0:
+            return
+        if self.batch_latency_s is None:
+            self.batch_latency_s, self.event_latency_s = latency_s, latency_s / n_events
+        else:
+            self.batch_latency_s += self.smoothing * (latency_s - self.batch_latency_s)
+            self.event_latency_s += self.smoothing * (latency_s / n_events - self.event_latency_s)
+        self.batch_size = int(min(max(self.target_latency_s / max(self.event_latency_s, 1e-6), self.min_batch_size), self.max_batch_size))
+        self.max_wait_time = round(min(max(self.target_latency_s - self.batch_latency_s, self.min_wait_time), self.max_wait_time_limit), 2)
+        if self.applied is not None and self._differs() and time.monotonic() - self.applied_at >= self.retune_interval_s:
+            self._changed.set()
+
+    def _differs(self):
+        applied_size, applied_wait = self.applied
+        size_ratio = max(self.batch_size, applied_size) / min(self.batch_size, applied_size)
+        wait_ratio = max(self.max_wait_time, applied_wait) / min(self.max_wait_time, applied_wait)
+        return size_ratio >= self.change_ratio or wait_ratio >= self.change_ratio
+
+    async def wait_for_change(self):
+        await self._changed.wait()
+
+    def stats(self):
+        return {"max_batch_size": self.batch_size, "max_wait_time": self.max_wait_time, "retunes": self.retunes,
+                "batch_latency_ms": round(self.batch_latency_s * 1e3, 1) if self.batch_latency_s is not None else None}
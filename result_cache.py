@@ -0,0 +1,67 @@
+# result_cache.py
+# Bounded LRU + TTL cache of scoring results, keyed by message id.
+#
+# Event Hub redelivers events after a consumer restart (and whenever a batch is retried),
+# and every redelivery would otherwise be scored and written again. ResultCache remembers
+# the result for a key for `ttl_s` seconds, keeps at most `max_entries` keys (least
+# recently used evicted first), and counts hits and misses so the cost of replays is
+# visible. Used by event_consumer.py (keyed by the Cosmos document id) and model_api.py
+# (keyed by message_id).
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class ResultCache:
+    """Thread-safe LRU cache whose entries also expire `ttl_s` seconds after they were stored."""
+
+    def __init__(self, max_entries=100000, ttl_s=3600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._entries = OrderedDict() # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """The value stored for `key`, or `default` when absent or expired (counted as a miss)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl_s, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations, "evictions": self.evictions}
+
+def cache_from_env():
+    """ResultCache sized by RESULT_CACHE_MAX_ENTRIES (0 disables: returns None) and RESULT_CACHE_TTL_S."""
+    max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "100000"))
+    if max_entries <= 0:
+        return None
+    return ResultCache(max_entries=max_entries, ttl_s=float(os.getenv("RESULT_CACHE_TTL_S", "3600")))
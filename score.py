@@ -1,27 +1,22 @@
 # score.py
 import os
 import json
-import joblib
-import numpy as np
-import pandas as pd
 import logging 
 
+from inference_engine import load_engine
+from reading_decoder import ReadingDecoder
+
 model = None
 scaler = None
 scaled_feature_names = None
+engine = None
+decoder = None
 
 def init():
-    global model, scaler, scaled_feature_names
+    global model, scaler, scaled_feature_names, engine, decoder
     try:
-        model_path = os.path.join(os.getenv("AZUREML_MODEL_DIR"), "anomaly_model.pkl")
-        scaler_path = os.path.join(os.getenv("AZUREML_MODEL_DIR"), "scaler.pkl")
-        scaled_feature_names_path = os.path.join(os.getenv("AZUREML_MODEL_DIR"), "scaled_feature_names.json")
-
-        model = joblib.load(model_path)
-        scaler = joblib.load(scaler_path)
-
-        with open(scaled_feature_names_path, 'r') as f:
-            scaled_feature_names = json.load(f)
+        engine, model, scaler, scaled_feature_names = load_engine(os.getenv("AZUREML_MODEL_DIR"))
+        decoder = ReadingDecoder(scaled_feature_names)
 
         logging.info("Model, scaler, and feature names loaded successfully for inference.")
     except Exception as e:
@@ -30,18 +25,14 @@ def init():
 
 def run(raw_data):
     try:
-        data_dict = json.loads(raw_data)
-
-        input_df = pd.DataFrame([data_dict]) 
-
-        input_features = input_df[scaled_feature_names]
-
-        scaled_input = scaler.transform(input_features)
+        # The body is decoded straight into one feature row in scaled_feature_names order; a missing
+        # or non-numeric feature raises ReadingDecodeError naming the field.
+        input_features = decoder.decode_json(raw_data).values
 
-        anomaly_score = model.decision_function(scaled_input)[0] 
+        anomaly_scores, anomaly_flags = engine.score(input_features)
 
-        prediction = model.predict(scaled_input)[0]
-        is_anomaly = True if prediction == -1 else False
+        anomaly_score = anomaly_scores[0]
+        is_anomaly = bool(anomaly_flags[0])
 
         result = {
             "is_anomaly": is_anomaly,
@@ -0,0 +1,202 @@
+# stage_metrics.py
+# Per-stage latency histograms for model_api.py and event_consumer.py, exposed in Prometheus
+# text format (model_api's GET /metrics, the consumer's CONSUMER_METRICS_PORT) and summarized
+# in a periodic log line.
+#
+# Buckets are log-linear, HDR-style: SUB_BUCKETS per power of two of nanoseconds, so a
+# recorded duration is known to within 25%, and recording one costs a bit_length(), a shift
+# and two integer increments. Prometheus sees one cumulative bucket per power of two from
+# ~1 us to ~69 s. Increments are not locked: two threads recording into the same histogram
+# at the same instant can lose a count, which is fine for latency distributions.
+#
+# Under prefork_server.py every worker records its own histograms. With STAGE_METRICS_DIR set
+# each process also copies them to small memory-mapped files, one per stage, every
+# STAGE_METRICS_FLUSH_INTERVAL_S seconds, and rendering sums all files in the directory, so
+# /metrics on any worker reports the whole server (files of exited workers included, so
+# counters never go backwards).
+import asyncio
+import glob
+import logging
+import mmap
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+STAGE_METRICS_DIR = os.getenv("STAGE_METRICS_DIR")
+STAGE_METRICS_LOG_INTERVAL_S = float(os.getenv("STAGE_METRICS_LOG_INTERVAL_S", "60")) # 0 disables the summary log
+STAGE_METRICS_FLUSH_INTERVAL_S = float(os.getenv("STAGE_METRICS_FLUSH_INTERVAL_S", "1"))
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SUB_BUCKET_BITS = 2
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_BIT_LENGTH = 40 # Durations from 2**40 ns (~18 min) up share the last bucket
+N_BUCKETS = SUB_BUCKETS * (MAX_BIT_LENGTH - SUB_BUCKET_BITS + 1)
+EXPORT_BITS = range(10, 37) # Prometheus `le` bounds: 2**10 ns (~1 us) to 2**36 ns (~69 s)
+
+def bucket_index(ns):
+    """Bucket of a duration in nanoseconds (values below 2 * SUB_BUCKETS get exact buckets)."""
+    bits = ns.bit_length()
+    if bits <= SUB_BUCKET_BITS + 1:
+        return ns
+    if bits > MAX_BIT_LENGTH:
+        return N_BUCKETS - 1
+    return ((bits - SUB_BUCKET_BITS - 1) << SUB_BUCKET_BITS) + (ns >> (bits - SUB_BUCKET_BITS - 1))
+
+def _bucket_upper_ns(index):
+    """Exclusive upper bound of a bucket, in nanoseconds."""
+    if index < 2 * SUB_BUCKETS:
+        return index + 1
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift
+
+BUCKET_UPPER_NS = np.array([_bucket_upper_ns(i) for i in range(N_BUCKETS)], dtype=np.float64)
+EXPORT_CUTS = [bucket_index(1 << bits) for bits in EXPORT_BITS] # Buckets below each bound
+
+class StageHistogram:
+    """
+    Latency histogram of one stage: N_BUCKETS counts followed by the sum of all durations in
+    nanoseconds. Record with `observe_ns(time.perf_counter_ns() - started)`. Counts are kept in
+    a list (the cheapest thing to increment) and copied to the process's file by flush().
+    """
+
+    def __init__(self, metric, stage, directory=None):
+        self.metric = metric
+        self.stage = stage
+        self.counts = [0] * (N_BUCKETS + 1)
+        self._file = None
+        if directory:
+            path = os.path.join(directory, f"{metric}.{stage}.{os.getpid()}.bin")
+            with open(path, "w+b") as f:
+                f.truncate(8 * (N_BUCKETS + 1))
+                self._file = mmap.mmap(f.fileno(), 8 * (N_BUCKETS + 1))
+
+    def observe_ns(self, ns):
+        bits = ns.bit_length()
+        if bits <= SUB_BUCKET_BITS + 1:
+            index = ns
+        elif bits <= MAX_BIT_LENGTH:
+            index = ((bits - SUB_BUCKET_BITS - 1) << SUB_BUCKET_BITS) + (ns >> (bits - SUB_BUCKET_BITS - 1))
+        else:
+            index = N_BUCKETS - 1
+        counts = self.counts
+        counts[index] += 1
+        counts[N_BUCKETS] += ns
+
+    def snapshot(self):
+        """Counts and sum of this process, as an int64 array."""
+        return np.array(self.counts, dtype=np.int64)
+
+    def flush(self):
+        if self._file is not None:
+            self._file[:] = self.snapshot().tobytes()
+
+_histograms = {} # (metric, stage) -> StageHistogram of this process
+_help = {} # metric -> HELP text
+_last_logged = {} # (metric, stage) -> snapshot at the previous summary log
+
+def stage_histogram(metric, stage, help_text=""):
+    """The histogram of `stage` in `metric` (created on first use), labelled stage="<stage>"."""
+    key = (metric, stage)
+    if key not in _histograms:
+        if STAGE_METRICS_DIR:
+            os.makedirs(STAGE_METRICS_DIR, exist_ok=True)
+        _histograms[key] = StageHistogram(metric, stage, STAGE_METRICS_DIR)
+        _help.setdefault(metric, help_text)
+    return _histograms[key]
+
+def quantile_ns(counts, q):
+    """Upper bound of the bucket holding quantile `q` of a snapshot (0 when it is empty)."""
+    cumulative = np.cumsum(counts[:N_BUCKETS])
+    if not len(cumulative) or cumulative[-1] == 0:
+        return 0.0
+    return float(BUCKET_UPPER_NS[np.searchsorted(cumulative, q * cumulative[-1])])
+
+def flush():
+    for histogram in _histograms.values():
+        histogram.flush()
+
+def _totals():
+    """(metric, stage) -> counts and sum over this process, or over every process of STAGE_METRICS_DIR."""
+    if not STAGE_METRICS_DIR:
+        return {key: histogram.snapshot() for key, histogram in _histograms.items()}
+    flush() # This process's files are current; the others are at most one flush interval old
+    totals = {}
+    for path in glob.glob(os.path.join(STAGE_METRICS_DIR, "*.bin")):
+        try:
+            metric, stage, _pid, _ = os.path.basename(path).split(".")
+            data = np.fromfile(path, dtype=np.int64)
+        except (OSError, ValueError):
+            continue
+        if len(data) == N_BUCKETS + 1:
+            totals[(metric, stage)] = totals.get((metric, stage), 0) + data
+    return totals
+
+def render_prometheus():
+    """Every histogram in Prometheus text exposition format."""
+    lines, current_metric = [], None
+    for (metric, stage), data in sorted(_totals().items()):
+        if metric != current_metric:
+            current_metric = metric
+            lines.append(f"# HELP {metric} {_help.get(metric) or 'Stage latency.'}")
+            lines.append(f"# TYPE {metric} histogram")
+        cumulative = np.cumsum(data[:N_BUCKETS])
+        for bits, cut in zip(EXPORT_BITS, EXPORT_CUTS):
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="{(1 << bits) / 1e9:.6g}"}} {int(cumulative[cut - 1])}')
+        lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {int(cumulative[-1])}')
+        lines.append(f'{metric}_sum{{stage="{stage}"}} {data[N_BUCKETS] / 1e9:.9g}')
+        lines.append(f'{metric}_count{{stage="{stage}"}} {int(cumulative[-1])}')
+    return "\n".join(lines) + "\n"
+
+def summary():
+    """One line with count, mean, p50 and p99 per stage of this process since the previous call."""
+    parts = []
+    for key, histogram in _histograms.items():
+        current = histogram.snapshot()
+        delta = current - _last_logged.get(key, 0)
+        _last_logged[key] = current
+        n = int(delta[:N_BUCKETS].sum())
+        if n:
+            parts.append(f"{key[1]} n={n} mean={delta[N_BUCKETS] / n / 1e3:.1f}us "
+                         f"p50={quantile_ns(delta, 0.5) / 1e3:.1f}us p99={quantile_ns(delta, 0.99) / 1e3:.1f}us")
+    return "; ".join(parts)
+
+async def report_periodically(log_interval_s=STAGE_METRICS_LOG_INTERVAL_S, flush_interval_s=STAGE_METRICS_FLUSH_INTERVAL_S):
+    """Background task: flush() to STAGE_METRICS_DIR (when set) and log summary() every `log_interval_s` seconds."""
+    intervals = [interval for interval in (flush_interval_s if STAGE_METRICS_DIR else 0, log_interval_s) if interval > 0]
+    if not intervals:
+        return
+    tick_s = min(intervals)
+    loop = asyncio.get_running_loop()
+    next_log = loop.time() + log_interval_s
+    while True:
+        await asyncio.sleep(tick_s)
+        flush()
+        if log_interval_s > 0 and loop.time() >= next_log:
+            next_log += log_interval_s
+            line = summary()
+            if line:
+                logging.info(f"Stage latencies (last {log_interval_s:.0f}s): {line}")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes are not worth a log line each
+
+def start_http_server(port, host="0.0.0.0"):
+    """Serve GET /metrics from a daemon thread, for processes without a web framework; returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stage-metrics-http", daemon=True).start()
+    return server
@@ -1,24 +1,46 @@
+import numpy as np
 import pandas as pd
 import time
 import json
 import os
+import glob
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from azure.eventhub import EventHubProducerClient, EventData
 from dotenv import load_dotenv # To load environment variables from .env file
 
+import local_pipeline # Local Event Hub stand-in for PIPELINE_BACKEND=local
+import cmaps_cache # Memory-mapped columnar copies of the CMaps files
+import wire_format # Packed binary event bodies for WIRE_FORMAT=packed
+
 # --- Load Environment Variables ---
 # This line looks for a .env file in the same directory and loads its contents
 # as environment variables.
-load_dotenv() 
+load_dotenv()
 
 # --- Configuration ---
 # These variables are loaded from your .env file
 EVENT_HUB_CONNECTION_STR = os.getenv("EVENT_HUB_CONNECTION_STR")
 EVENT_HUB_NAME = os.getenv("EVENT_HUB_NAME")
 
+# "azure" (default) sends to Event Hubs; "local" appends to the file-backed queue in
+# LOCAL_QUEUE_DIR that event_consumer.py reads with the same setting.
+PIPELINE_BACKEND = os.getenv("PIPELINE_BACKEND", "azure").lower()
+LOCAL_QUEUE_DIR = os.getenv("LOCAL_QUEUE_DIR", "local_eventhub")
+LOCAL_PARTITION_COUNT = int(os.getenv("LOCAL_PARTITION_COUNT", "4"))
+
+# Event body encoding: "json" (default) or "packed", a fixed-layout float vector with a schema
+# header (wire_format.py) sent with content type wire_format.CONTENT_TYPE. event_consumer.py
+# reads both. WIRE_FORMAT_DTYPE is float64 (default, values arrive exactly as sent) or float32
+# (4 bytes per value; rounding can flip the anomaly flag of readings close to a split threshold).
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "json").lower()
+WIRE_FORMAT_DTYPE = wire_format.dtype_from_name(os.getenv("WIRE_FORMAT_DTYPE", "float64"))
+
 # --- Path to your downloaded NASA Turbofan dataset ---
 # Adjust this path if your 'CMaps' folder or 'train_FD001.txt' file
 # is located differently relative to your script.
-DATASET_PATH = 'CMaps/train_FD001.txt' 
+DATASET_PATH = 'CMaps/train_FD001.txt'
 
 # --- Define column names for the NASA Turbofan FD001 dataset ---
 # There are 26 columns in train_FD001.txt.
@@ -33,90 +55,290 @@ cols = ['unit_number', 'time_in_cycles', 'setting_1', 'setting_2', 'setting_3']
 MESSAGES_PER_SECOND = 10  # How many sensor readings to send per second
 SEND_LIMIT = 5000         # Max messages to send for this demo (set to None for infinite stream)
 
-# --- Load Data ---
-try:
-    # NASA Turbofan data is space-separated and has no header by default
-    # sep='\s+' handles one or more whitespace characters as delimiters.
-    # header=None indicates no header row in the file.
-    # names=cols assigns our predefined column names.
-    df = pd.read_csv(DATASET_PATH, sep='\s+', header=None, names=cols)
-    
-    # Optional: For initial testing, you might want to stream data from
-    # a smaller subset of units to see faster cycles or specific behavior.
-    # For example, streaming data for the first 5 unique engine units:
-    df_to_stream = df[df['unit_number'] <= 5].copy() 
-    print(f"Loaded {len(df)} rows from '{DATASET_PATH}'.")
-    print(f"Streaming data for {df_to_stream['unit_number'].nunique()} units, total {len(df_to_stream)} rows for this demo.")
-    
-except FileNotFoundError:
-    print(f"Error: Dataset not found at {DATASET_PATH}. Please ensure the 'CMaps' folder and 'train_FD001.txt' file are in the correct location relative to your script.")
-    exit()
-except Exception as e:
-    print(f"Error loading or processing dataset: {e}")
-    exit()
-
-# --- Initialize Event Hubs Producer Client ---
-# This client is responsible for sending events to your Event Hub.
-producer = None
-try:
+# --- Replay Mode (load generation) ---
+# STREAM_MODE=replay replays every CMaps train_*/test_* file, all units, interleaved cycle by
+# cycle like a live fleet. Rows are serialized a chunk at a time, packed into batches per
+# partition key (one key per engine, so each engine's readings stay in order) up to the
+# batch size limit, and paced by a shared token bucket across REPLAY_WORKERS sender threads.
+# Every file numbers its engines from 1, so each file's unit numbers are offset by the highest
+# unit number of the files before it (in sorted path order): every engine gets its own
+# unit_number, and source_file still names the file it came from.
+STREAM_MODE = os.getenv("STREAM_MODE", "demo").lower()
+REPLAY_FILES = os.getenv("REPLAY_FILES", "CMaps/train_*.txt CMaps/test_*.txt")
+REPLAY_RATE = float(os.getenv("REPLAY_RATE", "10000")) # Target events/s; 0 = as fast as possible
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", "4")) # Parallel sender threads (one producer client each)
+REPLAY_CHUNK_ROWS = int(os.getenv("REPLAY_CHUNK_ROWS", "1000")) # Rows serialized per chunk
+REPLAY_SEND_LIMIT = int(os.getenv("REPLAY_SEND_LIMIT", "0")) or None # Max events to replay; 0 = all
+# With WIRE_FORMAT=packed, up to this many readings of the same engine that fall in one chunk
+# share an event. Event Hubs throughput units cap events/s as well as bytes/s, so small packed
+# events only save throughput units when several readings share an event.
+REPLAY_READINGS_PER_EVENT = int(os.getenv("REPLAY_READINGS_PER_EVENT", "1"))
+
+def load_dataset(path):
+    # The text file is parsed once into CMaps/.cache (see cmaps_cache.py); later runs
+    # memory-map the cached columns instead of re-parsing it.
+    return cmaps_cache.load(path).to_frame()
+
+def create_producer():
+    """Returns (producer client, event class) for the configured backend."""
+    if PIPELINE_BACKEND == "local":
+        queue = local_pipeline.FilePartitionedQueue(LOCAL_QUEUE_DIR, partition_count=LOCAL_PARTITION_COUNT)
+        return local_pipeline.LocalProducerClient(queue), local_pipeline.LocalEventData
     producer = EventHubProducerClient.from_connection_string(
         conn_str=EVENT_HUB_CONNECTION_STR,
         eventhub_name=EVENT_HUB_NAME
     )
-    print("Event Hubs Producer Client initialized successfully.")
-except Exception as e:
-    print(f"Error initializing Event Hubs Producer: {e}")
-    print("Please ensure EVENT_HUB_CONNECTION_STR and EVENT_HUB_NAME are correctly set as environment variables (e.g., in a .env file).")
-    exit()
+    return producer, EventData
+
+def make_event(event_cls, body):
+    """Event for a serialized body; packed bodies carry wire_format.CONTENT_TYPE so consumers can tell them apart."""
+    event = event_cls(body)
+    if isinstance(body, bytes):
+        event.content_type = wire_format.CONTENT_TYPE
+    return event
 
 # --- Simulate Streaming of Sensor Data ---
-print(f"Starting simulation. Sending up to {SEND_LIMIT if SEND_LIMIT else 'all available'} messages at {MESSAGES_PER_SECOND} messages/second...")
-messages_sent = 0
-start_time = time.time()
-
-try:
-    with producer: # 'with' statement ensures the client is properly closed
-        # Iterate through the DataFrame (simulating incoming sensor readings)
-        for index, row in df_to_stream.iterrows():
-            if SEND_LIMIT is not None and messages_sent >= SEND_LIMIT:
-                print(f"Send limit of {SEND_LIMIT} messages reached. Stopping simulation.")
-                break
-
-            # Create a JSON payload for the sensor reading.
-            # Convert the entire Pandas Series (row) to a dictionary.
-            # This will include unit_number, time_in_cycles, settings, and all 21 sensors.
-            sensor_data = row.to_dict() 
-            
-            # Add unique message ID and current timestamp for real-time context.
-            # Use .get() with a default to avoid KeyError if a field is unexpectedly missing
-            sensor_data['message_id'] = f"msg_{messages_sent}_{sensor_data.get('unit_number', 'N/A')}_{sensor_data.get('time_in_cycles', 'N/A')}"
-            sensor_data['event_timestamp'] = pd.Timestamp.now().isoformat() # ISO 8601 format
-
-            # Create an EventData object from the JSON string.
-            event_data = EventData(json.dumps(sensor_data))
-            
-            # Create a batch and add the event. Sending in batches is more efficient.
-            event_data_batch = producer.create_batch()
-            event_data_batch.add(event_data)
-
-            # Send the batch of events to the Event Hub.
-            producer.send_batch(event_data_batch)
-            messages_sent += 1
-
-            # Print status updates periodically
-            if messages_sent % (MESSAGES_PER_SECOND * 5) == 0: # Update every 5 seconds of simulation
-                print(f"Sent {messages_sent} messages. Last Unit: {sensor_data.get('unit_number')}, Cycle: {sensor_data.get('time_in_cycles')}")
-
-            # Pause to simulate real-time intervals
-            time.sleep(1 / MESSAGES_PER_SECOND) 
-
-finally:
-    end_time = time.time()
-    duration = end_time - start_time
-    print(f"\n--- Simulation Summary ---")
-    print(f"Total messages sent: {messages_sent}")
-    print(f"Simulation duration: {duration:.2f} seconds")
-    print(f"Average messages/second: {messages_sent / duration:.2f}")
-    if producer:
-        producer.close()
-        print("Event Hubs Producer Client closed.")
\ No newline at end of file
+def stream_demo(producer, df_to_stream, event_cls=EventData, messages_per_second=MESSAGES_PER_SECOND, send_limit=SEND_LIMIT):
+    """Original one-event-per-send simulator: a steady trickle for demos and dashboards."""
+    print(f"Starting simulation. Sending up to {send_limit if send_limit else 'all available'} messages at {messages_per_second} messages/second...")
+    messages_sent = 0
+    start_time = time.time()
+
+    try:
+        with producer: # 'with' statement ensures the client is properly closed
+            # Iterate through the DataFrame (simulating incoming sensor readings)
+            for index, row in df_to_stream.iterrows():
+                if send_limit is not None and messages_sent >= send_limit:
+                    print(f"Send limit of {send_limit} messages reached. Stopping simulation.")
+                    break
+
+                # Create a JSON payload for the sensor reading.
+                # Convert the entire Pandas Series (row) to a dictionary.
+                # This will include unit_number, time_in_cycles, settings, and all 21 sensors.
+                sensor_data = row.to_dict()
+
+                # Add unique message ID and current timestamp for real-time context.
+                # Use .get() with a default to avoid KeyError if a field is unexpectedly missing
+                sensor_data['message_id'] = f"msg_{messages_sent}_{sensor_data.get('unit_number', 'N/A')}_{sensor_data.get('time_in_cycles', 'N/A')}"
+                sensor_data['event_timestamp'] = pd.Timestamp.now().isoformat() # ISO 8601 format
+
+                # Create an EventData object from the JSON string (or the packed frame).
+                if WIRE_FORMAT == "packed":
+                    event_data = make_event(event_cls, wire_format.encode_records([sensor_data], dtype=WIRE_FORMAT_DTYPE))
+                else:
+                    event_data = event_cls(json.dumps(sensor_data))
+
+                # Create a batch and add the event. Sending in batches is more efficient.
+                event_data_batch = producer.create_batch()
+                event_data_batch.add(event_data)
+
+                # Send the batch of events to the Event Hub.
+                producer.send_batch(event_data_batch)
+                messages_sent += 1
+
+                # Print status updates periodically
+                if messages_sent % (messages_per_second * 5) == 0: # Update every 5 seconds of simulation
+                    print(f"Sent {messages_sent} messages. Last Unit: {sensor_data.get('unit_number')}, Cycle: {sensor_data.get('time_in_cycles')}")
+
+                # Pause to simulate real-time intervals
+                time.sleep(1 / messages_per_second)
+
+    finally:
+        end_time = time.time()
+        duration = end_time - start_time
+        print(f"\n--- Simulation Summary ---")
+        print(f"Total messages sent: {messages_sent}")
+        print(f"Simulation duration: {duration:.2f} seconds")
+        print(f"Average messages/second: {messages_sent / duration:.2f}")
+        print("Event Hubs Producer Client closed.")
+    return messages_sent
+
+# --- Replay Mode ---
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire(n) takes n tokens at once and may overdraw; the caller
+    then sleeps off the debt, so whole batches are paced without per-event sleeps.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate * 0.05, 1.0) # ~50 ms of burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            wait_s = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+def load_replay_plan(patterns=REPLAY_FILES, send_limit=REPLAY_SEND_LIMIT):
+    """
+    Send order for all rows of the matching CMaps files, interleaved by cycle, plus the
+    memory-mapped tables they come from. The plan only holds row references and keys;
+    sensor values are gathered from the shared mapped columns one chunk at a time.
+    """
+    paths = sorted(path for pattern in patterns.split() for path in glob.glob(pattern))
+    if not paths:
+        raise FileNotFoundError(f"No CMaps files match '{patterns}'.")
+    tables, frames = {}, []
+    unit_offset = 0
+    for path in paths:
+        table = tables[os.path.splitext(os.path.basename(path))[0]] = cmaps_cache.load(path)
+        units = np.asarray(table['unit_number'], dtype=np.int64)
+        frames.append(pd.DataFrame({'source_file': table.name, 'row': np.arange(len(table)),
+                                    'unit_number': units + unit_offset, 'time_in_cycles': table['time_in_cycles']}))
+        unit_offset += int(units.max(initial=0))
+    plan = pd.concat(frames, ignore_index=True)
+    # Stable sort keeps each engine's readings in cycle order while interleaving engines and files.
+    plan = plan.sort_values('time_in_cycles', kind='mergesort', ignore_index=True)
+    if send_limit:
+        plan = plan.head(send_limit)
+    plan['partition_key'] = plan['source_file'] + '-' + plan['unit_number'].astype(str)
+    print(f"Loaded {len(plan)} rows for replay from {len(paths)} files ({plan['partition_key'].nunique()} units).")
+    return plan, tables
+
+def serialize_chunk(chunk, tables, run_id, wire=None):
+    """
+    Bodies for a chunk of rows in one vectorized pass (same fields as demo mode plus source_file,
+    with the plan's fleet-wide unit_number): JSON strings, or single-reading packed frames (bytes)
+    when `wire` (default WIRE_FORMAT) is "packed".
+    """
+    rows = chunk['row'].to_numpy()
+    sources = chunk.groupby('source_file', sort=False).indices
+    payload = {}
+    for col in cols:
+        values = np.empty(len(chunk)) # float64, like the row.to_dict() payloads of demo mode
+        for source, positions in sources.items():
+            values[positions] = tables[source][col][rows[positions]]
+        payload[col] = values
+    payload['unit_number'] = chunk['unit_number'].to_numpy(np.float64)
+    source_files = chunk['source_file'].to_numpy()
+    message_ids = (f"replay_{run_id}_" + chunk['partition_key'].to_numpy() + '_'
+                   + chunk['time_in_cycles'].astype(str).to_numpy())
+    event_timestamp = pd.Timestamp.now().isoformat()
+    if (wire or WIRE_FORMAT) == "packed":
+        return wire_format.encode_rows(np.column_stack([payload[col] for col in cols]),
+                                       {'source_file': source_files.tolist(), 'message_id': message_ids.tolist(),
+                                        'event_timestamp': [event_timestamp] * len(chunk)},
+                                       dtype=WIRE_FORMAT_DTYPE)
+    payload = pd.DataFrame(payload)
+    payload['source_file'] = source_files
+    payload['message_id'] = message_ids
+    payload['event_timestamp'] = event_timestamp
+    return payload.to_json(orient='records', lines=True).splitlines()
+
+def event_bodies(bodies, positions, readings_per_event):
+    """The bodies of one engine's rows in a chunk, merging up to `readings_per_event` packed frames per event."""
+    if readings_per_event <= 1 or not isinstance(bodies[positions[0]], bytes):
+        return [bodies[position] for position in positions]
+    return [wire_format.merge_frames([bodies[position] for position in positions[start:start + readings_per_event]])
+            for start in range(0, len(positions), readings_per_event)]
+
+def replay_worker(producer, event_cls, plan, tables, bucket, run_id, chunk_rows, readings_per_event=1):
+    """Sends plan (this worker's engines) chunk by chunk; returns (readings, batches, bytes)."""
+    events = batches = body_bytes = 0
+
+    def send(batch):
+        nonlocal batches
+        bucket.acquire(len(batch))
+        producer.send_batch(batch)
+        batches += 1
+
+    with producer:
+        for start in range(0, len(plan), chunk_rows):
+            chunk = plan.iloc[start:start + chunk_rows]
+            bodies = serialize_chunk(chunk, tables, run_id)
+            for partition_key, positions in chunk.groupby('partition_key', sort=False).indices.items():
+                batch = producer.create_batch(partition_key=partition_key)
+                for body in event_bodies(bodies, positions, readings_per_event):
+                    event = make_event(event_cls, body)
+                    try:
+                        batch.add(event)
+                    except ValueError: # Batch is at its size limit: send it and start the next one
+                        send(batch)
+                        batch = producer.create_batch(partition_key=partition_key)
+                        batch.add(event)
+                    body_bytes += len(body)
+                send(batch)
+                events += len(positions)
+    return events, batches, body_bytes
+
+def stream_replay(plan, tables, rate=REPLAY_RATE, workers=REPLAY_WORKERS, chunk_rows=REPLAY_CHUNK_ROWS, producer_factory=create_producer,
+                  readings_per_event=REPLAY_READINGS_PER_EVENT):
+    """Replays the plan across `workers` sender threads, each owning a disjoint set of engines."""
+    run_id = uuid.uuid4().hex[:8]
+    bucket = TokenBucket(rate)
+    worker_ids = pd.factorize(plan['partition_key'])[0] % workers
+    shards = [plan[worker_ids == w] for w in range(workers)]
+    print(f"Starting replay of {len(plan)} events at {rate if rate > 0 else 'unlimited'} events/s with {workers} workers...")
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(replay_worker, *producer_factory(), shard, tables, bucket, run_id, chunk_rows, readings_per_event)
+                   for shard in shards if len(shard)]
+        results = [future.result() for future in futures]
+    duration = time.time() - start_time
+
+    events = sum(r[0] for r in results)
+    batches = sum(r[1] for r in results)
+    body_bytes = sum(r[2] for r in results)
+    print(f"\n--- Replay Summary ---")
+    print(f"Total events sent: {events} in {batches} batches ({events / max(batches, 1):.1f} events/batch, {body_bytes / 1e6:.1f} MB)")
+    print(f"Replay duration: {duration:.2f} seconds")
+    print(f"Average events/second: {events / duration:.2f}")
+    return events, duration
+
+def main():
+    if PIPELINE_BACKEND != "local" and not (EVENT_HUB_CONNECTION_STR and EVENT_HUB_NAME):
+        print("Please ensure EVENT_HUB_CONNECTION_STR and EVENT_HUB_NAME are correctly set as environment variables (e.g., in a .env file).")
+        return
+
+    if STREAM_MODE == "replay":
+        try:
+            plan, tables = load_replay_plan()
+        except Exception as e:
+            print(f"Error loading replay dataset: {e}")
+            return
+        stream_replay(plan, tables)
+        return
+
+    # --- Load Data ---
+    try:
+        df = load_dataset(DATASET_PATH)
+
+        # Optional: For initial testing, you might want to stream data from
+        # a smaller subset of units to see faster cycles or specific behavior.
+        # For example, streaming data for the first 5 unique engine units:
+        df_to_stream = df[df['unit_number'] <= 5].copy()
+        print(f"Loaded {len(df)} rows from '{DATASET_PATH}'.")
+        print(f"Streaming data for {df_to_stream['unit_number'].nunique()} units, total {len(df_to_stream)} rows for this demo.")
+
+    except FileNotFoundError:
+        print(f"Error: Dataset not found at {DATASET_PATH}. Please ensure the 'CMaps' folder and 'train_FD001.txt' file are in the correct location relative to your script.")
+        return
+    except Exception as e:
+        print(f"Error loading or processing dataset: {e}")
+        return
+
+    # --- Initialize Event Hubs Producer Client ---
+    # This client is responsible for sending events to your Event Hub.
+    try:
+        producer, event_cls = create_producer()
+        print("Event Hubs Producer Client initialized successfully.")
+    except Exception as e:
+        print(f"Error initializing Event Hubs Producer: {e}")
+        print("Please ensure EVENT_HUB_CONNECTION_STR and EVENT_HUB_NAME are correctly set as environment variables (e.g., in a .env file).")
+        return
+
+    stream_demo(producer, df_to_stream, event_cls)
+
+if __name__ == "__main__":
+    main()
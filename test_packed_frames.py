@@ -0,0 +1,35 @@
+# test_packed_frames.py
+# A packed /predict/batch body with a reading that lacks a field is rejected with the same 422
+# as the JSON body: wire_format.encode_records writes the missing value as NaN.
+# Run with: python -m pytest test_packed_frames.py
+import json
+
+from fastapi.testclient import TestClient
+
+import model_api
+import wire_format
+
+def make_reading(unit_number):
+    reading = {name: 1.0 for name in model_api.READING_FIELDS}
+    reading.update(unit_number=float(unit_number), message_id=f"m-{unit_number}")
+    return reading
+
+def test_packed_frame_with_missing_field_is_rejected_like_json():
+    # The body is decoded before anything is scored, so the bundle needs no model.
+    model_api.active_model = model_api.ModelBundle("test", None, None, None, None, ["sensor_2"], None)
+    try:
+        readings = [make_reading(1), make_reading(2)]
+        del readings[1]["sensor_11"]
+        client = TestClient(model_api.app)
+        packed = client.post("/predict/batch", content=wire_format.encode_records(readings),
+                             headers={"Content-Type": wire_format.CONTENT_TYPE})
+        as_json = client.post("/predict/batch", content=json.dumps(readings),
+                              headers={"Content-Type": wire_format.JSON_CONTENT_TYPE})
+    finally:
+        model_api.active_model = None
+
+    assert packed.status_code == as_json.status_code == 422
+    packed_errors, json_errors = packed.json()["detail"], as_json.json()["detail"]
+    assert [(error["type"], error["loc"], error["msg"]) for error in packed_errors] == \
+           [(error["type"], error["loc"], error["msg"]) for error in json_errors] == \
+           [("missing", ["body", 1, "sensor_11"], "Field required")]
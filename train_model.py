@@ -0,0 +1,218 @@
+# train_model.py
+# Training pipeline from anomaly_model_training.ipynb (Cells 3-7) as a reproducible script:
+# select "normal" readings (units 1-5, cycles <= 50 by default, as the notebook's Cosmos query
+# does), fit MinMaxScaler and IsolationForest, and publish anomaly_model.pkl, scaler.pkl and
+# scaled_feature_names.json as a new version of MODEL_DIR (see model_store.py).
+#
+# Inputs are CMaps train_/test_ files (read through cmaps_cache.py) or exports of the `anomalies`
+# container as JSONL (one document per line), CSV or Parquet (needs pyarrow).
+#
+# Trees are built in parallel (--n-jobs, default all CPUs) and --max-samples sets the
+# subsample per tree. With a fixed --random-state the model is the same whatever --n-jobs.
+# The version is written to a temporary directory and renamed into MODEL_DIR, so it appears
+# complete. Its manifest.json records the version, inputs, row selection, parameters,
+# sklearn version, a fingerprint of the training matrix and fit time.
+# --activate also points MODEL_DIR/CURRENT at it; without CURRENT the highest version name
+# (a UTC timestamp by default) is served anyway. --export-engine adds the compact engine file.
+#
+# Usage:
+#   python train_model.py [INPUT ...] [--model-dir models] [--n-estimators 100] [--max-samples auto]
+#                         [--units 1-5] [--max-cycle 50] [--rolling-features] [--activate] [--export-engine]
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import cmaps_cache
+from feature_engine import engine_from_env
+from model_store import ARTIFACT_FILES, CURRENT_FILE, MANIFEST_FILE, validate_artifacts
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+FEATURE_COLUMNS = ['setting_1', 'setting_2', 'setting_3'] + [f'sensor_{i}' for i in range(1, 22)]
+DEFAULT_INPUTS = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "CMaps", "train_FD001.txt")]
+
+def read_input(path):
+    """One input file as a DataFrame of readings, sorted by unit and cycle."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".txt":
+        df = cmaps_cache.load(path).to_frame()
+    elif extension in (".jsonl", ".ndjson", ".json"):
+        df = pd.read_json(path, lines=True)
+    elif extension == ".csv":
+        df = pd.read_csv(path)
+    elif extension in (".parquet", ".pq"):
+        df = pd.read_parquet(path)
+    else:
+        raise ValueError(f"Cannot tell the format of '{path}' from its extension.")
+    columns = [col for col in ['unit_number', 'time_in_cycles'] + FEATURE_COLUMNS if col in df.columns]
+    df = df[columns].apply(pd.to_numeric, errors="coerce")
+    return df.sort_values(['unit_number', 'time_in_cycles'], kind="stable").reset_index(drop=True)
+
+def add_rolling_features(df, rolling_engine):
+    """Append the rolling engine's features, computed over each unit's full history in cycle order."""
+    values = df[rolling_engine.base_features].to_numpy(np.float64)
+    rolling = np.array([rolling_engine.update(unit, row, cycle)
+                        for unit, cycle, row in zip(df['unit_number'], df['time_in_cycles'], values)])
+    return pd.concat([df, pd.DataFrame(rolling, columns=rolling_engine.feature_names, index=df.index)], axis=1)
+
+def select_training_rows(df, units, max_cycle):
+    """The notebook's "normal" readings: `units` (None = all) up to `max_cycle` (None = all)."""
+    mask = np.ones(len(df), dtype=bool)
+    if units is not None:
+        mask &= df['unit_number'].isin(units).to_numpy()
+    if max_cycle is not None:
+        mask &= (df['time_in_cycles'] <= max_cycle).to_numpy()
+    return df[mask]
+
+def load_training_frame(paths, units=None, max_cycle=None, rolling_features=False):
+    """Returns (selected rows, feature names). Rolling features start afresh for every input file."""
+    frames = []
+    for path in paths:
+        df = read_input(path)
+        if rolling_features:
+            df = add_rolling_features(df, engine_from_env(enabled_default=True))
+        frames.append(select_training_rows(df, units, max_cycle))
+    df = pd.concat(frames, ignore_index=True)
+    feature_names = [col for col in FEATURE_COLUMNS if col in df.columns]
+    missing = [col for col in FEATURE_COLUMNS if col not in df.columns]
+    if missing:
+        logging.warning(f"Missing feature columns, training without them: {missing}")
+    if rolling_features:
+        feature_names += [col for col in df.columns if col not in feature_names and col not in ('unit_number', 'time_in_cycles')]
+    n_rows = len(df)
+    df = df.dropna(subset=feature_names)
+    if len(df) < n_rows:
+        logging.warning(f"Dropped {n_rows - len(df)} rows with missing or non-numeric features.")
+    if df.empty:
+        raise ValueError("No training rows left after selection.")
+    return df, feature_names
+
+def fit_model(X, n_estimators=100, max_samples="auto", contamination=0.01, max_features=1.0, n_jobs=None, random_state=42):
+    """Fit MinMaxScaler and IsolationForest on raw feature rows (DataFrame or array). Returns (model, scaler, fit seconds)."""
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import MinMaxScaler
+
+    started = time.perf_counter()
+    scaler = MinMaxScaler()
+    X_scaled = scaler.fit_transform(X)
+    model = IsolationForest(n_estimators=n_estimators, max_samples=max_samples, contamination=contamination,
+                            max_features=max_features, n_jobs=n_jobs, random_state=random_state)
+    model.fit(X_scaled)
+    return model, scaler, time.perf_counter() - started
+
+def save_artifacts(out_dir, model, scaler, feature_names):
+    """Write the notebook's three artifacts (Cell 7) into `out_dir`."""
+    import joblib
+
+    joblib.dump(model, os.path.join(out_dir, "anomaly_model.pkl"))
+    joblib.dump(scaler, os.path.join(out_dir, "scaler.pkl"))
+    with open(os.path.join(out_dir, "scaled_feature_names.json"), 'w') as f:
+        json.dump(feature_names, f)
+
+def publish_version(model_dir, version, model, scaler, feature_names, manifest, activate=False, export_engine=False):
+    """Write a complete version directory into `model_dir` (staged, then renamed); returns its path."""
+    os.makedirs(model_dir, exist_ok=True)
+    target = os.path.join(model_dir, version)
+    if os.path.exists(target):
+        raise FileExistsError(f"Version '{version}' already exists in {model_dir}.")
+    staging = tempfile.mkdtemp(prefix=f".{version}.", dir=model_dir)
+    try:
+        save_artifacts(staging, model, scaler, feature_names)
+        with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        if export_engine: # After the manifest, so the engine file carries the version
+            from export_model import export_model
+            export_model(staging)
+        os.chmod(staging, 0o755)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    if activate:
+        current_tmp = os.path.join(model_dir, f".{CURRENT_FILE}.{os.getpid()}")
+        with open(current_tmp, "w") as f:
+            f.write(version)
+        os.replace(current_tmp, os.path.join(model_dir, CURRENT_FILE))
+    return target
+
+def parse_units(value):
+    """'1-5', '1,3,7' or 'all'."""
+    if value == "all":
+        return None
+    units = []
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        units.extend(range(int(first), int(last or first) + 1))
+    return units
+
+def parse_max_samples(value):
+    """'auto', a row count ('256') or a fraction of the rows ('0.5')."""
+    if value == "auto":
+        return value
+    return float(value) if "." in value else int(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the anomaly model and publish it as a new version of MODEL_DIR.")
+    parser.add_argument("inputs", nargs="*", default=DEFAULT_INPUTS, help="CMaps files or exports of the anomalies container.")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+    parser.add_argument("--version", default=None, help="Version name (default: UTC timestamp).")
+    parser.add_argument("--units", type=parse_units, default=parse_units("1-5"), help="Training units, e.g. 1-5, 1,3,7 or all.")
+    parser.add_argument("--max-cycle", type=int, default=50, help="Last cycle of each unit used for training; 0 for all.")
+    parser.add_argument("--rolling-features", action="store_true", help="Also train on feature_engine's rolling features (ROLLING_* settings).")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--max-samples", type=parse_max_samples, default="auto")
+    parser.add_argument("--max-features", type=float, default=1.0)
+    parser.add_argument("--contamination", type=float, default=0.01)
+    parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Processes building trees; -1 for all CPUs.")
+    parser.add_argument("--activate", action="store_true", help=f"Point MODEL_DIR/{CURRENT_FILE} at the new version.")
+    parser.add_argument("--export-engine", action="store_true", help="Also write the compact engine file (export_model.py).")
+    args = parser.parse_args()
+
+    import sklearn
+
+    max_cycle = args.max_cycle or None
+    df, feature_names = load_training_frame(args.inputs, args.units, max_cycle, args.rolling_features)
+    X = df[feature_names].astype(np.float64) # A DataFrame, so the scaler records the feature names as in the notebook
+    logging.info(f"Training on {len(X)} rows x {len(feature_names)} features from {len(args.inputs)} input(s).")
+
+    model, scaler, fit_s = fit_model(X, args.n_estimators, args.max_samples, args.contamination, args.max_features,
+                                     args.n_jobs, args.random_state)
+    validate_artifacts(model, scaler, feature_names)
+    anomaly_scores = model.decision_function(scaler.transform(X))
+    logging.info(f"Fitted {args.n_estimators} trees (max_samples {model.max_samples_}) in {fit_s:.2f}s; "
+                 f"{np.mean(anomaly_scores < 0):.2%} of the training rows score as anomalies, offset {model.offset_:.4f}.")
+
+    version = args.version or datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "inputs": [os.path.abspath(path) for path in args.inputs],
+        "selection": {"units": args.units, "max_cycle": max_cycle, "rolling_features": args.rolling_features},
+        "rows": len(X),
+        "training_data_sha1": hashlib.sha1(np.ascontiguousarray(X.to_numpy()).tobytes()).hexdigest(),
+        "params": {"n_estimators": args.n_estimators, "max_samples": args.max_samples, "max_samples_used": int(model.max_samples_),
+                   "max_features": args.max_features, "contamination": args.contamination, "random_state": args.random_state},
+        "sklearn_version": sklearn.__version__,
+        "fit_seconds": round(fit_s, 3),
+        "artifacts": list(ARTIFACT_FILES),
+    }
+    try:
+        path = publish_version(args.model_dir, version, model, scaler, feature_names, manifest, args.activate, args.export_engine)
+    except (OSError, ValueError) as e:
+        logging.error(f"Publishing version '{version}' failed: {e}")
+        sys.exit(1)
+    logging.info(f"Published version '{version}' to {path}{' and made it current' if args.activate else ''}.")
+
+if __name__ == "__main__":
+    main()
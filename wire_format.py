@@ -0,0 +1,180 @@
+# wire_format.py
+# Compact binary encoding of sensor readings for stream_data.py -> Event Hub -> event_consumer.py
+# -> model_api.py, used instead of JSON when WIRE_FORMAT=packed.
+#
+# A JSON reading repeats its 29 key names in every event (~70% of the bytes). A packed frame
+# names its fields once, by schema id, and carries the readings as a fixed-layout float matrix:
+#
+#   header  "<4sBBII": magic b"IOTP", format version, dtype code (1 = float32, 2 = float64),
+#           schema id, record count
+#   values  record count x len(schema.fields) little-endian floats, row-major
+#   strings for each record, for each of schema.string_fields: the value in UTF-8 followed by
+#           STRING_END (0x1F, which values may not contain); null is encoded as a lone 0x00
+#
+# The schema id is the crc32 of the field lists, so producer and receivers agree on a layout
+# without exchanging it; receivers only decode schemas they know (see register_schema).
+# Frames travel with content type CONTENT_TYPE (Event Hub content_type, HTTP Content-Type);
+# anything else is treated as JSON, so both formats can be in flight at the same time.
+# Fields of a record that are not in the schema are not encoded.
+import json
+import struct
+import zlib
+
+import numpy as np
+
+CONTENT_TYPE = "application/vnd.iot-sensor.packed"
+JSON_CONTENT_TYPE = "application/json"
+
+MAGIC = b"IOTP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBBII")
+STRING_END = "\x1f" # ASCII unit separator
+NULL_STRING = "\x00"
+DTYPE_CODES = {np.dtype("<f4"): 1, np.dtype("<f8"): 2}
+CODE_DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+
+# The 26 columns of the CMaps files, in file order (stream_data.cols, model_api.SensorDataInput).
+READING_FIELDS = ('unit_number', 'time_in_cycles', 'setting_1', 'setting_2', 'setting_3') + \
+                 tuple(f'sensor_{i}' for i in range(1, 22))
+READING_STRING_FIELDS = ('message_id', 'event_timestamp', 'source_file')
+
+class Schema:
+    """Ordered float fields and string fields of a frame, identified by a stable schema id."""
+
+    def __init__(self, fields, string_fields=()):
+        self.fields = tuple(fields)
+        self.string_fields = tuple(string_fields)
+        self.schema_id = zlib.crc32(json.dumps([self.fields, self.string_fields]).encode("utf-8"))
+        self.index = {name: i for i, name in enumerate(self.fields)}
+
+READING_SCHEMA = Schema(READING_FIELDS, READING_STRING_FIELDS)
+_schemas = {READING_SCHEMA.schema_id: READING_SCHEMA}
+
+def register_schema(schema):
+    """Make frames with `schema` decodable; returns the schema."""
+    _schemas[schema.schema_id] = schema
+    return schema
+
+def dtype_from_name(name):
+    """np.dtype for WIRE_FORMAT_DTYPE-style names ("float64" / "float32")."""
+    dtype = np.dtype(name).newbyteorder("<")
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported wire dtype '{name}' (expected float32 or float64).")
+    return dtype
+
+class Frame:
+    """A decoded frame: values is a read-only (records, fields) view of the body; strings maps field -> list."""
+
+    def __init__(self, schema, values, strings):
+        self.schema = schema
+        self.values = values
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.values)
+
+def _encode_strings(columns, n_records):
+    """The strings section for `columns` (one sequence of values, or None for all-null, per string field)."""
+    pieces = []
+    for i in range(n_records):
+        for column in columns:
+            value = NULL_STRING if column is None or column[i] is None else str(column[i])
+            if STRING_END in value:
+                raise ValueError(f"String field value {value[:40]!r} contains the separator {STRING_END!r}.")
+            pieces.append(value)
+            pieces.append(STRING_END)
+    return "".join(pieces).encode("utf-8")
+
+def encode_matrix(values, strings=None, schema=READING_SCHEMA, dtype=np.float64):
+    """
+    One frame holding every row of `values` (records x len(schema.fields)). `strings` maps a
+    string field to one value (or None) per record; missing fields are encoded as null.
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    values = np.ascontiguousarray(values, dtype=dtype)
+    if values.ndim != 2 or values.shape[1] != len(schema.fields):
+        raise ValueError(f"Expected a (records, {len(schema.fields)}) matrix, got shape {values.shape}.")
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], schema.schema_id, len(values))
+    columns = [(strings or {}).get(name) for name in schema.string_fields]
+    return header + values.tobytes() + _encode_strings(columns, len(values))
+
+def encode_rows(values, strings=None, schema=READING_SCHEMA, dtype=np.float64):
+    """One single-record frame per row of `values`, e.g. one Event Hub event body per reading."""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    values = np.ascontiguousarray(values, dtype=dtype)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], schema.schema_id, 1)
+    columns = [(strings or {}).get(name) for name in schema.string_fields]
+    return [header + row.tobytes() + _encode_strings([None if column is None else column[i:i + 1] for column in columns], 1)
+            for i, row in enumerate(values)]
+
+def encode_records(records, schema=READING_SCHEMA, dtype=np.float64):
+    """One frame holding a list of reading dicts (fields missing from a record are encoded as NaN / null; model_api rejects a NaN required field as missing)."""
+    values = np.array([[record.get(name, np.nan) for name in schema.fields] for record in records], dtype=np.float64)
+    strings = {name: [record.get(name) for record in records] for name in schema.string_fields}
+    return encode_matrix(values.reshape(len(records), len(schema.fields)), strings, schema, dtype)
+
+def decode_frame(body):
+    """Parse a frame (bytes-like); raises ValueError for anything that is not a well-formed known frame."""
+    if len(body) < HEADER.size:
+        raise ValueError(f"Packed frame of {len(body)} bytes is shorter than its header.")
+    magic, version, dtype_code, schema_id, n_records = HEADER.unpack_from(body)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"Not a packed frame of format version {FORMAT_VERSION} (magic {magic!r}, version {version}).")
+    schema = _schemas.get(schema_id)
+    if schema is None:
+        raise ValueError(f"Unknown packed schema id {schema_id:#010x}.")
+    dtype = CODE_DTYPES.get(dtype_code)
+    if dtype is None:
+        raise ValueError(f"Unknown packed dtype code {dtype_code}.")
+
+    values_end = HEADER.size + n_records * len(schema.fields) * dtype.itemsize
+    if len(body) < values_end:
+        raise ValueError(f"Packed frame truncated: {n_records} records need {values_end} bytes, got {len(body)}.")
+    values = np.frombuffer(body, dtype=dtype, count=n_records * len(schema.fields), offset=HEADER.size)
+    values = values.reshape(n_records, len(schema.fields))
+
+    try:
+        pieces = str(body[values_end:], "utf-8").split(STRING_END)
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Malformed packed frame strings: {e}") from None
+    n_strings = len(schema.string_fields)
+    if len(pieces) != n_records * n_strings + 1 or pieces[-1]:
+        raise ValueError(f"Malformed packed frame strings: expected {n_records * n_strings} terminated values.")
+    strings = {name: [None if value == NULL_STRING else value for value in pieces[k:-1:n_strings]]
+               for k, name in enumerate(schema.string_fields)}
+    return Frame(schema, values, strings)
+
+def frame_to_records(frame):
+    """
+    Reading dicts of a frame, like the ones json.loads returns for JSON events (null strings are
+    left out). float32 values are widened exactly, so they read as e.g. 641.8200073242188.
+    """
+    fields = frame.schema.fields
+    records = [dict(zip(fields, row)) for row in frame.values.tolist()]
+    for name, column in frame.strings.items():
+        for record, value in zip(records, column):
+            if value is not None:
+                record[name] = value
+    return records
+
+def decode_records(body):
+    return frame_to_records(decode_frame(body))
+
+def merge_frames(frames):
+    """Concatenate frames of the same schema and dtype into one multi-record frame."""
+    if len(frames) == 1:
+        return bytes(frames[0])
+    values_parts, string_parts = [], []
+    first = None
+    total = 0
+    for frame in frames:
+        magic, version, dtype_code, schema_id, n_records = HEADER.unpack_from(frame)
+        if first is None:
+            first = (magic, version, dtype_code, schema_id)
+        elif (magic, version, dtype_code, schema_id) != first:
+            raise ValueError("Only frames of the same schema and dtype can be merged.")
+        values_end = HEADER.size + n_records * len(_schemas[schema_id].fields) * CODE_DTYPES[dtype_code].itemsize
+        values_parts.append(frame[HEADER.size:values_end])
+        string_parts.append(frame[values_end:])
+        total += n_records
+    return HEADER.pack(*first, total) + b"".join(values_parts) + b"".join(string_parts)